@@ -1,10 +1,16 @@
 
+import multiprocessing
+import os
 from flask import Flask
 from flask_cors import CORS
 from .routes import bp
+from .file_watcher import file_watcher
 
 def create_app():
     app = Flask(__name__)
     CORS(app)  # Enable CORS for all routes
     app.register_blueprint(bp)
+    # Spawned workers (the symbol index parse pool) re-import main; only the server process watches files
+    if os.getenv('FILE_WATCHER_ENABLED', 'true').lower() == 'true' and multiprocessing.parent_process() is None:
+        file_watcher.start()
     return app
@@ -2,10 +2,12 @@
 Action Plan Generation System
 Breaks down user requests into step-by-step actionable plans
 """
+import copy
 import json
 import os
+import threading
 from datetime import datetime
-from typing import Dict, List, Optional, Any
+from typing import Dict, List, Optional, Any, Tuple
 from dataclasses import dataclass, asdict
 from enum import Enum
 
@@ -76,6 +78,18 @@ class ActionPlanner:
     def __init__(self, storage_path: str = None):
         self.storage_path = storage_path or os.path.join('.coai', 'plans')
         os.makedirs(self.storage_path, exist_ok=True)
+        # Parsed plan files by id with the (mtime_ns, size) they were read at; another
+        # process (or an editor) may rewrite a plan, so entries are re-checked on every load
+        self._plan_cache: Dict[str, Tuple[Tuple[int, int], Dict[str, Any]]] = {}
+        self._cache_lock = threading.Lock()
+    
+    def invalidate(self, plan_id: str = None):
+        """Forget cached plan data for one plan (or all plans)"""
+        with self._cache_lock:
+            if plan_id is None:
+                self._plan_cache.clear()
+            else:
+                self._plan_cache.pop(plan_id, None)
     
     def generate_plan(self, user_request: str, project_context: Dict[str, Any] = None) -> ActionPlan:
         """
@@ -259,18 +273,33 @@ class ActionPlanner:
         
         with open(file_path, 'w', encoding='utf-8') as f:
             json.dump(plan_data, f, indent=2, ensure_ascii=False)
+        self.invalidate(plan.id)
         
         return file_path
     
     def load_plan(self, plan_id: str) -> Optional[ActionPlan]:
         """Load action plan from storage"""
         file_path = os.path.join(self.storage_path, f"{plan_id}.json")
-        
-        if not os.path.exists(file_path):
+        try:
+            stat = os.stat(file_path)
+        except OSError:
+            self.invalidate(plan_id)
             return None
+        version = (stat.st_mtime_ns, stat.st_size)
+        
+        with self._cache_lock:
+            cached = self._plan_cache.get(plan_id)
+        
+        if cached is not None and cached[0] == version:
+            plan_data = cached[1]
+        else:
+            with open(file_path, 'r', encoding='utf-8') as f:
+                plan_data = json.load(f)
+            with self._cache_lock:
+                self._plan_cache[plan_id] = (version, plan_data)
         
-        with open(file_path, 'r', encoding='utf-8') as f:
-            plan_data = json.load(f)
+        # Callers mutate the returned plan; never hand out the cached data itself
+        plan_data = copy.deepcopy(plan_data)
         
         # Convert string enums back to enum objects
         tasks = []
@@ -0,0 +1,275 @@
+"""
+COAI Admission Control
+Global bound on concurrent chat work with a short wait queue, so a burst is
+answered with fast 503s instead of piling up until the backend falls over
+"""
+
+import asyncio
+import math
+import os
+import threading
+import time
+from collections import deque
+from contextlib import asynccontextmanager, contextmanager
+from typing import Any, AsyncIterator, Callable, Deque, Dict, Iterator, Optional
+from .error_handler import OverloadedError
+from .latency_histogram import LatencyHistogram
+from .stage_timer import StageTimer
+
+# Gradient limiter tuning (after Netflix's concurrency-limits Gradient2)
+SHORT_ALPHA = 0.3       # Weight of each sample in the recent latency average
+LONG_ALPHA = 0.02       # Weight of each sample in the baseline latency average
+TOLERANCE = 1.5         # Recent latency may reach this multiple of the baseline before the limit shrinks
+SMOOTHING = 0.2         # Share of the newly computed limit applied per sample
+FAILURE_BACKOFF = 0.9   # Multiplicative decrease when a request fails
+
+WAIT_PERCENTILES = (50, 95, 99)
+
+
+class _Waiter:
+    __slots__ = ('wake', 'granted', 'enqueued')
+
+    def __init__(self, wake: Callable[[], None]):
+        self.wake = wake
+        self.granted = False
+        self.enqueued = time.perf_counter()
+
+
+class Slot:
+    """An admitted request's share of the concurrency limit; release it exactly once when the work ends"""
+
+    def __init__(self, controller: Optional['AdmissionController'], waited: float = 0.0):
+        self.controller = controller
+        self.waited = waited
+        self.started = time.perf_counter()
+        self.released = False
+
+    def release(self, ok: bool = True):
+        if self.released or self.controller is None:
+            return
+        self.released = True
+        self.controller._release(time.perf_counter() - self.started, ok)
+
+
+class AdmissionController:
+    """
+    Adaptive concurrency limit in front of the orchestrator
+
+    Up to `limit` requests run at once; the next `max_queue` wait in FIFO
+    order for up to `queue_timeout` seconds. Anything beyond that is
+    rejected at once with OverloadedError (503 + Retry-After), as is a
+    queued request whose wait times out.
+
+    The limit follows a gradient: each finished request updates a recent
+    and a baseline latency average, and while recent latency stays within
+    TOLERANCE x baseline the limit grows by about sqrt(limit); once it rises
+    past that, the limit shrinks in proportion, shedding load before the
+    backend saturates. Failures cut the limit by FAILURE_BACKOFF. The limit
+    only grows while it is actually being used.
+
+    Threads (Flask) and coroutines (ASGI) share one queue.
+    """
+
+    def __init__(
+        self,
+        initial_limit: int = None,
+        min_limit: int = None,
+        max_limit: int = None,
+        max_queue: int = None,
+        queue_timeout: float = None
+    ):
+        self.enabled = os.getenv('ADMISSION_CONTROL_ENABLED', 'true').lower() == 'true'
+        self.min_limit = min_limit or int(os.getenv('ADMISSION_MIN_LIMIT', '2'))
+        self.max_limit = max_limit or int(os.getenv('ADMISSION_MAX_LIMIT', '500'))
+        self.limit = float(initial_limit or int(os.getenv('ADMISSION_INITIAL_LIMIT', '20')))
+        self.max_queue = max_queue if max_queue is not None else int(os.getenv('ADMISSION_MAX_QUEUE', '50'))
+        self.queue_timeout = queue_timeout if queue_timeout is not None else float(
+            os.getenv('ADMISSION_QUEUE_TIMEOUT_SECONDS', '10'))
+        self.lock = threading.Lock()
+        self.in_flight = 0
+        self.waiters: Deque[_Waiter] = deque()
+        self.short_latency: Optional[float] = None
+        self.long_latency: Optional[float] = None
+        self.wait_times = LatencyHistogram()
+        self.stats = {"admitted": 0, "queued": 0, "rejected_queue_full": 0, "rejected_timeout": 0, "failures": 0}
+
+    # --- Admission ---
+
+    def _admit_or_enqueue(self, waiter: _Waiter) -> bool:
+        """True if admitted at once, False if queued; raises when the queue is full. Caller holds the lock."""
+        if self.in_flight < int(self.limit) and not self.waiters:
+            self.in_flight += 1
+            self.stats["admitted"] += 1
+            self.wait_times.record(0.0)
+            return True
+        if len(self.waiters) >= self.max_queue:
+            self.stats["rejected_queue_full"] += 1
+            raise OverloadedError("Server is at capacity", retry_after=self._retry_after())
+        self.waiters.append(waiter)
+        self.stats["queued"] += 1
+        return False
+
+    def _admitted(self, waiter: _Waiter, timer: Optional[StageTimer]) -> Slot:
+        waited = time.perf_counter() - waiter.enqueued
+        with self.lock:
+            self.stats["admitted"] += 1
+            self.wait_times.record(waited)
+        if timer is not None:
+            timer.stages["admission_wait"] = timer.stages.get("admission_wait", 0.0) + waited * 1000
+        return Slot(self, waited)
+
+    def _give_up(self, waiter: _Waiter) -> bool:
+        """Leave the queue after a timeout; False if the slot was granted meanwhile. Caller holds the lock."""
+        if waiter.granted:
+            return False
+        self.waiters.remove(waiter)
+        self.stats["rejected_timeout"] += 1
+        return True
+
+    def acquire(self, timer: Optional[StageTimer] = None) -> Slot:
+        """
+        Admit a request from a worker thread, waiting in the queue if needed
+
+        Raises:
+            OverloadedError: the queue is full or the wait timed out
+        """
+        if not self.enabled:
+            return Slot(None)
+        event = threading.Event()
+        waiter = _Waiter(event.set)
+        with self.lock:
+            if self._admit_or_enqueue(waiter):
+                return Slot(self)
+        if not event.wait(self.queue_timeout):
+            with self.lock:
+                if self._give_up(waiter):
+                    raise OverloadedError("Timed out waiting for capacity", retry_after=self._retry_after())
+        return self._admitted(waiter, timer)
+
+    async def aacquire(self, timer: Optional[StageTimer] = None) -> Slot:
+        """Async variant of acquire: a queued coroutine waits without holding a thread"""
+        if not self.enabled:
+            return Slot(None)
+        loop = asyncio.get_running_loop()
+        granted = loop.create_future()
+
+        def wake():
+            loop.call_soon_threadsafe(lambda: granted.done() or granted.set_result(True))
+
+        waiter = _Waiter(wake)
+        with self.lock:
+            if self._admit_or_enqueue(waiter):
+                return Slot(self)
+        try:
+            await asyncio.wait_for(asyncio.shield(granted), self.queue_timeout)
+        except asyncio.TimeoutError:
+            with self.lock:
+                if self._give_up(waiter):
+                    raise OverloadedError("Timed out waiting for capacity", retry_after=self._retry_after())
+        except asyncio.CancelledError:
+            with self.lock:
+                if not waiter.granted:
+                    self.waiters.remove(waiter)
+                    raise
+            self._hand_on()  # Granted as the client went away: pass the slot to the next waiter
+            raise
+        return self._admitted(waiter, timer)
+
+    @contextmanager
+    def admit(self, timer: Optional[StageTimer] = None) -> Iterator[Slot]:
+        """Hold a slot for the enclosed work; an exception counts as a failure"""
+        slot = self.acquire(timer)
+        try:
+            yield slot
+        except BaseException:
+            slot.release(ok=False)
+            raise
+        slot.release()
+
+    @asynccontextmanager
+    async def aadmit(self, timer: Optional[StageTimer] = None) -> AsyncIterator[Slot]:
+        slot = await self.aacquire(timer)
+        try:
+            yield slot
+        except BaseException:
+            slot.release(ok=False)
+            raise
+        slot.release()
+
+    # --- Limit adjustment ---
+
+    def _release(self, latency: float, ok: bool):
+        with self.lock:
+            busy = self.in_flight >= self.limit / 2
+            self.in_flight -= 1
+            self._update_limit(latency, ok, busy)
+            self._grant_waiters()
+
+    def _hand_on(self):
+        """Give back a slot that did no work; it says nothing about latency, so the limit is left alone"""
+        with self.lock:
+            self.in_flight -= 1
+            self._grant_waiters()
+
+    def _grant_waiters(self):
+        """Admit queued requests while there is room under the limit; the caller holds the lock"""
+        while self.waiters and self.in_flight < int(self.limit):
+            waiter = self.waiters.popleft()
+            waiter.granted = True
+            self.in_flight += 1
+            waiter.wake()
+
+    def _update_limit(self, latency: float, ok: bool, busy: bool):
+        """Gradient step for one finished request; the caller holds the lock"""
+        if not ok:
+            self.stats["failures"] += 1
+            self.limit = max(self.min_limit, self.limit * FAILURE_BACKOFF)
+            return
+        if self.short_latency is None:
+            self.short_latency = self.long_latency = latency
+            return
+        self.short_latency += (latency - self.short_latency) * SHORT_ALPHA
+        self.long_latency += (latency - self.long_latency) * LONG_ALPHA
+        # After a sustained slowdown the baseline has crept up; let it come back down quickly
+        if self.long_latency > 2 * self.short_latency:
+            self.long_latency *= 0.95
+        if self.short_latency <= 0:
+            return
+
+        gradient = max(0.5, min(1.0, TOLERANCE * self.long_latency / self.short_latency))
+        if gradient >= 1.0 and not busy:
+            return  # Not using the limit we have; growing it would prove nothing
+        new_limit = self.limit * gradient + math.sqrt(self.limit)
+        self.limit = self.limit * (1 - SMOOTHING) + new_limit * SMOOTHING
+        self.limit = min(self.max_limit, max(self.min_limit, self.limit))
+
+    def _retry_after(self) -> int:
+        """Seconds a rejected client should wait: roughly the time to drain the queue"""
+        if not self.long_latency:
+            return 1
+        return max(1, min(60, math.ceil(self.long_latency * (len(self.waiters) + 1) / max(self.limit, 1))))
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self.lock:
+            stats = dict(self.stats)
+            stats.update(
+                limit=round(self.limit, 2),
+                in_flight=self.in_flight,
+                queue_depth=len(self.waiters),
+                oldest_wait_seconds=round(time.perf_counter() - self.waiters[0].enqueued, 3) if self.waiters else 0.0,
+                recent_latency_seconds=round(self.short_latency or 0.0, 4),
+                baseline_latency_seconds=round(self.long_latency or 0.0, 4),
+                wait_seconds={name: round(value, 4) for name, value in self.wait_times.summary(WAIT_PERCENTILES).items()}
+            )
+        stats.update(
+            enabled=self.enabled,
+            min_limit=self.min_limit,
+            max_limit=self.max_limit,
+            max_queue=self.max_queue,
+            queue_timeout_seconds=self.queue_timeout
+        )
+        return stats
+
+
+# Global instance
+admission_controller = AdmissionController()
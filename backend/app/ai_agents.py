@@ -3,15 +3,25 @@ COAI AI Agents Module
 Handles different types of AI agents and their interactions
 """
 
+import asyncio
 import logging
+import re
 from abc import ABC, abstractmethod
-from typing import Dict, Any, List, Optional
+from typing import Dict, Any, AsyncIterator, Iterator, List, Optional
 from datetime import datetime
 
 # Use standard Python logging
 logger = logging.getLogger(__name__)
 
 
+def iter_text_chunks(text: str) -> Iterator[str]:
+    """
+    Split text into word-sized chunks (keeping whitespace) for simulated streaming
+    """
+    for chunk in re.findall(r'\S+\s*|\s+', text):
+        yield chunk
+
+
 class AIAgent(ABC):
     """Base class for all AI agents in the COAI system"""
     
@@ -32,6 +42,36 @@ class AIAgent(ABC):
         """Return list of agent capabilities"""
         pass
     
+    def stream_request(self, request: Dict[str, Any]) -> Iterator[Dict[str, Any]]:
+        """
+        Stream a response as token events followed by a final "done" event
+        
+        Agents without native streaming process the request as a whole and
+        replay the response in word-sized chunks.
+        """
+        result = self.process_request(request)
+        if result.get("status") == "success":
+            for chunk in iter_text_chunks(result.get("response", "")):
+                yield {"type": "token", "content": chunk}
+        yield {"type": "done", **result}
+    
+    async def aprocess_request(self, request: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Async variant of process_request for the ASGI server
+        
+        Agents without a native async client run process_request on a worker
+        thread, so a slow agent never blocks the event loop.
+        """
+        return await asyncio.to_thread(self.process_request, request)
+    
+    async def astream_request(self, request: Dict[str, Any]) -> AsyncIterator[Dict[str, Any]]:
+        """Async variant of stream_request, replaying the aprocess_request result in chunks"""
+        result = await self.aprocess_request(request)
+        if result.get("status") == "success":
+            for chunk in iter_text_chunks(result.get("response", "")):
+                yield {"type": "token", "content": chunk}
+        yield {"type": "done", **result}
+    
     def get_status(self) -> Dict[str, Any]:
         """Get current agent status"""
         return {
@@ -172,6 +212,70 @@ class AIAgentManager:
                 "timestamp": datetime.now().isoformat()
             }
     
+    def stream_request(self, request: Dict[str, Any]) -> Iterator[Dict[str, Any]]:
+        """Route streaming request to appropriate agent"""
+        agent_name = request.get('agent', self.default_agent)
+        
+        if agent_name not in self.agents:
+            yield {
+                "type": "done",
+                "status": "error",
+                "error": f"Agent '{agent_name}' not found",
+                "available_agents": list(self.agents.keys())
+            }
+            return
+        
+        try:
+            yield from self.agents[agent_name].stream_request(request)
+            self.logger.info(f"Streaming request processed by agent: {agent_name}")
+        except Exception as e:
+            self.logger.error(f"AIAgentManager streaming error: {str(e)}")
+            yield {
+                "type": "done",
+                "status": "error",
+                "error": str(e),
+                "timestamp": datetime.now().isoformat()
+            }
+    
+    async def aprocess_request(self, request: Dict[str, Any]) -> Dict[str, Any]:
+        """Async variant of process_request"""
+        agent_name = request.get('agent', self.default_agent)
+        if agent_name not in self.agents:
+            return self.process_request(request)  # Builds the not-found error
+        
+        try:
+            response = await self.agents[agent_name].aprocess_request(request)
+            self.logger.info(f"Request processed by agent: {agent_name}")
+            return response
+        except Exception as e:
+            self.logger.error(f"AIAgentManager error: {str(e)}")
+            return {
+                "status": "error",
+                "error": str(e),
+                "timestamp": datetime.now().isoformat()
+            }
+    
+    async def astream_request(self, request: Dict[str, Any]) -> AsyncIterator[Dict[str, Any]]:
+        """Async variant of stream_request"""
+        agent_name = request.get('agent', self.default_agent)
+        if agent_name not in self.agents:
+            for event in self.stream_request(request):
+                yield event
+            return
+        
+        try:
+            async for event in self.agents[agent_name].astream_request(request):
+                yield event
+            self.logger.info(f"Streaming request processed by agent: {agent_name}")
+        except Exception as e:
+            self.logger.error(f"AIAgentManager streaming error: {str(e)}")
+            yield {
+                "type": "done",
+                "status": "error",
+                "error": str(e),
+                "timestamp": datetime.now().isoformat()
+            }
+    
     def get_agent_status(self, agent_name: str = None) -> Dict[str, Any]:
         """Get status of specific agent or all agents"""
         try:
@@ -3,12 +3,17 @@ COAI AI Agents Module - Full Implementation with OpenAI Integration
 Handles real AI agents with actual OpenAI API integration
 """
 
+import asyncio
 import os
 import logging
-from typing import Dict, Any, List, Optional
+from typing import Dict, Any, AsyncIterator, Iterator, List, Optional
 from datetime import datetime
 import openai
 from dotenv import load_dotenv
+from .ai_agents import iter_text_chunks
+from .near_duplicate_cache import context_scope, near_duplicate_cache
+from .response_cache import response_cache
+from .tokenizer import count_tokens
 
 # Load environment variables
 load_dotenv()
@@ -28,6 +33,9 @@ class OpenAIAgent:
         self.max_tokens = int(os.getenv('OPENAI_MAX_TOKENS', '2000'))
         self.temperature = float(os.getenv('OPENAI_TEMPERATURE', '0.7'))
         self.fallback_to_mock = os.getenv('FALLBACK_TO_MOCK', 'true').lower() == 'true'
+        # Created on first async use, per event loop
+        self.async_client = None
+        self._async_client_loop = None
         
         # Initialize OpenAI client
         if self.api_key and self.api_key != 'your_openai_api_key_here':
@@ -43,6 +51,10 @@ class OpenAIAgent:
             self.is_configured = False
             logger.warning("OpenAI API key not configured - will use mock responses")
     
+    def uses_real_ai(self) -> bool:
+        """Whether requests go to the OpenAI API rather than mock responses"""
+        return os.getenv('ENABLE_REAL_AI', 'false').lower() == 'true' and self.is_configured
+    
     def process_request(self, request: Dict[str, Any]) -> Dict[str, Any]:
         """
         Process request using real OpenAI API or fallback to mock
@@ -54,9 +66,7 @@ class OpenAIAgent:
             file_path = context.get('file', 'unknown')
             
             # Check if real AI is enabled and configured
-            enable_real_ai = os.getenv('ENABLE_REAL_AI', 'false').lower() == 'true'
-            
-            if enable_real_ai and self.is_configured:
+            if self.uses_real_ai():
                 return self._process_with_openai(message, context, project, file_path)
             else:
                 logger.info("Using mock response (real AI disabled or not configured)")
@@ -75,33 +85,72 @@ class OpenAIAgent:
                     "timestamp": datetime.now().isoformat()
                 }
     
+    def stream_request(self, request: Dict[str, Any]) -> Iterator[Dict[str, Any]]:
+        """
+        Stream request tokens using real OpenAI API or fallback to mock
+        
+        Yields {"type": "token", "content": ...} events followed by a single
+        {"type": "done", ...} event carrying the same fields as process_request.
+        """
+        message = request.get('message', '')
+        context = request.get('context', {})
+        project = context.get('project', 'unknown')
+        file_path = context.get('file', 'unknown')
+        
+        if not self.uses_real_ai():
+            logger.info("Using mock stream (real AI disabled or not configured)")
+            yield from self._stream_with_mock(message, context, project, file_path)
+            return
+        
+        tokens_sent = False
+        try:
+            for event in self._stream_with_openai(message, context, project, file_path):
+                tokens_sent = tokens_sent or event["type"] == "token"
+                yield event
+        except Exception as e:
+            logger.error(f"Error in OpenAI agent stream: {e}")
+            # Partial output has already reached the client, so only fall back before the first token
+            if self.fallback_to_mock and not tokens_sent:
+                logger.info("Falling back to mock stream due to error")
+                yield from self._stream_with_mock(message, context, project, file_path)
+            else:
+                yield {
+                    "type": "done",
+                    "status": "error",
+                    "agent_type": self.agent_type,
+                    "error": str(e),
+                    "timestamp": datetime.now().isoformat()
+                }
+    
+    def _build_messages(self, message: str, context: Dict[str, Any], project: str, file_path: str) -> List[Dict[str, str]]:
+        """Build chat completion messages for the request"""
+        # Debug logging
+        logger.info(f"🔍 AI Agent Debug - Message length: {len(message)}")
+        logger.info(f"🔍 Contains 'PROJECT FILE INFORMATION': {'PROJECT FILE INFORMATION' in message}")
+        logger.info(f"🔍 Message preview: {message[:200]}...")
+        
+        # Check if message is already enhanced (packed by the preprocessor, rules included)
+        if "=== COAI System Context ===" in message or "PROJECT FILE INFORMATION" in message:
+            # Message is already enhanced by preprocessor, use minimal system prompt
+            system_prompt = "You are COAI, a helpful AI assistant. Follow the instructions in the user's message carefully."
+            logger.info("🎯 Using MINIMAL system prompt - enhanced message detected")
+        else:
+            # Build full system prompt for unprocessed messages
+            system_prompt = self._build_system_prompt(context, project, file_path)
+            logger.info("📝 Using FULL system prompt - regular message")
+        
+        return [
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": message}
+        ]
+    
     def _process_with_openai(self, message: str, context: Dict[str, Any], project: str, file_path: str) -> Dict[str, Any]:
         """Process request using real OpenAI API"""
         try:
-            # Debug logging
-            logger.info(f"🔍 AI Agent Debug - Message length: {len(message)}")
-            logger.info(f"🔍 Contains 'PROJECT FILE INFORMATION': {'PROJECT FILE INFORMATION' in message}")
-            logger.info(f"🔍 Message preview: {message[:200]}...")
-            
-            # Check if message is already enhanced (contains file context)
-            if "PROJECT FILE INFORMATION" in message:
-                # Message is already enhanced by preprocessor, use minimal system prompt
-                system_prompt = "You are COAI, a helpful AI assistant. Follow the instructions in the user's message carefully."
-                user_message = message
-                logger.info("🎯 Using MINIMAL system prompt - enhanced message detected")
-            else:
-                # Build full system prompt for unprocessed messages
-                system_prompt = self._build_system_prompt(context, project, file_path)
-                user_message = message
-                logger.info("📝 Using FULL system prompt - regular message")
-            
             # Make OpenAI API call
             response = self.client.chat.completions.create(
                 model=self.model,
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": user_message}
-                ],
+                messages=self._build_messages(message, context, project, file_path),
                 max_tokens=self.max_tokens,
                 temperature=self.temperature
             )
@@ -109,34 +158,214 @@ class OpenAIAgent:
             ai_response = response.choices[0].message.content
             
             # Calculate usage metrics
-            usage_info = {
-                "prompt_tokens": response.usage.prompt_tokens,
-                "completion_tokens": response.usage.completion_tokens,
-                "total_tokens": response.usage.total_tokens,
-                "model": self.model
-            }
+            usage_info = self._usage_info(response.usage, message, ai_response)
             
             logger.info(f"OpenAI API call successful. Tokens used: {usage_info['total_tokens']}")
             
-            return {
-                "status": "success",
-                "agent_type": self.agent_type,
-                "response": ai_response,
-                "timestamp": datetime.now().isoformat(),
-                "usage": usage_info,
-                "model": self.model,
-                "real_ai": True
-            }
+            return self._success_result(ai_response, usage_info)
             
         except Exception as e:
             logger.error(f"OpenAI API error: {e}")
             raise e
     
+    def _usage_info(self, usage: Any, message: str, ai_response: str) -> Dict[str, Any]:
+        """Token usage reported by the API, counted locally if the endpoint sent none"""
+        if usage is not None:
+            return {
+                "prompt_tokens": usage.prompt_tokens,
+                "completion_tokens": usage.completion_tokens,
+                "total_tokens": usage.total_tokens,
+                "model": self.model
+            }
+        # Some compatible endpoints ignore stream_options; count locally instead
+        prompt_tokens = count_tokens(message)
+        completion_tokens = count_tokens(ai_response)
+        return {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
+            "model": self.model
+        }
+    
+    def _success_result(self, ai_response: str, usage_info: Dict[str, Any]) -> Dict[str, Any]:
+        return {
+            "status": "success",
+            "agent_type": self.agent_type,
+            "response": ai_response,
+            "timestamp": datetime.now().isoformat(),
+            "usage": usage_info,
+            "model": self.model,
+            "real_ai": True
+        }
+    
+    def _stream_with_openai(self, message: str, context: Dict[str, Any], project: str, file_path: str) -> Iterator[Dict[str, Any]]:
+        """Stream request tokens from the real OpenAI API"""
+        stream = self.client.chat.completions.create(
+            model=self.model,
+            messages=self._build_messages(message, context, project, file_path),
+            max_tokens=self.max_tokens,
+            temperature=self.temperature,
+            stream=True,
+            stream_options={"include_usage": True}
+        )
+        
+        chunks = []
+        usage = None
+        try:
+            for chunk in stream:
+                if chunk.choices:
+                    content = chunk.choices[0].delta.content
+                    if content:
+                        chunks.append(content)
+                        yield {"type": "token", "content": content}
+                if getattr(chunk, "usage", None):
+                    usage = chunk.usage
+        finally:
+            # Release the HTTP connection if the client went away mid-stream
+            close = getattr(stream, "close", None)
+            if close:
+                close()
+        
+        ai_response = "".join(chunks)
+        usage_info = self._usage_info(usage, message, ai_response)
+        
+        logger.info(f"OpenAI streaming call successful. Tokens used: {usage_info['total_tokens']}")
+        
+        yield {"type": "done", **self._success_result(ai_response, usage_info)}
+    
+    # --- Async variants, used by the ASGI server: an in-flight API call holds no thread ---
+    
+    def _get_async_client(self) -> 'openai.AsyncOpenAI':
+        """Async client for the running event loop (its connection pool cannot be shared across loops)"""
+        loop = asyncio.get_running_loop()
+        if self._async_client_loop is not loop:
+            self.async_client = openai.AsyncOpenAI(api_key=self.api_key)
+            self._async_client_loop = loop
+        return self.async_client
+    
+    async def aprocess_request(self, request: Dict[str, Any]) -> Dict[str, Any]:
+        """Async variant of process_request"""
+        message = request.get('message', '')
+        context = request.get('context', {})
+        project = context.get('project', 'unknown')
+        file_path = context.get('file', 'unknown')
+        
+        try:
+            if self.uses_real_ai():
+                return await self._aprocess_with_openai(message, context, project, file_path)
+            logger.info("Using mock response (real AI disabled or not configured)")
+            # Mock replies may list project files
+            return await asyncio.to_thread(self._process_with_mock, message, context, project, file_path)
+        except Exception as e:
+            logger.error(f"Error in OpenAI agent: {e}")
+            if self.fallback_to_mock:
+                logger.info("Falling back to mock response due to error")
+                return await asyncio.to_thread(self._process_with_mock, message, context, project, file_path)
+            return {
+                "status": "error",
+                "agent_type": self.agent_type,
+                "error": str(e),
+                "timestamp": datetime.now().isoformat()
+            }
+    
+    async def astream_request(self, request: Dict[str, Any]) -> AsyncIterator[Dict[str, Any]]:
+        """Async variant of stream_request"""
+        message = request.get('message', '')
+        context = request.get('context', {})
+        project = context.get('project', 'unknown')
+        file_path = context.get('file', 'unknown')
+        
+        if not self.uses_real_ai():
+            logger.info("Using mock stream (real AI disabled or not configured)")
+            result = await asyncio.to_thread(self._process_with_mock, message, context, project, file_path)
+            for chunk in iter_text_chunks(result["response"]):
+                yield {"type": "token", "content": chunk}
+            yield {"type": "done", **result}
+            return
+        
+        tokens_sent = False
+        try:
+            async for event in self._astream_with_openai(message, context, project, file_path):
+                tokens_sent = tokens_sent or event["type"] == "token"
+                yield event
+        except Exception as e:
+            logger.error(f"Error in OpenAI agent stream: {e}")
+            # Partial output has already reached the client, so only fall back before the first token
+            if self.fallback_to_mock and not tokens_sent:
+                logger.info("Falling back to mock stream due to error")
+                result = await asyncio.to_thread(self._process_with_mock, message, context, project, file_path)
+                for chunk in iter_text_chunks(result["response"]):
+                    yield {"type": "token", "content": chunk}
+                yield {"type": "done", **result}
+            else:
+                yield {
+                    "type": "done",
+                    "status": "error",
+                    "agent_type": self.agent_type,
+                    "error": str(e),
+                    "timestamp": datetime.now().isoformat()
+                }
+    
+    async def _aprocess_with_openai(self, message: str, context: Dict[str, Any], project: str, file_path: str) -> Dict[str, Any]:
+        """Process request using the async OpenAI client"""
+        response = await self._get_async_client().chat.completions.create(
+            model=self.model,
+            messages=self._build_messages(message, context, project, file_path),
+            max_tokens=self.max_tokens,
+            temperature=self.temperature
+        )
+        ai_response = response.choices[0].message.content
+        usage_info = self._usage_info(response.usage, message, ai_response)
+        logger.info(f"OpenAI API call successful. Tokens used: {usage_info['total_tokens']}")
+        return self._success_result(ai_response, usage_info)
+    
+    async def _astream_with_openai(self, message: str, context: Dict[str, Any], project: str, file_path: str) -> AsyncIterator[Dict[str, Any]]:
+        """Stream request tokens from the async OpenAI client"""
+        stream = await self._get_async_client().chat.completions.create(
+            model=self.model,
+            messages=self._build_messages(message, context, project, file_path),
+            max_tokens=self.max_tokens,
+            temperature=self.temperature,
+            stream=True,
+            stream_options={"include_usage": True}
+        )
+        
+        chunks = []
+        usage = None
+        try:
+            async for chunk in stream:
+                if chunk.choices:
+                    content = chunk.choices[0].delta.content
+                    if content:
+                        chunks.append(content)
+                        yield {"type": "token", "content": content}
+                if getattr(chunk, "usage", None):
+                    usage = chunk.usage
+        finally:
+            # Release the HTTP connection if the client went away mid-stream
+            close = getattr(stream, "close", None)
+            if close:
+                await close()
+        
+        ai_response = "".join(chunks)
+        usage_info = self._usage_info(usage, message, ai_response)
+        logger.info(f"OpenAI streaming call successful. Tokens used: {usage_info['total_tokens']}")
+        yield {"type": "done", **self._success_result(ai_response, usage_info)}
+    
+    def _stream_with_mock(self, message: str, context: Dict[str, Any], project: str, file_path: str) -> Iterator[Dict[str, Any]]:
+        """Stream mock response in word-sized chunks"""
+        result = self._process_with_mock(message, context, project, file_path)
+        for chunk in iter_text_chunks(result["response"]):
+            yield {"type": "token", "content": chunk}
+        yield {"type": "done", **result}
+    
     def _process_with_mock(self, message: str, context: Dict[str, Any], project: str, file_path: str) -> Dict[str, Any]:
         """Process request using mock responses"""
         
         # Intelligent mock responses based on message content
         response_text = self._generate_mock_response(message, project, file_path)
+        prompt_tokens = count_tokens(message)
+        completion_tokens = count_tokens(response_text)
         
         return {
             "status": "success",
@@ -144,9 +373,9 @@ class OpenAIAgent:
             "response": response_text,
             "timestamp": datetime.now().isoformat(),
             "usage": {
-                "prompt_tokens": len(message.split()),
-                "completion_tokens": len(response_text.split()),
-                "total_tokens": len(message.split()) + len(response_text.split()),
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens,
                 "model": "mock"
             },
             "model": "mock",
@@ -398,17 +627,139 @@ class AIAgentManagerFull:
         agent_type = agent_type or self.default_agent
         return self.agents.get(agent_type, self.agents['openai'])
     
+    def _cache_key(self, agent: OpenAIAgent, request: Dict[str, Any]) -> Optional[str]:
+        """Response cache key for a request that would reach the API; None to bypass the cache"""
+        if not agent.uses_real_ai():
+            return None  # Mock replies are free
+        return response_cache.key_for(request, agent.model, agent.temperature, agent.max_tokens)
+    
+    def _near_duplicate_scope(self, agent: OpenAIAgent, request: Dict[str, Any]) -> Optional[str]:
+        """Scope for near-duplicate matching; None when the request carries no context fingerprint"""
+        fingerprint = request.get("metadata", {}).get("context_fingerprint")
+        if not near_duplicate_cache.enabled or not fingerprint:
+            return None
+        return context_scope(fingerprint, agent.model, agent.temperature, agent.max_tokens)
+    
+    def _lookup_cached(self, agent: OpenAIAgent, request: Dict[str, Any], key: str) -> Optional[Dict[str, Any]]:
+        """
+        Cached result for a request: the exact prompt first, then a rephrasing
+        of the same question asked in the same context
+        """
+        payload = response_cache.get(key)
+        if payload is not None:
+            logger.info(f"Response cache hit for {request.get('request_id')}")
+            return {**response_cache.cached_result(payload, agent.agent_type), "cache_match": "exact"}
+        
+        scope = self._near_duplicate_scope(agent, request)
+        message = request.get("metadata", {}).get("original_message")
+        if scope is None or not message:
+            return None
+        match = near_duplicate_cache.lookup(message, scope)
+        if match is None:
+            return None
+        payload = response_cache.get(match[0])
+        if payload is None:
+            near_duplicate_cache.discard(match[0])  # Expired from the response cache
+            return None
+        logger.info(f"Near-duplicate cache hit for {request.get('request_id')} (similarity {match[1]:.2f})")
+        return {
+            **response_cache.cached_result(payload, agent.agent_type),
+            "cache_match": "near_duplicate",
+            "similarity": round(match[1], 3)
+        }
+    
+    def _store_result(self, agent: OpenAIAgent, request: Dict[str, Any], key: str, result: Dict[str, Any]):
+        payload = response_cache.payload_for(result)
+        if payload is None:
+            return
+        response_cache.put(key, payload)
+        scope = self._near_duplicate_scope(agent, request)
+        message = request.get("metadata", {}).get("original_message")
+        if scope is not None and message:
+            near_duplicate_cache.add(message, scope, key)
+    
     def process_request(self, request: Dict[str, Any], agent_type: str = None) -> Dict[str, Any]:
-        """Process request through specified agent"""
+        """
+        Process request through specified agent
+        
+        An identical earlier request (same prompt apart from its timestamp,
+        model settings and rules), or a close rephrasing of one asked in the
+        same context, is answered from the response cache.
+        """
+        agent = self.get_agent(agent_type)
+        key = self._cache_key(agent, request)
+        if key:
+            cached = self._lookup_cached(agent, request, key)
+            if cached is not None:
+                return cached
+        
+        result = agent.process_request(request)
+        if key:
+            self._store_result(agent, request, key, result)
+        return result
+    
+    def stream_request(self, request: Dict[str, Any], agent_type: str = None) -> Iterator[Dict[str, Any]]:
+        """Stream request through specified agent, replaying cached replies as token events"""
+        agent = self.get_agent(agent_type)
+        key = self._cache_key(agent, request)
+        if not key:
+            return agent.stream_request(request)
+        cached = self._lookup_cached(agent, request, key)
+        if cached is not None:
+            return self._replay_cached(cached)
+        return self._stream_and_store(agent, request, key, agent.stream_request(request))
+    
+    def _replay_cached(self, result: Dict[str, Any]) -> Iterator[Dict[str, Any]]:
+        for chunk in iter_text_chunks(result["response"]):
+            yield {"type": "token", "content": chunk}
+        yield {"type": "done", **result}
+    
+    def _stream_and_store(
+        self, agent: OpenAIAgent, request: Dict[str, Any], key: str, events: Iterator[Dict[str, Any]]
+    ) -> Iterator[Dict[str, Any]]:
+        """Pass a stream through, caching its reply once it completes successfully"""
+        for event in events:
+            if event.get("type") == "done":
+                self._store_result(agent, request, key, event)
+            yield event
+    
+    async def aprocess_request(self, request: Dict[str, Any], agent_type: str = None) -> Dict[str, Any]:
+        """Async variant of process_request; cache lookups and stores (SQLite) run on worker threads"""
+        agent = self.get_agent(agent_type)
+        key = self._cache_key(agent, request)
+        if key:
+            cached = await asyncio.to_thread(self._lookup_cached, agent, request, key)
+            if cached is not None:
+                return cached
+        
+        result = await agent.aprocess_request(request)
+        if key:
+            await asyncio.to_thread(self._store_result, agent, request, key, result)
+        return result
+    
+    async def astream_request(self, request: Dict[str, Any], agent_type: str = None) -> AsyncIterator[Dict[str, Any]]:
+        """Async variant of stream_request"""
         agent = self.get_agent(agent_type)
-        return agent.process_request(request)
+        key = self._cache_key(agent, request)
+        cached = await asyncio.to_thread(self._lookup_cached, agent, request, key) if key else None
+        if cached is not None:
+            for event in self._replay_cached(cached):
+                yield event
+            return
+        
+        async for event in agent.astream_request(request):
+            if key and event.get("type") == "done":
+                await asyncio.to_thread(self._store_result, agent, request, key, event)
+            yield event
     
     def get_status(self) -> Dict[str, Any]:
         """Get status of all agents"""
         return {
             "manager_type": "full",
             "default_agent": self.default_agent,
-            "agents": {name: agent.get_status() for name, agent in self.agents.items()}
+            "agents": {name: agent.get_status() for name, agent in self.agents.items()},
+            "response_cache": response_cache.get_stats(),
+            "near_duplicate_cache": near_duplicate_cache.get_stats()
         }
 
 
@@ -0,0 +1,380 @@
+"""
+COAI ASGI Application
+Serves the chat endpoints natively on asyncio and every other route through
+the Flask app on a thread pool, so one process holds hundreds of open chats
+"""
+
+import asyncio
+import io
+import json
+import logging
+import os
+import sys
+import threading
+from concurrent.futures import (
+    CancelledError as FutureCancelledError, ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+)
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+from . import create_app
+from . import routes
+from .admission_control import AdmissionController, admission_controller
+from .async_orchestrator import AsyncCOAIOrchestrator, async_orchestrator
+from .error_handler import (
+    AIAgentError, OverloadedError, ValidationError, create_error_response, error_status_code, validate_chat_request
+)
+from .security_middleware import rate_limit_rejection, security_rejection
+from .stage_timer import StageTimer
+from .usage_tracker import usage_tracker
+
+logger = logging.getLogger(__name__)
+
+Scope = Dict[str, Any]
+Receive = Callable[[], Awaitable[Dict[str, Any]]]
+Send = Callable[[Dict[str, Any]], Awaitable[None]]
+
+# Same budget as the Flask chat views
+CHAT_RATE_LIMIT = 50
+CHAT_RATE_WINDOW = 3600
+
+# Response chunks a Flask route may run ahead of a slow client before its thread blocks
+WSGI_BUFFERED_CHUNKS = 16
+
+# flask-cors allows every origin on the Flask routes; the native ones match it
+CORS_HEADERS = [(b"access-control-allow-origin", b"*")]
+
+
+async def read_body(receive: Receive) -> bytes:
+    body = bytearray()
+    while True:
+        message = await receive()
+        if message["type"] == "http.disconnect":
+            break
+        body.extend(message.get("body", b""))
+        if not message.get("more_body"):
+            break
+    return bytes(body)
+
+
+async def wait_for_disconnect(receive: Receive):
+    """Returns once the client has gone away; call after the body has been read"""
+    while (await receive())["type"] != "http.disconnect":
+        pass
+
+
+def client_ip(scope: Scope) -> str:
+    """Client address as the Flask decorators see it: X-Forwarded-For first"""
+    for name, value in scope.get("headers", []):
+        if name == b"x-forwarded-for":
+            return value.decode("latin-1")
+    client = scope.get("client")
+    return client[0] if client else ""
+
+
+def wsgi_environ(scope: Scope, body: bytes) -> Dict[str, Any]:
+    """PEP 3333 environ for an ASGI HTTP request with a fully read body"""
+    server = scope.get("server") or ("localhost", 80)
+    client = scope.get("client") or ("", 0)
+    environ = {
+        "REQUEST_METHOD": scope["method"],
+        "SCRIPT_NAME": scope.get("root_path", "").encode("utf-8").decode("latin-1"),
+        "PATH_INFO": scope["path"].encode("utf-8").decode("latin-1"),
+        "QUERY_STRING": scope.get("query_string", b"").decode("latin-1"),
+        "SERVER_NAME": server[0],
+        "SERVER_PORT": str(server[1]),
+        "SERVER_PROTOCOL": f"HTTP/{scope.get('http_version', '1.1')}",
+        "REMOTE_ADDR": client[0],
+        "wsgi.version": (1, 0),
+        "wsgi.url_scheme": scope.get("scheme", "http"),
+        "wsgi.input": io.BytesIO(body),
+        "wsgi.errors": sys.stderr,
+        "wsgi.multithread": True,
+        "wsgi.multiprocess": False,
+        "wsgi.run_once": False,
+    }
+    for name, value in scope.get("headers", []):
+        name, value = name.decode("latin-1"), value.decode("latin-1")
+        if name == "content-type":
+            environ["CONTENT_TYPE"] = value
+        elif name == "content-length":
+            environ["CONTENT_LENGTH"] = value
+        else:
+            key = "HTTP_" + name.upper().replace("-", "_")
+            environ[key] = f"{environ[key]},{value}" if key in environ else value
+    return environ
+
+
+async def send_json(send: Send, body: Any, status: int = 200, headers: List[Tuple[bytes, bytes]] = None):
+    payload = json.dumps(body, ensure_ascii=False, default=str).encode("utf-8")
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(payload)).encode())]
+                   + CORS_HEADERS + (headers or [])
+    })
+    await send({"type": "http.response.body", "body": payload})
+
+
+async def send_error(send: Send, error: Exception, context: Dict[str, Any] = None):
+    """Error response as handle_api_errors would produce it"""
+    headers = [(b"retry-after", str(error.retry_after).encode())] if isinstance(error, OverloadedError) else None
+    await send_json(send, create_error_response(error, context), error_status_code(error), headers)
+
+
+class ASGIApp:
+    """
+    ASGI front for the backend
+
+    POST /api/chat and /api/chat/stream are handled here with the async
+    orchestrator, applying the same rate limit, security checks, validation,
+    admission control and error responses as the Flask views. Every other
+    request is passed to the Flask app, which runs on a worker thread of its
+    own pool (ASGI_WSGI_THREADS) so slow routes never block the event loop.
+    """
+
+    def __init__(
+        self,
+        flask_app,
+        orchestrator: AsyncCOAIOrchestrator = None,
+        wsgi_threads: int = None,
+        admission: AdmissionController = None
+    ):
+        self.flask_app = flask_app
+        self.orchestrator = orchestrator or async_orchestrator
+        self.admission = admission or admission_controller
+        self.executor = ThreadPoolExecutor(
+            max_workers=wsgi_threads or int(os.getenv('ASGI_WSGI_THREADS', '32')),
+            thread_name_prefix='coai-wsgi'
+        )
+        self.routes = {
+            ("POST", "/api/chat"): self.chat,
+            ("POST", "/api/chat/stream"): self.chat_stream,
+        }
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] == "lifespan":
+            await self._lifespan(receive, send)
+        elif scope["type"] == "http":
+            handler = self.routes.get((scope["method"], scope["path"]))
+            if handler is not None:
+                await handler(scope, receive, send)
+            else:
+                await self._call_wsgi(scope, receive, send)
+        elif scope["type"] == "websocket":
+            await send({"type": "websocket.close", "code": 1000})
+
+    async def _lifespan(self, receive: Receive, send: Send):
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                await asyncio.to_thread(usage_tracker.migrate_legacy_days)
+                routes.warm_indexes()
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                self.executor.shutdown(wait=False)
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    # --- Native chat endpoints ---
+
+    async def _chat_request(
+        self, scope: Scope, receive: Receive, timer: StageTimer
+    ) -> Tuple[Optional[Dict[str, Any]], Optional[Tuple[Dict[str, Any], int]]]:
+        """(request body, None) for an acceptable chat request, else (None, (error body, status))"""
+        ip = client_ip(scope)
+        rejection = rate_limit_rejection(ip, CHAT_RATE_LIMIT, CHAT_RATE_WINDOW)
+        if rejection:
+            return None, rejection
+
+        body = await read_body(receive)
+        try:
+            data = json.loads(body) if body else None
+        except ValueError:
+            data = None
+        if not isinstance(data, dict):
+            data = None
+        elif (rejection := security_rejection(data, ip)):
+            return None, rejection
+
+        try:
+            with timer.span("validation"):
+                validate_chat_request(data)
+        except ValidationError as e:
+            return None, (create_error_response(e), error_status_code(e))
+        return data, None
+
+    async def chat(self, scope: Scope, receive: Receive, send: Send):
+        """POST /api/chat: same request and response as the Flask view"""
+        timer = StageTimer()
+        data, rejection = await self._chat_request(scope, receive, timer)
+        if rejection:
+            await send_json(send, *rejection)
+            return
+
+        context = routes.build_chat_context(data, "/api/chat", timer)
+        logger.info(f"Processing async chat request - Project: {context['project']}, File: {context['file']}")
+        try:
+            async with self.admission.aadmit(timer):
+                response = await self.orchestrator.process_chat_request(data["message"].strip(), context, timer=timer)
+                if response.get("error"):
+                    raise AIAgentError(
+                        response.get("message", "Orchestrator processing failed"),
+                        agent_type=response.get("agent_type", "unknown")
+                    )
+        except Exception as e:
+            await send_error(send, e, context)
+            return
+        logger.info(f"Chat request {response.get('request_id')} completed successfully")
+        await send_json(send, response)
+
+    async def chat_stream(self, scope: Scope, receive: Receive, send: Send):
+        """POST /api/chat/stream: Server-Sent Events, one write per event"""
+        timer = StageTimer()
+        data, rejection = await self._chat_request(scope, receive, timer)
+        if rejection:
+            await send_json(send, *rejection)
+            return
+
+        context = routes.build_chat_context(data, "/api/chat/stream", timer)
+        logger.info(f"Streaming async chat request - Project: {context['project']}, File: {context['file']}")
+        try:
+            slot = await self.admission.aacquire(timer)
+        except OverloadedError as e:
+            await send_error(send, e, context)
+            return
+        ok = False
+        try:
+            ok = await self._stream_events(data, context, receive, send, timer)
+        finally:
+            slot.release(ok=ok)
+
+    async def _stream_events(
+        self, data: Dict[str, Any], context: Dict[str, Any], receive: Receive, send: Send, timer: StageTimer
+    ) -> bool:
+        """Send the SSE response for an admitted stream request; False if processing failed"""
+        await send({
+            "type": "http.response.start",
+            "status": 200,
+            "headers": [
+                (b"content-type", b"text/event-stream; charset=utf-8"),
+                (b"cache-control", b"no-cache"),
+                (b"x-accel-buffering", b"no"),  # Disable proxy buffering so tokens flush immediately
+            ] + CORS_HEADERS
+        })
+
+        events = self.orchestrator.stream_chat_request(data["message"].strip(), context, timer=timer)
+        disconnected = asyncio.ensure_future(wait_for_disconnect(receive))
+        ok = True
+        try:
+            async for event in events:
+                if disconnected.done():
+                    break  # Closing the stream below records the request as cancelled
+                if event["type"] == "error":
+                    ok = False
+                payload = json.dumps(event, ensure_ascii=False)
+                await send({
+                    "type": "http.response.body",
+                    "body": f"event: {event['type']}\ndata: {payload}\n\n".encode("utf-8"),
+                    "more_body": True
+                })
+            else:
+                await send({"type": "http.response.body", "body": b""})
+        except OSError:
+            logger.info("Client went away during chat stream")
+        finally:
+            disconnected.cancel()
+            await events.aclose()
+        return ok
+
+    # --- Everything else: the Flask app on a worker thread ---
+
+    async def _call_wsgi(self, scope: Scope, receive: Receive, send: Send):
+        body = await read_body(receive)
+        loop = asyncio.get_running_loop()
+        # Bounded, so a slow client blocks the worker thread instead of buffering the whole response
+        queue: asyncio.Queue = asyncio.Queue(maxsize=WSGI_BUFFERED_CHUNKS)
+        cancelled = threading.Event()
+
+        def hand_over(kind: str, value: Any = None):
+            """Queue an item for the event loop, blocking while the queue is full until the response is abandoned"""
+            if cancelled.is_set():
+                return
+            try:
+                put = asyncio.run_coroutine_threadsafe(queue.put((kind, value)), loop)
+            except RuntimeError:
+                cancelled.set()  # The loop is gone
+                return
+            while not cancelled.is_set():
+                try:
+                    put.result(timeout=0.5)
+                    return
+                except FutureTimeoutError:
+                    pass
+                except FutureCancelledError:
+                    cancelled.set()  # The loop shut down with the put pending
+                    return
+            put.cancel()
+
+        def run():
+            """Run the WSGI app on one worker thread so Flask's context stays on that thread"""
+            def start_response(status: str, headers: List[Tuple[str, str]], exc_info=None):
+                hand_over("start", (int(status.split(" ", 1)[0]), headers))
+                return lambda data: hand_over("body", data)
+
+            try:
+                result = self.flask_app(wsgi_environ(scope, body), start_response)
+                try:
+                    for chunk in result:
+                        if cancelled.is_set():
+                            break
+                        if chunk:
+                            hand_over("body", chunk)
+                finally:
+                    close = getattr(result, "close", None)
+                    if close:
+                        close()
+            except Exception as e:
+                logger.error(f"WSGI app failed for {scope['path']}: {e}")
+                hand_over("error", e)
+                return
+            hand_over("end")
+
+        loop.run_in_executor(self.executor, run)
+        # Nothing else reads from the client now, and a send after disconnect may silently succeed:
+        # without this an endless route (/api/files/watch) would hold its worker thread forever
+        disconnected = asyncio.ensure_future(wait_for_disconnect(receive))
+        started = False
+        try:
+            while True:
+                item = asyncio.ensure_future(queue.get())
+                await asyncio.wait((item, disconnected), return_when=asyncio.FIRST_COMPLETED)
+                if disconnected.done():
+                    item.cancel()
+                    return
+                kind, value = item.result()
+                if kind == "start":
+                    status, headers = value
+                    await send({
+                        "type": "http.response.start",
+                        "status": status,
+                        "headers": [(name.lower().encode("latin-1"), value.encode("latin-1")) for name, value in headers]
+                    })
+                    started = True
+                elif kind == "body":
+                    await send({"type": "http.response.body", "body": value, "more_body": True})
+                elif kind == "end":
+                    await send({"type": "http.response.body", "body": b""})
+                    return
+                else:
+                    if not started:
+                        await send_json(send, {"error": "Internal server error"}, 500)
+                    else:
+                        await send({"type": "http.response.body", "body": b""})
+                    return
+        finally:
+            # Client disconnected, server shutting down or response done; stop feeding the response
+            cancelled.set()
+            disconnected.cancel()
+
+
+def create_asgi_app() -> ASGIApp:
+    return ASGIApp(create_app())
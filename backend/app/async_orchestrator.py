@@ -0,0 +1,134 @@
+"""
+COAI Async Orchestrator
+Asyncio variant of the orchestrator for the ASGI server: an in-flight AI call
+is a suspended coroutine rather than a blocked worker thread
+"""
+
+import asyncio
+import logging
+from datetime import datetime
+from typing import Any, AsyncIterator, Dict, Optional
+from .orchestrator import COAIOrchestrator, ai_agent_manager
+from .logger import coai_logger
+from .stage_timer import StageTimer
+from .single_flight import async_single_flight
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncCOAIOrchestrator(COAIOrchestrator):
+    """
+    Same flow, logging, usage tracking and response format as COAIOrchestrator
+
+    Preprocessing (file context, retrieval, prompt packing) reads files and is
+    CPU-bound, so it runs on the event loop's worker threads; the agent call
+    awaits the async OpenAI client. Logging and usage tracking only enqueue
+    to their write-behind workers and stay on the loop.
+    """
+
+    async def process_chat_request(
+        self,
+        message: str,
+        context: Dict[str, Any],
+        timer: Optional[StageTimer] = None
+    ) -> Dict[str, Any]:
+        """Async variant of COAIOrchestrator.process_chat_request"""
+        request_id = None
+        start_time = datetime.now()
+        timer = timer or StageTimer()
+
+        try:
+            # Step 1: Log incoming request
+            with timer.span("logging"):
+                request_id = coai_logger.log_chat_request(message, context)
+            logger.info(f"Async orchestrator processing request: {request_id}")
+
+            # Step 2: Validate input
+            with timer.span("validation"):
+                validation_result = self._validate_request(message, context)
+            if not validation_result["valid"]:
+                raise ValueError(validation_result["error"])
+
+            # Steps 3-5: Preprocess and call the AI agent, once for concurrent identical requests
+            wait_started = datetime.now()
+            answer, coalesced = await async_single_flight.run(
+                self._coalesce_key(message, context),
+                lambda: self._answer_chat_request_async(request_id, message, context, timer)
+            )
+            if coalesced:
+                timer.stages["coalesced_wait"] = (datetime.now() - wait_started).total_seconds() * 1000
+
+            # Steps 6-8: Log, track usage and prepare the final response
+            return self._complete_chat_request(request_id, message, context, answer, coalesced, start_time, timer)
+
+        except Exception as e:
+            return self._fail_chat_request(request_id, message, context, start_time, e)
+
+    async def _answer_chat_request_async(
+        self,
+        request_id: str,
+        message: str,
+        context: Dict[str, Any],
+        timer: StageTimer
+    ) -> Dict[str, Any]:
+        processed_data = await asyncio.to_thread(self._preprocess, request_id, message, context, timer)
+
+        # Step 5: Call AI agent
+        logger.info(f"Step 2/4: Calling AI agent for {request_id}")
+        with timer.span("agent"):
+            ai_result = await ai_agent_manager.aprocess_request(self._agent_request(request_id, context, processed_data))
+        return self._answer_from_result(request_id, processed_data, ai_result, timer)
+
+    async def stream_chat_request(
+        self,
+        message: str,
+        context: Dict[str, Any],
+        timer: Optional[StageTimer] = None
+    ) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Async variant of COAIOrchestrator.stream_chat_request
+
+        Closing the generator early (the client disconnected) records the
+        request as cancelled, like the sync stream.
+        """
+        stream = self._begin_stream(message, context, timer)
+
+        try:
+            # Steps 1-3: Log, validate and preprocess the prompt
+            self._open_stream(stream)
+            processed_data = await asyncio.to_thread(
+                self._preprocess, stream["request_id"], message, context, stream["timer"]
+            )
+
+            yield {"type": "start", "request_id": stream["request_id"]}
+
+            # Step 4: Stream AI agent response
+            logger.info(f"Step 2/4: Streaming AI agent response for {stream['request_id']}")
+            ai_result = {}
+            # Includes time the client takes to consume each token
+            stream["agent_started"] = datetime.now()
+            async for event in ai_agent_manager.astream_request(self._agent_request(stream["request_id"], context, processed_data)):
+                if event.get("type") == "token":
+                    yield self._stream_token(stream, event["content"])
+                elif event.get("type") == "done":
+                    ai_result = event
+            for event in self._close_agent_stream(stream, processed_data, ai_result):
+                yield event
+
+            # Steps 5-6: Finalise logging and usage, then send the final event
+            yield self._complete_stream(stream, processed_data, ai_result)
+
+        except Exception as e:
+            yield self._fail_stream(stream, e)
+        finally:
+            self._cancel_stream(stream)
+
+    def get_orchestrator_status(self) -> Dict[str, Any]:
+        status = super().get_orchestrator_status()
+        status["capabilities"] = status["capabilities"] + ["asyncio_agent_calls"]
+        status["coalescing"] = async_single_flight.get_stats()
+        return status
+
+
+# Global async orchestrator instance
+async_orchestrator = AsyncCOAIOrchestrator()
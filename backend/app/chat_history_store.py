@@ -0,0 +1,277 @@
+"""
+COAI Chat History Store
+Append-only JSONL segment log with size-based rotation and a sparse offset index
+"""
+
+import json
+import logging
+import os
+import threading
+from contextlib import contextmanager
+from typing import Dict, Any, Iterator, List, Optional, Tuple
+
+try:
+    import fcntl
+except ImportError:  # Windows: single-process dev server, no cross-process locking
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+SEGMENT_PREFIX = "segment_"
+SEGMENT_SUFFIX = ".jsonl"
+INDEX_FILE = "index.json"
+LOCK_FILE = ".lock"
+
+
+class ChatHistoryStore:
+    """
+    Stores chat history events as JSON Lines across rotating segment files
+
+    Each append is a single O_APPEND write, so cost no longer depends on history
+    size and concurrent writers cannot interleave partial entries. The index
+    records, per sealed segment, the entry count and the byte offset of every
+    `index_stride`-th entry, so reading the last N entries only parses the tail.
+
+    Several processes may share one directory: appends, rotation and index
+    writes happen under an advisory lock on LOCK_FILE, and each process first
+    catches up with the others (reloads a changed index, follows a rotation,
+    scans entries appended since its last write) instead of trusting its
+    in-memory offsets.
+    """
+
+    def __init__(
+        self,
+        history_dir: str,
+        max_segment_bytes: int = 1024 * 1024,
+        max_segments: int = 8,
+        index_stride: int = 64
+    ):
+        self.history_dir = history_dir
+        self.index_path = os.path.join(history_dir, INDEX_FILE)
+        self.max_segment_bytes = max_segment_bytes
+        self.max_segments = max_segments
+        self.index_stride = index_stride
+        self.lock = threading.Lock()
+
+        os.makedirs(history_dir, exist_ok=True)
+        self.lock_file = open(os.path.join(history_dir, LOCK_FILE), 'a')
+
+        with self._locked():
+            # Sealed segments: [{"name", "entries", "bytes", "offsets"}], oldest first
+            self.segments: List[Dict[str, Any]] = self._load_index()
+            self.index_version = self._index_version()
+            self.active = self._open_active_segment()
+
+    @contextmanager
+    def _locked(self) -> Iterator[None]:
+        """Hold the directory's cross-process lock; the caller holds self.lock (or is __init__)"""
+        if fcntl is None:
+            yield
+            return
+        fcntl.flock(self.lock_file.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(self.lock_file.fileno(), fcntl.LOCK_UN)
+
+    # --- Index management ---
+
+    def _load_index(self) -> List[Dict[str, Any]]:
+        """Load sealed segment metadata, dropping entries whose files are gone"""
+        if not os.path.exists(self.index_path):
+            return []
+        try:
+            with open(self.index_path, 'r', encoding='utf-8') as f:
+                segments = json.load(f).get("segments", [])
+            return [s for s in segments if os.path.exists(self._segment_path(s["name"]))]
+        except Exception as e:
+            logger.warning(f"Chat history index unreadable, rebuilding: {e}")
+            return [self._scan_segment(name) for name in self._segment_names()[:-1]]
+
+    def _save_index(self):
+        """Atomically persist sealed segment metadata"""
+        tmp_path = self.index_path + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({"segments": self.segments}, f)
+        os.replace(tmp_path, self.index_path)
+        self.index_version = self._index_version()
+
+    def _index_version(self) -> Optional[Tuple[int, int]]:
+        """Identity of the index file on disk; os.replace gives every save a new inode"""
+        try:
+            stat = os.stat(self.index_path)
+        except FileNotFoundError:
+            return None
+        return (stat.st_ino, stat.st_mtime_ns)
+
+    def _sync(self):
+        """Catch up with other processes' rotations and appends; the caller holds the file lock"""
+        version = self._index_version()
+        if version != self.index_version:
+            self.segments = self._load_index()
+            self.index_version = version
+            if any(s["name"] == self.active["name"] for s in self.segments):
+                # Another process sealed our segment and started a new one
+                os.close(self.active.pop("fd"))
+                self.active = self._open_active_segment()
+                return
+
+        path = self._segment_path(self.active["name"])
+        try:
+            size = os.path.getsize(path)
+        except FileNotFoundError:
+            size = -1
+        if size < self.active["bytes"]:
+            # Removed or truncated under us: start over from what is on disk
+            os.close(self.active.pop("fd"))
+            self.active = self._open_active_segment()
+        elif size > self.active["bytes"]:
+            self._scan_appended(self.active)
+            if size > self.active["bytes"]:
+                # Writers only append under the lock, so a partial line is a crashed process's torn write
+                os.truncate(path, self.active["bytes"])
+
+    def _segment_names(self) -> List[str]:
+        return sorted(
+            name for name in os.listdir(self.history_dir)
+            if name.startswith(SEGMENT_PREFIX) and name.endswith(SEGMENT_SUFFIX)
+        )
+
+    def _segment_path(self, name: str) -> str:
+        return os.path.join(self.history_dir, name)
+
+    def _scan_segment(self, name: str) -> Dict[str, Any]:
+        """Build index metadata for a segment by scanning its line offsets"""
+        segment = {"name": name, "entries": 0, "bytes": 0, "offsets": []}
+        self._scan_appended(segment)
+        return segment
+
+    def _scan_appended(self, segment: Dict[str, Any]):
+        """Extend a segment's metadata over the complete lines written after segment["bytes"]"""
+        with open(self._segment_path(segment["name"]), 'rb') as f:
+            f.seek(segment["bytes"])
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break  # Torn final write from an interrupted process
+                if segment["entries"] % self.index_stride == 0:
+                    segment["offsets"].append(segment["bytes"])
+                segment["entries"] += 1
+                segment["bytes"] += len(line)
+
+    def _open_active_segment(self) -> Dict[str, Any]:
+        """Open (or create) the newest segment for appending"""
+        sealed = {s["name"] for s in self.segments}
+        names = [n for n in self._segment_names() if n not in sealed]
+        if names:
+            active = self._scan_segment(names[-1])
+            path = self._segment_path(active["name"])
+            if os.path.getsize(path) > active["bytes"]:
+                # Drop a torn final write so the next append starts on a clean line
+                os.truncate(path, active["bytes"])
+        else:
+            last = self.segments[-1]["name"] if self.segments else None
+            number = int(last[len(SEGMENT_PREFIX):-len(SEGMENT_SUFFIX)]) + 1 if last else 1
+            name = f"{SEGMENT_PREFIX}{number:06d}{SEGMENT_SUFFIX}"
+            open(self._segment_path(name), 'ab').close()
+            active = {"name": name, "entries": 0, "bytes": 0, "offsets": []}
+        active["fd"] = os.open(self._segment_path(active["name"]), os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        return active
+
+    def _rotate(self):
+        """Seal the active segment and start a new one, enforcing retention"""
+        os.close(self.active.pop("fd"))
+        self.segments.append(self.active)
+
+        while len(self.segments) >= self.max_segments:
+            oldest = self.segments.pop(0)
+            try:
+                os.remove(self._segment_path(oldest["name"]))
+            except FileNotFoundError:
+                pass
+
+        self._save_index()
+        self.active = self._open_active_segment()
+
+    # --- Public API ---
+
+    def append(self, entry: Dict[str, Any]):
+        """Append a single history entry"""
+        self.append_many([entry])
+
+    def append_many(self, entries: List[Dict[str, Any]]):
+        """Append a batch of history entries, one write per segment touched"""
+        with self.lock, self._locked():
+            self._sync()
+            pending = b""
+            for entry in entries:
+                data = (json.dumps(entry, ensure_ascii=False) + "\n").encode('utf-8')
+                size = self.active["bytes"] + len(pending)
+                if size and size + len(data) > self.max_segment_bytes:
+                    self._write_pending(pending)
+                    pending = b""
+                    self._rotate()
+                    size = 0
+
+                if self.active["entries"] % self.index_stride == 0:
+                    self.active["offsets"].append(size)
+                self.active["entries"] += 1
+                pending += data
+            self._write_pending(pending)
+
+    def _write_pending(self, pending: bytes):
+        if pending:
+            os.write(self.active["fd"], pending)
+            self.active["bytes"] += len(pending)
+
+    def tail(self, limit: Optional[int] = None) -> List[Dict[str, Any]]:
+        """
+        Return the last `limit` entries (all retained entries if falsy), oldest first
+        """
+        with self.lock:
+            with self._locked():
+                self._sync()
+            segments = [dict(s) for s in self.segments]
+            active = {k: v for k, v in self.active.items() if k != "fd"}
+            active["offsets"] = list(active["offsets"])
+        segments.append(active)
+
+        collected: List[Dict[str, Any]] = []
+        for segment in reversed(segments):
+            needed = limit - len(collected) if limit else None
+            if needed is not None and needed <= 0:
+                break
+            collected = self._read_segment_tail(segment, needed) + collected
+
+        return collected[-limit:] if limit else collected
+
+    def _read_segment_tail(self, segment: Dict[str, Any], needed: Optional[int]) -> List[Dict[str, Any]]:
+        """Read the last `needed` entries of a segment, seeking via the offset index"""
+        start = 0
+        if needed is not None and segment["offsets"]:
+            first_wanted = max(segment["entries"] - needed, 0)
+            checkpoint = min(first_wanted // self.index_stride, len(segment["offsets"]) - 1)
+            start = segment["offsets"][checkpoint]
+
+        entries = []
+        try:
+            with open(self._segment_path(segment["name"]), 'rb') as f:
+                f.seek(start)
+                for line in f:
+                    if not line.endswith(b"\n"):
+                        break
+                    try:
+                        entries.append(json.loads(line))
+                    except ValueError:
+                        continue
+        except FileNotFoundError:
+            return []
+
+        # The active segment may have grown from other writers; keep only the tail
+        return entries[-needed:] if needed else entries
+
+    def close(self):
+        with self.lock:
+            fd = self.active.pop("fd", None)
+            if fd is not None:
+                os.close(fd)
+            self.lock_file.close()
@@ -0,0 +1,557 @@
+"""
+COAI Code Search
+On-disk trigram index over project files with literal and regex queries
+"""
+
+import atexit
+import hashlib
+import logging
+import marshal
+import os
+import re
+import threading
+import time
+from array import array
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Pattern, Set, Tuple
+from .file_context_manager import file_context_manager
+from .file_watcher import file_watcher, is_tree_change
+
+try:
+    from re import _parser as sre_parse
+    from re import _constants as sre_constants
+except ImportError:  # Python < 3.11
+    import sre_parse
+    import sre_constants
+
+logger = logging.getLogger(__name__)
+
+INDEX_VERSION = 1
+MAX_MATCHES_PER_FILE = 5
+# Matching files verified per requested result before a search stops early
+VERIFY_FACTOR = 4
+
+
+class SearchQueryError(ValueError):
+    """Query that cannot be compiled or is too short to search"""
+
+
+class SearchIndexBuildingError(RuntimeError):
+    """The project's index is still being built; retry after `retry_after` seconds"""
+    def __init__(self, root: str, retry_after: int = 1):
+        super().__init__(f"Search index for {root} is still being built")
+        self.retry_after = retry_after
+
+
+def _trigrams(data: bytes) -> Set[int]:
+    """Distinct byte trigrams of (already ASCII-lower-cased) data, packed as 24-bit ints"""
+    return {(a << 16) | (b << 8) | c for a, b, c in set(zip(data, data[1:], data[2:]))}
+
+
+def _literal_runs(pattern: List[Tuple[Any, Any]]) -> List[str]:
+    """
+    Literal strings every match of a parsed regex must contain
+
+    Walks the top-level sequence collecting runs of adjacent literals; groups
+    and repeats with a minimum of one contribute their own required runs.
+    Alternations, classes and optional parts end the current run.
+    """
+    runs: List[str] = []
+    current: List[str] = []
+
+    def flush():
+        if current:
+            runs.append(''.join(current))
+            current.clear()
+
+    for op, arg in pattern:
+        if op == sre_constants.LITERAL:
+            current.append(chr(arg))
+        elif op == sre_constants.AT:
+            continue  # Anchors are zero-width
+        elif op == sre_constants.SUBPATTERN:
+            flush()
+            runs.extend(_literal_runs(list(arg[-1])))
+        elif op in (sre_constants.MAX_REPEAT, sre_constants.MIN_REPEAT) and arg[0] >= 1:
+            flush()
+            runs.extend(_literal_runs(list(arg[2])))
+        else:
+            flush()
+    flush()
+    return runs
+
+
+@dataclass
+class CompiledQuery:
+    """A search query ready to run against the index"""
+    pattern: Pattern
+    trigrams: Set[int]
+    # Longest literal every match contains (lower-cased bytes), used to jump
+    # straight to the lines worth running the pattern on
+    anchor: Optional[bytes]
+
+
+def compile_query(query: str, regex: bool, case_sensitive: bool = False) -> CompiledQuery:
+    """
+    Compile a query and derive the trigrams any matching file must contain
+
+    The index is case-folded, so the same trigrams serve case-sensitive and
+    case-insensitive queries; only verification differs. An empty trigram set
+    means the query cannot be narrowed and every file is a candidate.
+    """
+    if not query:
+        raise SearchQueryError("Query must not be empty")
+    source = query if regex else re.escape(query)
+    flags = re.MULTILINE | (0 if case_sensitive else re.IGNORECASE)
+    try:
+        pattern = re.compile(source, flags)
+        literals = _literal_runs(list(sre_parse.parse(source))) if regex else [query]
+    except re.error as e:
+        raise SearchQueryError(f"Invalid regular expression: {e}")
+    if pattern.fullmatch(''):
+        raise SearchQueryError("Pattern matches empty text")
+
+    required: Set[int] = set()
+    for literal in literals:
+        required |= _trigrams(literal.encode('utf-8').lower())
+    if not case_sensitive:
+        # Only ASCII is case-folded in the index; other bytes may differ in case
+        required = {trigram for trigram in required if not trigram & 0x808080}
+        literals = [literal for literal in literals if literal.isascii()]
+
+    literals = [literal for literal in literals if '\n' not in literal]
+    anchor = max(literals, key=len).encode('utf-8').lower() if literals else None
+    return CompiledQuery(pattern, required, anchor)
+
+
+def find_matches(data: bytes, query: CompiledQuery) -> Tuple[int, List[Dict[str, Any]]]:
+    """
+    Count matches in one file and describe the first MAX_MATCHES_PER_FILE
+
+    With an anchor, matching is line-oriented like grep: only lines containing
+    the anchor are decoded and run through the pattern. Without one the
+    pattern runs over the whole decoded file.
+
+    Returns:
+        (match count, [{"line", "text"}, ...])
+    """
+    matches: List[Dict[str, Any]] = []
+    count = 0
+
+    if query.anchor is None:
+        text = data.decode('utf-8', errors='replace')
+        for match in query.pattern.finditer(text):
+            count += 1
+            if len(matches) < MAX_MATCHES_PER_FILE:
+                line_start = text.rfind('\n', 0, match.start()) + 1
+                line_end = text.find('\n', match.end())
+                matches.append({
+                    "line": text.count('\n', 0, match.start()) + 1,
+                    "text": text[line_start:line_end if line_end != -1 else len(text)].strip()[:300]
+                })
+        return count, matches
+
+    lowered = data.lower()
+    line_number, counted_to = 1, 0
+    position = lowered.find(query.anchor)
+    while position != -1:
+        line_start = data.rfind(b'\n', 0, position) + 1
+        line_end = data.find(b'\n', position)
+        if line_end == -1:
+            line_end = len(data)
+        line = data[line_start:line_end].decode('utf-8', errors='replace')
+        hits = sum(1 for _ in query.pattern.finditer(line))
+        if hits:
+            count += hits
+            if len(matches) < MAX_MATCHES_PER_FILE:
+                line_number += data.count(b'\n', counted_to, line_start)
+                counted_to = line_start
+                matches.append({"line": line_number, "text": line.strip()[:300]})
+        position = lowered.find(query.anchor, line_end + 1)
+    return count, matches
+
+
+class TrigramIndex:
+    """
+    Inverted trigram index for one project root
+
+    Every indexed file gets an id and adds its id to the posting list of each
+    distinct (lower-cased byte) trigram it contains. A query intersects the
+    posting lists of its trigrams, so only files that can match are read and
+    verified with the real pattern.
+
+    refresh() stats the files listed by the workspace index and re-indexes
+    those whose (mtime_ns, size) changed. Changed or deleted files are
+    tombstoned rather than removed from posting lists; the lists are compacted
+    once tombstones outnumber live files. The whole index is persisted with
+    marshal, so a restart only re-indexes what changed while it was down.
+    """
+
+    def __init__(
+        self,
+        root: str,
+        cache_path: Optional[str] = None,
+        max_file_bytes: int = None,
+        revalidate_interval: float = None
+    ):
+        self.root = os.path.abspath(root)
+        self.cache_path = cache_path
+        self.max_file_bytes = max_file_bytes or int(os.getenv('SEARCH_MAX_FILE_BYTES', str(1024 * 1024)))
+        if revalidate_interval is None:
+            revalidate_interval = float(os.getenv('SEARCH_REVALIDATE_SECONDS', '10'))
+        self.revalidate_interval = revalidate_interval
+        self.lock = threading.RLock()
+        # Separate from `lock`, which a running warm-up holds for the whole build
+        self.warm_lock = threading.Lock()
+        self.ready = threading.Event()  # Set once the first refresh has completed
+        self.warmer: Optional[threading.Thread] = None
+
+        # file id -> [rel_path, mtime_ns, size]; None once tombstoned
+        self.files: List[Optional[List[Any]]] = []
+        self.ids_by_path: Dict[str, int] = {}
+        self.postings: Dict[int, array] = {}
+        self.dead = 0
+        self.validated_at = 0.0
+        self.dirty_paths: Set[str] = set()
+        # Rewriting a large index per edited file would dominate; saves are batched
+        self.save_interval = float(os.getenv('SEARCH_SAVE_INTERVAL', '30'))
+        self.saved_at = 0.0
+        self.unsaved = False
+
+        self._load()
+        atexit.register(self.flush)
+
+    # --- Persistence ---
+
+    def _load(self):
+        if not self.cache_path or not os.path.exists(self.cache_path):
+            return
+        try:
+            with open(self.cache_path, 'rb') as f:
+                data = marshal.load(f)
+            if data.get("version") != INDEX_VERSION or data.get("root") != self.root:
+                return
+            self.files = data["files"]
+            self.postings = {}
+            for trigram, ids in data["postings"].items():
+                self.postings[trigram] = array('I')
+                self.postings[trigram].frombytes(ids)
+            self.ids_by_path = {entry[0]: file_id for file_id, entry in enumerate(self.files) if entry}
+            self.dead = len(self.files) - len(self.ids_by_path)
+        except Exception as e:
+            logger.warning(f"Search index {self.cache_path} unreadable, rebuilding: {e}")
+
+    def _save(self):
+        if not self.cache_path:
+            return
+        try:
+            os.makedirs(os.path.dirname(self.cache_path), exist_ok=True)
+            tmp_path = f"{self.cache_path}.{os.getpid()}.tmp"
+            with open(tmp_path, 'wb') as f:
+                marshal.dump({
+                    "version": INDEX_VERSION,
+                    "root": self.root,
+                    "files": self.files,
+                    "postings": {trigram: ids.tobytes() for trigram, ids in self.postings.items()}
+                }, f)
+            os.replace(tmp_path, self.cache_path)
+        except (OSError, ValueError) as e:
+            logger.warning(f"Could not persist search index {self.cache_path}: {e}")
+
+    # --- Indexing ---
+
+    def _read(self, rel_path: str) -> Optional[bytes]:
+        try:
+            with open(os.path.join(self.root, rel_path), 'rb') as f:
+                data = f.read(self.max_file_bytes + 1)
+        except OSError:
+            return None
+        if len(data) > self.max_file_bytes or b'\0' in data[:8192]:
+            return None  # Too large or binary
+        return data
+
+    def _remove(self, rel_path: str):
+        file_id = self.ids_by_path.pop(rel_path, None)
+        if file_id is not None:
+            self.files[file_id] = None
+            self.dead += 1
+
+    def _add(self, rel_path: str, mtime_ns: int, size: int):
+        data = self._read(rel_path)
+        file_id = len(self.files)
+        self.files.append([rel_path, mtime_ns, size])
+        self.ids_by_path[rel_path] = file_id
+        if data is None:
+            return  # Tracked so it is not re-read every refresh, but never matches
+        for trigram in _trigrams(data.lower()):
+            ids = self.postings.get(trigram)
+            if ids is None:
+                ids = self.postings[trigram] = array('I')
+            ids.append(file_id)
+
+    def _update(self, rel_path: str) -> bool:
+        """Re-index one file if it changed; returns True if anything changed"""
+        try:
+            stat = os.stat(os.path.join(self.root, rel_path))
+        except OSError:
+            if rel_path in self.ids_by_path:
+                self._remove(rel_path)
+                return True
+            return False
+        file_id = self.ids_by_path.get(rel_path)
+        if file_id is not None:
+            _, mtime_ns, size = self.files[file_id]
+            if (mtime_ns, size) == (stat.st_mtime_ns, stat.st_size):
+                return False
+            self._remove(rel_path)
+        self._add(rel_path, stat.st_mtime_ns, stat.st_size)
+        return True
+
+    def _compact(self):
+        """Drop tombstoned ids from every posting list and renumber live files"""
+        remap = {}
+        files = []
+        for file_id, entry in enumerate(self.files):
+            if entry is not None:
+                remap[file_id] = len(files)
+                files.append(entry)
+        postings = {}
+        for trigram, ids in self.postings.items():
+            live = array('I', (remap[file_id] for file_id in ids if file_id in remap))
+            if live:
+                postings[trigram] = live
+        self.files = files
+        self.postings = postings
+        self.ids_by_path = {entry[0]: file_id for file_id, entry in enumerate(files)}
+        self.dead = 0
+
+    def refresh(self, force: bool = False) -> int:
+        """
+        Bring the index up to date with the project files
+
+        Within `revalidate_interval` of the last full check (or
+        FILE_WATCHER_REVALIDATE_SECONDS while the file watcher reports changes
+        under the root) only paths reported through mark_dirty() are
+        re-examined.
+
+        Returns:
+            Number of files added, re-indexed or removed
+        """
+        with self.lock:
+            interval = file_watcher.revalidate_interval(self.root, self.revalidate_interval)
+            if force or not self.files or time.monotonic() - self.validated_at >= interval:
+                workspace = file_context_manager.get_workspace_index(self.root)
+                paths = set()
+                for rel_dir, record in list(workspace.dirs.items()):
+                    prefix = '' if rel_dir == '.' else rel_dir + os.sep
+                    paths.update(prefix + name for name in record["files"])
+                paths.update(self.ids_by_path)
+                self.validated_at = time.monotonic()
+            else:
+                paths = self.dirty_paths
+            self.dirty_paths = set()
+
+            changed = sum(self._update(rel_path) for rel_path in paths)
+            if self.dead > 1000 and self.dead > len(self.ids_by_path):
+                self._compact()
+            if changed:
+                self.unsaved = True
+            if self.unsaved and time.monotonic() - self.saved_at >= self.save_interval:
+                self.flush()
+            self.ready.set()
+            return changed
+
+    def warm(self) -> threading.Thread:
+        """Refresh on a background thread (the running one if a warm-up is under way)"""
+        with self.warm_lock:
+            if self.warmer is None or not self.warmer.is_alive():
+                self.warmer = threading.Thread(target=self._warm, name='coai-search-warm', daemon=True)
+                self.warmer.start()
+            return self.warmer
+
+    def _warm(self):
+        try:
+            self.refresh()
+        except Exception:
+            logger.exception("Search index warm-up failed for %s", self.root)
+
+    def flush(self):
+        """Persist pending changes now"""
+        with self.lock:
+            if self.unsaved:
+                self._save()
+                self.unsaved = False
+                self.saved_at = time.monotonic()
+
+    def mark_dirty(self, paths: Iterable[str]):
+        """Queue absolute paths (e.g. from the file watcher) for the next refresh"""
+        prefix = self.root + os.sep
+        extensions = file_context_manager.allowed_extensions
+        with self.lock:
+            for path in paths:
+                if path.startswith(prefix) and os.path.splitext(path)[1].lower() in extensions:
+                    self.dirty_paths.add(os.path.relpath(path, self.root))
+                elif is_tree_change(self.root, path):
+                    self.validated_at = 0.0
+
+    # --- Querying ---
+
+    def candidates(self, required: Set[int]) -> List[int]:
+        """Live file ids whose trigram set contains every required trigram"""
+        with self.lock:
+            if not required:
+                return [file_id for file_id, entry in enumerate(self.files) if entry]
+            lists = []
+            for trigram in required:
+                ids = self.postings.get(trigram)
+                if not ids:
+                    return []
+                lists.append(ids)
+            lists.sort(key=len)
+            result = set(lists[0])
+            for ids in lists[1:]:
+                result.intersection_update(ids)
+                if not result:
+                    return []
+            return sorted(file_id for file_id in result if self.files[file_id])
+
+    def search(
+        self,
+        query: str,
+        regex: bool = False,
+        case_sensitive: bool = False,
+        limit: int = 50
+    ) -> Dict[str, Any]:
+        """
+        Find files matching `query`, best matches first
+
+        Files are ranked by a bonus for matching the file name, then the number
+        of matching lines, then path. Each result carries up to
+        MAX_MATCHES_PER_FILE matching lines.
+
+        Candidates are verified in order of that name bonus and path depth, and
+        verification stops after VERIFY_FACTOR * limit matching files, so very
+        common terms stay fast; "truncated" is then set and "matched_files"
+        is a lower bound.
+        """
+        started = time.perf_counter()
+        compiled = compile_query(query, regex, case_sensitive)
+        self.refresh()
+        candidate_ids = self.candidates(compiled.trigrams)
+        with self.lock:
+            candidate_paths = [self.files[file_id][0] for file_id in candidate_ids if self.files[file_id]]
+
+        name_matches = {
+            rel_path for rel_path in candidate_paths
+            if compiled.pattern.search(os.path.basename(rel_path))
+        }
+        candidate_paths.sort(key=lambda rel_path: (
+            rel_path not in name_matches, rel_path.count(os.sep), rel_path
+        ))
+        verify_limit = limit * VERIFY_FACTOR
+        truncated = False
+
+        results = []
+        for rel_path in candidate_paths:
+            if len(results) >= verify_limit:
+                truncated = True
+                break
+            data = self._read(rel_path)
+            if data is None:
+                continue
+            match_count, matches = find_matches(data, compiled)
+            if not match_count:
+                continue
+            results.append({
+                "path": rel_path.replace(os.sep, '/'),
+                "score": match_count + (100 if rel_path in name_matches else 0),
+                "match_count": match_count,
+                "matches": matches
+            })
+
+        results.sort(key=lambda result: (-result["score"], result["path"]))
+        return {
+            "query": query,
+            "regex": regex,
+            "results": results[:limit],
+            "matched_files": len(results),
+            "truncated": truncated,
+            "candidates": len(candidate_paths),
+            "indexed_files": len(self.ids_by_path),
+            "took_ms": round((time.perf_counter() - started) * 1000, 2)
+        }
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "root": self.root,
+            "files": len(self.ids_by_path),
+            "tombstones": self.dead,
+            "trigrams": len(self.postings),
+            "postings": sum(len(ids) for ids in self.postings.values())
+        }
+
+
+class CodeSearch:
+    """Trigram indexes per project root, resolved like the file context listing"""
+
+    def __init__(self, persist: bool = None):
+        if persist is None:
+            persist = os.getenv('SEARCH_INDEX_PERSIST', 'true').lower() == 'true'
+        self.persist = persist
+        self.lock = threading.Lock()
+        self.indexes: Dict[str, TrigramIndex] = {}
+
+    def get_index(self, project: str = None) -> TrigramIndex:
+        root = os.path.abspath(file_context_manager.resolve_project_path(project))
+        with self.lock:
+            index = self.indexes.get(root)
+            if index is None:
+                index = self.indexes[root] = TrigramIndex(
+                    root, cache_path=default_cache_path(root) if self.persist else None
+                )
+            return index
+
+    def search(
+        self,
+        query: str,
+        project: str = None,
+        regex: bool = False,
+        case_sensitive: bool = False,
+        limit: int = 50
+    ) -> Dict[str, Any]:
+        """
+        Search a project's index
+
+        An index that has not been built yet is built on a background thread
+        rather than on the request thread, and SearchIndexBuildingError is
+        raised until it is ready.
+        """
+        index = self.get_index(project)
+        if not index.ready.is_set():
+            compile_query(query, regex, case_sensitive)  # Bad queries still fail as bad queries
+            index.warm()
+            raise SearchIndexBuildingError(index.root)
+        return index.search(query, regex=regex, case_sensitive=case_sensitive, limit=limit)
+
+    def warm(self, project: str = None) -> threading.Thread:
+        """Load and bring a project's index up to date in the background, e.g. at server startup"""
+        return self.get_index(project).warm()
+
+    def invalidate_paths(self, paths: Iterable[str]):
+        """Route changed absolute paths to every index that covers them"""
+        paths = list(paths)
+        with self.lock:
+            indexes = list(self.indexes.values())
+        for index in indexes:
+            index.mark_dirty(paths)
+
+
+def default_cache_path(root: str) -> str:
+    """Index file under backend/.coai/cache/search, one per indexed root"""
+    digest = hashlib.sha1(os.path.abspath(root).encode('utf-8')).hexdigest()[:16]
+    return str(Path(__file__).parent.parent / '.coai' / 'cache' / 'search' / f"{digest}.idx")
+
+
+# Global instance
+code_search = CodeSearch()
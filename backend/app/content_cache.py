@@ -0,0 +1,228 @@
+"""
+COAI Content Cache
+Decoded text of project files shared by the file endpoint and prompt
+assembly, validated against (mtime_ns, size) and addressed by content hash
+"""
+
+import hashlib
+import logging
+import mmap
+import os
+import re
+import sys
+import threading
+from array import array
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+_NEWLINE_RE = re.compile('\n')
+BINARY_SNIFF_BYTES = 8192
+
+
+@dataclass(frozen=True)
+class FileContent:
+    """
+    One version of a file
+
+    `text` is None for binary files. `line_offsets[i]` is the offset in
+    `text` at which line i + 1 starts, so a line range can be sliced out
+    without splitting the whole file.
+    """
+    path: str
+    mtime_ns: int
+    size: int
+    sha256: str
+    text: Optional[str]
+    line_offsets: array
+
+    @property
+    def binary(self) -> bool:
+        return self.text is None
+
+    @property
+    def etag(self) -> str:
+        return self.sha256
+
+    @property
+    def line_count(self) -> int:
+        return len(self.line_offsets) if self.text else 0
+
+    def lines(self, start: int = 1, end: int = None) -> str:
+        """Text of lines start..end (1-based, inclusive) without the final newline"""
+        if not self.text:
+            return ""
+        count = len(self.line_offsets)
+        end = count if end is None else min(end, count)
+        if start > end:
+            return ""
+        stop = self.line_offsets[end] if end < count else len(self.text)
+        return self.text[self.line_offsets[start - 1]:stop].replace('\r\n', '\n').rstrip('\n')
+
+    def splitlines(self) -> List[str]:
+        return self.text.splitlines() if self.text else []
+
+
+class _Blob:
+    """Decoded text shared by every cached path with the same content hash"""
+    __slots__ = ("text", "line_offsets", "cost", "refs")
+
+    def __init__(self, text: Optional[str], line_offsets: array):
+        self.text = text
+        self.line_offsets = line_offsets
+        self.cost = (sys.getsizeof(text) if text is not None else 0) + line_offsets.itemsize * len(line_offsets)
+        self.refs = 0
+
+
+class ContentCache:
+    """
+    Byte-budgeted LRU of decoded file contents
+
+    An entry is served while the file's (mtime_ns, size) is unchanged, so a
+    hit costs one stat(). Identical files (copies, vendored duplicates) share
+    one decoded text via their SHA-256, and only its first copy counts
+    against the budget. Files of at least `mmap_threshold` bytes are hashed
+    and decoded straight from a memory map instead of being read into an
+    intermediate bytes object first.
+    """
+
+    def __init__(self, max_bytes: int = None, mmap_threshold: int = None, max_entry_bytes: int = None):
+        if max_bytes is None:
+            max_bytes = int(os.getenv('CONTENT_CACHE_MAX_BYTES', str(64 * 1024 * 1024)))
+        if mmap_threshold is None:
+            mmap_threshold = int(os.getenv('CONTENT_CACHE_MMAP_BYTES', str(1024 * 1024)))
+        self.max_bytes = max_bytes
+        self.mmap_threshold = mmap_threshold
+        # One huge file should not flush everything else
+        self.max_entry_bytes = max_entry_bytes or max(self.max_bytes // 8, 1)
+        self.lock = threading.Lock()
+        self.entries: "OrderedDict[str, FileContent]" = OrderedDict()
+        self.blobs: Dict[str, _Blob] = {}
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _load(self, path: str, mtime_ns: int, size: int) -> Tuple[FileContent, _Blob]:
+        with open(path, 'rb') as f:
+            if size >= self.mmap_threshold and size > 0:
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                    return self._decode(path, mtime_ns, size, data)
+            return self._decode(path, mtime_ns, size, f.read())
+
+    def _decode(self, path: str, mtime_ns: int, size: int, data) -> Tuple[FileContent, _Blob]:
+        sha256 = hashlib.sha256(data).hexdigest()
+        with self.lock:
+            blob = self.blobs.get(sha256)
+        if blob is None:
+            if data.find(b'\0', 0, BINARY_SNIFF_BYTES) != -1:
+                text, offsets = None, array('I')
+            else:
+                text = str(data, 'utf-8', 'replace')
+                offsets = array('I', [0])
+                offsets.extend(match.end() for match in _NEWLINE_RE.finditer(text))
+                if len(offsets) > 1 and offsets[-1] == len(text):
+                    offsets.pop()  # A final newline does not start another line
+            blob = _Blob(text, offsets)
+        return FileContent(path, mtime_ns, size, sha256, blob.text, blob.line_offsets), blob
+
+    def _store(self, content: FileContent, blob: _Blob):
+        """Insert under the lock, evicting least recently used entries over budget"""
+        self._discard(content.path)
+        shared = self.blobs.get(content.sha256)
+        if shared is None:
+            self.blobs[content.sha256] = shared = blob
+            self.current_bytes += blob.cost
+        shared.refs += 1
+        self.entries[content.path] = content
+        while self.current_bytes > self.max_bytes and len(self.entries) > 1:
+            self._discard(next(iter(self.entries)))
+            self.evictions += 1
+
+    def _discard(self, path: str):
+        content = self.entries.pop(path, None)
+        if content is None:
+            return
+        blob = self.blobs[content.sha256]
+        blob.refs -= 1
+        if not blob.refs:
+            del self.blobs[content.sha256]
+            self.current_bytes -= blob.cost
+
+    def get(self, path: str, max_size: int = None, store: bool = True) -> Optional[FileContent]:
+        """
+        Content of a file, from memory while it is unchanged on disk
+
+        Args:
+            path: File path; made absolute
+            max_size: Return None without reading when the file is larger
+            store: False for one-off reads (index builds) that should be
+                served from the cache but not displace hot entries
+
+        Returns:
+            FileContent, or None if the file is missing, unreadable or too large
+        """
+        path = os.path.abspath(path)
+        try:
+            stat = os.stat(path)
+        except OSError:
+            with self.lock:
+                self._discard(path)
+            return None
+        if max_size is not None and stat.st_size > max_size:
+            return None
+
+        with self.lock:
+            content = self.entries.get(path)
+            if content is not None and (content.mtime_ns, content.size) == (stat.st_mtime_ns, stat.st_size):
+                self.entries.move_to_end(path)
+                self.hits += 1
+                return content
+            self.misses += 1
+
+        try:
+            content, blob = self._load(path, stat.st_mtime_ns, stat.st_size)
+        except (OSError, ValueError) as e:
+            logger.debug(f"Could not read {path}: {e}")
+            return None
+        if store and blob.cost <= self.max_entry_bytes:
+            with self.lock:
+                self._store(content, blob)
+        return content
+
+    def read_text(self, path: str, max_size: int = None) -> Optional[str]:
+        """Decoded text of a file; None if missing, unreadable, too large or binary"""
+        content = self.get(path, max_size)
+        return content.text if content is not None else None
+
+    def invalidate_paths(self, paths: Iterable[str]):
+        """Drop changed absolute paths now rather than on their next stat"""
+        with self.lock:
+            for path in paths:
+                self._discard(os.path.abspath(path))
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.blobs.clear()
+            self.current_bytes = 0
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self.entries),
+                "unique_contents": len(self.blobs),
+                "bytes": self.current_bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+                "evictions": self.evictions
+            }
+
+
+# Global instance
+content_cache = ContentCache()
@@ -0,0 +1,210 @@
+"""
+COAI Context Packer
+Fits the sections of an enhanced prompt into a token budget
+"""
+
+import logging
+import os
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional
+from .tokenizer import count_tokens
+
+logger = logging.getLogger(__name__)
+
+TRUNCATION_MARKER = "... (truncated to fit the token budget)"
+# Tokens of a required item kept (before the marker) however tight the budget
+REQUIRED_MIN_TOKENS = 32
+
+# Context windows of the models COAI is configured with; unknown models get the default
+MODEL_CONTEXT_WINDOWS = {
+    "gpt-3.5-turbo": 16385,
+    "gpt-4": 8192,
+    "gpt-4-turbo": 128000,
+    "gpt-4o": 128000,
+    "gpt-4o-mini": 128000,
+}
+DEFAULT_CONTEXT_WINDOW = 8192
+# Room left for the system message and chat message framing
+SYSTEM_PROMPT_RESERVE = 500
+
+
+def prompt_token_budget(model: str = None, max_completion_tokens: int = None) -> int:
+    """
+    Tokens available to the enhanced prompt
+
+    PROMPT_TOKEN_BUDGET wins when set; otherwise the model's context window
+    minus the completion allowance and the system prompt reserve.
+    """
+    configured = os.getenv('PROMPT_TOKEN_BUDGET')
+    if configured:
+        return int(configured)
+    model = model or os.getenv('OPENAI_MODEL', 'gpt-3.5-turbo')
+    if max_completion_tokens is None:
+        max_completion_tokens = int(os.getenv('OPENAI_MAX_TOKENS', '2000'))
+    window = MODEL_CONTEXT_WINDOWS.get(model, DEFAULT_CONTEXT_WINDOW)
+    return max(window - max_completion_tokens - SYSTEM_PROMPT_RESERVE, 0)
+
+
+@dataclass
+class Section:
+    """
+    One block of the prompt and the pieces of content it may hold
+
+    Sections are rendered in the order given but filled in `priority` order
+    (lowest first), each up to its own `budget` and what is left overall.
+    Items are candidates in order of value:
+      - fit="greedy": an item that does not fit is skipped and smaller ones
+        after it are still tried (snippets)
+      - fit="prefix": packing stops at the first item that does not fit and a
+        truncation marker is added (tree lines, rules)
+    With keep="tail" items are taken from the end but still rendered in their
+    original order, so the most recent history survives. A `required` section
+    always keeps an item, cut down to fit if necessary; room for it is set
+    aside before any other section is filled.
+    """
+    name: str
+    items: List[str]
+    priority: int
+    budget: Optional[int] = None
+    header: Optional[str] = None
+    fit: str = "prefix"
+    keep: str = "head"
+    required: bool = False
+
+
+@dataclass
+class PackedPrompt:
+    text: str
+    budget: int
+    total_tokens: int
+    sections: Dict[str, Dict[str, Any]] = field(default_factory=dict)
+
+    @property
+    def truncated_sections(self) -> List[str]:
+        return [name for name, stats in self.sections.items() if stats["truncated"]]
+
+    def token_counts(self) -> Dict[str, Any]:
+        """Summary for response metadata"""
+        return {
+            "total": self.total_tokens,
+            "budget": self.budget,
+            "sections": {name: stats["tokens"] for name, stats in self.sections.items()},
+            "truncated_sections": self.truncated_sections
+        }
+
+
+class ContextPacker:
+    """Packs prompt sections into a token budget, deterministically"""
+
+    def __init__(self, count_tokens: Callable[[str], int] = count_tokens, separator: str = "\n"):
+        self.count_tokens = count_tokens
+        self.separator = separator
+
+    def truncate(self, text: str, budget: int) -> str:
+        """Longest prefix of `text` that, with the marker, fits in `budget` tokens"""
+        if self.count_tokens(text) <= budget:
+            return text
+        marker = self.separator + TRUNCATION_MARKER
+        low, high = 0, len(text)
+        while low < high:
+            middle = (low + high + 1) // 2
+            if self.count_tokens(text[:middle] + marker) <= budget:
+                low = middle
+            else:
+                high = middle - 1
+        return text[:low] + marker if low else ""
+
+    def _required_minimum(self, section: Section, separator_tokens: int, marker_tokens: int) -> int:
+        """Tokens a required section needs at least: its header and a shortened first item"""
+        header_tokens = self.count_tokens(section.header) + separator_tokens if section.header else 0
+        first = section.items[-1] if section.keep == "tail" else section.items[0]
+        minimum = header_tokens + min(
+            self.count_tokens(first) + separator_tokens,
+            REQUIRED_MIN_TOKENS + marker_tokens + separator_tokens
+        )
+        return minimum if section.budget is None else min(minimum, section.budget)
+
+    def pack(self, sections: List[Section], budget: int) -> PackedPrompt:
+        """
+        Fill sections by priority and render them in order
+
+        Returns:
+            PackedPrompt with the text and per-section token statistics
+
+        Raises:
+            ValueError: the budget cannot hold even a shortened required section
+                (a section budget of 0 still turns a required section off)
+        """
+        remaining = budget
+        kept: Dict[str, List[str]] = {}
+        stats: Dict[str, Dict[str, Any]] = {}
+        separator_tokens = self.count_tokens(self.separator)
+        marker_tokens = self.count_tokens(TRUNCATION_MARKER) + separator_tokens
+        reserves = {
+            section.name: self._required_minimum(section, separator_tokens, marker_tokens)
+            for section in sections if section.required and section.items
+        }
+        reserved = sum(reserves.values())
+
+        for section in sorted(sections, key=lambda section: section.priority):
+            reserved -= reserves.get(section.name, 0)
+            available = max(remaining - reserved, 0)
+            allowance = available if section.budget is None else min(section.budget, available)
+            costs = [self.count_tokens(item) + separator_tokens for item in section.items]
+            header_tokens = self.count_tokens(section.header) + separator_tokens if section.header else 0
+            overflows = header_tokens + sum(costs) > allowance
+            marked = overflows and section.fit == "prefix" and not section.required
+            limit = allowance - (marker_tokens if marked else 0)
+
+            texts = dict(enumerate(section.items))
+            chosen = []
+            used = header_tokens
+            order = range(len(section.items) - 1, -1, -1) if section.keep == "tail" else range(len(section.items))
+            for position in order:
+                if used + costs[position] <= limit:
+                    chosen.append(position)
+                    used += costs[position]
+                elif section.required and not chosen:
+                    # The user's message is never dropped, only shortened
+                    shortened = self.truncate(texts[position], limit - used - separator_tokens)
+                    if shortened:
+                        texts[position] = shortened
+                        chosen.append(position)
+                        used += self.count_tokens(shortened) + separator_tokens
+                    break
+                elif section.fit == "prefix":
+                    break
+
+            content = [texts[position] for position in sorted(chosen)]
+            if not content and available < reserves.get(section.name, 0):
+                raise ValueError(f"Token budget of {budget} is too small for the required '{section.name}' section")
+            if not content:
+                used = 0  # The header goes with its content
+            elif marked:
+                if section.keep == "tail":
+                    content.insert(0, TRUNCATION_MARKER)
+                else:
+                    content.append(TRUNCATION_MARKER)
+                used += marker_tokens
+            kept[section.name] = content
+            remaining -= used
+            stats[section.name] = {
+                "tokens": used,
+                "budget": allowance,
+                "items": len(chosen),
+                "dropped": len(section.items) - len(chosen),
+                "kept": sorted(chosen),
+                "truncated": overflows
+            }
+
+        blocks = []
+        for section in sections:
+            content = kept.get(section.name)
+            if content:
+                blocks.append(self.separator.join(([section.header] if section.header else []) + content))
+        text = (self.separator * 2).join(blocks)
+        return PackedPrompt(text=text, budget=budget, total_tokens=self.count_tokens(text), sections=stats)
+
+
+# Global instance
+context_packer = ContextPacker()
@@ -7,6 +7,7 @@ import logging
 import traceback
 import os
 from datetime import datetime
+from functools import wraps
 from typing import Dict, Any, Optional
 from flask import jsonify
 
@@ -69,6 +70,12 @@ class FileAccessError(COAIError):
         super().__init__(message, "FILE_ACCESS_ERROR", kwargs)
         self.file_path = file_path
 
+class OverloadedError(COAIError):
+    """Request shed by admission control because the server is at capacity"""
+    def __init__(self, message: str, retry_after: int = 1, **kwargs):
+        super().__init__(message, "OVERLOADED", kwargs)
+        self.retry_after = retry_after
+
 def log_error(error: Exception, context: Dict[str, Any] = None):
     """Log error with comprehensive context information"""
     
@@ -112,6 +119,9 @@ def create_error_response(error: Exception, context: Dict[str, Any] = None) -> D
     elif isinstance(error, FileAccessError):
         user_message = "Unable to access the requested file. Please check the file path."
         fallback_available = False
+    elif isinstance(error, OverloadedError):
+        user_message = f"The server is busy. Please retry in {error.retry_after} seconds."
+        fallback_available = False
     else:
         user_message = "An unexpected error occurred. Our team has been notified."
         fallback_available = True
@@ -131,6 +141,9 @@ def create_error_response(error: Exception, context: Dict[str, Any] = None) -> D
         response["project"] = context.get("project")
         response["file"] = context.get("file")
     
+    if isinstance(error, OverloadedError):
+        response["retry_after"] = error.retry_after
+    
     # In debug mode, add more details
     debug_mode = os.getenv('DEBUG_MODE', 'false').lower() == 'true'
     if debug_mode:
@@ -142,26 +155,27 @@ def create_error_response(error: Exception, context: Dict[str, Any] = None) -> D
     
     return response
 
+def error_status_code(error: Exception) -> int:
+    """HTTP status for an error raised while handling an API request"""
+    if isinstance(error, (AIAgentError, OverloadedError)):
+        return 503  # Service Unavailable
+    if isinstance(error, ValidationError):
+        return 400  # Bad Request
+    if isinstance(error, FileAccessError):
+        return 404  # Not Found
+    return 500  # Internal Server Error (ConfigurationError and anything unexpected)
+
 def handle_api_errors(func):
     """Decorator for comprehensive API error handling"""
+    @wraps(func)
     def wrapper(*args, **kwargs):
         try:
             return func(*args, **kwargs)
-        except AIAgentError as e:
-            error_response = create_error_response(e, kwargs.get('context'))
-            return jsonify(error_response), 503  # Service Unavailable
-        except ValidationError as e:
-            error_response = create_error_response(e, kwargs.get('context'))
-            return jsonify(error_response), 400  # Bad Request
-        except ConfigurationError as e:
-            error_response = create_error_response(e, kwargs.get('context'))
-            return jsonify(error_response), 500  # Internal Server Error
-        except FileAccessError as e:
-            error_response = create_error_response(e, kwargs.get('context'))
-            return jsonify(error_response), 404  # Not Found
         except Exception as e:
             error_response = create_error_response(e, kwargs.get('context'))
-            return jsonify(error_response), 500  # Internal Server Error
+            if isinstance(e, OverloadedError):
+                return jsonify(error_response), 503, {"Retry-After": str(e.retry_after)}
+            return jsonify(error_response), error_status_code(e)
     return wrapper
 
 def validate_chat_request(data: Dict[str, Any]) -> None:
@@ -187,6 +201,17 @@ def validate_chat_request(data: Dict[str, Any]) -> None:
     file_name = data.get("file", "").strip()
     if not file_name:
         raise ValidationError("File name is required", field="file")
+    
+    history = data.get("history")
+    if history is not None:
+        if not isinstance(history, list) or not all(
+            isinstance(turn, dict) and turn.get("role") in ("user", "assistant") and isinstance(turn.get("content"), str)
+            for turn in history
+        ):
+            raise ValidationError("History must be a list of {role, content} messages", field="history")
+    
+    if "cache" in data and not isinstance(data["cache"], bool):
+        raise ValidationError("Cache must be true or false", field="cache")
 
 def validate_file_access(file_path: str) -> None:
     """Validate file access permissions and security"""
@@ -3,13 +3,18 @@ COAI File Context Manager
 Handles project file reading and context injection for AI agents
 """
 
+import heapq
 import os
 import logging
-from typing import Dict, List, Any
-from pathlib import Path
+import threading
+from bisect import bisect_left
+from typing import Dict, Iterable, List, Any, Tuple
+from .workspace_index import WorkspaceIndex, default_cache_path
 
 logger = logging.getLogger(__name__)
 
+KEY_FILES = ('main.py', 'app.py', 'index.js', 'package.json', 'README.md', 'requirements.txt')
+
 class FileContextManager:
     """
     Manages file context for AI agents - reads project files when needed
@@ -20,6 +25,11 @@ class FileContextManager:
         self.workspace_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '../../'))
         self.max_file_size = 50000  # 50KB max per file
         self.allowed_extensions = {'.py', '.js', '.ts', '.jsx', '.tsx', '.md', '.txt', '.json', '.yaml', '.yml'}
+        self.persist_index = os.getenv('FILE_INDEX_PERSIST', 'true').lower() == 'true'
+        self.lock = threading.Lock()
+        # One persistent index per project root, plus the listing derived from it
+        self._indexes: Dict[str, WorkspaceIndex] = {}
+        self._listings: Dict[str, Tuple[int, Dict[str, Any]]] = {}
         
     def should_include_file_context(self, message: str) -> bool:
         """
@@ -37,26 +47,32 @@ class FileContextManager:
     def get_project_file_listing(self, project: str = None) -> Dict[str, Any]:
         """
         Get comprehensive project file listing
+        
+        Tree and summary are derived from the persistent workspace index, and the
+        derived listing is reused until the index reports a change.
         """
         try:
-            project_path = self.workspace_root
+            project_path = self.resolve_project_path(project)
+            index = self.get_workspace_index(project_path)
             
-            # If specific project requested, look in that subfolder
-            if project and project != "demo-project":
-                potential_project_path = os.path.join(self.workspace_root, project)
-                if os.path.exists(potential_project_path):
-                    project_path = potential_project_path
+            with self.lock:
+                cached = self._listings.get(project_path)
+                if cached and cached[0] == index.generation:
+                    return dict(cached[1])
             
-            file_tree = self._build_file_tree(project_path)
-            file_summary = self._get_file_summary(project_path)
+            generation = index.generation
+            file_tree, file_summary = self._build_listing(index)
             
-            return {
+            listing = {
                 "status": "success",
                 "project_path": project_path,
                 "file_tree": file_tree,
                 "file_summary": file_summary,
                 "total_files": file_summary["total_files"]
             }
+            with self.lock:
+                self._listings[project_path] = (generation, listing)
+            return dict(listing)
             
         except Exception as e:
             logger.error(f"Error getting project file listing: {str(e)}")
@@ -67,57 +83,94 @@ class FileContextManager:
                 "file_summary": {"total_files": 0}
             }
     
-    def _build_file_tree(self, root_path: str, max_depth: int = 3) -> Dict[str, Any]:
+    def resolve_project_path(self, project: str = None) -> str:
+        """Directory for a project name: its workspace subfolder, else the workspace root"""
+        project_path = self.workspace_root
+        
+        # If specific project requested, look in that subfolder
+        if project and project != "demo-project":
+            potential_project_path = os.path.abspath(os.path.join(self.workspace_root, project))
+            # Separator included, so "../<workspace>X" cannot reach a sibling directory
+            inside = potential_project_path.startswith(os.path.join(self.workspace_root, ''))
+            if inside and os.path.exists(potential_project_path):
+                project_path = potential_project_path
+        
+        return project_path
+    
+    def get_workspace_index(self, root_path: str) -> WorkspaceIndex:
+        """Workspace index for a project root, revalidated against the filesystem"""
+        index = self._get_index(root_path)
+        index.refresh()
+        return index
+    
+    def _get_index(self, root_path: str) -> WorkspaceIndex:
+        """Return the workspace index for a project root, loading it on first use"""
+        root_path = os.path.abspath(root_path)
+        with self.lock:
+            index = self._indexes.get(root_path)
+            if index is None:
+                index = self._indexes[root_path] = WorkspaceIndex(
+                    root_path,
+                    self.allowed_extensions,
+                    cache_path=default_cache_path(root_path) if self.persist_index else None
+                )
+            return index
+    
+    def invalidate(self, root_path: str = None, rel_dir: str = None):
+        """Drop cached listings (and index records) for one project root or all of them"""
+        with self.lock:
+            indexes = list(self._indexes.values())
+            if root_path is not None:
+                root_path = os.path.abspath(root_path)
+                indexes = [index for index in indexes if index.root == root_path]
+            for index in indexes:
+                self._listings.pop(index.root, None)
+        for index in indexes:
+            index.invalidate(rel_dir)
+    
+    def invalidate_paths(self, paths: Iterable[str]):
         """
-        Build a tree structure of project files
+        Invalidate index records affected by changes to these absolute paths
+        
+        Only the parent directory of each changed path is re-scanned; a change
+        at or above an index root invalidates that whole index.
         """
-        def build_tree(path: str, current_depth: int = 0) -> Dict[str, Any]:
-            if current_depth > max_depth:
-                return {"name": "...", "type": "truncated"}
-                
-            name = os.path.basename(path)
-            
-            if os.path.isdir(path):
-                # Skip hidden directories and common build/cache dirs
-                if name.startswith('.') or name in ['node_modules', '__pycache__', 'dist', 'build']:
-                    return None
-                    
-                children = []
-                try:
-                    for entry in sorted(os.listdir(path)):
-                        child_path = os.path.join(path, entry)
-                        child_tree = build_tree(child_path, current_depth + 1)
-                        if child_tree:
-                            children.append(child_tree)
-                except PermissionError:
-                    logger.warning(f"Permission denied accessing {path}")
-                    return {"name": name, "type": "dir", "error": "permission_denied"}
-                
-                return {
-                    "name": name,
-                    "type": "dir",
-                    "children": children[:20],  # Limit children to prevent overwhelming
-                    "path": os.path.relpath(path, root_path)
-                }
-            else:
-                # Only include allowed file types
-                if Path(path).suffix.lower() not in self.allowed_extensions:
-                    return None
-                    
-                file_size = os.path.getsize(path)
-                return {
-                    "name": name,
-                    "type": "file",
-                    "path": os.path.relpath(path, root_path),
-                    "size": file_size,
-                    "extension": Path(path).suffix
-                }
-        
-        return build_tree(root_path)
+        with self.lock:
+            indexes = list(self._indexes.values())
+        for index in indexes:
+            prefix = index.root + os.sep
+            rel_dirs = set()
+            for path in paths:
+                path = os.path.abspath(path)
+                if path == index.root or index.root.startswith(path + os.sep):
+                    rel_dirs = {None}
+                    break
+                if path.startswith(prefix):
+                    rel_dirs.add(os.path.relpath(os.path.dirname(path), index.root))
+            if not rel_dirs:
+                continue
+            with self.lock:
+                self._listings.pop(index.root, None)
+            for rel_dir in rel_dirs:
+                index.invalidate(rel_dir)
     
-    def _get_file_summary(self, root_path: str) -> Dict[str, Any]:
+    def _build_listing(
+        self,
+        index: WorkspaceIndex,
+        max_depth: int = 3,
+        max_children: int = 20
+    ) -> Tuple[Dict[str, Any], Dict[str, Any]]:
         """
-        Get summary statistics about project files
+        Build the file tree and summary statistics in one pass over the index
+        
+        Every indexed directory is visited once. Its per-extension counts feed
+        the summary directly, key files are found by bisecting the sorted name
+        list, and down to `max_depth` it becomes a tree node. Only the first
+        `max_children` children of a node are materialised, and only those
+        files are stat'ed for their size.
+        
+        Returns:
+            (file_tree, file_summary)
         """
         summary = {
             "total_files": 0,
@@ -125,40 +178,73 @@ class FileContextManager:
             "key_files": [],
             "directories": []
         }
+        by_type = summary["by_type"]
+        truncated = {"name": "...", "type": "truncated"}
         
-        try:
-            for root, dirs, files in os.walk(root_path):
-                # Skip hidden and build directories
-                dirs[:] = [d for d in dirs if not d.startswith('.') and d not in ['node_modules', '__pycache__', 'dist', 'build']]
-                
-                rel_root = os.path.relpath(root, root_path)
-                if rel_root != '.':
-                    summary["directories"].append(rel_root)
-                
-                for file in files:
-                    if file.startswith('.'):
-                        continue
-                        
-                    file_path = os.path.join(root, file)
-                    extension = Path(file).suffix.lower()
-                    
-                    if extension in self.allowed_extensions:
-                        summary["total_files"] += 1
-                        
-                        # Count by file type
-                        if extension in summary["by_type"]:
-                            summary["by_type"][extension] += 1
-                        else:
-                            summary["by_type"][extension] = 1
-                        
-                        # Identify key files
-                        if file in ['main.py', 'app.py', 'index.js', 'package.json', 'README.md', 'requirements.txt']:
-                            summary["key_files"].append(os.path.relpath(file_path, root_path))
-                            
-        except Exception as e:
-            logger.error(f"Error building file summary: {str(e)}")
+        def visit(rel_dir: str, name: str, depth: int) -> Dict[str, Any]:
+            record = index.get_dir(rel_dir)
+            if record is None:
+                return None
+            if rel_dir != '.':
+                summary["directories"].append(rel_dir)
+            prefix = '' if rel_dir == '.' else rel_dir + os.sep
+            
+            for extension, count in record["types"].items():
+                summary["total_files"] += count
+                by_type[extension] = by_type.get(extension, 0) + count
+            files = record["files"]
+            for key_file in KEY_FILES:
+                position = bisect_left(files, key_file)
+                if position < len(files) and files[position] == key_file:
+                    summary["key_files"].append(prefix + key_file)
+            
+            subtrees = {}
+            for dir_name in record["dirs"]:
+                child = visit(prefix + dir_name, dir_name, depth + 1)
+                if child:
+                    subtrees[dir_name] = child
+            
+            if depth > max_depth:
+                return dict(truncated)
+            if record.get("error"):
+                return {"name": name, "type": "dir", "error": record["error"]}
+            
+            children = []
+            for child_name in heapq.merge(files, subtrees):
+                if len(children) >= max_children:  # Limit children to prevent overwhelming
+                    break
+                if child_name in subtrees:
+                    children.append(subtrees[child_name])
+                elif depth + 1 > max_depth:
+                    children.append(dict(truncated))
+                else:
+                    node = self._file_node(index.root, prefix + child_name, child_name)
+                    if node:
+                        children.append(node)
+            
+            return {
+                "name": name,
+                "type": "dir",
+                "children": children,
+                "path": rel_dir
+            }
         
-        return summary
+        file_tree = visit('.', os.path.basename(index.root), 0)
+        return file_tree, summary
+    
+    def _file_node(self, root_path: str, rel_path: str, name: str) -> Dict[str, Any]:
+        """Tree node for a single file; None if it disappeared since indexing"""
+        try:
+            file_size = os.stat(os.path.join(root_path, rel_path)).st_size
+        except OSError:
+            return None
+        return {
+            "name": name,
+            "type": "file",
+            "path": rel_path,
+            "size": file_size,
+            "extension": os.path.splitext(name)[1]
+        }
     
     def format_file_context_for_ai(self, file_data: Dict[str, Any]) -> str:
         """
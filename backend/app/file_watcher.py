@@ -0,0 +1,489 @@
+"""
+COAI File Watcher
+inotify-based (polling fallback) change notification for the workspace and project roots
+"""
+
+import ctypes
+import ctypes.util
+import errno
+import logging
+import os
+import queue
+import select
+import struct
+import sys
+import threading
+import time
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from .workspace_index import is_skipped_dir
+
+logger = logging.getLogger(__name__)
+
+# inotify(7) constants
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0x00000800
+IN_CLOEXEC = 0x00080000
+
+WATCH_MASK = (IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO |
+              IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF)
+EVENT_HEADER = struct.Struct('iIII')
+
+# Tree delta telling a client its view is stale and must be re-fetched
+RESET_DELTA = {"change": "reset", "path": "", "parent": "", "name": "", "type": "dir"}
+
+
+@dataclass
+class FileChange:
+    """
+    One debounced filesystem change
+
+    kind is "created", "deleted", "modified" or "rescan" (events were lost, e.g.
+    on inotify queue overflow, and everything under `root` may have changed).
+    """
+    root: str
+    path: str
+    kind: str
+    is_dir: bool = False
+
+    @property
+    def rel_path(self) -> str:
+        """Path relative to the watched root, '/'-separated ('' for the root)"""
+        rel_path = os.path.relpath(self.path, self.root)
+        return '' if rel_path == '.' else rel_path.replace(os.sep, '/')
+
+
+def is_tree_change(root: str, path: str) -> bool:
+    """
+    Whether a change reported at `path` may stand for unreported changes to
+    files under `root`: the path is at or above the root (a rescan), or is a
+    directory inside it that appeared or went away as a whole
+    """
+    if path == root or root.startswith(path + os.sep):
+        return True
+    return path.startswith(root + os.sep) and (os.path.isdir(path) or not os.path.exists(path))
+
+
+def _is_ignored(name: str, is_dir: bool) -> bool:
+    """Hidden entries (editor swap files, .git, ...) and skipped build dirs"""
+    return name.startswith('.') or (is_dir and is_skipped_dir(name))
+
+
+class InotifyBackend:
+    """Linux inotify via ctypes: one watch per indexed directory"""
+
+    def __init__(self):
+        libc_name = ctypes.util.find_library('c') or 'libc.so.6'
+        self.libc = ctypes.CDLL(libc_name, use_errno=True)
+        self.fd = self.libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        # wd -> (root, directory path, recursive)
+        self.watches: Dict[int, Tuple[str, str, bool]] = {}
+        self.roots: Dict[str, bool] = {}
+
+    def add_root(self, root: str, recursive: bool = True):
+        self.roots[root] = recursive
+        self._add_tree(root, root, recursive)
+
+    def _add_tree(self, root: str, path: str, recursive: bool):
+        pending = [path]
+        while pending:
+            current = pending.pop()
+            self._add_watch(root, current, recursive)
+            if not recursive:
+                continue
+            try:
+                with os.scandir(current) as entries:
+                    for entry in entries:
+                        if entry.is_dir(follow_symlinks=False) and not _is_ignored(entry.name, True):
+                            pending.append(entry.path)
+            except OSError:
+                continue
+
+    def _add_watch(self, root: str, path: str, recursive: bool):
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(path), WATCH_MASK)
+        if wd < 0:
+            error = ctypes.get_errno()
+            if error == errno.ENOSPC:
+                raise OSError(error, "inotify watch limit reached (fs.inotify.max_user_watches)")
+            return  # Directory vanished before we could watch it
+        self.watches[wd] = (root, path, recursive)
+
+    def _remove_tree(self, path: str):
+        """Drop watches for a directory moved out from under us"""
+        prefix = path + os.sep
+        for wd, (_, watched, _) in list(self.watches.items()):
+            if watched == path or watched.startswith(prefix):
+                self.libc.inotify_rm_watch(self.fd, wd)
+                self.watches.pop(wd, None)
+
+    def read(self, timeout: float) -> List[FileChange]:
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return []
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return []
+
+        changes = []
+        offset = 0
+        while offset + EVENT_HEADER.size <= len(data):
+            wd, mask, _cookie, length = EVENT_HEADER.unpack_from(data, offset)
+            name = os.fsdecode(data[offset + EVENT_HEADER.size:offset + EVENT_HEADER.size + length].rstrip(b'\0'))
+            offset += EVENT_HEADER.size + length
+
+            if mask & IN_Q_OVERFLOW:
+                changes.extend(FileChange(root, root, "rescan", True) for root in self.roots)
+                continue
+            if mask & IN_IGNORED:
+                self.watches.pop(wd, None)
+                continue
+            watch = self.watches.get(wd)
+            if watch is None:
+                continue
+            root, directory, recursive = watch
+            is_dir = bool(mask & IN_ISDIR)
+
+            if mask & (IN_DELETE_SELF | IN_MOVE_SELF):
+                if directory == root:
+                    changes.append(FileChange(root, root, "deleted", True))
+                continue
+            if not name or _is_ignored(name, is_dir):
+                continue
+
+            path = os.path.join(directory, name)
+            if mask & (IN_CREATE | IN_MOVED_TO):
+                if is_dir and recursive:
+                    try:
+                        self._add_tree(root, path, recursive)
+                    except OSError as e:
+                        logger.warning(f"Not watching {path}: {e}")
+                changes.append(FileChange(root, path, "created", is_dir))
+            elif mask & (IN_DELETE | IN_MOVED_FROM):
+                if is_dir and mask & IN_MOVED_FROM:
+                    self._remove_tree(path)
+                changes.append(FileChange(root, path, "deleted", is_dir))
+            elif mask & (IN_MODIFY | IN_CLOSE_WRITE) and not is_dir:
+                changes.append(FileChange(root, path, "modified", False))
+        return changes
+
+    def close(self):
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
+
+
+class PollingBackend:
+    """Portable fallback: periodic (mtime_ns, size) snapshots diffed per root"""
+
+    def __init__(self, interval: float = None):
+        self.interval = interval or float(os.getenv('FILE_WATCHER_POLL_INTERVAL', '2.0'))
+        # root -> (recursive, {path: (is_dir, mtime_ns, size)})
+        self.roots: Dict[str, Tuple[bool, Dict[str, Tuple[bool, int, int]]]] = {}
+        self.next_poll = time.monotonic() + self.interval
+
+    def add_root(self, root: str, recursive: bool = True):
+        self.roots[root] = (recursive, self._snapshot(root, recursive))
+
+    def _snapshot(self, root: str, recursive: bool) -> Dict[str, Tuple[bool, int, int]]:
+        snapshot = {}
+        pending = [root]
+        while pending:
+            current = pending.pop()
+            try:
+                with os.scandir(current) as entries:
+                    for entry in entries:
+                        try:
+                            is_dir = entry.is_dir(follow_symlinks=False)
+                            if _is_ignored(entry.name, is_dir):
+                                continue
+                            stat = entry.stat(follow_symlinks=False)
+                        except OSError:
+                            continue
+                        snapshot[entry.path] = (is_dir, stat.st_mtime_ns, 0 if is_dir else stat.st_size)
+                        if is_dir and recursive:
+                            pending.append(entry.path)
+            except OSError:
+                continue
+        return snapshot
+
+    def read(self, timeout: float) -> List[FileChange]:
+        remaining = self.next_poll - time.monotonic()
+        if remaining > 0:
+            time.sleep(min(timeout, remaining))
+            if time.monotonic() < self.next_poll:
+                return []
+        self.next_poll = time.monotonic() + self.interval
+
+        changes = []
+        for root, (recursive, previous) in list(self.roots.items()):
+            current = self._snapshot(root, recursive)
+            for path, (is_dir, mtime_ns, size) in current.items():
+                before = previous.get(path)
+                if before is None:
+                    changes.append(FileChange(root, path, "created", is_dir))
+                elif not is_dir and before[1:] != (mtime_ns, size):
+                    changes.append(FileChange(root, path, "modified", False))
+            for path, (is_dir, _, _) in previous.items():
+                if path not in current:
+                    changes.append(FileChange(root, path, "deleted", is_dir))
+            self.roots[root] = (recursive, current)
+        return changes
+
+    def close(self):
+        self.roots.clear()
+
+
+def _merge_kind(previous: str, new: str) -> Optional[str]:
+    """Collapse two changes to the same path within one debounce window"""
+    if previous == "created":
+        return None if new == "deleted" else "created"
+    if previous == "deleted" and new == "created":
+        return "modified"
+    return new
+
+
+class FileWatcher:
+    """
+    Watches directory trees and publishes debounced batches of FileChange
+
+    Uses inotify where available and falls back to polling elsewhere (or when
+    the inotify watch limit is hit). Raw events are coalesced per path until
+    the tree has been quiet for `debounce` seconds (or `max_delay` has passed),
+    then every subscriber is called with the batch on the watcher thread.
+    """
+
+    def __init__(self, debounce: float = None, max_delay: float = None, backend: str = None):
+        self.debounce = debounce if debounce is not None else float(os.getenv('FILE_WATCHER_DEBOUNCE', '0.2'))
+        self.max_delay = max_delay if max_delay is not None else float(os.getenv('FILE_WATCHER_MAX_DELAY', '1.0'))
+        self.backend_name = backend or os.getenv('FILE_WATCHER_BACKEND', 'auto')
+        # Full re-checks by indexes over watched trees, which otherwise rely on reported changes
+        self.revalidate_seconds = float(os.getenv('FILE_WATCHER_REVALIDATE_SECONDS', '300'))
+        self.lock = threading.Lock()
+        self.roots: Dict[str, bool] = {}
+        self.subscribers: List[Callable[[List[FileChange]], None]] = []
+        self.stats = {"events": 0, "batches": 0, "subscriber_errors": 0}
+        self._backend = None
+        self._thread = None
+        self._pid = None
+        self._stopping = False
+
+    def add_root(self, path: str, recursive: bool = True) -> bool:
+        """Watch a directory tree; returns False if it does not exist"""
+        path = os.path.abspath(path)
+        if not os.path.isdir(path):
+            return False
+        with self.lock:
+            if path in self.roots:
+                return True
+            self.roots[path] = recursive
+            if self._backend is not None:
+                self._add_backend_root(path, recursive)
+        return True
+
+    def subscribe(self, callback: Callable[[List[FileChange]], None]) -> Callable[[List[FileChange]], None]:
+        with self.lock:
+            self.subscribers.append(callback)
+        return callback
+
+    def unsubscribe(self, callback: Callable[[List[FileChange]], None]):
+        with self.lock:
+            if callback in self.subscribers:
+                self.subscribers.remove(callback)
+
+    def _create_backend(self):
+        if self.backend_name != 'polling' and sys.platform.startswith('linux'):
+            try:
+                return InotifyBackend()
+            except (OSError, AttributeError) as e:
+                logger.warning(f"inotify unavailable, falling back to polling: {e}")
+        return PollingBackend()
+
+    def _add_backend_root(self, path: str, recursive: bool):
+        try:
+            self._backend.add_root(path, recursive)
+        except OSError as e:
+            # Watch limit exhausted: poll everything rather than miss changes
+            logger.warning(f"{e}; switching file watcher to polling")
+            self._backend.close()
+            self._backend = PollingBackend()
+            for root, root_recursive in self.roots.items():
+                self._backend.add_root(root, root_recursive)
+
+    def start(self) -> bool:
+        """Start the watcher thread (again, after a fork); False if already running"""
+        with self.lock:
+            if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+                return False
+            self._pid = os.getpid()
+            self._stopping = False
+            self._backend = self._create_backend()
+            for path, recursive in self.roots.items():
+                self._add_backend_root(path, recursive)
+            self._thread = threading.Thread(target=self._run, name="file-watcher", daemon=True)
+            self._thread.start()
+            logger.info(f"File watcher started ({type(self._backend).__name__}, {len(self.roots)} roots)")
+            return True
+
+    def stop(self, timeout: float = 2.0):
+        with self.lock:
+            self._stopping = True
+            thread = self._thread
+        if thread is not None and thread.is_alive() and self._pid == os.getpid():
+            thread.join(timeout)
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive() and self._pid == os.getpid()
+
+    def covers(self, path: str) -> bool:
+        """True while the watcher runs and `path` lies in a recursively watched tree"""
+        if not self.running:
+            return False
+        path = os.path.abspath(path)
+        with self.lock:
+            return any(
+                recursive and (path == root or path.startswith(root + os.sep))
+                for root, recursive in self.roots.items()
+            )
+
+    def revalidate_interval(self, root: str, interval: float) -> float:
+        """
+        Seconds between full re-checks for an index over `root` that re-checks
+        every `interval` seconds on its own; much longer while changes under
+        the root are being reported
+        """
+        return max(interval, self.revalidate_seconds) if self.covers(root) else interval
+
+    def _run(self):
+        backend = self._backend
+        pending: Dict[Tuple[str, str], FileChange] = {}
+        first_at = last_at = 0.0
+        try:
+            while not self._stopping:
+                with self.lock:
+                    backend = self._backend
+                try:
+                    changes = backend.read(self.debounce if pending else 0.5)
+                except (OSError, ValueError):
+                    if backend is self._backend:
+                        raise
+                    changes = []  # Backend was swapped for polling mid-read
+                now = time.monotonic()
+
+                if changes:
+                    if not pending:
+                        first_at = now
+                    last_at = now
+                    self.stats["events"] += len(changes)
+                    for change in changes:
+                        key = (change.root, change.path)
+                        previous = pending.get(key)
+                        kind = _merge_kind(previous.kind, change.kind) if previous else change.kind
+                        if kind is None:
+                            del pending[key]
+                        else:
+                            change.kind = kind
+                            pending[key] = change
+
+                if pending and (now - last_at >= self.debounce or now - first_at >= self.max_delay):
+                    batch = list(pending.values())
+                    pending.clear()
+                    self._publish(batch)
+        except Exception as e:
+            logger.error(f"File watcher stopped: {e}")
+        finally:
+            backend.close()
+
+    def _publish(self, batch: List[FileChange]):
+        self.stats["batches"] += 1
+        with self.lock:
+            subscribers = list(self.subscribers)
+        for callback in subscribers:
+            try:
+                callback(batch)
+            except Exception as e:
+                self.stats["subscriber_errors"] += 1
+                logger.error(f"File watcher subscriber failed: {e}")
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            **self.stats,
+            "running": self.running,
+            "backend": type(self._backend).__name__ if self._backend else None,
+            "roots": list(self.roots),
+            "subscribers": len(self.subscribers)
+        }
+
+
+class TreeDeltaBroadcaster:
+    """
+    Fans watcher batches for one root out to per-client queues as tree deltas
+
+    Each delta names the parent directory, so a client only patches directories
+    it has already expanded instead of re-fetching the tree. A client that falls
+    `max_queue` batches behind gets a single "reset" and should re-fetch.
+    """
+
+    def __init__(self, watcher: FileWatcher, root: str, max_queue: int = 100):
+        self.root = os.path.abspath(root)
+        self.max_queue = max_queue
+        self.lock = threading.Lock()
+        self.clients: List[queue.Queue] = []
+        watcher.subscribe(self._on_changes)
+
+    def open(self) -> queue.Queue:
+        client = queue.Queue(maxsize=self.max_queue)
+        with self.lock:
+            self.clients.append(client)
+        return client
+
+    def close(self, client: queue.Queue):
+        with self.lock:
+            if client in self.clients:
+                self.clients.remove(client)
+
+    def _on_changes(self, changes: List[FileChange]):
+        deltas = [self.to_delta(change) for change in changes if change.root == self.root]
+        if not deltas:
+            return
+        batch = {"changes": deltas}
+        with self.lock:
+            clients = list(self.clients)
+        for client in clients:
+            try:
+                client.put_nowait(batch)
+            except queue.Full:
+                with client.mutex:
+                    client.queue.clear()
+                client.put_nowait({"changes": [dict(RESET_DELTA)]})
+
+    @staticmethod
+    def to_delta(change: FileChange) -> Dict[str, Any]:
+        rel_path = change.rel_path
+        if change.kind == "rescan" or not rel_path:
+            return dict(RESET_DELTA)
+        parent, _, name = rel_path.rpartition('/')
+        return {
+            "change": {"created": "added", "deleted": "removed"}.get(change.kind, change.kind),
+            "path": rel_path,
+            "parent": parent,
+            "name": name,
+            "type": "dir" if change.is_dir else "file"
+        }
+
+
+# Global watcher; roots and subscribers are registered by the modules owning the caches
+file_watcher = FileWatcher()
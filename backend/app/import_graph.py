@@ -0,0 +1,407 @@
+"""
+COAI Import Graph
+Which project files import which, so the file the user is working in and
+its nearest neighbours can be put in front of the model
+"""
+
+import json
+import logging
+import os
+import re
+import threading
+from collections import deque
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+from .file_context_manager import file_context_manager
+from .symbol_index import PYTHON_EXTENSIONS, Import, SymbolIndex, symbol_search
+
+logger = logging.getLogger(__name__)
+
+JS_RESOLVE_EXTENSIONS = ('.js', '.jsx', '.ts', '.tsx')
+JS_CONFIG_FILES = ('jsconfig.json', 'tsconfig.json')
+OUTLINE_KINDS = ('class', 'function', 'method', 'interface', 'type', 'enum')
+MAX_OUTLINE_LINES = 40
+OUTLINE_LINE_CHARS = 160
+# Files without definitions are shown by their first lines instead
+HEAD_LINES = 15
+
+_JSON_COMMENT_RE = re.compile(r'/\*.*?\*/|^\s*//[^\n]*', re.S | re.M)
+_JSON_TRAILING_COMMA_RE = re.compile(r',(\s*[}\]])')
+
+
+def _load_js_config(path: str) -> Optional[Dict[str, Any]]:
+    """compilerOptions of a jsconfig/tsconfig file, which may carry comments and trailing commas"""
+    try:
+        with open(path, encoding='utf-8') as f:
+            text = f.read()
+    except OSError:
+        return None
+    try:
+        config = json.loads(text)
+    except ValueError:
+        try:
+            config = json.loads(_JSON_TRAILING_COMMA_RE.sub(r'\1', _JSON_COMMENT_RE.sub('', text)))
+        except ValueError:
+            logger.warning(f"Could not parse {path}")
+            return None
+    options = config.get("compilerOptions") if isinstance(config, dict) else None
+    return options if isinstance(options, dict) else {}
+
+
+class ImportGraph:
+    """
+    Import edges between the code files of one project root
+
+    Imports come from the symbol index, which re-parses only changed files.
+    Edges are re-resolved when the index generation moves on: only for the
+    changed files while the set of files is the same, for all files when
+    files were added or removed (a new file can change what an import
+    resolves to).
+    """
+
+    def __init__(self, index: SymbolIndex):
+        self.index = index
+        self.lock = threading.RLock()
+        self.generation = -1
+        self.file_imports: Dict[str, List[Import]] = {}
+        # dotted module suffix -> [rel_path], e.g. "app.routes" and "routes" -> app/routes.py
+        self.modules: Dict[str, List[str]] = {}
+        self.js_configs: Dict[str, Optional[Tuple[str, Dict[str, Any]]]] = {}
+        self.imports: Dict[str, Set[str]] = {}
+        self.importers: Dict[str, Set[str]] = {}
+
+    # --- Resolution ---
+
+    def _build_module_map(self):
+        self.modules = {}
+        for rel_path in self.file_imports:
+            stem, extension = os.path.splitext(rel_path)
+            if extension not in PYTHON_EXTENSIONS:
+                continue
+            parts = stem.split(os.sep)
+            if parts[-1] == '__init__':
+                parts.pop()
+            for start in range(len(parts)):
+                self.modules.setdefault('.'.join(parts[start:]), []).append(rel_path)
+
+    def _closest(self, importer: str, candidates: Iterable[str]) -> Optional[str]:
+        """The candidate sharing the longest directory prefix with the importer, then the shortest"""
+        importer_dir = os.path.dirname(importer).split(os.sep)
+
+        def shared(rel_path: str) -> int:
+            count = 0
+            for left, right in zip(importer_dir, os.path.dirname(rel_path).split(os.sep)):
+                if left != right:
+                    break
+                count += 1
+            return count
+
+        candidates = [rel_path for rel_path in candidates if rel_path != importer]
+        if not candidates:
+            return None
+        return min(candidates, key=lambda rel_path: (-shared(rel_path), rel_path.count(os.sep), rel_path))
+
+    def _python_module_file(self, base: str) -> Optional[str]:
+        for rel_path in (base + '.py', os.path.join(base, '__init__.py')):
+            if rel_path in self.file_imports:
+                return rel_path
+        return None
+
+    def _resolve_python(self, importer: str, module: str, names: Tuple[str, ...]) -> List[str]:
+        targets = []
+        level = len(module) - len(module.lstrip('.'))
+        if level:
+            base = os.path.dirname(importer)
+            for _ in range(level - 1):
+                base = os.path.dirname(base)
+            dotted = module[level:]
+            base = os.path.normpath(os.path.join(base, *dotted.split('.'))) if dotted else base
+            # `from . import views` imports the module views.py, `from .views import x` imports views.py
+            for name in names:
+                target = self._python_module_file(os.path.normpath(os.path.join(base, name)))
+                if target:
+                    targets.append(target)
+            if not targets and dotted:
+                target = self._python_module_file(base)
+                if target:
+                    targets.append(target)
+            return targets
+
+        for name in names:
+            target = self._closest(importer, self.modules.get(f"{module}.{name}", ()))
+            if target:
+                targets.append(target)
+        if not targets:
+            target = self._closest(importer, self.modules.get(module, ()))
+            if target:
+                targets.append(target)
+        return targets
+
+    def _js_config_for(self, directory: str) -> Optional[Tuple[str, Dict[str, Any]]]:
+        """(config dir, compilerOptions) of the nearest jsconfig/tsconfig at or above `directory`"""
+        if directory in self.js_configs:
+            return self.js_configs[directory]
+        found = None
+        for name in JS_CONFIG_FILES:
+            path = os.path.join(self.index.root, directory, name)
+            if os.path.isfile(path):
+                options = _load_js_config(path)
+                if options is not None:
+                    found = (directory, options)
+                    break
+        if found is None and directory:
+            found = self._js_config_for(os.path.dirname(directory))
+        self.js_configs[directory] = found
+        return found
+
+    def _js_file(self, base: str) -> Optional[str]:
+        base = os.path.normpath(base)
+        if base.startswith('..'):
+            return None
+        candidates = [base] if os.path.splitext(base)[1] in JS_RESOLVE_EXTENSIONS else []
+        candidates += [base + extension for extension in JS_RESOLVE_EXTENSIONS]
+        candidates += [os.path.join(base, 'index' + extension) for extension in JS_RESOLVE_EXTENSIONS]
+        for rel_path in candidates:
+            if rel_path in self.file_imports:
+                return rel_path
+        return None
+
+    def _resolve_js(self, importer: str, specifier: str) -> List[str]:
+        if specifier.startswith('.'):
+            target = self._js_file(os.path.join(os.path.dirname(importer), specifier))
+            return [target] if target else []
+
+        found = self._js_config_for(os.path.dirname(importer))
+        if found is None:
+            return []
+        config_dir, options = found
+        base_dir = os.path.normpath(os.path.join(config_dir, options.get("baseUrl") or '.'))
+        paths = options.get("paths") or {}
+        # Like TypeScript, the alias with the longest prefix before `*` wins
+        best, best_length, rest = None, -1, ''
+        for pattern in paths:
+            prefix, star, suffix = pattern.partition('*')
+            if star and specifier.startswith(prefix) and specifier.endswith(suffix) \
+                    and len(specifier) >= len(prefix) + len(suffix) and len(prefix) > best_length:
+                best, best_length = pattern, len(prefix)
+                rest = specifier[len(prefix):len(specifier) - len(suffix)]
+            elif not star and specifier == pattern:
+                best, best_length, rest = pattern, len(pattern) + 1, ''
+                break
+        if best is not None:
+            for target in paths[best] if isinstance(paths[best], list) else []:
+                rel_path = self._js_file(os.path.join(base_dir, target.replace('*', rest)))
+                if rel_path:
+                    return [rel_path]
+            return []
+        if options.get("baseUrl"):
+            target = self._js_file(os.path.join(base_dir, specifier))
+            return [target] if target else []
+        return []  # A package from node_modules
+
+    def _resolve(self, importer: str) -> Set[str]:
+        python = os.path.splitext(importer)[1] in PYTHON_EXTENSIONS
+        targets = set()
+        for module, names in self.file_imports.get(importer, ()):
+            if python:
+                targets.update(self._resolve_python(importer, module, names))
+            else:
+                targets.update(self._resolve_js(importer, module))
+        targets.discard(importer)
+        return targets
+
+    def _set_edges(self, importer: str, targets: Set[str]):
+        for target in self.imports.get(importer, ()):
+            sources = self.importers.get(target)
+            if sources is not None:
+                sources.discard(importer)
+                if not sources:
+                    del self.importers[target]
+        if targets:
+            self.imports[importer] = targets
+        else:
+            self.imports.pop(importer, None)
+        for target in targets:
+            self.importers.setdefault(target, set()).add(importer)
+
+    def update(self):
+        """Refresh the symbol index and re-resolve the edges it invalidated"""
+        self.index.refresh_for_query()
+        with self.index.lock:
+            if self.index.generation == self.generation:
+                return
+            current = {rel_path: entry[4] for rel_path, entry in self.index.files.items()}
+            generation = self.index.generation
+        with self.lock:
+            if set(current) == set(self.file_imports):
+                changed = [rel_path for rel_path, imports in current.items() if imports is not self.file_imports[rel_path]]
+                self.file_imports = current
+            else:
+                self.file_imports = current
+                self._build_module_map()
+                self.imports, self.importers = {}, {}
+                changed = list(current)
+            self.js_configs = {}
+            for rel_path in changed:
+                self._set_edges(rel_path, self._resolve(rel_path))
+            self.generation = generation
+
+    # --- Querying ---
+
+    def resolve_file(self, file: str) -> Optional[str]:
+        """
+        Project-relative path of the file a chat request names
+
+        Accepts absolute paths inside the root, root-relative paths and, when
+        unambiguous, a path suffix such as "routes.py" or "app/routes.py".
+        The name comes from the client and the file's text goes into the
+        prompt, so only files the workspace index lists (allowed extensions,
+        no dotfiles or dot directories such as .env or .git) resolve.
+        """
+        if not file or file == "unknown":
+            return None
+        path = file.replace('/', os.sep)
+        if os.path.isabs(path):
+            path = os.path.relpath(path, self.index.root)
+        path = os.path.normpath(path)
+        if path.startswith('..') or any(part.startswith('.') for part in path.split(os.sep)):
+            return None
+        self.update()
+        with self.lock:
+            if path in self.file_imports:
+                return path
+            matches = [rel_path for rel_path in self.file_imports if rel_path.endswith(os.sep + path)]
+        if len(matches) == 1:
+            return matches[0]
+        if not matches and self._is_indexed_file(path):
+            return path  # Not a code file, but one of the workspace's documents or configs
+        return None
+
+    def _is_indexed_file(self, rel_path: str) -> bool:
+        if os.path.splitext(rel_path)[1].lower() not in file_context_manager.allowed_extensions:
+            return False
+        record = file_context_manager.get_workspace_index(self.index.root).get_dir(os.path.dirname(rel_path) or '.')
+        return bool(record) and os.path.basename(rel_path) in record["files"]
+
+    def neighbours(self, rel_path: str, max_depth: int = 2, limit: int = 10) -> List[Dict[str, Any]]:
+        """
+        Files reachable from `rel_path` over import edges in either direction
+
+        Breadth-first, so direct imports and importers come before files two
+        hops away; within a distance, files the current file imports come
+        before files importing it.
+
+        Returns:
+            [{"path", "relation": "imports"|"imported_by", "distance", "via"}, ...]
+        """
+        self.update()
+        results = []
+        with self.lock:
+            seen = {rel_path}
+            queue = deque([(rel_path, 0)])
+            while queue and len(results) < limit:
+                node, distance = queue.popleft()
+                if distance >= max_depth:
+                    continue
+                for relation, edges in (("imports", self.imports), ("imported_by", self.importers)):
+                    for neighbour in sorted(edges.get(node, ())):
+                        if neighbour in seen:
+                            continue
+                        seen.add(neighbour)
+                        queue.append((neighbour, distance + 1))
+                        results.append({
+                            "path": neighbour.replace(os.sep, '/'),
+                            "relation": relation,
+                            "distance": distance + 1,
+                            "via": node.replace(os.sep, '/') if distance else None
+                        })
+        return results[:limit]
+
+    def outline(self, rel_path: str) -> str:
+        """Signature lines of a file's classes and functions, indented by nesting"""
+        with self.index.lock:
+            entry = self.index.files.get(rel_path)
+            definitions = [definition for definition in entry[2] if definition[2] in OUTLINE_KINDS] if entry else []
+        lines = self.index.read_lines(rel_path)
+        if lines is None:
+            return ""
+        if not definitions:
+            return "\n".join(lines[:HEAD_LINES]).rstrip()
+        outline = []
+        for name, qualname, _, line, end_line in definitions[:MAX_OUTLINE_LINES]:
+            # Python definitions start at their first decorator
+            signature = next((text for text in lines[line - 1:end_line] if name in text), lines[line - 1])
+            outline.append("  " * qualname.count('.') + signature.strip()[:OUTLINE_LINE_CHARS])
+        if len(definitions) > MAX_OUTLINE_LINES:
+            outline.append(f"... ({len(definitions) - MAX_OUTLINE_LINES} more definitions)")
+        return "\n".join(outline)
+
+    def get_stats(self) -> Dict[str, Any]:
+        self.update()
+        with self.lock:
+            return {
+                "root": self.index.root,
+                "files": len(self.file_imports),
+                "edges": sum(len(targets) for targets in self.imports.values())
+            }
+
+
+class RelatedFiles:
+    """The current file and its import neighbours for the enhanced prompt"""
+
+    def __init__(self):
+        self.enabled = os.getenv('RELATED_FILES_ENABLED', 'true').lower() == 'true'
+        self.max_depth = int(os.getenv('RELATED_FILES_DEPTH', '2'))
+        self.max_files = int(os.getenv('RELATED_FILES_MAX', '8'))
+        self.lock = threading.Lock()
+        self.graphs: Dict[str, ImportGraph] = {}
+
+    def get_graph(self, project: str = None) -> ImportGraph:
+        index = symbol_search.get_index(project)
+        with self.lock:
+            graph = self.graphs.get(index.root)
+            if graph is None or graph.index is not index:
+                graph = self.graphs[index.root] = ImportGraph(index)
+            return graph
+
+    def context_for(self, file: str, project: str = None) -> Optional[Dict[str, Any]]:
+        """
+        The current file's text and its neighbours' outlines
+
+        Returns:
+            {"path", "text", "related": [{"path", "relation", "distance", "via", "text"}, ...]}
+            or None when the file is unknown, the feature is disabled or the
+            project's symbol index is still being built
+        """
+        if not self.enabled:
+            return None
+        graph = self.get_graph(project)
+        if not graph.index.ready.is_set():
+            graph.index.warm()
+            return None
+        rel_path = graph.resolve_file(file)
+        if rel_path is None:
+            return None
+        lines = graph.index.read_lines(rel_path, max_chars=file_context_manager.max_file_size)
+        related = []
+        for neighbour in graph.neighbours(rel_path, self.max_depth, self.max_files):
+            text = graph.outline(neighbour["path"].replace('/', os.sep))
+            if text:
+                related.append({**neighbour, "text": text})
+        return {
+            "path": rel_path.replace(os.sep, '/'),
+            "text": "\n".join(lines) if lines is not None else "",
+            "related": related
+        }
+
+    def format_current_file_for_ai(self, context: Dict[str, Any]) -> str:
+        return f"--- {context['path']} (current file) ---\n{context['text']}"
+
+    def format_related_file_for_ai(self, related: Dict[str, Any]) -> str:
+        relation = "imported by the current file" if related["relation"] == "imports" else "imports the current file"
+        if related["via"]:
+            relation = ("imported by " if related["relation"] == "imports" else "imports ") + related["via"]
+        return f"--- {related['path']} ({relation}) ---\n{related['text']}"
+
+
+# Global instance
+related_files = RelatedFiles()
@@ -0,0 +1,97 @@
+"""
+COAI Latency Histograms
+Mergeable log-bucketed histograms for response time percentiles
+"""
+
+import math
+from dataclasses import dataclass, field
+from typing import Dict, Iterable, Optional
+
+# Bucket boundaries grow geometrically so every recorded value is reported within
+# RELATIVE_ACCURACY of its true value, whatever its magnitude
+RELATIVE_ACCURACY = 0.02
+GAMMA = (1 + RELATIVE_ACCURACY) / (1 - RELATIVE_ACCURACY)
+LOG_GAMMA = math.log(GAMMA)
+
+DEFAULT_PERCENTILES = (50, 90, 99)
+
+
+@dataclass
+class LatencyHistogram:
+    """
+    Sparse log-bucketed histogram of latencies in seconds
+
+    Bucket i holds values in (GAMMA^(i-1), GAMMA^i]. Merging is a per-bucket
+    sum, so histograms recorded per hour, per day or per worker process combine
+    into exactly the histogram of the union, and percentiles of the merged
+    result keep the same error bound. Plain fields keep it JSON-serialisable
+    through dataclasses.asdict.
+    """
+    counts: Dict[int, int] = field(default_factory=dict)
+    zero_count: int = 0
+    count: int = 0
+    total: float = 0.0
+    min: Optional[float] = None
+    max: Optional[float] = None
+
+    def __post_init__(self):
+        # JSON round-trips turn the integer bucket keys into strings
+        self.counts = {int(index): count for index, count in self.counts.items()}
+
+    def record(self, value: float, count: int = 1):
+        """Record a latency observation"""
+        if value > 0:
+            index = math.ceil(math.log(value) / LOG_GAMMA)
+            self.counts[index] = self.counts.get(index, 0) + count
+        else:
+            self.zero_count += count
+        self.count += count
+        self.total += value * count
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+
+    def merge(self, other: 'LatencyHistogram'):
+        """Fold another histogram into this one"""
+        for index, count in other.counts.items():
+            self.counts[index] = self.counts.get(index, 0) + count
+        self.zero_count += other.zero_count
+        self.count += other.count
+        self.total += other.total
+        if other.min is not None:
+            self.min = other.min if self.min is None else min(self.min, other.min)
+        if other.max is not None:
+            self.max = other.max if self.max is None else max(self.max, other.max)
+
+    def percentile(self, q: float) -> float:
+        """Approximate q-th percentile (0-100); 0.0 when empty"""
+        if not self.count:
+            return 0.0
+        rank = q / 100 * (self.count - 1)
+        seen = self.zero_count
+        if rank < seen:
+            return 0.0
+        for index in sorted(self.counts):
+            seen += self.counts[index]
+            if rank < seen:
+                # Bucket midpoint in relative terms, clamped to observed extremes
+                value = 2 * GAMMA ** index / (GAMMA + 1)
+                return min(max(value, self.min), self.max)
+        return self.max
+
+    def summary(self, percentiles: Iterable[int] = DEFAULT_PERCENTILES) -> Dict[str, float]:
+        """Count, mean, max and the requested percentiles (as p50, p90, ...)"""
+        result = {
+            'count': self.count,
+            'mean': self.total / self.count if self.count else 0.0,
+            'max': self.max or 0.0
+        }
+        for q in percentiles:
+            result[f'p{q}'] = self.percentile(q)
+        return result
+
+    @classmethod
+    def merged(cls, histograms: Iterable['LatencyHistogram']) -> 'LatencyHistogram':
+        result = cls()
+        for histogram in histograms:
+            result.merge(histogram)
+        return result
@@ -8,6 +8,8 @@ import logging
 import os
 from datetime import datetime
 from typing import Dict, Any
+from .chat_history_store import ChatHistoryStore
+from .write_behind import WriteBehindQueue
 
 class COAILogger:
     """
@@ -21,11 +23,14 @@ class COAILogger:
         
         self.log_dir = log_dir
         self.actions_log = os.path.join(log_dir, "actions.log")
-        self.chat_log = os.path.join(log_dir, "chat_history.json")
+        self.chat_log = os.path.join(log_dir, "chat_history.json")  # Legacy single-file history
         
         # Ensure log directory exists
         os.makedirs(log_dir, exist_ok=True)
         
+        # Append-only segmented chat history
+        self.chat_history = ChatHistoryStore(os.path.join(log_dir, "chat_history"))
+        
         # Setup logger
         self.logger = logging.getLogger("coai")
         self.logger.setLevel(logging.INFO)
@@ -36,6 +41,11 @@ class COAILogger:
             formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
             handler.setFormatter(formatter)
             self.logger.addHandler(handler)
+        
+        self._migrate_legacy_chat_history()
+        
+        # Action log lines and history entries are written off the request path
+        self.writer = WriteBehindQueue("coai_logger", self._write_batch)
     
     def log_chat_request(self, message: str, context: Dict[str, Any]) -> str:
         """
@@ -54,8 +64,7 @@ class COAILogger:
             "context": context
         }
         
-        self.logger.info(f"Chat request: {request_id} - Project: {context.get('project')} - Message: {message[:50]}...")
-        self._append_to_chat_history(log_entry)
+        self._emit(logging.INFO, f"Chat request: {request_id} - Project: {context.get('project')} - Message: {message[:50]}...", log_entry)
         
         return request_id
     
@@ -72,8 +81,7 @@ class COAILogger:
             "metadata": metadata
         }
         
-        self.logger.info(f"Prompt processed: {request_id} - Length: {metadata.get('prompt_length', 0)}")
-        self._append_to_chat_history(log_entry)
+        self._emit(logging.INFO, f"Prompt processed: {request_id} - Length: {metadata.get('prompt_length', 0)}", log_entry)
     
     def log_ai_response(self, request_id: str, response: str, agent_type: str = "unknown"):
         """
@@ -87,8 +95,7 @@ class COAILogger:
             "agent_type": agent_type
         }
         
-        self.logger.info(f"AI response: {request_id} - Agent: {agent_type} - Response length: {len(response)}")
-        self._append_to_chat_history(log_entry)
+        self._emit(logging.INFO, f"AI response: {request_id} - Agent: {agent_type} - Response length: {len(response)}", log_entry)
     
     def log_error(self, request_id: str, error: str, context: Dict[str, Any] = None):
         """
@@ -102,44 +109,59 @@ class COAILogger:
             "context": context or {}
         }
         
-        self.logger.error(f"Error: {request_id} - {error}")
-        self._append_to_chat_history(log_entry)
+        self._emit(logging.ERROR, f"Error: {request_id} - {error}", log_entry)
+    
+    def _emit(self, level: int, message: str, entry: Dict[str, Any]):
+        """
+        Queue an action log line and its chat history entry for the background writer
+        """
+        record = None
+        if self.logger.isEnabledFor(level):
+            # Build the record now so its timestamp reflects the event, not the flush
+            record = self.logger.makeRecord(self.logger.name, level, __file__, 0, message, None, None)
+        self.writer.submit((record, entry))
+    
+    def _write_batch(self, items: list):
+        """
+        Write a batch of queued log records and chat history entries
+        """
+        for record, _ in items:
+            if record is not None:
+                self.logger.handle(record)
+        self._append_to_chat_history([entry for _, entry in items])
     
-    def _append_to_chat_history(self, entry: Dict[str, Any]):
+    def _append_to_chat_history(self, entries: list):
         """
-        Append entry to chat history JSON file
+        Append entries to the segmented chat history log
         """
         try:
-            # Read existing history
-            history = []
-            if os.path.exists(self.chat_log):
-                with open(self.chat_log, 'r', encoding='utf-8') as f:
-                    history = json.load(f)
-            
-            # Append new entry
-            history.append(entry)
-            
-            # Keep only last 1000 entries to prevent file from growing too large
-            if len(history) > 1000:
-                history = history[-1000:]
-            
-            # Write back to file
-            with open(self.chat_log, 'w', encoding='utf-8') as f:
-                json.dump(history, f, indent=2, ensure_ascii=False)
-                
+            self.chat_history.append_many(entries)
         except Exception as e:
             self.logger.error(f"Failed to write to chat history: {str(e)}")
     
+    def _migrate_legacy_chat_history(self):
+        """
+        One-time import of the legacy chat_history.json into the segment log
+        """
+        if not os.path.exists(self.chat_log):
+            return
+        
+        try:
+            with open(self.chat_log, 'r', encoding='utf-8') as f:
+                history = json.load(f)
+            self.chat_history.append_many(history)
+            os.replace(self.chat_log, self.chat_log + ".migrated")
+            self.logger.info(f"Migrated {len(history)} chat history entries to segment log")
+        except Exception as e:
+            self.logger.error(f"Failed to migrate chat history: {str(e)}")
+    
     def get_chat_history(self, limit: int = 50) -> list:
         """
         Get recent chat history
         """
         try:
-            if os.path.exists(self.chat_log):
-                with open(self.chat_log, 'r', encoding='utf-8') as f:
-                    history = json.load(f)
-                return history[-limit:] if limit else history
-            return []
+            self.writer.flush()
+            return self.chat_history.tail(limit)
         except Exception as e:
             self.logger.error(f"Failed to read chat history: {str(e)}")
             return []
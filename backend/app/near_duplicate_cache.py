@@ -0,0 +1,239 @@
+"""
+COAI Near-Duplicate Cache
+MinHash signatures of user messages in an LSH index, so a rephrased question
+asked in the same context is answered from the response cache
+"""
+
+import hashlib
+import json
+import logging
+import os
+import re
+import struct
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Any, Dict, FrozenSet, List, Optional, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+NUM_PERM = 64
+BANDS = 16
+ROWS = NUM_PERM // BANDS
+# A message needs this many distinct terms before a near match means anything
+MIN_TERMS = 2
+# Candidates verified per lookup; more only happens with thousands of near-identical messages
+MAX_CANDIDATES = 64
+
+# One 64-bit hash per signature position, all read from a single extendable-output digest
+_TERM_HASHES = struct.Struct(f'<{NUM_PERM}Q')
+
+_WORD_RE = re.compile(r'\w+')
+# Identifier-ish tokens, kept whole across dots, slashes and :: (get_user, main.py, app/routes, Foo::bar)
+_TOKEN_RE = re.compile(r'\w+(?:(?:\.|/|::)\w+)*')
+_CAMEL_CASE_RE = re.compile(r'[a-z][A-Z]')
+# Function words only: negations and question words such as "why" change the answer
+STOPWORDS = frozenset("""
+    a an the is are was were be been do does did of in on at to for from by with and or
+    this that these those it its my our your me i we you please can could would should
+""".split())
+
+
+def message_terms(message: str) -> FrozenSet[str]:
+    """
+    Normalized terms of a message: case- and accent-folded words without
+    function words, crudely singularised, plus each pair of adjacent words
+    so that word order counts ("rename a to b" is not "rename b to a")
+    """
+    text = unicodedata.normalize('NFKD', message.lower())
+    text = ''.join(char for char in text if not unicodedata.combining(char))
+    words = []
+    for word in _WORD_RE.findall(text):
+        if word in STOPWORDS:
+            continue
+        if len(word) > 3 and word.endswith('s') and not word.endswith('ss'):
+            word = word[:-1]
+        words.append(word)
+    return frozenset(words) | frozenset(f"{left} {right}" for left, right in zip(words, words[1:]))
+
+
+def code_terms(message: str) -> FrozenSet[str]:
+    """
+    Code-like tokens of a message, verbatim: identifiers with underscores,
+    dots, path separators or camelCase, and words mixing letters and digits.
+    Two messages only share a reply when these match exactly.
+    """
+    terms = set()
+    for token in _TOKEN_RE.findall(message):
+        has_digit = any(char.isdigit() for char in token)
+        if ('_' in token or '.' in token or '/' in token or '::' in token or _CAMEL_CASE_RE.search(token)
+                or (has_digit and not token.isdigit())):
+            terms.add(token)
+    return frozenset(terms)
+
+
+@lru_cache(maxsize=65536)
+def _term_hashes(term: str) -> Tuple[int, ...]:
+    """
+    The term's value under each of NUM_PERM independent hash functions
+
+    SHAKE-128 output split into 64-bit words, one C call per term instead of
+    NUM_PERM big-integer permutations in Python; most message terms (word
+    pairs) are new, so this is the cold path of every lookup.
+    """
+    return _TERM_HASHES.unpack(hashlib.shake_128(term.encode('utf-8')).digest(_TERM_HASHES.size))
+
+
+def minhash(terms: FrozenSet[str]) -> Tuple[int, ...]:
+    """MinHash signature; the share of equal positions estimates the Jaccard similarity"""
+    return tuple(map(min, zip(*map(_term_hashes, terms))))
+
+
+def jaccard(left: FrozenSet[str], right: FrozenSet[str]) -> float:
+    if not left and not right:
+        return 1.0
+    return len(left & right) / len(left | right)
+
+
+def context_scope(fingerprint: str, model: str, temperature: float, max_tokens: int) -> str:
+    """Scope within which near-duplicate messages may share a reply"""
+    return hashlib.sha256(json.dumps([fingerprint, model, round(float(temperature), 3), max_tokens]).encode()).hexdigest()[:16]
+
+
+class NearDuplicateCache:
+    """
+    LSH index from message signatures to response cache keys
+
+    Signatures are split into BANDS bands of ROWS values; two messages become
+    candidates when any band matches, which happens with probability
+    1 - (1 - s^ROWS)^BANDS for Jaccard similarity s (about 0.9 at s = 0.6).
+    Candidates are then checked against their exact term sets, so a reply is
+    only reused for similarity >= `threshold`, and only when both messages
+    name exactly the same identifiers, files and other code-like tokens.
+    Band keys include the scope, which pins project, file context, retrieved
+    code, rules and model settings.
+
+    Only keys are kept here; replies live in the response cache, so they
+    expire with it. Entries are evicted oldest first beyond `max_entries`.
+    """
+
+    def __init__(self, threshold: float = None, max_entries: int = None):
+        self.enabled = os.getenv('NEAR_DUPLICATE_CACHE_ENABLED', 'true').lower() == 'true'
+        self.threshold = threshold if threshold is not None else float(os.getenv('NEAR_DUPLICATE_THRESHOLD', '0.8'))
+        self.max_entries = max_entries or int(os.getenv('NEAR_DUPLICATE_MAX_ENTRIES', '100000'))
+        self.lock = threading.Lock()
+        # entry id -> (scope, terms, code terms, band keys, response key)
+        self.entries: "OrderedDict[int, Tuple[str, FrozenSet[str], FrozenSet[str], Tuple[int, ...], str]]" = OrderedDict()
+        self.buckets: Dict[int, List[int]] = {}
+        self.by_content: Dict[Tuple[str, FrozenSet[str], FrozenSet[str]], int] = {}
+        # response key -> ids of the entries pointing at it, so discard needs no scan
+        self.by_response: Dict[str, Set[int]] = {}
+        self.next_id = 0
+        self.stats = {"hits": 0, "misses": 0, "added": 0, "evicted": 0, "lookup_seconds": 0.0}
+
+    def _band_keys(self, scope: str, signature: Tuple[int, ...]) -> Tuple[int, ...]:
+        return tuple(hash((scope, band, signature[band * ROWS:(band + 1) * ROWS])) for band in range(BANDS))
+
+    def add(self, message: str, scope: str, response_key: str) -> bool:
+        """Index a message whose reply is stored under `response_key`; False if too short to index"""
+        terms = message_terms(message)
+        if len(terms) < MIN_TERMS:
+            return False
+        code = code_terms(message)
+        band_keys = self._band_keys(scope, minhash(terms))
+        with self.lock:
+            self._remove(self.by_content.get((scope, terms, code)))
+            entry_id = self.next_id
+            self.next_id += 1
+            self.entries[entry_id] = (scope, terms, code, band_keys, response_key)
+            self.by_content[(scope, terms, code)] = entry_id
+            self.by_response.setdefault(response_key, set()).add(entry_id)
+            for band_key in band_keys:
+                self.buckets.setdefault(band_key, []).append(entry_id)
+            self.stats["added"] += 1
+            while len(self.entries) > self.max_entries:
+                self._remove(next(iter(self.entries)))
+                self.stats["evicted"] += 1
+        return True
+
+    def _remove(self, entry_id: Optional[int]):
+        """Drop an entry from the index; the caller holds the lock"""
+        entry = self.entries.pop(entry_id, None) if entry_id is not None else None
+        if entry is None:
+            return
+        scope, terms, code, band_keys, response_key = entry
+        self.by_content.pop((scope, terms, code), None)
+        entry_ids = self.by_response.get(response_key)
+        if entry_ids is not None:
+            entry_ids.discard(entry_id)
+            if not entry_ids:
+                del self.by_response[response_key]
+        for band_key in band_keys:
+            bucket = self.buckets.get(band_key)
+            if bucket is not None:
+                bucket.remove(entry_id)
+                if not bucket:
+                    del self.buckets[band_key]
+
+    def lookup(self, message: str, scope: str) -> Optional[Tuple[str, float]]:
+        """
+        Response key of the most similar earlier message in the same scope
+
+        Returns:
+            (response key, Jaccard similarity) or None if nothing reaches the threshold
+        """
+        started = time.perf_counter()
+        terms = message_terms(message)
+        best = None
+        if len(terms) >= MIN_TERMS:
+            code = code_terms(message)
+            band_keys = self._band_keys(scope, minhash(terms))
+            with self.lock:
+                candidates = set()
+                for band_key in band_keys:
+                    candidates.update(self.buckets.get(band_key, ()))
+                    if len(candidates) >= MAX_CANDIDATES:
+                        break
+                for entry_id in candidates:
+                    entry_scope, entry_terms, entry_code, _, response_key = self.entries[entry_id]
+                    if entry_scope != scope:
+                        continue  # A band hash collision across scopes
+                    if entry_code != code:
+                        continue  # Different identifiers or files: a different question
+                    similarity = jaccard(terms, entry_terms)
+                    if similarity >= self.threshold and (best is None or similarity > best[1]):
+                        best = (response_key, similarity)
+        with self.lock:
+            self.stats["hits" if best else "misses"] += 1
+            self.stats["lookup_seconds"] += time.perf_counter() - started
+        return best
+
+    def discard(self, response_key: str):
+        """Forget entries pointing at a reply that is gone (expired from the response cache)"""
+        with self.lock:
+            for entry_id in list(self.by_response.get(response_key, ())):
+                self._remove(entry_id)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.buckets.clear()
+            self.by_content.clear()
+            self.by_response.clear()
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self.lock:
+            stats = dict(self.stats)
+            stats["entries"] = len(self.entries)
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = round(stats["hits"] / lookups, 3) if lookups else 0.0
+        stats["avg_lookup_ms"] = round(stats.pop("lookup_seconds") * 1000 / lookups, 4) if lookups else 0.0
+        stats["enabled"] = self.enabled
+        stats["threshold"] = self.threshold
+        return stats
+
+
+# Global instance
+near_duplicate_cache = NearDuplicateCache()
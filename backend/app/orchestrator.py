@@ -6,10 +6,17 @@ Coordinates communication between frontend, preprocessor, and AI agents
 import os
 import logging
 from datetime import datetime
-from typing import Dict, Any, Optional
+from typing import Dict, Any, Iterator, Optional
 from .preprocessor import preprocessor
 from .logger import coai_logger
 from .usage_tracker import usage_tracker
+from .ai_agents import iter_text_chunks
+from .stage_timer import StageTimer, stage_stats
+from .content_cache import content_cache
+from .response_cache import response_cache
+from .near_duplicate_cache import near_duplicate_cache
+from .single_flight import request_key, single_flight
+from .admission_control import admission_controller
 
 # Try to import full AI agents first, fallback to basic if needed
 try:
@@ -42,7 +49,12 @@ class COAIOrchestrator:
         self.status = "initialized"
         logger.info("COAI Orchestrator initialized")
     
-    def process_chat_request(self, message: str, context: Dict[str, Any]) -> Dict[str, Any]:
+    def process_chat_request(
+        self,
+        message: str,
+        context: Dict[str, Any],
+        timer: Optional[StageTimer] = None
+    ) -> Dict[str, Any]:
         """
         Main orchestration method for chat requests with usage tracking
         
@@ -51,74 +63,166 @@ class COAIOrchestrator:
         Args:
             message: User's message
             context: Request context (project, file, etc.)
+            timer: Stage timer already started by the caller (one is created if omitted)
             
         Returns:
-            Processed response ready for frontend
+            Processed response ready for frontend; metadata.stage_timings holds
+            the per-stage breakdown in milliseconds
         """
         request_id = None
         start_time = datetime.now()
+        timer = timer or StageTimer()
         
         try:
             # Step 1: Log incoming request
-            request_id = coai_logger.log_chat_request(message, context)
+            with timer.span("logging"):
+                request_id = coai_logger.log_chat_request(message, context)
             logger.info(f"Orchestrator processing request: {request_id}")
             
             # Step 2: Validate input
-            validation_result = self._validate_request(message, context)
+            with timer.span("validation"):
+                validation_result = self._validate_request(message, context)
             if not validation_result["valid"]:
                 raise ValueError(validation_result["error"])
             
-            # Step 3: Preprocess the prompt
-            logger.info(f"Step 1/4: Preprocessing prompt for {request_id}")
-            processed_data = preprocessor.process_prompt(message, context)
+            # Steps 3-5: Preprocess and call the AI agent, once for concurrent identical requests
+            wait_started = datetime.now()
+            answer, coalesced = single_flight.run(
+                self._coalesce_key(message, context),
+                lambda: self._answer_chat_request(request_id, message, context, timer)
+            )
+            if coalesced:
+                timer.stages["coalesced_wait"] = (datetime.now() - wait_started).total_seconds() * 1000
             
-            # DEBUG: Log enhanced prompt content
-            enhanced_prompt = processed_data["enhanced_prompt"]
-            logger.info(f"Enhanced prompt length: {len(enhanced_prompt)} characters")
-            if "PROJECT FILE INFORMATION" in enhanced_prompt:
-                logger.info("✅ File context successfully included in prompt")
-            else:
-                logger.warning("❌ File context NOT included in prompt")
+            # Steps 6-8: Log, track usage and prepare the final response
+            return self._complete_chat_request(request_id, message, context, answer, coalesced, start_time, timer)
             
-            # Step 4: Log preprocessing
+        except Exception as e:
+            return self._fail_chat_request(request_id, message, context, start_time, e)
+    
+    def _coalesce_key(self, message: str, context: Dict[str, Any]) -> Optional[str]:
+        """Single-flight key of a chat request; None for requests that opted out of caching"""
+        return request_key(message, context) if context.get("cache") is not False else None
+    
+    def _answer_chat_request(
+        self,
+        request_id: str,
+        message: str,
+        context: Dict[str, Any],
+        timer: StageTimer
+    ) -> Dict[str, Any]:
+        """
+        Preprocess a chat request and get the AI agent's reply
+        
+        This is the part of process_chat_request that concurrent identical
+        requests share, so the result holds nothing caller-specific beyond
+        the ID of the request that produced it.
+        """
+        processed_data = self._preprocess(request_id, message, context, timer)
+        
+        # Step 5: Call AI agent (real implementation)
+        logger.info(f"Step 2/4: Calling AI agent for {request_id}")
+        with timer.span("agent"):
+            ai_result = ai_agent_manager.process_request(self._agent_request(request_id, context, processed_data))
+        return self._answer_from_result(request_id, processed_data, ai_result, timer)
+    
+    def _preprocess(self, request_id: str, message: str, context: Dict[str, Any], timer: StageTimer) -> Dict[str, Any]:
+        """Steps 3-4: build the enhanced prompt and log it"""
+        logger.info(f"Step 1/4: Preprocessing prompt for {request_id}")
+        with timer.span("preprocess"), timer.activate():
+            processed_data = preprocessor.process_prompt(message, context)
+        
+        # DEBUG: Log enhanced prompt content
+        enhanced_prompt = processed_data["enhanced_prompt"]
+        logger.info(f"Enhanced prompt length: {len(enhanced_prompt)} characters")
+        if "PROJECT FILE INFORMATION" in enhanced_prompt:
+            logger.info("✅ File context successfully included in prompt")
+        else:
+            logger.warning("❌ File context NOT included in prompt")
+        
+        with timer.span("logging"):
             coai_logger.log_prompt_processing(
                 request_id,
                 message,
                 processed_data["enhanced_prompt"],
                 processed_data["metadata"]
             )
-            
-            # Step 5: Call AI agent (real implementation)
-            logger.info(f"Step 2/4: Calling AI agent for {request_id}")
-            ai_request = {
-                "message": processed_data["enhanced_prompt"],
-                "context": context,  # Add context for ai_agents_full.py
-                "metadata": processed_data["metadata"],
-                "request_id": request_id
-            }
-            ai_result = ai_agent_manager.process_request(ai_request)
-            
-            if ai_result.get("status") != "success":
-                # Fallback to simulation if AI agent fails
-                logger.warning(f"AI agent failed for {request_id}, falling back to simulation")
-                ai_response = self._simulate_ai_response(processed_data)
-                agent_type = "simulated_fallback"
-                real_ai = False
-                usage_data = {"total_tokens": 0, "model": "fallback"}
-            else:
-                ai_response = ai_result["response"]
-                agent_type = ai_result.get("agent_type", "unknown")
-                real_ai = ai_result.get("real_ai", False)
-                usage_data = ai_result.get("usage", {"total_tokens": 0, "model": "unknown"})
-            
-            # Step 6: Log AI response
-            logger.info(f"Step 3/4: Processing AI response for {request_id}")
+        return processed_data
+    
+    def _agent_request(self, request_id: str, context: Dict[str, Any], processed_data: Dict[str, Any]) -> Dict[str, Any]:
+        return {
+            "message": processed_data["enhanced_prompt"],
+            "context": context,  # Add context for ai_agents_full.py
+            "metadata": processed_data["metadata"],
+            "request_id": request_id
+        }
+    
+    def _answer_from_result(
+        self,
+        request_id: str,
+        processed_data: Dict[str, Any],
+        ai_result: Dict[str, Any],
+        timer: StageTimer
+    ) -> Dict[str, Any]:
+        """The reply and its usage from an agent result, simulated if the agent failed"""
+        answer = {"request_id": request_id, "processed_data": processed_data, "cache_match": None}
+        if ai_result.get("status") != "success":
+            # Fallback to simulation if AI agent fails
+            logger.warning(f"AI agent failed for {request_id}, falling back to simulation")
+            with timer.span("agent"):
+                answer["ai_response"] = self._simulate_ai_response(processed_data)
+            answer.update(agent_type="simulated_fallback", real_ai=False, cached=False,
+                          usage_data={"total_tokens": 0, "model": "fallback"})
+        else:
+            answer.update(
+                ai_response=ai_result["response"],
+                agent_type=ai_result.get("agent_type", "unknown"),
+                real_ai=ai_result.get("real_ai", False),
+                usage_data=ai_result.get("usage", {"total_tokens": 0, "model": "unknown"}),
+                cached=ai_result.get("cached", False),
+                cache_match=ai_result.get("cache_match")
+            )
+        return answer
+    
+    def _complete_chat_request(
+        self,
+        request_id: str,
+        message: str,
+        context: Dict[str, Any],
+        answer: Dict[str, Any],
+        coalesced: bool,
+        start_time: datetime,
+        timer: StageTimer
+    ) -> Dict[str, Any]:
+        """Steps 6-8: log the reply, track usage and build the response for the frontend"""
+        processed_data = answer["processed_data"]
+        ai_response = answer["ai_response"]
+        agent_type = answer["agent_type"]
+        cached = answer["cached"]
+        usage_data = answer["usage_data"]
+        if coalesced:
+            logger.info(f"Request {request_id} coalesced with identical in-flight request {answer['request_id']}")
+            with timer.span("logging"):
+                coai_logger.log_prompt_processing(
+                    request_id,
+                    message,
+                    processed_data["enhanced_prompt"],
+                    processed_data["metadata"]
+                )
+            # The leader's usage entry carries the tokens; this one spent none
+            usage_data = {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0,
+                          "model": usage_data.get("model", "unknown")}
+        
+        # Step 6: Log AI response
+        logger.info(f"Step 3/4: Processing AI response for {request_id}")
+        with timer.span("logging"):
             coai_logger.log_ai_response(request_id, ai_response, agent_type)
-            
-            # Step 7: Track usage analytics
-            end_time = datetime.now()
-            response_time = (end_time - start_time).total_seconds()
-            
+        
+        # Step 7: Track usage analytics
+        end_time = datetime.now()
+        response_time = (end_time - start_time).total_seconds()
+        
+        with timer.span("usage_tracking"):
             usage_tracker.track_request(
                 request_id=request_id,
                 agent_type=agent_type,
@@ -129,55 +233,301 @@ class COAIOrchestrator:
                 tokens_data=usage_data,
                 response_time=response_time,
                 status="success",
-                real_ai=real_ai
+                real_ai=answer["real_ai"],
+                cached=cached,
+                coalesced=coalesced
             )
+        
+        # Step 8: Prepare final response
+        logger.info(f"Step 4/4: Preparing final response for {request_id}")
+        stage_stats.record(timer)
+        final_response = self._prepare_final_response(
+            request_id, message, context, processed_data, ai_response, agent_type, timer
+        )
+        
+        # Add usage info to response
+        final_response["metadata"]["cached"] = cached
+        final_response["metadata"]["cache_match"] = answer["cache_match"] if cached else None
+        final_response["metadata"]["coalesced"] = coalesced
+        final_response["usage_tracked"] = True
+        final_response["response_time"] = response_time
+        
+        logger.info(f"Orchestrator completed processing: {request_id}")
+        return final_response
+    
+    def _fail_chat_request(
+        self,
+        request_id: Optional[str],
+        message: str,
+        context: Dict[str, Any],
+        start_time: datetime,
+        error: Exception
+    ) -> Dict[str, Any]:
+        """Record a failed chat request and build its error response"""
+        error_msg = f"Orchestrator error: {str(error)}"
+        logger.error(f"{error_msg} for request: {request_id}")
+        
+        # Track failed request
+        if request_id:
+            end_time = datetime.now()
+            response_time = (end_time - start_time).total_seconds()
             
-            # Step 8: Prepare final response
-            logger.info(f"Step 4/4: Preparing final response for {request_id}")
-            final_response = self._prepare_final_response(
-                request_id, message, context, processed_data, ai_response, agent_type
+            usage_tracker.track_request(
+                request_id=request_id,
+                agent_type="error",
+                project=context.get("project", "unknown"),
+                file=context.get("file", "unknown"),
+                message=message,
+                response="",
+                tokens_data={"total_tokens": 0, "model": "error"},
+                response_time=response_time,
+                status="error",
+                real_ai=False,
+                error=error_msg
             )
             
-            # Add usage info to response
-            final_response["usage_tracked"] = True
-            final_response["response_time"] = response_time
+            coai_logger.log_error(request_id, error_msg, context)
+        
+        # Return error response
+        return {
+            "request_id": request_id,
+            "error": True,
+            "message": error_msg,
+            "status": "orchestrator_error",
+            "timestamp": datetime.now().isoformat()
+        }
+    
+    def stream_chat_request(
+        self,
+        message: str,
+        context: Dict[str, Any],
+        timer: Optional[StageTimer] = None
+    ) -> Iterator[Dict[str, Any]]:
+        """
+        Streaming variant of process_chat_request
+        
+        Yields a "start" event with the request ID, one "token" event per
+        response chunk and a final "done" (or "error") event carrying the same
+        payload as process_chat_request. Logging and usage tracking are
+        finalised once the agent stream closes, including when the client
+        disconnects mid-stream.
+        
+        Args:
+            message: User's message
+            context: Request context (project, file, etc.)
+            timer: Stage timer already started by the caller (one is created if omitted)
+            
+        Yields:
+            Stream events ready to be serialised for the frontend
+        """
+        stream = self._begin_stream(message, context, timer)
+        
+        try:
+            # Steps 1-3: Log, validate and preprocess the prompt
+            self._open_stream(stream)
+            processed_data = self._preprocess(stream["request_id"], message, context, stream["timer"])
             
-            logger.info(f"Orchestrator completed processing: {request_id}")
-            return final_response
+            yield {"type": "start", "request_id": stream["request_id"]}
             
-        except Exception as e:
-            error_msg = f"Orchestrator error: {str(e)}"
-            logger.error(f"{error_msg} for request: {request_id}")
+            # Step 4: Stream AI agent response
+            logger.info(f"Step 2/4: Streaming AI agent response for {stream['request_id']}")
+            ai_result = {}
+            # Includes time the client takes to consume each token
+            stream["agent_started"] = datetime.now()
+            for event in ai_agent_manager.stream_request(self._agent_request(stream["request_id"], context, processed_data)):
+                if event.get("type") == "token":
+                    yield self._stream_token(stream, event["content"])
+                elif event.get("type") == "done":
+                    ai_result = event
+            yield from self._close_agent_stream(stream, processed_data, ai_result)
             
-            # Track failed request
-            if request_id:
-                end_time = datetime.now()
-                response_time = (end_time - start_time).total_seconds()
-                
-                usage_tracker.track_request(
-                    request_id=request_id,
-                    agent_type="error",
-                    project=context.get("project", "unknown"),
-                    file=context.get("file", "unknown"),
-                    message=message,
-                    response="",
-                    tokens_data={"total_tokens": 0, "model": "error"},
-                    response_time=response_time,
-                    status="error",
-                    real_ai=False,
-                    error=error_msg
-                )
-                
-                coai_logger.log_error(request_id, error_msg, context)
+            # Steps 5-6: Finalise logging and usage, then send the final event
+            yield self._complete_stream(stream, processed_data, ai_result)
             
-            # Return error response
-            return {
-                "request_id": request_id,
-                "error": True,
-                "message": error_msg,
-                "status": "orchestrator_error",
-                "timestamp": datetime.now().isoformat()
-            }
+        except Exception as e:
+            yield self._fail_stream(stream, e)
+        finally:
+            self._cancel_stream(stream)
+    
+    def _begin_stream(self, message: str, context: Dict[str, Any], timer: Optional[StageTimer]) -> Dict[str, Any]:
+        """State of a streamed chat request, shared by the stream steps below"""
+        return {
+            "request_id": None,
+            "message": message,
+            "context": context,
+            "timer": timer or StageTimer(),
+            "start_time": datetime.now(),
+            "first_token_time": None,
+            "agent_started": None,
+            "chunks": [],
+            "agent_type": "unknown",
+            "real_ai": False,
+            "usage_data": {"total_tokens": 0, "model": "unknown"},
+            "cached": False,
+            "finalised": False
+        }
+    
+    def _open_stream(self, stream: Dict[str, Any]):
+        """Steps 1-2 of a streamed request: log it and validate it"""
+        timer = stream["timer"]
+        with timer.span("logging"):
+            stream["request_id"] = coai_logger.log_chat_request(stream["message"], stream["context"])
+        logger.info(f"Orchestrator streaming request: {stream['request_id']}")
+        
+        with timer.span("validation"):
+            validation_result = self._validate_request(stream["message"], stream["context"])
+        if not validation_result["valid"]:
+            raise ValueError(validation_result["error"])
+    
+    def _stream_token(self, stream: Dict[str, Any], content: str) -> Dict[str, Any]:
+        """Record a response chunk and return its token event"""
+        if stream["first_token_time"] is None:
+            stream["first_token_time"] = datetime.now()
+        stream["chunks"].append(content)
+        return {"type": "token", "content": content}
+    
+    def _close_agent_stream(
+        self,
+        stream: Dict[str, Any],
+        processed_data: Dict[str, Any],
+        ai_result: Dict[str, Any]
+    ) -> Iterator[Dict[str, Any]]:
+        """
+        Take the agent's final result once its stream has closed
+        
+        Yields simulated token events if the agent failed before producing
+        output; raises if it failed part-way through.
+        """
+        if ai_result.get("status") != "success" and not stream["chunks"]:
+            # Fallback to simulation if AI agent fails before producing output
+            logger.warning(f"AI agent stream failed for {stream['request_id']}, falling back to simulation")
+            stream["agent_type"] = "simulated_fallback"
+            stream["usage_data"] = {"total_tokens": 0, "model": "fallback"}
+            for chunk in iter_text_chunks(self._simulate_ai_response(processed_data)):
+                yield self._stream_token(stream, chunk)
+        elif ai_result.get("status") != "success":
+            raise RuntimeError(ai_result.get("error", "AI agent stream failed"))
+        else:
+            stream["agent_type"] = ai_result.get("agent_type", "unknown")
+            stream["real_ai"] = ai_result.get("real_ai", False)
+            stream["usage_data"] = ai_result.get("usage", {"total_tokens": 0, "model": "unknown"})
+            stream["cached"] = ai_result.get("cached", False)
+        stream["timer"].stages["agent"] = (datetime.now() - stream["agent_started"]).total_seconds() * 1000
+    
+    def _complete_stream(
+        self,
+        stream: Dict[str, Any],
+        processed_data: Dict[str, Any],
+        ai_result: Dict[str, Any]
+    ) -> Dict[str, Any]:
+        """Steps 5-6: log the streamed reply, track usage and build the final "done" event"""
+        request_id, message, context, timer = stream["request_id"], stream["message"], stream["context"], stream["timer"]
+        cached = stream["cached"]
+        
+        # Step 5: Finalise logging and usage once the agent stream has closed
+        logger.info(f"Step 3/4: Finalising streamed response for {request_id}")
+        ai_response = "".join(stream["chunks"])
+        response_time = self._finalise_stream(
+            request_id, message, context, ai_response, stream["agent_type"],
+            stream["usage_data"], stream["start_time"], "success", stream["real_ai"], timer=timer, cached=cached
+        )
+        stream["finalised"] = True
+        
+        # Step 6: Prepare final event
+        logger.info(f"Step 4/4: Preparing final stream event for {request_id}")
+        stage_stats.record(timer)
+        final_response = self._prepare_final_response(
+            request_id, message, context, processed_data, ai_response, stream["agent_type"], timer
+        )
+        final_response["metadata"]["cached"] = cached
+        final_response["metadata"]["cache_match"] = ai_result.get("cache_match") if cached else None
+        final_response["usage_tracked"] = True
+        final_response["response_time"] = response_time
+        first_token_time = stream["first_token_time"]
+        final_response["time_to_first_token"] = (
+            (first_token_time - stream["start_time"]).total_seconds() if first_token_time else None
+        )
+        
+        logger.info(f"Orchestrator completed streaming: {request_id}")
+        return {"type": "done", **final_response}
+    
+    def _fail_stream(self, stream: Dict[str, Any], error: Exception) -> Dict[str, Any]:
+        """Record a failed streamed request and build its "error" event"""
+        request_id = stream["request_id"]
+        error_msg = f"Orchestrator error: {str(error)}"
+        logger.error(f"{error_msg} for request: {request_id}")
+        
+        if request_id and not stream["finalised"]:
+            self._finalise_stream(
+                request_id, stream["message"], stream["context"], "".join(stream["chunks"]), "error",
+                {"total_tokens": 0, "model": "error"}, stream["start_time"], "error", False,
+                error=error_msg
+            )
+            stream["finalised"] = True
+        
+        return {
+            "type": "error",
+            "request_id": request_id,
+            "error": True,
+            "message": error_msg,
+            "status": "orchestrator_error",
+            "timestamp": datetime.now().isoformat()
+        }
+    
+    def _cancel_stream(self, stream: Dict[str, Any]):
+        """Record a stream the client abandoned before it completed; no-op once finalised"""
+        if stream["request_id"] and not stream["finalised"]:
+            logger.warning(f"Stream cancelled by client: {stream['request_id']}")
+            self._finalise_stream(
+                stream["request_id"], stream["message"], stream["context"], "".join(stream["chunks"]),
+                stream["agent_type"], stream["usage_data"], stream["start_time"], "cancelled",
+                stream["real_ai"], cached=stream["cached"]
+            )
+    
+    def _finalise_stream(
+        self,
+        request_id: str,
+        message: str,
+        context: Dict[str, Any],
+        ai_response: str,
+        agent_type: str,
+        usage_data: Dict[str, Any],
+        start_time: datetime,
+        status: str,
+        real_ai: bool,
+        error: str = None,
+        timer: Optional[StageTimer] = None,
+        cached: bool = False
+    ) -> float:
+        """
+        Log the streamed response and record its usage, returning the response time
+        """
+        response_time = (datetime.now() - start_time).total_seconds()
+        timer = timer or StageTimer()
+        
+        with timer.span("logging"):
+            if error:
+                coai_logger.log_error(request_id, error, context)
+            else:
+                coai_logger.log_ai_response(request_id, ai_response, agent_type)
+        
+        with timer.span("usage_tracking"):
+            usage_tracker.track_request(
+                request_id=request_id,
+                agent_type=agent_type,
+                project=context.get("project", "unknown"),
+                file=context.get("file", "unknown"),
+                message=message,
+                response=ai_response,
+                tokens_data=usage_data,
+                response_time=response_time,
+                status=status,
+                real_ai=real_ai,
+                error=error,
+                cached=cached
+            )
+        
+        return response_time
     
     def _validate_request(self, message: str, context: Dict[str, Any]) -> Dict[str, Any]:
         """
@@ -254,11 +604,13 @@ What specific help do you need with your project?"""
         context: Dict[str, Any],
         processed_data: Dict[str, Any], 
         ai_response: str,
-        agent_type: str = "unknown"
+        agent_type: str = "unknown",
+        timer: Optional[StageTimer] = None
     ) -> Dict[str, Any]:
         """
         Prepare the final response for frontend
         """
+        timings = timer.breakdown() if timer else {"total_ms": 0.0, "stages": {}}
         return {
             "request_id": request_id,
             "reply": ai_response,
@@ -271,7 +623,10 @@ What specific help do you need with your project?"""
             },
             "metadata": {
                 "prompt_length": processed_data["metadata"].get("prompt_length"),
-                "processing_time": "< 1s",
+                "token_counts": processed_data["metadata"].get("token_counts"),
+                "estimated_cost": processed_data["metadata"].get("estimated_cost"),
+                "processing_time": round(timings["total_ms"] / 1000, 3),
+                "stage_timings": timings["stages"],
                 "agent_type": agent_type,
                 "orchestrator_version": "1.0.0"
             },
@@ -302,12 +657,25 @@ What specific help do you need with your project?"""
             "version": "1.0.0",
             "capabilities": [
                 "chat_request_processing",
+                "streaming_chat_responses",
                 "prompt_preprocessing", 
                 "request_logging",
                 "ai_agent_integration",
                 "openai_support",
                 "copilot_simulation"
             ],
+            "stage_timings": stage_stats.summary(),
+            "write_behind": {
+                "logger": coai_logger.writer.get_stats(),
+                "usage_tracker": usage_tracker.writer.get_stats()
+            },
+            "caches": {
+                "file_content": content_cache.get_stats(),
+                "responses": response_cache.get_stats(),
+                "near_duplicates": near_duplicate_cache.get_stats()
+            },
+            "coalescing": single_flight.get_stats(),
+            "admission": admission_controller.get_stats(),
             "next_features": [
                 "file_system_access",
                 "project_management",
@@ -3,10 +3,19 @@ COAI Prompt Preprocessor Module
 Handles prompt preparation and enhancement for AI agents
 """
 
+import hashlib
+import json
 import logging
+import os
 from datetime import datetime
-from typing import Dict, Any
+from typing import Dict, Any, List, Optional
+from .context_packer import Section, PackedPrompt, context_packer, prompt_token_budget
 from .file_context_manager import file_context_manager
+from .import_graph import related_files
+from .retrieval import snippet_retriever
+from .symbol_index import symbol_search
+from .stage_timer import span
+from .usage_tracker import estimate_cost
 
 logger = logging.getLogger(__name__)
 
@@ -21,6 +30,17 @@ class PromptPreprocessor:
             "language": "English",
             "response_format": "Clear and helpful"
         }
+        # Most tokens each optional prompt section may take
+        self.section_budgets = {
+            "user_message": int(os.getenv('PROMPT_MESSAGE_TOKENS', '4000')),
+            "rules": int(os.getenv('PROMPT_RULES_TOKENS', '500')),
+            "current_file": int(os.getenv('PROMPT_CURRENT_FILE_TOKENS', '1500')),
+            "related_files": int(os.getenv('PROMPT_RELATED_FILES_TOKENS', '800')),
+            "definitions": int(os.getenv('PROMPT_DEFINITIONS_TOKENS', '1500')),
+            "snippets": snippet_retriever.token_budget,
+            "file_tree": int(os.getenv('PROMPT_FILE_TREE_TOKENS', '1200')),
+            "history": int(os.getenv('PROMPT_HISTORY_TOKENS', '1000'))
+        }
     
     def process_prompt(self, message: str, context: Dict[str, Any]) -> Dict[str, Any]:
         """
@@ -43,7 +63,14 @@ class PromptPreprocessor:
             file = context.get("file", "unknown")
             
             # Build enhanced prompt
-            enhanced_prompt = self._build_prompt(message, context)
+            snippets = self._retrieve_snippets(message, project)
+            definitions = self._find_definitions(message, project)
+            current = self._find_related_files(file, project)
+            packed = self._build_prompt(message, context, snippets, definitions, current)
+            enhanced_prompt = packed.text
+            snippets = [snippets[position] for position in packed.sections["snippets"]["kept"]]
+            definitions = [definitions[position] for position in packed.sections["definitions"]["kept"]]
+            related = [current["related"][position] for position in packed.sections["related_files"]["kept"]] if current else []
             
             # Prepare metadata
             metadata = {
@@ -52,7 +79,24 @@ class PromptPreprocessor:
                 "file": file,
                 "processed_at": datetime.now().isoformat(),
                 "prompt_length": len(enhanced_prompt),
-                "language": self._detect_language(message)
+                "prompt_tokens": packed.total_tokens,
+                "token_counts": packed.token_counts(),
+                "estimated_cost": self._estimate_cost(packed.total_tokens),
+                "language": self._detect_language(message),
+                "snippets": [
+                    {key: snippet[key] for key in ("path", "start_line", "end_line", "score", "tokens")}
+                    for snippet in snippets
+                ],
+                "symbols": [
+                    {key: definition[key] for key in ("qualified_name", "kind", "path", "line")}
+                    for definition in definitions
+                ],
+                "context_fingerprint": self._context_fingerprint(context, current, snippets, definitions),
+                "current_file": current["path"] if current and packed.sections["current_file"]["items"] else None,
+                "related_files": [
+                    {key: item[key] for key in ("path", "relation", "distance")}
+                    for item in related
+                ]
             }
             
             logger.info(f"Processed prompt for project: {project}, file: {file}")
@@ -68,51 +112,157 @@ class PromptPreprocessor:
             logger.error(f"Error processing prompt: {str(e)}")
             raise
     
-    def _build_prompt(self, message: str, context: Dict[str, Any]) -> str:
+    def _retrieve_snippets(self, message: str, project: str) -> List[Dict[str, Any]]:
+        """
+        Code snippets relevant to the message, within the retrieval token budget
+        
+        Retrieval only enriches the prompt, so a failure is logged and skipped.
+        """
+        try:
+            with span("retrieval"):
+                return snippet_retriever.retrieve(message, project)
+        except Exception as e:
+            logger.warning(f"Snippet retrieval failed for project {project}: {e}")
+            return []
+    
+    def _find_definitions(self, message: str, project: str) -> List[Dict[str, Any]]:
+        """Source of the symbols named in the message; failures are logged and skipped"""
+        try:
+            with span("symbols"):
+                return symbol_search.definitions_for_message(message, project)
+        except Exception as e:
+            logger.warning(f"Symbol lookup failed for project {project}: {e}")
+            return []
+    
+    def _find_related_files(self, file: str, project: str) -> Optional[Dict[str, Any]]:
+        """The current file and its import neighbours; failures are logged and skipped"""
+        try:
+            with span("imports"):
+                return related_files.context_for(file, project)
+        except Exception as e:
+            logger.warning(f"Import graph lookup failed for {file} in project {project}: {e}")
+            return None
+    
+    def _context_fingerprint(
+        self,
+        context: Dict[str, Any],
+        current: Optional[Dict[str, Any]],
+        snippets: List[Dict[str, Any]] = None,
+        definitions: List[Dict[str, Any]] = None
+    ) -> str:
+        """
+        Hash of the prompt inputs other than the message itself: project, file
+        and its current text, rules, conversation history, and the path and
+        content hash of every snippet and definition sent with the prompt.
+        Rephrasings of a question share cached replies only within one
+        fingerprint, so a reply about code that has since changed is not reused.
+        """
+        def sources(items):
+            return sorted(
+                (item["path"], item.get("line", item.get("start_line")),
+                 hashlib.sha256(item.get("text", "").encode('utf-8')).hexdigest()[:16])
+                for item in items or []
+            )
+        
+        inputs = [
+            context.get("project"),
+            context.get("file"),
+            current["text"] if current else None,
+            context.get("global_rules", []),
+            context.get("agent_rules", {}),
+            context.get("history", []),
+            sources(snippets),
+            sources(definitions),
+        ]
+        return hashlib.sha256(json.dumps(inputs, sort_keys=True, default=str).encode('utf-8')).hexdigest()[:16]
+    
+    def _build_prompt(
+        self,
+        message: str,
+        context: Dict[str, Any],
+        snippets: List[Dict[str, Any]] = None,
+        definitions: List[Dict[str, Any]] = None,
+        current: Dict[str, Any] = None
+    ) -> PackedPrompt:
         """
-        Build enhanced prompt with context and file information when needed
+        Build enhanced prompt with context, rules, file information, the
+        current file and its imports, symbol definitions, code snippets and
+        history, packed into the prompt token budget
+        
+        The fixed framing and the user's message are packed first, then rules,
+        the current file and definitions, related files and snippets, the file
+        tree and history, each within its own section budget. The current file
+        is cut down rather than dropped when it does not fit.
         """
         project = context.get("project", "unknown")
         file = context.get("file", "unknown")
+        budgets = self.section_budgets
         
-        prompt_parts = [
-            "=== COAI System Context ===",
-            f"Project: {project}",
-            f"Current File: {file}",
-            f"Timestamp: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}",
-            "",
-        ]
+        rules = list(context.get("global_rules", [])) + list(context.get("agent_rules", {}).get("openai", []))
         
-        # Check if this request needs file context
+        file_context_lines = []
         if file_context_manager.should_include_file_context(message):
             logger.info(f"Including file context for project: {project}")
-            file_data = file_context_manager.get_project_file_listing(project)
-            file_context_text = file_context_manager.format_file_context_for_ai(file_data)
-            
-            prompt_parts.extend([
-                "=== PROJECT FILE INFORMATION ===",
-                file_context_text,
-                "",
-            ])
+            with span("file_context"):
+                file_data = file_context_manager.get_project_file_listing(project)
+                file_context_lines = file_context_manager.format_file_context_for_ai(file_data).split("\n")
         
-        prompt_parts.extend([
-            "=== System Instructions ===",
-            self.default_context["system_role"],
-            "Please respond in English with clear, actionable advice.",
-            "If this involves code, provide specific examples.",
-            "If asked about project files, use the file structure information provided above.",
-            "",
-            "=== User Query ===",
-            message,
-            "",
-            "=== Response Guidelines ===",
-            "- Be concise but thorough",
-            "- Include code examples when relevant", 
-            "- Consider the project context and file structure",
-            "- Provide actionable next steps"
-        ])
+        history = []
+        for turn in context.get("history", [])[-20:]:
+            speaker = "User" if turn.get("role") == "user" else "Assistant"
+            history.append(f"{speaker}: {turn.get('content', '')}")
         
-        return "\n".join(prompt_parts)
+        sections = [
+            Section("system_context", priority=0, header="=== COAI System Context ===", items=[
+                f"Project: {project}",
+                f"Current File: {file}",
+                f"Timestamp: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}",
+            ]),
+            Section("rules", priority=2, budget=budgets["rules"],
+                    header="=== Project Rules ===", items=[f"- {rule}" for rule in rules]),
+            Section("file_tree", priority=5, budget=budgets["file_tree"],
+                    header="=== PROJECT FILE INFORMATION ===", items=file_context_lines),
+            Section("current_file", priority=3, budget=budgets["current_file"], required=True,
+                    header="=== CURRENT FILE ===",
+                    items=[related_files.format_current_file_for_ai(current)] if current and current["text"] else []),
+            Section("related_files", priority=4, budget=budgets["related_files"], fit="greedy",
+                    header="=== RELATED FILES (imports) ===",
+                    items=[related_files.format_related_file_for_ai(item) for item in (current or {}).get("related", [])]),
+            Section("definitions", priority=3, budget=budgets["definitions"], fit="greedy",
+                    header="=== SYMBOL DEFINITIONS ===",
+                    items=[symbol_search.format_definition_for_ai(definition) for definition in definitions or []]),
+            Section("snippets", priority=4, budget=budgets["snippets"], fit="greedy",
+                    header="=== RELEVANT CODE SNIPPETS ===",
+                    items=[snippet_retriever.format_snippets_for_ai([snippet]) for snippet in snippets or []]),
+            Section("history", priority=6, budget=budgets["history"], keep="tail",
+                    header="=== Conversation So Far ===", items=history),
+            Section("instructions", priority=0, header="=== System Instructions ===", items=[
+                self.default_context["system_role"],
+                "Please respond in English with clear, actionable advice.",
+                "If this involves code, provide specific examples.",
+                "If asked about project files, use the file structure information provided above.",
+                "Base answers about existing code on the current file, definitions and snippets provided above, citing their paths.",
+            ]),
+            Section("user_message", priority=1, budget=budgets["user_message"], required=True,
+                    header="=== User Query ===", items=[message]),
+            Section("guidelines", priority=0, header="=== Response Guidelines ===", items=[
+                "- Be concise but thorough",
+                "- Include code examples when relevant",
+                "- Consider the project context and file structure",
+                "- Provide actionable next steps"
+            ]),
+        ]
+        
+        packed = context_packer.pack(sections, prompt_token_budget())
+        if packed.truncated_sections:
+            logger.info(f"Prompt sections truncated to fit {packed.budget} tokens: {packed.truncated_sections}")
+        return packed
+    
+    def _estimate_cost(self, prompt_tokens: int) -> float:
+        """Upper bound on the request's cost: the prompt plus a full-length completion"""
+        model = os.getenv('OPENAI_MODEL', 'gpt-3.5-turbo')
+        max_completion_tokens = int(os.getenv('OPENAI_MAX_TOKENS', '2000'))
+        return round(estimate_cost(model, prompt_tokens, max_completion_tokens), 6)
     
     def _detect_language(self, message: str) -> str:
         """
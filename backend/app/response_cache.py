@@ -0,0 +1,253 @@
+"""
+COAI Response Cache
+Exact-match cache of AI agent replies, so a question already answered for
+the same prompt, model settings and rules does not pay for another round trip
+"""
+
+import hashlib
+import json
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, Optional, Tuple
+from .usage_tracker import estimate_cost
+
+logger = logging.getLogger(__name__)
+
+# Bump to orphan every stored entry when the key or payload format changes
+KEY_VERSION = 1
+
+# Lines of the enhanced prompt that change on every request without changing its meaning
+VOLATILE_LINES = re.compile(r'^Timestamp: .*(?:\n|$)', re.M)
+_TRAILING_SPACE = re.compile(r'[ \t]+$', re.M)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS responses (
+    key TEXT PRIMARY KEY,
+    model TEXT,
+    payload TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    expires_at REAL NOT NULL,
+    hits INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS idx_responses_expires ON responses (expires_at);
+"""
+
+
+def normalize_prompt(prompt: str) -> str:
+    """Prompt text with volatile lines, trailing spaces and line ending differences removed"""
+    prompt = prompt.replace('\r\n', '\n')
+    prompt = VOLATILE_LINES.sub('', prompt)
+    return _TRAILING_SPACE.sub('', prompt).strip()
+
+
+def rules_hash(context: Dict[str, Any]) -> str:
+    """Hash of the global and per-agent rules injected into a request's context"""
+    rules = {
+        "global": list(context.get("global_rules", [])),
+        "agents": context.get("agent_rules", {})
+    }
+    return hashlib.sha256(json.dumps(rules, sort_keys=True).encode('utf-8')).hexdigest()[:16]
+
+
+def cache_key(prompt: str, model: str, temperature: float, max_tokens: int, rules_version: str) -> str:
+    parts = [KEY_VERSION, normalize_prompt(prompt), model, round(float(temperature), 3), max_tokens, rules_version]
+    return hashlib.sha256(json.dumps(parts).encode('utf-8')).hexdigest()
+
+
+class ResponseCache:
+    """
+    Two-tier reply cache: an in-memory LRU in front of a SQLite table
+
+    Entries expire `ttl` seconds after they were stored. The SQLite tier
+    survives restarts and is shared by worker processes (WAL mode, one
+    connection per thread as in the usage store); the memory tier saves the
+    query on hot keys. Only successful replies from the real model are
+    stored, by the agent manager.
+    """
+
+    def __init__(self, db_path: str = None, max_memory_entries: int = None, ttl: float = None):
+        self.enabled = os.getenv('RESPONSE_CACHE_ENABLED', 'true').lower() == 'true'
+        self.ttl = ttl if ttl is not None else float(os.getenv('RESPONSE_CACHE_TTL_SECONDS', str(24 * 3600)))
+        self.max_memory_entries = max_memory_entries or int(os.getenv('RESPONSE_CACHE_MEMORY_ENTRIES', '256'))
+        self.db_path = str(db_path or os.getenv('RESPONSE_CACHE_PATH') or
+                           Path(__file__).parent.parent / '.coai' / 'cache' / 'responses.db')
+        self.lock = threading.Lock()
+        self.memory: "OrderedDict[str, Tuple[float, Dict[str, Any]]]" = OrderedDict()
+        self._local = threading.local()
+        self.stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "stores": 0, "bypassed": 0,
+                      "tokens_saved": 0, "cost_saved": 0.0}
+        self._schema_ready = False
+
+    def _connect(self) -> Optional[sqlite3.Connection]:
+        """This thread's connection, opened (and the schema created) on first use; None if unavailable"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None or getattr(self._local, "pid", None) != os.getpid():
+            try:
+                os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
+                conn = sqlite3.connect(self.db_path, timeout=5)
+                conn.execute("PRAGMA journal_mode=WAL")
+                conn.execute("PRAGMA synchronous=NORMAL")
+                if not self._schema_ready:
+                    conn.executescript(SCHEMA)
+                    conn.commit()
+                    self._schema_ready = True
+            except sqlite3.Error as e:
+                logger.warning(f"Response cache database unavailable ({self.db_path}): {e}")
+                return None
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def key_for(self, request: Dict[str, Any], model: str, temperature: float, max_tokens: int) -> Optional[str]:
+        """
+        Cache key of an agent request, or None if the request opted out
+
+        A request opts out with context["cache"] = False (the chat endpoints'
+        "cache": false); the whole cache with RESPONSE_CACHE_ENABLED=false.
+        """
+        context = request.get("context", {})
+        if not self.enabled or context.get("cache") is False:
+            with self.lock:
+                self.stats["bypassed"] += 1
+            return None
+        return cache_key(request.get("message", ""), model, temperature, max_tokens, rules_hash(context))
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """Stored reply payload for a key, or None if missing or expired"""
+        now = time.time()
+        with self.lock:
+            entry = self.memory.get(key)
+            if entry is not None:
+                if entry[0] > now:
+                    self.memory.move_to_end(key)
+                    self._count_hit("memory_hits", entry[1])
+                    return dict(entry[1])
+                del self.memory[key]
+
+        conn = self._connect()
+        row = None
+        if conn is not None:
+            try:
+                row = conn.execute(
+                    "SELECT payload, expires_at FROM responses WHERE key = ? AND expires_at > ?", (key, now)
+                ).fetchone()
+                if row is not None:
+                    with conn:
+                        conn.execute("UPDATE responses SET hits = hits + 1 WHERE key = ?", (key,))
+            except sqlite3.Error as e:
+                logger.warning(f"Response cache lookup failed: {e}")
+                row = None
+
+        with self.lock:
+            if row is None:
+                self.stats["misses"] += 1
+                return None
+            payload = json.loads(row[0])
+            self._remember(key, row[1], payload)
+            self._count_hit("disk_hits", payload)
+            return dict(payload)
+
+    def put(self, key: str, payload: Dict[str, Any]):
+        """Store a reply payload ({"response", "usage", "model", ...}) for `ttl` seconds"""
+        now = time.time()
+        expires_at = now + self.ttl
+        with self.lock:
+            self._remember(key, expires_at, payload)
+            self.stats["stores"] += 1
+        conn = self._connect()
+        if conn is None:
+            return
+        try:
+            with conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO responses (key, model, payload, created_at, expires_at, hits) "
+                    "VALUES (?, ?, ?, ?, ?, 0)",
+                    (key, payload.get("model"), json.dumps(payload), now, expires_at)
+                )
+        except sqlite3.Error as e:
+            logger.warning(f"Response cache store failed: {e}")
+
+    def _remember(self, key: str, expires_at: float, payload: Dict[str, Any]):
+        """Insert into the memory tier; the caller holds the lock"""
+        self.memory[key] = (expires_at, payload)
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.max_memory_entries:
+            self.memory.popitem(last=False)
+
+    def _count_hit(self, tier: str, payload: Dict[str, Any]):
+        usage = payload.get("usage", {})
+        self.stats[tier] += 1
+        self.stats["tokens_saved"] += usage.get("total_tokens", 0)
+        self.stats["cost_saved"] += estimate_cost(
+            usage.get("model", payload.get("model", "")), usage.get("prompt_tokens", 0), usage.get("completion_tokens", 0)
+        )
+
+    def purge_expired(self) -> int:
+        """Delete expired rows; returns how many were removed"""
+        now = time.time()
+        with self.lock:
+            for key in [key for key, (expires_at, _) in self.memory.items() if expires_at <= now]:
+                del self.memory[key]
+        conn = self._connect()
+        if conn is None:
+            return 0
+        with conn:
+            return conn.execute("DELETE FROM responses WHERE expires_at <= ?", (now,)).rowcount
+
+    def clear(self):
+        with self.lock:
+            self.memory.clear()
+        conn = self._connect()
+        if conn is not None:
+            with conn:
+                conn.execute("DELETE FROM responses")
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self.lock:
+            stats = dict(self.stats)
+            stats["memory_entries"] = len(self.memory)
+        hits = stats["memory_hits"] + stats["disk_hits"]
+        lookups = hits + stats["misses"]
+        stats["hit_rate"] = round(hits / lookups, 3) if lookups else 0.0
+        stats["cost_saved"] = round(stats["cost_saved"], 6)
+        stats["enabled"] = self.enabled
+        stats["ttl_seconds"] = self.ttl
+        return stats
+
+    def cached_result(self, payload: Dict[str, Any], agent_type: str) -> Dict[str, Any]:
+        """An agent result served from the cache; its usage is zero since no tokens were spent"""
+        return {
+            "status": "success",
+            "agent_type": agent_type,
+            "response": payload["response"],
+            "timestamp": datetime.now().isoformat(),
+            "cached_at": payload.get("timestamp"),
+            "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0, "model": payload.get("model")},
+            "model": payload.get("model"),
+            "real_ai": True,
+            "cached": True,
+            "cached_usage": payload.get("usage", {})
+        }
+
+    @staticmethod
+    def payload_for(result: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """What to store for an agent result; None for errors and mock replies"""
+        if result.get("status") != "success" or not result.get("real_ai") or result.get("cached"):
+            return None
+        return {
+            "response": result.get("response", ""),
+            "usage": result.get("usage", {}),
+            "model": result.get("model"),
+            "timestamp": result.get("timestamp")
+        }
+
+
+# Global instance
+response_cache = ResponseCache()
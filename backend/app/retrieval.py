@@ -0,0 +1,322 @@
+"""
+COAI Snippet Retrieval
+BM25 ranking over line chunks of project files, used to ground prompts in
+the code relevant to the user's message
+"""
+
+import logging
+import math
+import os
+import re
+import threading
+import time
+from collections import Counter
+from typing import Any, Dict, FrozenSet, Iterable, List, NamedTuple, Optional, Tuple
+from .content_cache import content_cache
+from .file_context_manager import file_context_manager
+from .file_watcher import file_watcher, is_tree_change
+from .tokenizer import count_tokens
+
+logger = logging.getLogger(__name__)
+
+CHUNK_LINES = 40
+K1 = 1.2
+B = 0.75
+
+_WORD_RE = re.compile(r'[A-Za-z_][A-Za-z0-9_]*|\d+')
+_CAMEL_RE = re.compile(r'[A-Z]+(?![a-z])|[A-Z]?[a-z]+|\d+')
+
+STOPWORDS = frozenset("""
+    a an and are as at be but by can do does for from how i if in into is it its
+    me my no not of on or our so that the their then there these this to was we
+    what when where which who why will with you your self none true false return
+""".split())
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    Lower-cased search terms: each identifier plus its snake_case and
+    camelCase parts, so "getUserName" also matches "user" and "name"
+    """
+    terms = []
+    for word in _WORD_RE.findall(text):
+        lowered = word.lower()
+        if lowered not in STOPWORDS and len(lowered) > 1:
+            terms.append(lowered)
+        parts = [part.lower() for piece in word.split('_') for part in _CAMEL_RE.findall(piece)]
+        if len(parts) > 1:
+            terms.extend(part for part in parts if len(part) > 1 and part not in STOPWORDS)
+    return terms
+
+
+class IndexedFile(NamedTuple):
+    mtime_ns: int
+    size: int
+    line_count: int
+    chunk_lengths: List[int]
+    terms: FrozenSet[str]
+
+
+class Bm25Index:
+    """
+    In-memory BM25 index over fixed-size line chunks of one project root
+
+    Files come from the workspace index and are re-chunked when their
+    (mtime_ns, size) changes, or sooner when reported through mark_dirty().
+    While the file watcher reports changes under the root, the full re-check
+    runs only every FILE_WATCHER_REVALIDATE_SECONDS. Chunk text is not kept;
+    snippets are read back from disk when retrieved.
+    """
+
+    def __init__(self, root: str, max_file_bytes: int = None, revalidate_interval: float = None):
+        self.root = os.path.abspath(root)
+        self.max_file_bytes = max_file_bytes or file_context_manager.max_file_size
+        if revalidate_interval is None:
+            revalidate_interval = float(os.getenv('RETRIEVAL_REVALIDATE_SECONDS', '10'))
+        self.revalidate_interval = revalidate_interval
+        self.lock = threading.RLock()
+        self.ready = threading.Event()  # Set once the first build has completed
+        self.warmer: Optional[threading.Thread] = None
+
+        self.files: Dict[str, IndexedFile] = {}
+        # term -> {(rel_path, chunk_no): term frequency}
+        self.postings: Dict[str, Dict[Tuple[str, int], int]] = {}
+        self.chunk_count = 0
+        self.total_length = 0
+        self.validated_at = 0.0
+        self.dirty_paths = set()
+
+    # --- Indexing ---
+
+    def _read(self, rel_path: str, store: bool = True):
+        """Cached content of a file; None if missing, too large or binary"""
+        content = content_cache.get(os.path.join(self.root, rel_path), max_size=self.max_file_bytes, store=store)
+        return None if content is None or content.binary else content
+
+    def _remove(self, rel_path: str):
+        entry = self.files.pop(rel_path, None)
+        if entry is None:
+            return
+        self.chunk_count -= len(entry.chunk_lengths)
+        self.total_length -= sum(entry.chunk_lengths)
+        for term in entry.terms:
+            chunks = self.postings[term]
+            for chunk_no in range(len(entry.chunk_lengths)):
+                chunks.pop((rel_path, chunk_no), None)
+            if not chunks:
+                del self.postings[term]
+
+    def _add(self, rel_path: str, mtime_ns: int, size: int):
+        # Indexing reads every file once, so it must not push hot files out of the cache
+        content = self._read(rel_path, store=False)
+        lines = content.splitlines() if content else []
+        # The path's own terms count in every chunk, so "routes" finds routes.py
+        path_terms = tokenize(rel_path.replace(os.sep, ' '))
+        lengths = []
+        terms_seen = set()
+        for chunk_no, start in enumerate(range(0, max(len(lines), 1), CHUNK_LINES)):
+            terms = Counter(tokenize('\n'.join(lines[start:start + CHUNK_LINES])))
+            terms.update(path_terms)
+            for term, frequency in terms.items():
+                self.postings.setdefault(term, {})[(rel_path, chunk_no)] = frequency
+            terms_seen.update(terms)
+            length = sum(terms.values())
+            lengths.append(length)
+            self.chunk_count += 1
+            self.total_length += length
+        self.files[rel_path] = IndexedFile(mtime_ns, size, len(lines), lengths, frozenset(terms_seen))
+
+    def _update(self, rel_path: str) -> bool:
+        try:
+            stat = os.stat(os.path.join(self.root, rel_path))
+        except OSError:
+            if rel_path in self.files:
+                self._remove(rel_path)
+                return True
+            return False
+        entry = self.files.get(rel_path)
+        if entry and (entry.mtime_ns, entry.size) == (stat.st_mtime_ns, stat.st_size):
+            return False
+        self._remove(rel_path)
+        self._add(rel_path, stat.st_mtime_ns, stat.st_size)
+        return True
+
+    def refresh(self, force: bool = False) -> int:
+        """
+        Bring the index up to date with the project files
+
+        Returns:
+            Number of files added, re-chunked or removed
+        """
+        with self.lock:
+            interval = file_watcher.revalidate_interval(self.root, self.revalidate_interval)
+            if force or not self.files or time.monotonic() - self.validated_at >= interval:
+                workspace = file_context_manager.get_workspace_index(self.root)
+                paths = set(self.files)
+                for rel_dir, record in list(workspace.dirs.items()):
+                    prefix = '' if rel_dir == '.' else rel_dir + os.sep
+                    paths.update(prefix + name for name in record["files"])
+                self.validated_at = time.monotonic()
+            else:
+                paths = self.dirty_paths
+            self.dirty_paths = set()
+            changed = sum(self._update(rel_path) for rel_path in paths)
+            self.ready.set()
+            return changed
+
+    def warm(self) -> threading.Thread:
+        """Refresh on a background thread (the running one if a warm-up is under way)"""
+        with self.lock:
+            if self.warmer is None or not self.warmer.is_alive():
+                self.warmer = threading.Thread(target=self._warm, name='coai-retrieval-warm', daemon=True)
+                self.warmer.start()
+            return self.warmer
+
+    def _warm(self):
+        try:
+            self.refresh()
+        except Exception:
+            logger.exception("Retrieval index warm-up failed for %s", self.root)
+
+    def mark_dirty(self, paths: Iterable[str]):
+        """Queue absolute paths (e.g. from the file watcher) for the next refresh"""
+        prefix = self.root + os.sep
+        extensions = file_context_manager.allowed_extensions
+        with self.lock:
+            for path in paths:
+                if path.startswith(prefix) and os.path.splitext(path)[1].lower() in extensions:
+                    self.dirty_paths.add(os.path.relpath(path, self.root))
+                elif is_tree_change(self.root, path):
+                    self.validated_at = 0.0
+
+    # --- Querying ---
+
+    def search(self, query: str, top_k: int = 8) -> List[Dict[str, Any]]:
+        """
+        Top-k chunks by BM25 score for the query terms
+
+        Returns:
+            [{"path", "chunk", "start_line", "end_line", "score"}, ...]
+        """
+        self.refresh()
+        terms = set(tokenize(query))
+        scores: Dict[Tuple[str, int], float] = {}
+        with self.lock:
+            if not self.chunk_count:
+                return []
+            average_length = self.total_length / self.chunk_count
+            for term in terms:
+                chunks = self.postings.get(term)
+                if not chunks:
+                    continue
+                idf = math.log(1 + (self.chunk_count - len(chunks) + 0.5) / (len(chunks) + 0.5))
+                for key, frequency in chunks.items():
+                    length = self.files[key[0]].chunk_lengths[key[1]]
+                    norm = K1 * (1 - B + B * length / average_length)
+                    scores[key] = scores.get(key, 0.0) + idf * frequency * (K1 + 1) / (frequency + norm)
+
+            ranked = sorted(scores.items(), key=lambda item: (-item[1], item[0]))[:top_k]
+            return [{
+                "path": rel_path.replace(os.sep, '/'),
+                "chunk": chunk_no,
+                "start_line": chunk_no * CHUNK_LINES + 1,
+                "end_line": min((chunk_no + 1) * CHUNK_LINES, self.files[rel_path].line_count),
+                "score": round(score, 3)
+            } for (rel_path, chunk_no), score in ranked]
+
+    def read_snippet(self, hit: Dict[str, Any]) -> Optional[str]:
+        """Current text of a retrieved chunk; None if the file is gone"""
+        content = self._read(hit["path"].replace('/', os.sep))
+        if content is None:
+            return None
+        return content.lines(hit["start_line"], hit["end_line"]).strip('\n')
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "root": self.root,
+            "files": len(self.files),
+            "chunks": self.chunk_count,
+            "terms": len(self.postings)
+        }
+
+
+class SnippetRetriever:
+    """Retrieves code snippets for a message and packs them under a token budget"""
+
+    def __init__(self):
+        self.enabled = os.getenv('RETRIEVAL_ENABLED', 'true').lower() == 'true'
+        self.top_k = int(os.getenv('RETRIEVAL_TOP_K', '8'))
+        self.token_budget = int(os.getenv('RETRIEVAL_TOKEN_BUDGET', '1500'))
+        self.min_score = float(os.getenv('RETRIEVAL_MIN_SCORE', '2.0'))
+        self.lock = threading.Lock()
+        self.indexes: Dict[str, Bm25Index] = {}
+
+    def get_index(self, project: str = None) -> Bm25Index:
+        root = os.path.abspath(file_context_manager.resolve_project_path(project))
+        with self.lock:
+            index = self.indexes.get(root)
+            if index is None:
+                index = self.indexes[root] = Bm25Index(root)
+            return index
+
+    def retrieve(self, message: str, project: str = None, token_budget: int = None) -> List[Dict[str, Any]]:
+        """
+        Best-scoring snippets for the message that fit in `token_budget`
+
+        Hits are taken greedily in score order; a hit that does not fit in what
+        is left of the budget is skipped so a smaller one further down can
+        still be used. Each returned hit carries its "text" and "tokens".
+        Nothing is returned until the project's index has been built; the
+        build is started in the background instead of holding up the chat.
+        """
+        if not self.enabled:
+            return []
+        budget = self.token_budget if token_budget is None else token_budget
+        index = self.get_index(project)
+        if not index.ready.is_set():
+            index.warm()
+            return []
+
+        snippets = []
+        for hit in index.search(message, top_k=self.top_k):
+            if hit["score"] < self.min_score or budget <= 0:
+                break
+            text = index.read_snippet(hit)
+            if not text:
+                continue
+            snippet = {**hit, "text": text}
+            snippet["tokens"] = count_tokens(self.format_snippets_for_ai([snippet]))
+            if snippet["tokens"] > budget:
+                continue
+            budget -= snippet["tokens"]
+            snippets.append(snippet)
+        return snippets
+
+    def warm(self, project: str = None) -> Optional[threading.Thread]:
+        """Build a project's index in the background, e.g. at server startup"""
+        if not self.enabled:
+            return None
+        return self.get_index(project).warm()
+
+    def format_snippets_for_ai(self, snippets: List[Dict[str, Any]]) -> str:
+        """Format retrieved snippets for the enhanced prompt"""
+        parts = []
+        for snippet in snippets:
+            parts.extend([
+                f"--- {snippet['path']} (lines {snippet['start_line']}-{snippet['end_line']}) ---",
+                snippet["text"],
+                "",
+            ])
+        return "\n".join(parts).rstrip("\n")
+
+    def invalidate_paths(self, paths: Iterable[str]):
+        """Route changed absolute paths to every index that covers them"""
+        paths = list(paths)
+        with self.lock:
+            indexes = list(self.indexes.values())
+        for index in indexes:
+            index.mark_dirty(paths)
+
+
+# Global instance
+snippet_retriever = SnippetRetriever()
@@ -1,7 +1,9 @@
-from flask import Blueprint, jsonify, request, abort, send_file
+from flask import Blueprint, Response, jsonify, request, abort, stream_with_context
 import os
+import json
 import logging
-from datetime import datetime
+import queue
+from datetime import datetime, timedelta
 from dotenv import load_dotenv
 
 # Load environment variables
@@ -65,7 +67,7 @@ except Exception as e:
     logger.info("Falling back to Orchestrator Stub")
     
     class OrchestratorStub:
-        def process_chat_request(self, message, context):
+        def process_chat_request(self, message, context, timer=None):
             if len(message) > 10000:
                 return {
                     "error": "Message too long (max 10000 characters)",
@@ -81,6 +83,14 @@ except Exception as e:
                 "error": False,
                 "debug": {"stub": True}
             }
+        def stream_chat_request(self, message, context, timer=None):
+            response = self.process_chat_request(message, context, timer)
+            if response.get("error"):
+                yield {"type": "error", **response}
+                return
+            yield {"type": "start", "request_id": response["request_id"]}
+            yield {"type": "token", "content": response["reply"]}
+            yield {"type": "done", **response}
         def get_orchestrator_status(self):
             return {
                 "orchestrator_status": "stub",
@@ -89,20 +99,92 @@ except Exception as e:
                 "capabilities": ["chat_request_processing", "prompt_preprocessing", "request_logging", "ai_agent_integration"]
             }
     orchestrator = OrchestratorStub()
-class CoaiLoggerStub:
-    def get_chat_history(self, limit):
-        return []
-coai_logger = CoaiLoggerStub()
+from app.logger import coai_logger
 
-from app.rules_loader import load_agent_rules, RULES_PATH
+from app.rules_loader import load_agent_rules, RULES_PATH, GLOBAL_RULES_PATH
 from app.error_handler import (
     handle_api_errors, validate_chat_request, create_error_response,
-    AIAgentError, ValidationError, log_error
+    AIAgentError, ValidationError, OverloadedError, log_error
 )
+from app.stage_timer import StageTimer, stage_stats
+from app.admission_control import admission_controller
 import threading
 rules_lock = threading.Lock()
 current_agent_rules = load_agent_rules()
 
+# --- File watcher: keeps file index, rules and plan caches in step with the disk ---
+from app.file_context_manager import file_context_manager
+from app.file_watcher import file_watcher, TreeDeltaBroadcaster
+from app.code_search import code_search, SearchIndexBuildingError, SearchQueryError
+from app.retrieval import snippet_retriever
+from app.symbol_index import symbol_search
+from app.content_cache import content_cache
+from app.multi_project_manager import PROJECTS_DIR
+
+# Root browsed by /api/files/list and streamed by /api/files/watch
+FILES_BASE_DIR = os.path.abspath("C:/ai_projects")
+PLANS_DIR = os.path.abspath(action_planner.storage_path)
+
+for watch_root in (file_context_manager.workspace_root, GLOBAL_RULES_PATH, PLANS_DIR,
+                   FILES_BASE_DIR, os.path.abspath(PROJECTS_DIR)):
+    file_watcher.add_root(watch_root)
+
+project_tree_deltas = TreeDeltaBroadcaster(file_watcher, FILES_BASE_DIR)
+
+def _on_file_changes(changes):
+    """Invalidate whatever a debounced batch of file changes made stale"""
+    global current_agent_rules
+    changed_paths = [change.path for change in changes]
+    file_context_manager.invalidate_paths(changed_paths)
+    content_cache.invalidate_paths(changed_paths)
+    code_search.invalidate_paths(changed_paths)
+    snippet_retriever.invalidate_paths(changed_paths)
+    symbol_search.invalidate_paths(changed_paths)
+    
+    rules_changed = False
+    for change in changes:
+        if change.path == RULES_PATH or (change.kind == "rescan" and change.root == GLOBAL_RULES_PATH):
+            rules_changed = True
+        elif change.kind == "rescan" and change.root == PLANS_DIR:
+            action_planner.invalidate()
+        elif os.path.dirname(change.path) == PLANS_DIR and change.path.endswith('.json'):
+            action_planner.invalidate(os.path.basename(change.path)[:-5])
+    
+    if rules_changed:
+        with rules_lock:
+            current_agent_rules = load_agent_rules()
+        logger.info("Agent rules reloaded after file change.")
+
+file_watcher.subscribe(_on_file_changes)
+
+def warm_indexes():
+    """Build the default project's search indexes in the background, so no chat request pays for it"""
+    symbol_search.warm()
+    snippet_retriever.warm()
+    code_search.warm()
+
+def build_chat_context(data, endpoint, timer):
+    """Orchestrator context for a validated chat request body, with the current agent rules injected"""
+    message = data.get("message", "").strip()
+    context = {
+        "project": data.get("project", "demo-project"),
+        "file": data.get("file", "main.py"),
+        "timestamp": datetime.now().isoformat(),
+        "user_message": message,
+        "endpoint": endpoint,
+        "request_id": f"chat_{int(datetime.now().timestamp())}"
+    }
+    if data.get("history"):
+        context["history"] = data["history"]
+    if data.get("cache") is False:
+        context["cache"] = False  # Skip the response cache for this request
+    
+    # Inject current rules into context
+    with timer.span("rules_injection"), rules_lock:
+        context["global_rules"] = current_agent_rules.get('global', [])
+        context["agent_rules"] = current_agent_rules.get('agents', {})
+    return context
+
 # --- Main chat endpoint using orchestrator ---
 @bp.route("/api/chat", methods=["POST"])
 @rate_limit(limit=50, window=3600)  # 50 requests per hour
@@ -113,50 +195,38 @@ def chat():
     Main chat endpoint that uses the orchestrator for full request processing
     Enhanced with comprehensive error handling
     """
+    timer = StageTimer()
     data = request.get_json()
     
     # Validate request data
-    validate_chat_request(data)
+    with timer.span("validation"):
+        validate_chat_request(data)
     
     message = data.get("message", "").strip()
-    project = data.get("project", "demo-project")
-    file = data.get("file", "main.py")
-    
-    # Prepare context
-    context = {
-        "project": project,
-        "file": file,
-        "timestamp": datetime.now().isoformat(),
-        "user_message": message,
-        "endpoint": "/api/chat",
-        "request_id": f"chat_{int(datetime.now().timestamp())}"
-    }
+    context = build_chat_context(data, "/api/chat", timer)
     
     try:
         # Use orchestrator for full processing
-        logger.info(f"Processing chat request through orchestrator - Project: {project}, File: {file}")
-        
-        # Inject current rules into context
-        with rules_lock:
-            context["global_rules"] = current_agent_rules.get('global', [])
-            context["agent_rules"] = current_agent_rules.get('agents', {})
+        logger.info(f"Processing chat request through orchestrator - Project: {context['project']}, File: {context['file']}")
         
-        response = orchestrator.process_chat_request(message, context)
-        
-        # Check if orchestrator returned an error
-        if response.get("error"):
-            # Convert orchestrator error to AI agent error for consistent handling
-            raise AIAgentError(
-                response.get("message", "Orchestrator processing failed"),
-                agent_type=response.get("agent_type", "unknown")
-            )
+        # Waits for a slot, or raises OverloadedError (503 + Retry-After) when the server is saturated
+        with admission_controller.admit(timer):
+            response = orchestrator.process_chat_request(message, context, timer=timer)
+            
+            # Check if orchestrator returned an error
+            if response.get("error"):
+                # Convert orchestrator error to AI agent error for consistent handling
+                raise AIAgentError(
+                    response.get("message", "Orchestrator processing failed"),
+                    agent_type=response.get("agent_type", "unknown")
+                )
         
         # Log successful processing
         logger.info(f"Chat request {response.get('request_id')} completed successfully")
         
         return jsonify(response)
     
-    except (AIAgentError, ValidationError):
+    except (AIAgentError, ValidationError, OverloadedError):
         # These will be handled by the @handle_api_errors decorator
         raise
     except Exception as e:
@@ -165,7 +235,58 @@ def chat():
         raise AIAgentError(f"Unexpected error during chat processing: {str(e)}")
 
 
-    # --- Dynamic rules reload endpoint ---
+# --- Streaming chat endpoint (Server-Sent Events) ---
+@bp.route("/api/chat/stream", methods=["POST"])
+@rate_limit(limit=50, window=3600)  # Shares the chat budget
+@validate_security()
+@handle_api_errors
+def chat_stream():
+    """
+    Streaming chat endpoint - sends the reply token by token as Server-Sent Events
+    
+    Events: "start" (request_id), "token" (content), then "done" with the same
+    payload as /api/chat, or "error" if processing fails.
+    """
+    timer = StageTimer()
+    data = request.get_json()
+    
+    # Validate request data before the stream opens so errors keep their HTTP status
+    with timer.span("validation"):
+        validate_chat_request(data)
+    
+    message = data.get("message", "").strip()
+    context = build_chat_context(data, "/api/chat/stream", timer)
+    
+    logger.info(f"Streaming chat request through orchestrator - Project: {context['project']}, File: {context['file']}")
+    
+    # Admitted before the stream opens so a saturated server still answers 503 + Retry-After
+    slot = admission_controller.acquire(timer)
+    outcome = {"ok": True}
+    
+    def generate():
+        try:
+            for event in orchestrator.stream_chat_request(message, context, timer=timer):
+                if event["type"] == "error":
+                    outcome["ok"] = False
+                payload = json.dumps(event, ensure_ascii=False)
+                yield f"event: {event['type']}\ndata: {payload}\n\n"
+        except Exception:
+            outcome["ok"] = False
+            raise
+    
+    response = Response(
+        stream_with_context(generate()),
+        mimetype="text/event-stream",
+        headers={
+            "Cache-Control": "no-cache",
+            "X-Accel-Buffering": "no"  # Disable proxy buffering so tokens flush immediately
+        }
+    )
+    # The slot is held until the stream is closed, whether it finished or the client went away;
+    # a stream that failed counts as a failure so the limit backs off
+    response.call_on_close(lambda: slot.release(ok=outcome["ok"]))
+    return response
+
 
 # --- Dynamic rules reload endpoint ---
 @bp.route("/api/rules/reload", methods=["POST"])
@@ -204,7 +325,7 @@ def chat_history():
 @bp.route("/api/files/list", methods=["GET"])
 def list_files():
     """Return a tree structure of files and folders in C:\ai_projects, lazy loading by path param"""
-    base_dir = os.path.abspath("C:/ai_projects")
+    base_dir = FILES_BASE_DIR
     rel_path = request.args.get("path", "")
     abs_path = os.path.abspath(os.path.join(base_dir, rel_path))
     # Saugumo patikra: turi būti C:/ai_projects viduje
@@ -238,9 +359,97 @@ def list_files():
         return jsonify({"children": tree["children"]})
     else:
         return jsonify({"tree": tree})
+@bp.route("/api/files/watch", methods=["GET"])
+def watch_files():
+    """
+    Server-Sent Events stream of debounced tree deltas under C:/ai_projects
+    
+    Each "delta" event carries {"changes": [{change, path, parent, name, type}]}
+    with change "added", "removed", "modified" or "reset" (re-fetch the tree).
+    """
+    file_watcher.start()
+    client = project_tree_deltas.open()
+    
+    def generate():
+        try:
+            yield f"event: ready\ndata: {json.dumps(file_watcher.get_stats())}\n\n"
+            while True:
+                try:
+                    batch = client.get(timeout=15)
+                except queue.Empty:
+                    yield ": keep-alive\n\n"
+                    continue
+                yield f"event: delta\ndata: {json.dumps(batch, ensure_ascii=False)}\n\n"
+        finally:
+            project_tree_deltas.close(client)
+    
+    return Response(
+        stream_with_context(generate()),
+        mimetype="text/event-stream",
+        headers={
+            "Cache-Control": "no-cache",
+            "X-Accel-Buffering": "no"
+        }
+    )
+
+@bp.route("/api/search", methods=["GET"])
+@rate_limit(limit=300, window=3600)
+def search_code():
+    """Ranked full-text search over project files (trigram index, optional regex)"""
+    query = request.args.get('q', '')
+    project = request.args.get('project')
+    regex = request.args.get('regex', 'false').lower() == 'true'
+    case_sensitive = request.args.get('case', 'false').lower() == 'true'
+    limit = request.args.get('limit', 50, type=int)
+    if limit < 1 or limit > 500:
+        return jsonify({"error": "Limit must be between 1 and 500"}), 400
+    
+    try:
+        result = code_search.search(query, project=project, regex=regex,
+                                    case_sensitive=case_sensitive, limit=limit)
+        return jsonify({"success": True, **result})
+        
+    except SearchQueryError as e:
+        return jsonify({"error": str(e)}), 400
+    except SearchIndexBuildingError as e:
+        return (jsonify({"error": "Search index is being built, retry shortly", "building": True,
+                         "retry_after": e.retry_after}),
+                503, {"Retry-After": str(e.retry_after)})
+    except Exception as e:
+        logger.error(f"Error searching code: {str(e)}")
+        return jsonify({"error": "Failed to search code"}), 500
+
+@bp.route("/api/symbols", methods=["GET"])
+@rate_limit(limit=300, window=3600)
+def lookup_symbols():
+    """Definitions and references of a Python/JS symbol (name or Class.method)"""
+    name = request.args.get('q', '').strip()
+    project = request.args.get('project')
+    kind = request.args.get('kind') or None
+    include_references = request.args.get('references', 'true').lower() == 'true'
+    limit = request.args.get('limit', 200, type=int)
+    if not name:
+        return jsonify({"error": "Query parameter 'q' is required"}), 400
+    if limit < 1 or limit > 1000:
+        return jsonify({"error": "Limit must be between 1 and 1000"}), 400
+    
+    try:
+        result = symbol_search.lookup(name, project=project, kind=kind,
+                                      include_references=include_references, limit=limit)
+        return jsonify({"success": True, **result})
+        
+    except Exception as e:
+        logger.error(f"Error looking up symbol: {str(e)}")
+        return jsonify({"error": "Failed to look up symbol"}), 500
+
 @bp.route("/api/files/<path:filename>", methods=["GET"])
 def get_file(filename):
-    """Safely read a file from the project directory (read-only)"""
+    """
+    Safely read a file from the project directory (read-only)
+    
+    Served from the shared content cache; the content hash is the ETag, so a
+    client revalidating with If-None-Match gets 304 for an unchanged file.
+    """
     # Saugumo patikra
     if '..' in filename or filename.startswith('/'):
         return jsonify({'error': 'Neleistinas kelias'}), 400
@@ -253,9 +462,13 @@ def get_file(filename):
     if not os.path.isfile(file_path):
         return jsonify({'error': 'Failas nerastas'}), 404
     try:
-        with open(file_path, 'r', encoding='utf-8') as f:
-            content = f.read()
-        return jsonify({'content': content})
+        content = content_cache.get(file_path)
+        if content is None or content.binary:
+            return jsonify({'error': 'Nepavyko perskaityti failo'}), 500
+        response = jsonify({'content': content.text, 'sha256': content.sha256})
+        response.set_etag(content.etag)
+        response.headers['Cache-Control'] = 'no-cache'
+        return response.make_conditional(request)
     except Exception:
         return jsonify({'error': 'Nepavyko perskaityti failo'}), 500
 @bp.route("/api/orchestrator/status", methods=["GET"])
@@ -309,6 +522,21 @@ def get_usage_summary():
     try:
         from app.usage_tracker import usage_tracker
         
+        # Monthly summaries come straight from the rollups
+        month = request.args.get('month')
+        if month:
+            monthly = usage_tracker.get_monthly_summary(month)
+            if monthly:
+                return jsonify({
+                    "success": True,
+                    "summary": monthly['summary'],
+                    "daily": monthly['daily']
+                })
+            return jsonify({
+                "success": False,
+                "message": "No data available for the specified month"
+            }), 404
+        
         # Get date from query params or use today
         target_date = request.args.get('date')
         summary = usage_tracker.get_daily_summary(target_date)
@@ -316,7 +544,8 @@ def get_usage_summary():
         if summary:
             return jsonify({
                 "success": True,
-                "summary": summary.__dict__
+                "summary": summary.__dict__,
+                "hourly": usage_tracker.get_hourly_usage(summary.date)
             })
         else:
             return jsonify({
@@ -337,8 +566,8 @@ def get_usage_stats():
         from app.usage_tracker import usage_tracker
         
         days = request.args.get('days', 7, type=int)
-        if days < 1 or days > 90:  # Reasonable limits
-            return jsonify({"error": "Days must be between 1 and 90"}), 400
+        if days < 1 or days > 3660:  # Rollups keep long ranges cheap; cap at ten years
+            return jsonify({"error": "Days must be between 1 and 3660"}), 400
         
         stats = usage_tracker.get_usage_stats(days)
         return jsonify({
@@ -350,55 +579,125 @@ def get_usage_stats():
         logger.error(f"Error getting usage stats: {str(e)}")
         return jsonify({"error": "Failed to get usage stats"}), 500
 
-@bp.route("/api/usage/export", methods=["POST"])
-def export_usage_data():
-    """Export usage data for a date range"""
+@bp.route("/api/usage/latency", methods=["GET"])
+@cache_response(ttl=60)
+@rate_limit(limit=200, window=3600)
+def get_usage_latency():
+    """Latency percentiles overall and per agent type, model and project"""
     try:
         from app.usage_tracker import usage_tracker
         
-        data = request.get_json()
-        start_date = data.get('start_date')
-        end_date = data.get('end_date')
-        format_type = data.get('format', 'json')
-        
-        if not start_date or not end_date:
-            return jsonify({"error": "start_date and end_date are required"}), 400
-        
-        if format_type not in ['json', 'csv']:
-            return jsonify({"error": "format must be 'json' or 'csv'"}), 400
+        start = request.args.get('start')
+        end = request.args.get('end')
+        if not start or not end:
+            days = request.args.get('days', 7, type=int)
+            if days < 1 or days > 3660:
+                return jsonify({"error": "Days must be between 1 and 3660"}), 400
+            end = datetime.now().date().isoformat()
+            start = (datetime.now().date() - timedelta(days=days - 1)).isoformat()
         
-        export_path = usage_tracker.export_usage_data(start_date, end_date, format_type)
+        return jsonify({
+            "success": True,
+            "start": start,
+            "end": end,
+            "latency": usage_tracker.get_latency_stats(start, end)
+        })
         
+    except Exception as e:
+        logger.error(f"Error getting usage latency: {str(e)}")
+        return jsonify({"error": "Failed to get usage latency"}), 500
+
+@bp.route("/api/usage/stages", methods=["GET"])
+@rate_limit(limit=200, window=3600)
+def get_usage_stages():
+    """Per-stage chat pipeline latency percentiles (milliseconds) for this process"""
+    try:
         return jsonify({
             "success": True,
-            "export_path": export_path,
-            "download_url": f"/api/usage/download/{os.path.basename(export_path)}"
+            "stages": stage_stats.summary()
         })
         
     except Exception as e:
-        logger.error(f"Error exporting usage data: {str(e)}")
-        return jsonify({"error": "Failed to export usage data"}), 500
+        logger.error(f"Error getting stage timings: {str(e)}")
+        return jsonify({"error": "Failed to get stage timings"}), 500
 
-@bp.route("/api/usage/download/<filename>", methods=["GET"])
-def download_usage_file(filename):
-    """Download exported usage file"""
+@bp.route("/api/usage/query", methods=["GET"])
+@rate_limit(limit=200, window=3600)
+def query_usage():
+    """Group-by usage query over an arbitrary date range"""
     try:
         from app.usage_tracker import usage_tracker
         
-        file_path = usage_tracker.usage_dir / filename
+        start = request.args.get('start')
+        end = request.args.get('end')
+        if not start or not end:
+            return jsonify({"error": "start and end are required"}), 400
+        
+        group_by = [g for g in request.args.get('group_by', 'day').split(',') if g]
+        filters = {
+            key: request.args[key]
+            for key in ('project', 'model', 'agent_type', 'status')
+            if request.args.get(key)
+        }
+        
+        rows = usage_tracker.query_usage(start, end, group_by, filters)
+        return jsonify({
+            "success": True,
+            "group_by": group_by,
+            "rows": rows
+        })
         
-        if not file_path.exists():
-            return jsonify({"error": "File not found"}), 404
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        logger.error(f"Error querying usage data: {str(e)}")
+        return jsonify({"error": "Failed to query usage data"}), 500
+
+@bp.route("/api/usage/export", methods=["GET", "POST"])
+def export_usage_data():
+    """Stream usage entries for a date range as a JSON Lines or CSV download"""
+    try:
+        from app.usage_tracker import usage_tracker
         
-        # Security check - ensure file is in usage directory
-        if not str(file_path).startswith(str(usage_tracker.usage_dir)):
-            return jsonify({"error": "Access denied"}), 403
+        params = request.args if request.method == "GET" else (request.get_json(silent=True) or {})
         
-        return send_file(file_path, as_attachment=True)
+        start_date = params.get('start_date')
+        end_date = params.get('end_date')
+        if not start_date or not end_date:
+            # Fall back to the last N days, as the analytics dashboard requests
+            days = int(params.get('days', 0) or 0)
+            if days < 1:
+                return jsonify({"error": "start_date and end_date (or days) are required"}), 400
+            end_date = datetime.now().date().isoformat()
+            start_date = (datetime.now().date() - timedelta(days=days - 1)).isoformat()
+        
+        format_type = params.get('format', 'jsonl')
+        compress = str(params.get('gzip', 'false')).lower() in ('1', 'true')
+        
+        chunks = usage_tracker.iter_export(start_date, end_date, format_type, compress)
+        
+        filename = f"usage_export_{start_date}_to_{end_date}.{format_type}"
+        if compress:
+            mimetype = "application/gzip"
+            filename += ".gz"
+        else:
+            mimetype = "text/csv" if format_type == "csv" else "application/x-ndjson"
+        
+        # No Content-Length: the body is sent with chunked transfer encoding
+        return Response(
+            chunks,
+            mimetype=mimetype,
+            headers={
+                "Content-Disposition": f'attachment; filename="{filename}"',
+                "X-Accel-Buffering": "no"
+            }
+        )
         
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
     except Exception as e:
-        logger.error(f"Error downloading usage file: {str(e)}")
-        return jsonify({"error": "Failed to download file"}), 500
+        logger.error(f"Error exporting usage data: {str(e)}")
+        return jsonify({"error": "Failed to export usage data"}), 500
 
 @bp.route('/api/progress/<task_id>', methods=['GET'])
 def get_progress(task_id):
@@ -7,7 +7,7 @@ import hashlib
 import json
 from functools import wraps
 from datetime import datetime, timedelta
-from typing import Dict, Any, Optional
+from typing import Dict, Any, Optional, Tuple
 from collections import defaultdict, deque
 import os
 import logging
@@ -170,6 +170,24 @@ rate_limiter = RateLimiter()
 request_cache = RequestCache()
 security_validator = SecurityValidator()
 
+def rate_limit_rejection(ip: str, limit: int = None, window: int = None) -> Optional[Tuple[Dict[str, Any], int]]:
+    """(body, status) rejecting a request over the rate limit, or None if it is allowed"""
+    # Get configuration
+    actual_limit = limit or int(os.getenv('RATE_LIMIT_REQUESTS', 100))
+    actual_window = window or int(os.getenv('RATE_LIMIT_WINDOW', 3600))
+    
+    if not rate_limiter.is_allowed(ip, actual_limit, actual_window):
+        security_validator.log_security_event(
+            'RATE_LIMIT_EXCEEDED', ip, 
+            f"Limit: {actual_limit} requests per {actual_window}s"
+        )
+        return {
+            'error': 'Rate limit exceeded',
+            'message': 'Too many requests. Please try again later.',
+            'retry_after': 3600
+        }, 429
+    return None
+
 def rate_limit(limit: int = None, window: int = None):
     """Rate limiting decorator"""
     def decorator(f):
@@ -177,23 +195,12 @@ def rate_limit(limit: int = None, window: int = None):
         def decorated_function(*args, **kwargs):
             from flask import request, jsonify
             
-            # Get configuration
-            actual_limit = limit or int(os.getenv('RATE_LIMIT_REQUESTS', 100))
-            actual_window = window or int(os.getenv('RATE_LIMIT_WINDOW', 3600))
-            
             # Get client IP
             ip = request.environ.get('HTTP_X_FORWARDED_FOR', request.remote_addr)
             
-            if not rate_limiter.is_allowed(ip, actual_limit, actual_window):
-                security_validator.log_security_event(
-                    'RATE_LIMIT_EXCEEDED', ip, 
-                    f"Limit: {actual_limit} requests per {actual_window}s"
-                )
-                return jsonify({
-                    'error': 'Rate limit exceeded',
-                    'message': 'Too many requests. Please try again later.',
-                    'retry_after': 3600
-                }), 429
+            rejection = rate_limit_rejection(ip, limit, window)
+            if rejection:
+                return jsonify(rejection[0]), rejection[1]
             
             return f(*args, **kwargs)
         return decorated_function
@@ -232,6 +239,31 @@ def cache_response(ttl: int = 300):
         return decorated_function
     return decorator
 
+def security_rejection(data: Dict[str, Any], ip: str) -> Optional[Tuple[Dict[str, Any], int]]:
+    """(body, status) rejecting a JSON request body with suspicious content, or None if it passes"""
+    # Validate message content
+    message = data.get('message', '')
+    if message and not security_validator.validate_message(message):
+        security_validator.log_security_event(
+            'INVALID_MESSAGE', ip, f"Suspicious message content"
+        )
+        return {
+            'error': 'Invalid message content',
+            'message': 'Message contains suspicious content'
+        }, 400
+    
+    # Validate file paths
+    project_path = data.get('project_path', '')
+    if project_path and not security_validator.validate_file_path(project_path):
+        security_validator.log_security_event(
+            'INVALID_FILE_PATH', ip, f"Access denied to path: {project_path}"
+        )
+        return {
+            'error': 'Access denied',
+            'message': 'File path not allowed'
+        }, 403
+    return None
+
 def validate_security():
     """Security validation decorator"""
     def decorator(f):
@@ -243,29 +275,9 @@ def validate_security():
             
             # Validate request data
             if request.is_json:
-                data = request.get_json()
-                
-                # Validate message content
-                message = data.get('message', '')
-                if message and not security_validator.validate_message(message):
-                    security_validator.log_security_event(
-                        'INVALID_MESSAGE', ip, f"Suspicious message content"
-                    )
-                    return jsonify({
-                        'error': 'Invalid message content',
-                        'message': 'Message contains suspicious content'
-                    }), 400
-                
-                # Validate file paths
-                project_path = data.get('project_path', '')
-                if project_path and not security_validator.validate_file_path(project_path):
-                    security_validator.log_security_event(
-                        'INVALID_FILE_PATH', ip, f"Access denied to path: {project_path}"
-                    )
-                    return jsonify({
-                        'error': 'Access denied',
-                        'message': 'File path not allowed'
-                    }), 403
+                rejection = security_rejection(request.get_json(), ip)
+                if rejection:
+                    return jsonify(rejection[0]), rejection[1]
             
             return f(*args, **kwargs)
         return decorated_function
@@ -0,0 +1,151 @@
+"""
+COAI Single Flight
+Coalesces concurrent identical requests, so a burst of the same chat question
+is preprocessed and sent upstream once while the other callers wait for it
+"""
+
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import threading
+from concurrent.futures import Future
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+from .response_cache import normalize_prompt, rules_hash
+
+logger = logging.getLogger(__name__)
+
+
+def request_key(message: str, context: Dict[str, Any]) -> str:
+    """
+    Hash of a chat request's normalized message and the context it is asked in
+
+    Only the fields that shape the reply (project, file, rules, history and
+    the cache opt-out) are hashed; per-request fields such as the timestamp
+    and request ID would make every key unique.
+    """
+    parts = [
+        normalize_prompt(message),
+        context.get("project"),
+        context.get("file"),
+        rules_hash(context),
+        context.get("history"),
+        context.get("cache") is not False
+    ]
+    return hashlib.sha256(json.dumps(parts, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+
+class SingleFlight:
+    """
+    At most one call in flight per key
+
+    The first caller for a key (the leader) runs the work; callers arriving
+    while it runs (followers) block on the leader's future and receive the
+    same result, or the same exception. The key is forgotten as soon as the
+    leader finishes, so this never serves stale results - later callers run
+    the work again (and may hit the response cache instead).
+    """
+
+    def __init__(self, timeout: float = None):
+        self.enabled = os.getenv('COALESCE_REQUESTS_ENABLED', 'true').lower() == 'true'
+        # Followers give up waiting after this long and fail like a timed-out upstream call
+        self.timeout = timeout if timeout is not None else float(os.getenv('COALESCE_WAIT_SECONDS', '120'))
+        self.lock = threading.Lock()
+        self.in_flight: Dict[str, Future] = {}
+        self.stats = {"leaders": 0, "coalesced": 0, "max_waiters": 0}
+        self._waiters: Dict[str, int] = {}
+
+    def run(self, key: Optional[str], work: Callable[[], Any]) -> Tuple[Any, bool]:
+        """
+        Run `work` once per concurrent `key`
+
+        Returns:
+            (result, coalesced) where coalesced is True for followers that
+            reused the leader's result; a None key always runs the work
+        """
+        if key is None or not self.enabled:
+            return work(), False
+
+        with self.lock:
+            future = self.in_flight.get(key)
+            leader = future is None
+            if leader:
+                future = self.in_flight[key] = Future()
+                self._waiters[key] = 0
+                self.stats["leaders"] += 1
+            else:
+                self._waiters[key] += 1
+                self.stats["coalesced"] += 1
+                self.stats["max_waiters"] = max(self.stats["max_waiters"], self._waiters[key])
+
+        if not leader:
+            return future.result(timeout=self.timeout), True
+
+        try:
+            result = work()
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result, False
+        finally:
+            with self.lock:
+                del self.in_flight[key]
+                self._waiters.pop(key, None)
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self.lock:
+            stats = dict(self.stats)
+            stats["in_flight"] = len(self.in_flight)
+        stats["enabled"] = self.enabled
+        return stats
+
+
+class AsyncSingleFlight(SingleFlight):
+    """
+    SingleFlight for coroutines on one event loop
+
+    Followers await the leader's asyncio future instead of blocking a thread.
+    """
+
+    async def run(self, key: Optional[str], work: Callable[[], Awaitable[Any]]) -> Tuple[Any, bool]:
+        if key is None or not self.enabled:
+            return await work(), False
+
+        future = self.in_flight.get(key)
+        if future is not None:
+            with self.lock:
+                self._waiters[key] += 1
+                self.stats["coalesced"] += 1
+                self.stats["max_waiters"] = max(self.stats["max_waiters"], self._waiters[key])
+            # Shielded: a follower that is cancelled must not cancel the leader's work
+            return await asyncio.wait_for(asyncio.shield(future), self.timeout), True
+
+        future = asyncio.get_running_loop().create_future()
+        with self.lock:
+            self.in_flight[key] = future
+            self._waiters[key] = 0
+            self.stats["leaders"] += 1
+        try:
+            result = await work()
+        except BaseException as e:
+            if isinstance(e, asyncio.CancelledError):
+                future.cancel()
+            else:
+                future.set_exception(e)
+                future.exception()  # Retrieved here, so an unshared failure is not logged twice
+            raise
+        else:
+            future.set_result(result)
+            return result, False
+        finally:
+            with self.lock:
+                del self.in_flight[key]
+                self._waiters.pop(key, None)
+
+
+# Global instances
+single_flight = SingleFlight()
+async_single_flight = AsyncSingleFlight()
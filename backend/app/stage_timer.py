@@ -0,0 +1,110 @@
+"""
+COAI Stage Timing
+Lightweight span recorder for the chat pipeline with per-stage latency aggregates
+"""
+
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, Iterator, Optional
+from .latency_histogram import LatencyHistogram
+
+# Timer of the request being processed on this thread, so deeper layers
+# (e.g. file context building in the preprocessor) can add spans without
+# having the timer threaded through their signatures
+_active_timer: ContextVar[Optional['StageTimer']] = ContextVar('coai_stage_timer', default=None)
+
+STAGE_PERCENTILES = (50, 90, 95, 99)
+
+
+class StageTimer:
+    """
+    Records wall-clock time per pipeline stage for one request
+
+    Spans with the same name accumulate (e.g. the three logging calls), and
+    spans may nest: "file_context" is measured inside "preprocess".
+    """
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.stages: Dict[str, float] = {}
+
+    @contextmanager
+    def span(self, name: str) -> Iterator[None]:
+        """Time the enclosed block as stage `name`"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed_ms = (time.perf_counter() - started) * 1000
+            self.stages[name] = self.stages.get(name, 0.0) + elapsed_ms
+
+    @contextmanager
+    def activate(self) -> Iterator['StageTimer']:
+        """Make this the timer that module-level span() records into"""
+        token = _active_timer.set(self)
+        try:
+            yield self
+        finally:
+            _active_timer.reset(token)
+
+    def total_ms(self) -> float:
+        return (time.perf_counter() - self.started) * 1000
+
+    def breakdown(self) -> Dict[str, Any]:
+        """Per-stage milliseconds plus the total so far"""
+        return {
+            "total_ms": round(self.total_ms(), 3),
+            "stages": {name: round(ms, 3) for name, ms in self.stages.items()}
+        }
+
+
+@contextmanager
+def span(name: str) -> Iterator[None]:
+    """Time a block against the active request's timer; a no-op outside a request"""
+    timer = _active_timer.get()
+    if timer is None:
+        yield
+        return
+    with timer.span(name):
+        yield
+
+
+class StageStats:
+    """
+    Per-stage latency distribution across requests in this process
+
+    Each stage keeps a LatencyHistogram of milliseconds, so the tail of every
+    stage (and of the total) can be read off directly.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.histograms: Dict[str, LatencyHistogram] = {}
+
+    def record(self, timer: StageTimer):
+        """Fold a finished request's stage timings in"""
+        total_ms = timer.total_ms()
+        with self.lock:
+            for name, ms in list(timer.stages.items()) + [("total", total_ms)]:
+                histogram = self.histograms.get(name)
+                if histogram is None:
+                    histogram = self.histograms[name] = LatencyHistogram()
+                histogram.record(ms)
+
+    def summary(self) -> Dict[str, Dict[str, float]]:
+        """count/mean/max/p50/p90/p95/p99 in milliseconds for each stage"""
+        with self.lock:
+            return {
+                name: histogram.summary(STAGE_PERCENTILES)
+                for name, histogram in sorted(self.histograms.items())
+            }
+
+    def reset(self):
+        with self.lock:
+            self.histograms.clear()
+
+
+# Global per-process stage statistics
+stage_stats = StageStats()
@@ -0,0 +1,568 @@
+"""
+COAI Symbol Index
+Definitions, references and imports of Python and JS/TS symbols per project,
+so chat requests that name a function or class can be given its exact source
+"""
+
+import ast
+import bisect
+import logging
+import multiprocessing
+import os
+import re
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+from .content_cache import content_cache
+from .file_context_manager import file_context_manager
+from .file_watcher import file_watcher, is_tree_change
+
+logger = logging.getLogger(__name__)
+
+PYTHON_EXTENSIONS = {'.py'}
+JS_EXTENSIONS = {'.js', '.jsx', '.ts', '.tsx'}
+# Below this many changed files parsing in-process beats starting a pool
+POOL_THRESHOLD = 32
+MAX_DEFINITION_LINES = 80
+# A bare name defined in more places than this says too little to inject
+AMBIGUOUS_DEFINITIONS = 3
+
+# (name, qualified name, kind, line, end line)
+Definition = Tuple[str, str, str, int, int]
+# (name, line)
+Reference = Tuple[str, int]
+# (module or specifier, imported names): ("app.routes", ()), (".utils", ("slugify",)), ("./ui/Button", ())
+Import = Tuple[str, Tuple[str, ...]]
+
+
+# --- Python ---
+
+class _PythonVisitor(ast.NodeVisitor):
+    def __init__(self):
+        self.definitions: List[Definition] = []
+        self.references: Set[Reference] = set()
+        self.imports: List[Import] = []
+        self.scope: List[Tuple[str, str]] = []  # (name, kind) of enclosing defs
+
+    def _define(self, node, name: str, kind: str):
+        qualname = ".".join([scope_name for scope_name, _ in self.scope] + [name])
+        start = min([node.lineno] + [decorator.lineno for decorator in getattr(node, 'decorator_list', [])])
+        self.definitions.append((name, qualname, kind, start, getattr(node, 'end_lineno', None) or node.lineno))
+
+    def _visit_function(self, node):
+        kind = "method" if self.scope and self.scope[-1][1] == "class" else "function"
+        self._define(node, node.name, kind)
+        self.scope.append((node.name, "function"))
+        self.generic_visit(node)
+        self.scope.pop()
+
+    visit_FunctionDef = _visit_function
+    visit_AsyncFunctionDef = _visit_function
+
+    def visit_ClassDef(self, node):
+        self._define(node, node.name, "class")
+        self.scope.append((node.name, "class"))
+        self.generic_visit(node)
+        self.scope.pop()
+
+    def _visit_assignment(self, node):
+        if not self.scope:
+            targets = node.targets if isinstance(node, ast.Assign) else [node.target]
+            for target in targets:
+                if isinstance(target, ast.Name):
+                    self._define(node, target.id, "variable")
+        self.generic_visit(node)
+
+    visit_Assign = _visit_assignment
+    visit_AnnAssign = _visit_assignment
+
+    def visit_Import(self, node):
+        self.imports.extend((alias.name, ()) for alias in node.names)
+
+    def visit_ImportFrom(self, node):
+        module = "." * node.level + (node.module or "")
+        self.imports.append((module, tuple(alias.name for alias in node.names if alias.name != "*")))
+
+    def visit_Name(self, node):
+        if isinstance(node.ctx, ast.Load):
+            self.references.add((node.id, node.lineno))
+
+    def visit_Attribute(self, node):
+        self.references.add((node.attr, node.end_lineno or node.lineno))
+        self.generic_visit(node)
+
+
+def extract_python_symbols(source: str) -> Tuple[List[Definition], List[Reference], List[Import]]:
+    """Definitions (functions, classes, methods, module variables), name references and imports"""
+    try:
+        tree = ast.parse(source)
+    except (SyntaxError, ValueError):
+        return [], [], []
+    visitor = _PythonVisitor()
+    visitor.visit(tree)
+    return visitor.definitions, sorted(visitor.references), visitor.imports
+
+
+# --- JavaScript / TypeScript ---
+
+_JS_TOKEN = re.compile(r"""
+    (?P<comment>//[^\n]*|/\*.*?(?:\*/|\Z))
+  | (?P<string>"(?:\\.|[^"\\\n])*"|'(?:\\.|[^'\\\n])*'|`(?:\\.|[^`\\])*`)
+  | (?P<name>[A-Za-z_$][\w$]*)
+  | (?P<punct>=>|[{}()=;])
+""", re.S | re.X)
+
+_JS_KEYWORDS = frozenset("""
+    async await break case catch class const continue debugger default delete do else enum export extends
+    false finally for from function get if implements import in instanceof interface let new null of
+    return set static super switch this throw true try type typeof undefined var void while with yield
+""".split())
+
+
+def extract_js_symbols(source: str) -> Tuple[List[Definition], List[Reference], List[Import]]:
+    """
+    Definitions, references and imports from a token scan of JS/TS source
+
+    Recognises function, class, interface, type and enum declarations,
+    top-level const/let/var bindings (functions when bound to an arrow or
+    function expression) and class methods. A definition ends at the brace
+    closing the first block it opens, or on its own line if it opens none.
+    Imports are the string specifiers of `import ... from`, `export ... from`,
+    side-effect `import '...'`, `require('...')` and dynamic `import('...')`.
+    """
+    line_starts = [0] + [match.end() for match in re.finditer(r'\n', source)]
+    tokens = []
+    imports: List[Import] = []
+    for match in _JS_TOKEN.finditer(source):
+        kind = match.lastgroup
+        if kind in ("name", "punct"):
+            tokens.append((kind, match.group(), bisect.bisect_right(line_starts, match.start())))
+        elif kind == "string" and tokens:
+            previous = tokens[-1][1]
+            before = tokens[-2][1] if len(tokens) > 1 else None
+            if previous in ("from", "import") or (previous == "(" and before in ("require", "import")):
+                specifier = match.group()[1:-1]
+                if specifier and (specifier, ()) not in imports:
+                    imports.append((specifier, ()))
+
+    definitions: List[Definition] = []
+    references: Set[Reference] = set()
+    depth = 0
+    parens = 0
+    classes: List[Tuple[str, int]] = []  # (class name, depth of its body)
+    pending: List[list] = []  # [definition index, brace depth, paren depth] awaiting their block
+    open_blocks: List[Tuple[int, int]] = []  # (definition index, depth inside the block)
+
+    def define(name: str, kind: str, line: int, qualname: str = None):
+        definitions.append([name, qualname or name, kind, line, line])
+        # A statement without a semicolon ends where the next definition starts
+        pending[:] = [entry for entry in pending if entry[1] != depth]
+        pending.append([len(definitions) - 1, depth, parens])
+
+    for i, (kind, value, line) in enumerate(tokens):
+        following = tokens[i + 1][1] if i + 1 < len(tokens) else None
+        previous = tokens[i - 1][1] if i else None
+        if kind == "name":
+            if previous in ("function", "class", "interface", "enum") and value not in _JS_KEYWORDS:
+                define(value, previous, line)
+                if previous == "class":
+                    classes.append((value, depth + 1))
+            elif previous == "type" and following == "=":
+                define(value, "type", line)
+            elif previous in ("const", "let", "var") and depth == 0 and following == "=":
+                after = tokens[i + 2][1] if i + 2 < len(tokens) else None
+                is_function = after in ("function", "async", "(") or (
+                    i + 3 < len(tokens) and tokens[i + 3][1] == "=>"
+                )
+                define(value, "function" if is_function else "variable", line)
+            elif (classes and depth == classes[-1][1] and following == "("
+                  and value not in _JS_KEYWORDS and previous not in (".", "=")):
+                define(value, "method", line, f"{classes[-1][0]}.{value}")
+            elif value not in _JS_KEYWORDS:
+                references.add((value, line))
+            continue
+
+        if value == "(":
+            parens += 1
+        elif value == ")":
+            parens = max(parens - 1, 0)
+        elif value == "{":
+            for entry in pending:
+                if entry[1] == depth and entry[2] == parens:
+                    open_blocks.append((entry[0], depth + 1))
+                    pending.remove(entry)
+                    break
+            depth += 1
+        elif value == "}":
+            if open_blocks and open_blocks[-1][1] == depth:
+                definitions[open_blocks.pop()[0]][4] = line
+            if classes and classes[-1][1] == depth:
+                classes.pop()
+            depth = max(depth - 1, 0)
+        elif value == ";":
+            pending[:] = [entry for entry in pending if entry[1] != depth]
+
+    return [tuple(definition) for definition in definitions], sorted(references), imports
+
+
+def parse_file(path: str) -> Optional[Tuple[List[Definition], List[Reference], List[Import]]]:
+    """Symbols and imports of one file by extension; None if unreadable or too large"""
+    extension = os.path.splitext(path)[1].lower()
+    try:
+        if os.path.getsize(path) > file_context_manager.max_file_size * 20:
+            return None
+        with open(path, encoding='utf-8', errors='replace') as f:
+            source = f.read()
+    except OSError:
+        return None
+    if extension in PYTHON_EXTENSIONS:
+        return extract_python_symbols(source)
+    return extract_js_symbols(source)
+
+
+class SymbolIndex:
+    """
+    Symbol definitions, references and imports for one project root
+
+    refresh() re-parses files whose (mtime_ns, size) changed, checking every
+    file only every `revalidate_interval` (FILE_WATCHER_REVALIDATE_SECONDS
+    while the file watcher reports changes under the root) and otherwise just
+    the paths reported through mark_dirty(); when many changed
+    (a cold start) they are parsed in a process pool, since ast parsing is
+    CPU-bound and holds the GIL. Parsing runs outside `lock`, so queries keep
+    answering from the previous state meanwhile. `generation` is bumped
+    whenever anything changed, so structures derived from the index (the
+    import graph) know when to rebuild.
+
+    The cold build belongs off the request path: warm() runs it on a
+    background thread, and `ready` is set once it has completed.
+    """
+
+    def __init__(self, root: str, revalidate_interval: float = None, workers: int = None):
+        self.root = os.path.abspath(root)
+        if revalidate_interval is None:
+            revalidate_interval = float(os.getenv('SYMBOL_INDEX_REVALIDATE_SECONDS', '10'))
+        self.revalidate_interval = revalidate_interval
+        self.workers = workers or int(os.getenv('SYMBOL_INDEX_WORKERS', '0')) or os.cpu_count() or 1
+        self.lock = threading.RLock()
+        self.refresh_lock = threading.Lock()  # One refresh at a time; held while parsing
+        self.ready = threading.Event()
+        self.warmer: Optional[threading.Thread] = None
+
+        # rel_path -> (mtime_ns, size, definitions, references, imports)
+        self.files: Dict[str, Tuple[int, int, List[Definition], List[Reference], List[Import]]] = {}
+        # name -> [(rel_path, definition)]
+        self.definitions: Dict[str, List[Tuple[str, Definition]]] = {}
+        # name -> {rel_path: [line, ...]}
+        self.references: Dict[str, Dict[str, List[int]]] = {}
+        self.generation = 0
+        self.validated_at = 0.0
+        self.dirty_paths: Set[str] = set()
+
+    def _remove(self, rel_path: str):
+        entry = self.files.pop(rel_path, None)
+        if entry is None:
+            return
+        for definition in entry[2]:
+            remaining = [item for item in self.definitions.get(definition[0], []) if item[0] != rel_path]
+            if remaining:
+                self.definitions[definition[0]] = remaining
+            else:
+                self.definitions.pop(definition[0], None)
+        for name, _ in entry[3]:
+            by_file = self.references.get(name)
+            if by_file is not None:
+                by_file.pop(rel_path, None)
+                if not by_file:
+                    del self.references[name]
+
+    def _add(self, rel_path: str, mtime_ns: int, size: int, symbols):
+        definitions, references, imports = symbols or ([], [], [])
+        self.files[rel_path] = (mtime_ns, size, definitions, references, imports)
+        for definition in definitions:
+            self.definitions.setdefault(definition[0], []).append((rel_path, definition))
+        for name, line in references:
+            self.references.setdefault(name, {}).setdefault(rel_path, []).append(line)
+
+    def _changed_paths(self, paths: Iterable[str]) -> Tuple[List[Tuple[str, int, int]], List[str]]:
+        changed, removed = [], []
+        for rel_path in paths:
+            try:
+                stat = os.stat(os.path.join(self.root, rel_path))
+            except OSError:
+                if rel_path in self.files:
+                    removed.append(rel_path)
+                continue
+            entry = self.files.get(rel_path)
+            if entry is None or entry[:2] != (stat.st_mtime_ns, stat.st_size):
+                changed.append((rel_path, stat.st_mtime_ns, stat.st_size))
+        return changed, removed
+
+    def refresh(self, force: bool = False, wait: bool = True) -> int:
+        """
+        Bring the index up to date with the project's code files
+
+        Args:
+            wait: False to return at once (0) when another refresh is under way
+
+        Returns:
+            Number of files added, re-parsed or removed
+        """
+        if not self.refresh_lock.acquire(blocking=wait):
+            return 0
+        try:
+            changed, removed = self._collect_changes(force)
+            if not changed:
+                self.ready.set()
+                return removed
+            # Parsed without holding `lock`; the process pool is spawned, not forked, since this
+            # process runs the watcher and writer threads and a forked child could inherit a held lock
+            absolute = [os.path.join(self.root, rel_path) for rel_path, _, _ in changed]
+            if len(changed) >= POOL_THRESHOLD and self.workers > 1:
+                with ProcessPoolExecutor(max_workers=self.workers,
+                                         mp_context=multiprocessing.get_context('spawn')) as pool:
+                    results = list(pool.map(parse_file, absolute, chunksize=16))
+            else:
+                results = [parse_file(path) for path in absolute]
+            with self.lock:
+                for (rel_path, mtime_ns, size), symbols in zip(changed, results):
+                    self._remove(rel_path)
+                    self._add(rel_path, mtime_ns, size, symbols)
+                self.generation += 1
+            self.ready.set()
+            return len(changed) + removed
+        finally:
+            self.refresh_lock.release()
+
+    def _collect_changes(self, force: bool) -> Tuple[List[Tuple[str, int, int]], int]:
+        """Drop removed files; (files to re-parse, number removed). The caller holds `refresh_lock`."""
+        with self.lock:
+            interval = file_watcher.revalidate_interval(self.root, self.revalidate_interval)
+            if force or not self.files or time.monotonic() - self.validated_at >= interval:
+                workspace = file_context_manager.get_workspace_index(self.root)
+                paths = set(self.files)
+                for rel_dir, record in list(workspace.dirs.items()):
+                    prefix = '' if rel_dir == '.' else rel_dir + os.sep
+                    paths.update(
+                        prefix + name for name in record["files"]
+                        if os.path.splitext(name)[1].lower() in PYTHON_EXTENSIONS | JS_EXTENSIONS
+                    )
+                self.validated_at = time.monotonic()
+            else:
+                paths = self.dirty_paths
+            self.dirty_paths = set()
+
+            changed, removed = self._changed_paths(paths)
+            for rel_path in removed:
+                self._remove(rel_path)
+            if removed:
+                self.generation += 1
+            return changed, len(removed)
+
+    def warm(self) -> threading.Thread:
+        """Refresh on a background thread (the running one if a warm-up is under way)"""
+        with self.lock:
+            if self.warmer is None or not self.warmer.is_alive():
+                self.warmer = threading.Thread(target=self._warm, name='coai-symbol-warm', daemon=True)
+                self.warmer.start()
+            return self.warmer
+
+    def _warm(self):
+        try:
+            self.refresh()
+        except Exception:
+            logger.exception("Symbol index warm-up failed for %s", self.root)
+
+    def mark_dirty(self, paths: Iterable[str]):
+        """Queue absolute paths (e.g. from the file watcher) for the next refresh"""
+        prefix = self.root + os.sep
+        extensions = PYTHON_EXTENSIONS | JS_EXTENSIONS
+        with self.lock:
+            for path in paths:
+                if path.startswith(prefix) and os.path.splitext(path)[1].lower() in extensions:
+                    self.dirty_paths.add(os.path.relpath(path, self.root))
+                elif is_tree_change(self.root, path):
+                    self.validated_at = 0.0
+
+    # --- Querying ---
+
+    def refresh_for_query(self):
+        """Refresh before a lookup; once built, answer from the current state rather than wait out another refresh"""
+        self.refresh(wait=not self.ready.is_set())
+
+    def _describe(self, rel_path: str, definition: Definition) -> Dict[str, Any]:
+        name, qualname, kind, line, end_line = definition
+        return {
+            "name": name,
+            "qualified_name": qualname,
+            "kind": kind,
+            "path": rel_path.replace(os.sep, '/'),
+            "line": line,
+            "end_line": end_line
+        }
+
+    def find_definitions(self, name: str, kind: str = None) -> List[Dict[str, Any]]:
+        """Definitions of an exact name (or qualified name such as Class.method)"""
+        self.refresh_for_query()
+        short_name = name.rsplit('.', 1)[-1]
+        with self.lock:
+            matches = [
+                self._describe(rel_path, definition)
+                for rel_path, definition in self.definitions.get(short_name, [])
+                if (name == short_name or definition[1] == name or definition[1].endswith('.' + name))
+                and (kind is None or definition[2] == kind)
+            ]
+        return sorted(matches, key=lambda match: (match["path"], match["line"]))
+
+    def find_references(self, name: str, limit: int = 200) -> List[Dict[str, Any]]:
+        self.refresh_for_query()
+        short_name = name.rsplit('.', 1)[-1]
+        results = []
+        with self.lock:
+            for rel_path in sorted(self.references.get(short_name, {})):
+                for line in self.references[short_name][rel_path]:
+                    if len(results) >= limit:
+                        return results
+                    results.append({"path": rel_path.replace(os.sep, '/'), "line": line})
+        return results
+
+    def search(self, prefix: str, limit: int = 50) -> List[str]:
+        """Defined names starting with `prefix` (case-insensitive)"""
+        self.refresh_for_query()
+        prefix = prefix.lower()
+        with self.lock:
+            return sorted(name for name in self.definitions if name.lower().startswith(prefix))[:limit]
+
+    def read_lines(self, rel_path: str, max_chars: int = None) -> Optional[List[str]]:
+        """Lines of a project file, optionally only its first `max_chars`; None if unreadable or binary"""
+        content = content_cache.get(os.path.join(self.root, rel_path))
+        if content is None or content.binary:
+            return None
+        return (content.text[:max_chars] if max_chars else content.text).splitlines()
+
+    def read_definition(self, definition: Dict[str, Any], max_lines: int = MAX_DEFINITION_LINES) -> Optional[str]:
+        """Source text of a definition, cut at `max_lines` lines"""
+        content = content_cache.get(os.path.join(self.root, definition["path"].replace('/', os.sep)))
+        if content is None or content.binary:
+            return None
+        start = definition["line"] - 1
+        end = min(definition["end_line"], start + max_lines)
+        text = content.lines(start + 1, end)
+        if definition["end_line"] > end:
+            text += f"\n... ({definition['end_line'] - end} more lines)"
+        return text
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "root": self.root,
+            "files": len(self.files),
+            "definitions": sum(len(items) for items in self.definitions.values()),
+            "referenced_names": len(self.references)
+        }
+
+
+_IDENTIFIER_RE = re.compile(r'`([^`\s]+)`|([A-Za-z_][\w.]*[\w])(\()?')
+
+
+def mentioned_identifiers(message: str) -> List[str]:
+    """
+    Names in a chat message that look like code: backticked, called, dotted,
+    snake_case or camelCase/PascalCase words. Plain words are ignored so
+    ordinary English does not pull in definitions.
+    """
+    names = []
+    for match in _IDENTIFIER_RE.finditer(message):
+        name = (match.group(1) or match.group(2)).rstrip('()')
+        code_like = (
+            match.group(1) or match.group(3) or '_' in name or '.' in name
+            or any(char.isupper() for char in name[1:])
+        )
+        if code_like and len(name) >= 3 and name not in names:
+            names.append(name)
+    return names
+
+
+class SymbolSearch:
+    """Symbol indexes per project root, resolved like the file context listing"""
+
+    def __init__(self):
+        self.enabled = os.getenv('SYMBOL_INDEX_ENABLED', 'true').lower() == 'true'
+        self.max_definitions = int(os.getenv('SYMBOL_CONTEXT_MAX_DEFINITIONS', '6'))
+        self.lock = threading.Lock()
+        self.indexes: Dict[str, SymbolIndex] = {}
+
+    def get_index(self, project: str = None) -> SymbolIndex:
+        root = os.path.abspath(file_context_manager.resolve_project_path(project))
+        with self.lock:
+            index = self.indexes.get(root)
+            if index is None:
+                index = self.indexes[root] = SymbolIndex(root)
+            return index
+
+    def lookup(self, name: str, project: str = None, kind: str = None,
+               include_references: bool = True, limit: int = 200) -> Dict[str, Any]:
+        index = self.get_index(project)
+        definitions = index.find_definitions(name, kind)
+        result = {"symbol": name, "definitions": definitions}
+        if include_references:
+            result["references"] = index.find_references(name, limit)
+        if not definitions:
+            result["suggestions"] = index.search(name.rsplit('.', 1)[-1], limit=20)
+        return result
+
+    def definitions_for_message(self, message: str, project: str = None) -> List[Dict[str, Any]]:
+        """
+        Definitions (with source) of the code symbols named in a chat message
+
+        Each returned definition carries its "text"; at most
+        `max_definitions` are returned, in order of mention. Unqualified names
+        defined in more than AMBIGUOUS_DEFINITIONS places are skipped. Until
+        the project's index has been built nothing is returned; the build is
+        started in the background instead of holding up the chat.
+        """
+        if not self.enabled:
+            return []
+        names = mentioned_identifiers(message)
+        if not names:
+            return []
+        index = self.get_index(project)
+        if not index.ready.is_set():
+            index.warm()
+            return []
+        results = []
+        for name in names:
+            definitions = index.find_definitions(name)
+            if len(definitions) > AMBIGUOUS_DEFINITIONS and '.' not in name:
+                continue
+            for definition in definitions:
+                if len(results) >= self.max_definitions:
+                    return results
+                text = index.read_definition(definition)
+                if text:
+                    results.append({**definition, "text": text})
+        return results
+
+    def warm(self, project: str = None) -> Optional[threading.Thread]:
+        """Build a project's index in the background, e.g. at server startup"""
+        if not self.enabled:
+            return None
+        return self.get_index(project).warm()
+
+    def format_definition_for_ai(self, definition: Dict[str, Any]) -> str:
+        return (
+            f"--- {definition['path']}:{definition['line']} "
+            f"({definition['kind']} {definition['qualified_name']}) ---\n{definition['text']}"
+        )
+
+    def invalidate_paths(self, paths: Iterable[str]):
+        """Route changed absolute paths to every index that covers them"""
+        paths = list(paths)
+        with self.lock:
+            indexes = list(self.indexes.values())
+        for index in indexes:
+            index.mark_dirty(paths)
+
+
+# Global instance
+symbol_search = SymbolSearch()
@@ -0,0 +1,292 @@
+"""
+COAI Usage Analytics Store
+SQLite (WAL) backend for usage entries with indexed group-by queries
+"""
+
+import json
+import logging
+import os
+import sqlite3
+import sys
+import threading
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+ENTRY_COLUMNS = [
+    "timestamp", "request_id", "agent_type", "project", "file",
+    "message_length", "response_length", "tokens_used", "prompt_tokens",
+    "completion_tokens", "model", "cost_estimate", "response_time",
+    "status", "real_ai", "error", "cached", "coalesced"
+]
+BOOLEAN_COLUMNS = {"real_ai", "cached", "coalesced"}
+
+# Columns added after the first release: name -> declaration, applied to older databases on open
+ADDED_COLUMNS = {
+    "cached": "INTEGER NOT NULL DEFAULT 0",
+    "coalesced": "INTEGER NOT NULL DEFAULT 0",
+}
+
+# Group-by dimensions exposed by query(); values are SQL expressions over usage_entries
+GROUP_BY_EXPRESSIONS = {
+    "hour": "substr(timestamp, 1, 13)",
+    "day": "substr(timestamp, 1, 10)",
+    "month": "substr(timestamp, 1, 7)",
+    "hour_of_day": "CAST(substr(timestamp, 12, 2) AS INTEGER)",
+    "project": "project",
+    "model": "model",
+    "agent_type": "agent_type",
+    "status": "status",
+}
+
+FILTER_COLUMNS = {"project", "model", "agent_type", "status"}
+ORDERABLE_COLUMNS = {"requests", "tokens", "cost", "avg_response_time", "max_response_time"}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS usage_entries (
+    id INTEGER PRIMARY KEY,
+    timestamp TEXT NOT NULL,
+    request_id TEXT NOT NULL,
+    agent_type TEXT,
+    project TEXT,
+    file TEXT,
+    message_length INTEGER,
+    response_length INTEGER,
+    tokens_used INTEGER,
+    prompt_tokens INTEGER,
+    completion_tokens INTEGER,
+    model TEXT,
+    cost_estimate REAL,
+    response_time REAL,
+    status TEXT,
+    real_ai INTEGER,
+    error TEXT,
+    cached INTEGER NOT NULL DEFAULT 0,
+    coalesced INTEGER NOT NULL DEFAULT 0,
+    UNIQUE (request_id, timestamp)
+);
+CREATE INDEX IF NOT EXISTS idx_usage_timestamp ON usage_entries (timestamp);
+CREATE INDEX IF NOT EXISTS idx_usage_project ON usage_entries (project, timestamp);
+CREATE INDEX IF NOT EXISTS idx_usage_agent_type ON usage_entries (agent_type, timestamp);
+CREATE INDEX IF NOT EXISTS idx_usage_model ON usage_entries (model, timestamp);
+CREATE TABLE IF NOT EXISTS imported_files (
+    name TEXT PRIMARY KEY,
+    offset INTEGER NOT NULL
+);
+"""
+
+
+class UsageStore:
+    """
+    Indexed usage entry store
+
+    Range queries run against the timestamp index, so stats over 90 days cost
+    a few index scans instead of re-reading 90 daily files. The database uses
+    WAL mode so readers never block the background writer.
+
+    It is a secondary index: the daily logs stay the source of truth, and
+    import_daily_files() catches it up with whatever they gained while it
+    was not being written (disabled, deleted, or another process without it).
+    """
+
+    def __init__(self, db_path: str):
+        self.db_path = str(db_path)
+        self._local = threading.local()
+
+        conn = self._connect()
+        conn.executescript(SCHEMA)
+        existing = {row["name"] for row in conn.execute("PRAGMA table_info(usage_entries)")}
+        for column, declaration in ADDED_COLUMNS.items():
+            if column not in existing:
+                conn.execute(f"ALTER TABLE usage_entries ADD COLUMN {column} {declaration}")
+        conn.commit()
+
+    def _connect(self) -> sqlite3.Connection:
+        """Return this thread's connection, opening it on first use"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None or getattr(self._local, "pid", None) != os.getpid():
+            conn = sqlite3.connect(self.db_path, timeout=30)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def insert_entries(self, entries: Iterable[Dict[str, Any]]) -> int:
+        """
+        Insert usage entries (as dicts); duplicates by request_id/timestamp are ignored
+
+        Returns:
+            Number of rows inserted
+        """
+        rows = [
+            tuple(int(entry.get(col) or 0) if col in BOOLEAN_COLUMNS else entry.get(col) for col in ENTRY_COLUMNS)
+            for entry in entries
+        ]
+        if not rows:
+            return 0
+
+        conn = self._connect()
+        placeholders = ", ".join("?" for _ in ENTRY_COLUMNS)
+        before = conn.total_changes
+        with conn:
+            conn.executemany(
+                f"INSERT OR IGNORE INTO usage_entries ({', '.join(ENTRY_COLUMNS)}) VALUES ({placeholders})",
+                rows
+            )
+        return conn.total_changes - before
+
+    def query(
+        self,
+        start: str,
+        end: str,
+        group_by: Optional[List[str]] = None,
+        filters: Optional[Dict[str, str]] = None,
+        order_by: str = None,
+        limit: int = None
+    ) -> List[Dict[str, Any]]:
+        """
+        Aggregate usage over [start, end) grouped by any of GROUP_BY_EXPRESSIONS
+
+        Args:
+            start: Inclusive ISO date or timestamp lower bound
+            end: Exclusive ISO date or timestamp upper bound
+            group_by: Dimensions such as ["day"], ["hour"] or ["project", "model"]
+            filters: Equality filters on project/model/agent_type/status
+            order_by: Result column to sort by, descending (defaults to group order)
+            limit: Maximum number of rows
+
+        Returns:
+            One dict per group with request, token, cost and latency aggregates
+        """
+        group_by = group_by or []
+        for dimension in group_by:
+            if dimension not in GROUP_BY_EXPRESSIONS:
+                raise ValueError(f"Unsupported group_by dimension: {dimension}")
+
+        select = [f"{GROUP_BY_EXPRESSIONS[d]} AS {d}" for d in group_by]
+        select += [
+            "COUNT(*) AS requests",
+            "SUM(status = 'success') AS successful_requests",
+            "SUM(status != 'success') AS failed_requests",
+            "SUM(real_ai) AS real_ai_requests",
+            "COALESCE(SUM(cached), 0) AS cached_requests",
+            "COALESCE(SUM(coalesced), 0) AS coalesced_requests",
+            "COALESCE(SUM(tokens_used), 0) AS tokens",
+            "COALESCE(SUM(prompt_tokens), 0) AS prompt_tokens",
+            "COALESCE(SUM(completion_tokens), 0) AS completion_tokens",
+            "COALESCE(SUM(cost_estimate), 0.0) AS cost",
+            "COALESCE(AVG(response_time), 0.0) AS avg_response_time",
+            "COALESCE(MAX(response_time), 0.0) AS max_response_time",
+        ]
+
+        where = ["timestamp >= ?", "timestamp < ?"]
+        params: List[Any] = [start, end]
+        for column, value in (filters or {}).items():
+            if column not in FILTER_COLUMNS:
+                raise ValueError(f"Unsupported filter: {column}")
+            where.append(f"{column} = ?")
+            params.append(value)
+
+        sql = f"SELECT {', '.join(select)} FROM usage_entries WHERE {' AND '.join(where)}"
+        if group_by:
+            sql += f" GROUP BY {', '.join(group_by)}"
+        if order_by:
+            if order_by not in ORDERABLE_COLUMNS:
+                raise ValueError(f"Unsupported order_by: {order_by}")
+            sql += f" ORDER BY {order_by} DESC"
+        elif group_by:
+            sql += f" ORDER BY {', '.join(group_by)}"
+        if limit:
+            sql += f" LIMIT {int(limit)}"
+
+        rows = self._connect().execute(sql, params).fetchall()
+        return [dict(row) for row in rows if row["requests"]]
+
+    def iter_entries(self, start: str, end: str) -> Iterable[Dict[str, Any]]:
+        """Yield raw entries in [start, end) in timestamp order"""
+        cursor = self._connect().execute(
+            f"SELECT {', '.join(ENTRY_COLUMNS)} FROM usage_entries "
+            "WHERE timestamp >= ? AND timestamp < ? ORDER BY timestamp",
+            (start, end)
+        )
+        for row in cursor:
+            entry = dict(row)
+            for column in BOOLEAN_COLUMNS:
+                entry[column] = bool(entry[column])
+            yield entry
+
+    def count(self) -> int:
+        return self._connect().execute("SELECT COUNT(*) FROM usage_entries").fetchone()[0]
+
+    def imported_offset(self, name: str) -> int:
+        """Bytes of a daily file already imported"""
+        row = self._connect().execute("SELECT offset FROM imported_files WHERE name = ?", (name,)).fetchone()
+        return row["offset"] if row else 0
+
+    def set_imported_offset(self, name: str, offset: int):
+        conn = self._connect()
+        with conn:
+            conn.execute(
+                "INSERT INTO imported_files (name, offset) VALUES (?, ?) "
+                "ON CONFLICT (name) DO UPDATE SET offset = excluded.offset",
+                (name, offset)
+            )
+
+
+def import_daily_files(store: UsageStore, daily_dir: str) -> int:
+    """
+    Import .coai/usage/daily/*.json (legacy) and *.jsonl files into the store
+
+    Incremental: the store remembers how many bytes of each file it has
+    imported, so a re-run only reads what the logs gained since. Entries
+    already in the store are skipped.
+
+    Returns:
+        Number of entries inserted
+    """
+    daily_path = Path(daily_dir)
+    if not daily_path.exists():
+        return 0
+
+    inserted = 0
+    for path in sorted(daily_path.iterdir()):
+        try:
+            if path.suffix not in (".jsonl", ".json"):
+                continue
+            size = path.stat().st_size
+            offset = store.imported_offset(path.name)
+            if size == offset:
+                continue
+            if path.suffix == ".jsonl":
+                if size < offset:
+                    offset = 0  # Replaced rather than appended to
+                with open(path, "rb") as f:
+                    f.seek(offset)
+                    data = f.read()
+                # A line still being written is left for the next import
+                complete = data[:data.rfind(b"\n") + 1]
+                entries = [json.loads(line) for line in complete.decode("utf-8").splitlines() if line]
+                offset += len(complete)
+            else:
+                with open(path, "r", encoding="utf-8") as f:
+                    entries = json.load(f).get("entries", [])
+                offset = size
+            inserted += store.insert_entries(entries)
+            store.set_imported_offset(path.name, offset)
+        except Exception as e:
+            logger.warning(f"Skipping usage file {path.name}: {e}")
+
+    logger.info(f"Imported {inserted} usage entries from {daily_dir}")
+    return inserted
+
+
+if __name__ == "__main__":
+    # Usage: python -m app.usage_store [daily_dir] [db_path]
+    base_dir = Path(__file__).parent.parent / '.coai' / 'usage'
+    daily_dir = sys.argv[1] if len(sys.argv) > 1 else str(base_dir / 'daily')
+    db_path = sys.argv[2] if len(sys.argv) > 2 else str(base_dir / 'usage.db')
+    store = UsageStore(db_path)
+    print(f"Imported {import_daily_files(store, daily_dir)} entries into {db_path}")
@@ -4,13 +4,27 @@ Tracks API calls, token usage, costs, and performance metrics
 """
 
 import os
+import io
+import sys
+import csv
 import json
 import time
-from datetime import datetime, date
-from typing import Dict, Any, List, Optional
-from dataclasses import dataclass, asdict
+import zlib
+from datetime import datetime, date, timedelta
+from typing import Callable, Dict, Any, Iterable, Iterator, List, Optional, Tuple
+from dataclasses import dataclass, asdict, field, fields
 import threading
+from collections import OrderedDict
+from contextlib import contextmanager
 from pathlib import Path
+from .write_behind import WriteBehindQueue
+from .latency_histogram import LatencyHistogram
+from .usage_store import UsageStore, import_daily_files
+
+try:
+    import fcntl
+except ImportError:  # Windows: single-process dev server, no cross-process locking
+    fcntl = None
 
 @dataclass
 class UsageEntry:
@@ -31,6 +45,10 @@ class UsageEntry:
     status: str
     real_ai: bool
     error: Optional[str] = None
+    # Served from the response cache: no tokens spent, zero cost
+    cached: bool = False
+    # Shared the reply of an identical concurrent request: no tokens spent, zero cost
+    coalesced: bool = False
 
 @dataclass
 class DailySummary:
@@ -45,21 +63,412 @@ class DailySummary:
     projects_used: List[str]
     most_used_agent: str
     real_ai_requests: int
+    p50_response_time: float = 0.0
+    p90_response_time: float = 0.0
+    p99_response_time: float = 0.0
+    max_response_time: float = 0.0
+    cached_requests: int = 0
+    coalesced_requests: int = 0
+
+EXPORT_FORMATS = ('jsonl', 'csv')
+
+# Entry fields that get their own latency histogram in day and month buckets
+LATENCY_DIMENSIONS = ('agent_type', 'model', 'project')
+
+@dataclass
+class UsageAggregates:
+    """Running totals for one hour, day or month, updated in O(1) per entry"""
+    date: str
+    total_requests: int = 0
+    successful_requests: int = 0
+    failed_requests: int = 0
+    real_ai_requests: int = 0
+    cached_requests: int = 0
+    coalesced_requests: int = 0
+    total_tokens: int = 0
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    total_cost: float = 0.0
+    response_time_sum: float = 0.0
+    agent_counts: Dict[str, int] = field(default_factory=dict)
+    project_counts: Dict[str, int] = field(default_factory=dict)
+    model_counts: Dict[str, int] = field(default_factory=dict)
+    hour_counts: List[int] = field(default_factory=lambda: [0] * 24)
+    latency: LatencyHistogram = field(default_factory=LatencyHistogram)
+    # "<dimension>:<value>" -> histogram, e.g. "model:gpt-4"
+    latency_by_key: Dict[str, LatencyHistogram] = field(default_factory=dict)
+    
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> 'UsageAggregates':
+        """Rebuild from a JSON snapshot, tolerating fields added or removed since it was written"""
+        known = {f.name for f in fields(cls)}
+        aggregates = cls(**{key: value for key, value in data.items() if key in known})
+        if isinstance(aggregates.latency, dict):
+            aggregates.latency = LatencyHistogram(**aggregates.latency)
+        aggregates.latency_by_key = {
+            key: LatencyHistogram(**histogram) if isinstance(histogram, dict) else histogram
+            for key, histogram in aggregates.latency_by_key.items()
+        }
+        return aggregates
+    
+    def add(self, entry: 'UsageEntry', latency_by_key: bool = True):
+        """
+        Fold a single entry into the running totals
+        
+        Per-dimension latency histograms are skipped when `latency_by_key` is False,
+        which keeps fine-grained (hourly) buckets small.
+        """
+        self.total_requests += 1
+        if entry.status == 'success':
+            self.successful_requests += 1
+        else:
+            self.failed_requests += 1
+        if entry.real_ai:
+            self.real_ai_requests += 1
+        if entry.cached:
+            self.cached_requests += 1
+        if entry.coalesced:
+            self.coalesced_requests += 1
+        self.total_tokens += entry.tokens_used
+        self.prompt_tokens += entry.prompt_tokens
+        self.completion_tokens += entry.completion_tokens
+        self.total_cost += entry.cost_estimate
+        self.response_time_sum += entry.response_time
+        self.agent_counts[entry.agent_type] = self.agent_counts.get(entry.agent_type, 0) + 1
+        self.project_counts[entry.project] = self.project_counts.get(entry.project, 0) + 1
+        self.model_counts[entry.model] = self.model_counts.get(entry.model, 0) + 1
+        self.hour_counts[int(entry.timestamp[11:13])] += 1
+        self.latency.record(entry.response_time)
+        if latency_by_key:
+            for dimension in LATENCY_DIMENSIONS:
+                key = f"{dimension}:{getattr(entry, dimension)}"
+                histogram = self.latency_by_key.get(key)
+                if histogram is None:
+                    histogram = self.latency_by_key[key] = LatencyHistogram()
+                histogram.record(entry.response_time)
+    
+    def merge(self, other: 'UsageAggregates'):
+        """Fold another bucket's totals into this one"""
+        for name in ('total_requests', 'successful_requests', 'failed_requests', 'real_ai_requests',
+                     'cached_requests', 'coalesced_requests', 'total_tokens', 'prompt_tokens', 'completion_tokens', 'total_cost',
+                     'response_time_sum'):
+            setattr(self, name, getattr(self, name) + getattr(other, name))
+        for name in ('agent_counts', 'project_counts', 'model_counts'):
+            counts = getattr(self, name)
+            for key, value in getattr(other, name).items():
+                counts[key] = counts.get(key, 0) + value
+        self.hour_counts = [a + b for a, b in zip(self.hour_counts, other.hour_counts)]
+        self.latency.merge(other.latency)
+        for key, histogram in other.latency_by_key.items():
+            if key not in self.latency_by_key:
+                self.latency_by_key[key] = LatencyHistogram()
+            self.latency_by_key[key].merge(histogram)
+    
+    def latency_summary(self) -> Dict[str, Any]:
+        """Percentiles overall and per agent type, model and project"""
+        result: Dict[str, Any] = {'overall': self.latency.summary()}
+        for dimension in LATENCY_DIMENSIONS:
+            result[dimension] = {}
+        for key, histogram in sorted(self.latency_by_key.items()):
+            dimension, _, value = key.partition(':')
+            if dimension in result:
+                result[dimension][value] = histogram.summary()
+        return result
+    
+    def to_summary(self) -> DailySummary:
+        """Build the public daily summary from the running totals"""
+        return DailySummary(
+            date=self.date,
+            total_requests=self.total_requests,
+            successful_requests=self.successful_requests,
+            failed_requests=self.failed_requests,
+            total_tokens=self.total_tokens,
+            total_cost=self.total_cost,
+            avg_response_time=self.response_time_sum / self.total_requests if self.total_requests else 0.0,
+            projects_used=list(self.project_counts.keys()),
+            most_used_agent=max(self.agent_counts.items(), key=lambda x: x[1])[0] if self.agent_counts else "none",
+            real_ai_requests=self.real_ai_requests,
+            p50_response_time=self.latency.percentile(50),
+            p90_response_time=self.latency.percentile(90),
+            p99_response_time=self.latency.percentile(99),
+            max_response_time=self.latency.max or 0.0,
+            cached_requests=self.cached_requests,
+            coalesced_requests=self.coalesced_requests
+        )
+
+def estimate_cost(model: str, prompt_tokens: int, completion_tokens: int) -> float:
+    """Estimated OpenAI cost in USD for a token count"""
+    # Basic OpenAI pricing (as of 2024 - approximate)
+    if 'gpt-4' in model.lower():
+        prompt_cost = prompt_tokens * 0.00003  # $0.03 per 1K tokens
+        completion_cost = completion_tokens * 0.00006  # $0.06 per 1K tokens
+    elif 'gpt-3.5-turbo' in model.lower():
+        prompt_cost = prompt_tokens * 0.0000015  # $0.0015 per 1K tokens
+        completion_cost = completion_tokens * 0.000002  # $0.002 per 1K tokens
+    else:
+        # Default pricing
+        prompt_cost = prompt_tokens * 0.000001
+        completion_cost = completion_tokens * 0.000001
+    
+    return prompt_cost + completion_cost
+
+@contextmanager
+def _locked(f):
+    """Hold an exclusive advisory lock on an open file across processes"""
+    if fcntl is None:
+        yield
+        return
+    fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+    try:
+        yield
+    finally:
+        fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+def _replay_log(entries_file: Path, offset: int, fold: Callable[['UsageEntry'], None]) -> int:
+    """
+    Fold every complete entry written to a day's log after `offset`
+    
+    Returns the offset just past the last complete line, so a write still in
+    progress in another process is picked up by the next call.
+    """
+    try:
+        if entries_file.stat().st_size <= offset:
+            return offset
+        with open(entries_file, 'rb') as f:
+            f.seek(offset)
+            for line in f:
+                if not line.endswith(b'\n'):
+                    break
+                offset += len(line)
+                try:
+                    fold(UsageEntry(**json.loads(line)))
+                except (ValueError, TypeError) as e:
+                    print(f"Warning: Skipping malformed usage entry in {entries_file.name}: {e}")
+    except FileNotFoundError:
+        pass
+    return offset
+
+@dataclass
+class MonthlyRollup:
+    """Pre-aggregated usage for one calendar month at month, day and hour granularity"""
+    month: str
+    aggregates: UsageAggregates
+    days: Dict[str, UsageAggregates] = field(default_factory=dict)
+    hours: Dict[str, UsageAggregates] = field(default_factory=dict)
+    # Byte offset into each day's log up to which entries are folded in
+    entries_offsets: Dict[str, int] = field(default_factory=dict)
+    
+    def add(self, entry: 'UsageEntry'):
+        day, hour = entry.timestamp[:10], entry.timestamp[:13]
+        self.aggregates.add(entry)
+        self.days.setdefault(day, UsageAggregates(date=day)).add(entry)
+        self.hours.setdefault(hour, UsageAggregates(date=hour)).add(entry, latency_by_key=False)
+    
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'month': self.month,
+            'aggregates': asdict(self.aggregates),
+            'days': {day: asdict(agg) for day, agg in self.days.items()},
+            'hours': {hour: asdict(agg) for hour, agg in self.hours.items()},
+            'entries_offsets': self.entries_offsets
+        }
+    
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> 'MonthlyRollup':
+        return cls(
+            month=data['month'],
+            aggregates=UsageAggregates.from_dict(data['aggregates']),
+            days={day: UsageAggregates.from_dict(agg) for day, agg in data.get('days', {}).items()},
+            hours={hour: UsageAggregates.from_dict(agg) for hour, agg in data.get('hours', {}).items()},
+            entries_offsets=data.get('entries_offsets', {})
+        )
+
+class UsageRollups:
+    """
+    Hourly, daily and monthly usage aggregates maintained as entries arrive
+    
+    Each month lives in one file under monthly/, so a stats query costs one read
+    per month touched no matter how many requests were logged. Like the daily
+    snapshots, each file records how far into every day's log it has folded.
+    The logs are shared by all worker processes, so buckets are only ever fed
+    by tailing them. A rollup file saved by another process that has folded
+    further than the cached copy replaces it before the tail is replayed.
+    """
+    
+    def __init__(self, usage_dir: Path, max_cached_months: int = 24):
+        self.daily_dir = usage_dir / 'daily'
+        self.monthly_dir = usage_dir / 'monthly'
+        self.max_cached_months = max_cached_months
+        self._months: 'OrderedDict[str, MonthlyRollup]' = OrderedDict()
+        self._dirty = set()
+        # mtime_ns of each rollup file as last loaded or saved by this process
+        self._file_versions: Dict[str, int] = {}
+    
+    def _rollup_file(self, month: str) -> Path:
+        return self.monthly_dir / f'{month}.json'
+    
+    def _get_month(self, month: str) -> MonthlyRollup:
+        """Return a month's rollup, caught up with its day logs"""
+        rollup = self._months.get(month)
+        if rollup is None:
+            rollup = self._load_month(month) or MonthlyRollup(month=month, aggregates=UsageAggregates(date=month))
+            self._months[month] = rollup
+            # Evicting is always safe: file plus log tail rebuilds the same state
+            while len(self._months) > self.max_cached_months:
+                evicted, _ = self._months.popitem(last=False)
+                self._dirty.discard(evicted)
+        else:
+            self._months.move_to_end(month)
+            saved = self._load_month(month, only_if_changed=True)
+            if saved and sum(saved.entries_offsets.values()) > sum(rollup.entries_offsets.values()):
+                rollup = self._months[month] = saved
+        
+        self._catch_up(rollup)
+        return rollup
+    
+    def refresh(self, months: Iterable[str]):
+        """Fold newly logged entries into the given months"""
+        for month in months:
+            self._get_month(month)
+    
+    def _load_month(self, month: str, only_if_changed: bool = False) -> Optional[MonthlyRollup]:
+        """Load a month's rollup file, optionally only if it changed since we last saw it"""
+        rollup_file = self._rollup_file(month)
+        try:
+            version = rollup_file.stat().st_mtime_ns
+            if only_if_changed and self._file_versions.get(month) == version:
+                return None
+            with open(rollup_file, 'r') as f:
+                rollup = MonthlyRollup.from_dict(json.load(f))
+            self._file_versions[month] = version
+            return rollup
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            print(f"Warning: Could not load usage rollup for {month}, rebuilding: {e}")
+            return None
+    
+    def _catch_up(self, rollup: MonthlyRollup):
+        """Replay log entries appended after the rollup's recorded offsets"""
+        for entries_file in sorted(self.daily_dir.glob(f'{rollup.month}-*.jsonl')):
+            day = entries_file.stem
+            offset = rollup.entries_offsets.get(day, 0)
+            new_offset = _replay_log(entries_file, offset, rollup.add)
+            if new_offset != offset:
+                rollup.entries_offsets[day] = new_offset
+                self._dirty.add(rollup.month)
+    
+    def save(self):
+        """Persist months changed since the last save"""
+        for month in sorted(self._dirty):
+            rollup_file = self._rollup_file(month)
+            # Per-process temp name: concurrent workers each publish a consistent file
+            tmp_file = rollup_file.with_suffix(f'.json.{os.getpid()}.tmp')
+            try:
+                with open(tmp_file, 'w') as f:
+                    json.dump(self._months[month].to_dict(), f)
+                os.replace(tmp_file, rollup_file)
+                self._file_versions[month] = rollup_file.stat().st_mtime_ns
+            except Exception as e:
+                print(f"Warning: Could not save usage rollup for {month}: {e}")
+                return
+        self._dirty.clear()
+    
+    def _available_months(self) -> set:
+        """Months that have either a rollup file or logged entries"""
+        months = set(self._months)
+        months.update(name[:7] for name in os.listdir(self.daily_dir) if name.endswith('.jsonl'))
+        months.update(name[:7] for name in os.listdir(self.monthly_dir) if name.endswith('.json'))
+        return months
+    
+    def get_range(self, start_day: str, end_day: str) -> Tuple[List[UsageAggregates], UsageAggregates]:
+        """
+        Day buckets between start_day and end_day (inclusive), oldest first, plus their total
+        
+        Months entirely inside the range contribute their monthly aggregate; only the
+        boundary months are summed day by day.
+        """
+        start_month, end_month = start_day[:7], end_day[:7]
+        total = UsageAggregates(date=f'{start_day}/{end_day}')
+        days: List[UsageAggregates] = []
+        
+        for month in sorted(self._available_months()):
+            if not start_month <= month <= end_month:
+                continue
+            rollup = self._get_month(month)
+            in_range = [agg for day, agg in sorted(rollup.days.items()) if start_day <= day <= end_day]
+            days.extend(in_range)
+            if start_month < month < end_month:
+                total.merge(rollup.aggregates)
+            else:
+                for agg in in_range:
+                    total.merge(agg)
+        
+        return days, total
+    
+    def get_month(self, month: str) -> Optional[MonthlyRollup]:
+        if month not in self._available_months():
+            return None
+        return self._get_month(month)
+    
+    def get_hours(self, day: str) -> List[UsageAggregates]:
+        """Hour buckets for a day, oldest first"""
+        rollup = self.get_month(day[:7])
+        if rollup is None:
+            return []
+        return [agg for hour, agg in sorted(rollup.hours.items()) if hour.startswith(day)]
 
 class UsageTracker:
     """
     Comprehensive usage tracking for COAI system
+    
+    Safe to run in several worker processes against one usage directory. Each
+    batch is appended to the shared day log under an exclusive file lock, and
+    aggregates are only ever built by tailing those logs, so every worker's
+    totals include every other worker's entries. One worker at a time (the
+    holder of .leader.lock) folds the logs as they grow and publishes the
+    snapshots and rollups; the others just append, and on a read adopt the
+    latest published state and replay the short tail behind it.
     """
     
-    def __init__(self):
-        self.usage_dir = self._setup_usage_directory()
-        self.current_session = []
+    def __init__(self, usage_dir: str = None):
+        self.usage_dir = self._setup_usage_directory(usage_dir)
         self.lock = threading.Lock()
+        
+        # Summaries are snapshotted every N entries or T seconds, whichever comes first
+        self.snapshot_every = int(os.getenv('USAGE_SNAPSHOT_EVERY', '50'))
+        self.snapshot_interval = float(os.getenv('USAGE_SNAPSHOT_INTERVAL', '30'))
+        self._unsnapshotted = 0
+        self._last_snapshot = time.monotonic()
+        self._snapshot_version = None
+        self._leader_file = None
+        self._leader_pid = None
+        self.aggregates, self.aggregates_offset = UsageAggregates(date=date.today().isoformat()), 0
+        
+        # Legacy full-day files are read as they are; migrate_legacy_days() runs at server start
         self._load_today_data()
+        
+        # Pre-aggregated hourly/daily/monthly buckets serving the stats endpoints
+        self.rollups = UsageRollups(self.usage_dir)
+        
+        # Indexed analytics store behind /api/usage/query; a secondary index of the daily
+        # logs (the source of truth), backfilled on open with whatever it missed
+        self.store = None
+        if os.getenv('USAGE_SQLITE_ENABLED', 'true').lower() == 'true':
+            try:
+                self.store = UsageStore(self.usage_dir / 'usage.db')
+                import_daily_files(self.store, self.usage_dir / 'daily')
+            except Exception as e:
+                print(f"Warning: Could not open usage database, falling back to daily files: {e}")
+                self.store = None
+        
+        # Entries are persisted in batches by a background writer
+        self.writer = WriteBehindQueue("usage_tracker", self._write_entries)
     
-    def _setup_usage_directory(self) -> Path:
+    def _setup_usage_directory(self, usage_dir: str = None) -> Path:
         """Setup usage tracking directory structure"""
-        base_dir = Path(__file__).parent.parent / '.coai' / 'usage'
+        usage_dir = usage_dir or os.getenv('USAGE_DIR')
+        base_dir = Path(usage_dir) if usage_dir else Path(__file__).parent.parent / '.coai' / 'usage'
         base_dir.mkdir(parents=True, exist_ok=True)
         
         # Create subdirectories
@@ -69,21 +478,88 @@ class UsageTracker:
         
         return base_dir
     
+    def _entries_file(self, day: str) -> Path:
+        """Append-only entry log for a day"""
+        return self.usage_dir / 'daily' / f'{day}.jsonl'
+    
+    def _summary_file(self, day: str) -> Path:
+        """Summary snapshot for a day (legacy days also hold their entries here)"""
+        return self.usage_dir / 'daily' / f'{day}.json'
+    
+    def migrate_legacy_days(self) -> int:
+        """
+        Copy the entries of legacy full-day .json files into day logs, so rollups
+        and the usage database cover those days too
+        
+        Only new .jsonl logs are written; the legacy files are left as they are
+        and their summaries are then rebuilt from the log. Called when a server
+        starts (and by `python -m app.usage_tracker migrate`), never on import.
+        
+        Returns:
+            Number of days migrated
+        """
+        migrated = 0
+        names = set(os.listdir(self.usage_dir / 'daily'))
+        for name in sorted(names):
+            if not name.endswith('.json') or name[:-len('.json')] + '.jsonl' in names:
+                continue
+            try:
+                with open(self.usage_dir / 'daily' / name, 'r') as f:
+                    data = json.load(f)
+            except Exception as e:
+                print(f"Warning: Could not read legacy usage file {name}: {e}")
+                continue
+            if 'entries' in data and 'aggregates' not in data:
+                migrated += self._migrate_legacy_day(name[:-len('.json')], data['entries'])
+        return migrated
+    
     def _load_today_data(self):
-        """Load today's usage data"""
-        today = date.today().isoformat()
-        today_file = self.usage_dir / 'daily' / f'{today}.json'
-        
-        if today_file.exists():
+        """Restore today's running aggregates from the last snapshot plus the log tail"""
+        self.aggregates, self.aggregates_offset = self._load_aggregates(date.today().isoformat())
+    
+    def _load_aggregates(self, day: str, replay: bool = True) -> Tuple[UsageAggregates, int]:
+        """
+        Rebuild a day's aggregates, replaying only entries newer than the snapshot
+        
+        Args:
+            day: Day to load (YYYY-MM-DD)
+            replay: Fold in log entries past the snapshot (False returns the snapshot as is)
+        
+        Returns:
+            The aggregates and the log offset they are complete up to
+        """
+        aggregates = UsageAggregates(date=day)
+        offset = 0
+        summary_file = self._summary_file(day)
+        
+        if summary_file.exists():
             try:
-                with open(today_file, 'r') as f:
+                with open(summary_file, 'r') as f:
                     data = json.load(f)
-                    self.current_session = [UsageEntry(**entry) for entry in data.get('entries', [])]
+                if 'aggregates' in data:
+                    aggregates = UsageAggregates.from_dict(data['aggregates'])
+                    offset = data.get('entries_offset', 0)
+                elif 'entries' in data and not self._entries_file(day).exists():
+                    # Legacy full-day file not migrated yet: its entries are the whole day
+                    for entry in data['entries']:
+                        aggregates.add(UsageEntry(**entry))
             except Exception as e:
-                print(f"Warning: Could not load today's usage data: {e}")
-                self.current_session = []
-        else:
-            self.current_session = []
+                print(f"Warning: Could not load usage snapshot for {day}: {e}")
+                aggregates, offset = UsageAggregates(date=day), 0
+        
+        if replay:
+            offset = _replay_log(self._entries_file(day), offset, aggregates.add)
+        
+        return aggregates, offset
+    
+    def _migrate_legacy_day(self, day: str, entries: List[Dict[str, Any]]) -> bool:
+        """Move a legacy full-day file's entries into the append-only log, exactly once"""
+        with open(self.usage_dir / '.migrate.lock', 'a') as lock_file, _locked(lock_file):
+            # Another worker may have migrated this day while we were reading it
+            if self._entries_file(day).exists():
+                return False
+            self._append_entries(day, [UsageEntry(**entry) for entry in entries])
+            return True
     
     def track_request(
         self,
@@ -97,12 +573,17 @@ class UsageTracker:
         response_time: float,
         status: str,
         real_ai: bool,
-        error: str = None
+        error: str = None,
+        cached: bool = False,
+        coalesced: bool = False
     ) -> UsageEntry:
-        """Track a single API request"""
+        """
+        Track a single API request; `cached` marks a reply served from the
+        response cache, `coalesced` one shared with an identical concurrent request
+        """
         
         # Calculate cost estimate (basic OpenAI pricing)
-        cost_estimate = self._calculate_cost(tokens_data, agent_type, real_ai)
+        cost_estimate = 0.0 if cached or coalesced else self._calculate_cost(tokens_data, agent_type, real_ai)
         
         # Create usage entry
         entry = UsageEntry(
@@ -121,129 +602,265 @@ class UsageTracker:
             response_time=response_time,
             status=status,
             real_ai=real_ai,
-            error=error
+            error=error,
+            cached=cached,
+            coalesced=coalesced
         )
         
-        # Thread-safe addition
-        with self.lock:
-            self.current_session.append(entry)
-            self._save_today_data()
+        # Persisted asynchronously; the request path only pays for the enqueue
+        self.writer.submit(entry)
         
         return entry
     
+    def _write_entries(self, entries: List[UsageEntry]):
+        """Persist a batch of queued usage entries"""
+        with self.lock:
+            by_day: Dict[str, List[UsageEntry]] = {}
+            for entry in entries:
+                by_day.setdefault(entry.timestamp[:10], []).append(entry)
+            
+            for day in by_day:
+                self._append_entries(day, by_day[day])
+            
+            if self._is_leader():
+                for day in by_day:
+                    if day < self.aggregates.date:
+                        # Late entries for a past day: refresh that day's snapshot from its log
+                        self._save_snapshot(*self._load_aggregates(day))
+                
+                self._unsnapshotted += self._refresh()
+                self.rollups.refresh({day[:7] for day in by_day})
+                
+                if (self._unsnapshotted >= self.snapshot_every
+                        or time.monotonic() - self._last_snapshot >= self.snapshot_interval):
+                    self._save_today_data()
+        
+        if self.store:
+            try:
+                self.store.insert_entries([asdict(entry) for entry in entries])
+            except Exception as e:
+                print(f"Warning: Could not write usage data to database: {e}")
+    
+    def _is_leader(self) -> bool:
+        """Whether this process maintains the shared snapshots and rollups"""
+        if fcntl is None:
+            return True
+        if self._leader_pid != os.getpid():
+            # Never inherit leadership across a fork; the lock belongs to the parent
+            self._leader_file, self._leader_pid = None, os.getpid()
+        if self._leader_file is None:
+            lock_file = open(self.usage_dir / '.leader.lock', 'a')
+            try:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+                self._leader_file = lock_file
+            except OSError:
+                lock_file.close()
+        return self._leader_file is not None
+    
+    def _refresh(self) -> int:
+        """
+        Fold entries any process appended to today's log; caller holds self.lock
+        
+        Returns:
+            Number of entries folded in
+        """
+        version = self._snapshot_file_version(self.aggregates.date)
+        if version is not None and version != self._snapshot_version:
+            # Another worker published a snapshot; adopt it if it has folded further
+            saved, saved_offset = self._load_aggregates(self.aggregates.date, replay=False)
+            self._snapshot_version = version
+            if saved_offset > self.aggregates_offset:
+                self.aggregates, self.aggregates_offset = saved, saved_offset
+        
+        before = self.aggregates.total_requests
+        self.aggregates_offset = _replay_log(
+            self._entries_file(self.aggregates.date), self.aggregates_offset, self.aggregates.add
+        )
+        folded = self.aggregates.total_requests - before
+        
+        today = date.today().isoformat()
+        if today > self.aggregates.date:
+            # Day rolled over: seal the previous day's snapshot and start from today's
+            if self._is_leader():
+                self._save_today_data()
+            self.aggregates, self.aggregates_offset = self._load_aggregates(today)
+        
+        return folded
+    
+    def _snapshot_file_version(self, day: str) -> Optional[int]:
+        try:
+            return self._summary_file(day).stat().st_mtime_ns
+        except FileNotFoundError:
+            return None
+    
+    def _append_entries(self, day: str, entries: List[UsageEntry]):
+        """Append entries to the day's JSONL log in a single locked write"""
+        data = ''.join(json.dumps(asdict(entry)) + '\n' for entry in entries)
+        try:
+            with open(self._entries_file(day), 'a', encoding='utf-8') as f, _locked(f):
+                f.write(data)
+        except Exception as e:
+            print(f"Warning: Could not append usage data: {e}")
+    
     def _calculate_cost(self, tokens_data: Dict[str, Any], agent_type: str, real_ai: bool) -> float:
         """Calculate estimated cost for the request"""
         
         if not real_ai or agent_type != 'openai':
             return 0.0  # Mock responses are free
         
-        model = tokens_data.get('model', 'gpt-3.5-turbo')
-        prompt_tokens = tokens_data.get('prompt_tokens', 0)
-        completion_tokens = tokens_data.get('completion_tokens', 0)
-        
-        # Basic OpenAI pricing (as of 2024 - approximate)
-        if 'gpt-4' in model.lower():
-            prompt_cost = prompt_tokens * 0.00003  # $0.03 per 1K tokens
-            completion_cost = completion_tokens * 0.00006  # $0.06 per 1K tokens
-        elif 'gpt-3.5-turbo' in model.lower():
-            prompt_cost = prompt_tokens * 0.0000015  # $0.0015 per 1K tokens
-            completion_cost = completion_tokens * 0.000002  # $0.002 per 1K tokens
-        else:
-            # Default pricing
-            prompt_cost = prompt_tokens * 0.000001
-            completion_cost = completion_tokens * 0.000001
-        
-        return prompt_cost + completion_cost
+        return estimate_cost(
+            tokens_data.get('model', 'gpt-3.5-turbo'),
+            tokens_data.get('prompt_tokens', 0),
+            tokens_data.get('completion_tokens', 0)
+        )
     
     def _save_today_data(self):
-        """Save today's usage data to file"""
-        today = date.today().isoformat()
-        today_file = self.usage_dir / 'daily' / f'{today}.json'
-        
-        # Create daily summary
-        summary = self._generate_daily_summary()
+        """Snapshot the running aggregates for the current day"""
+        self.rollups.save()
+        if self._save_snapshot(self.aggregates, self.aggregates_offset):
+            self._unsnapshotted = 0
+            self._last_snapshot = time.monotonic()
+    
+    def _save_snapshot(self, aggregates: UsageAggregates, entries_offset: int) -> bool:
+        """Atomically write a day's summary snapshot"""
+        day = aggregates.date
         
         data = {
-            'date': today,
-            'summary': asdict(summary),
-            'entries': [asdict(entry) for entry in self.current_session]
+            'date': day,
+            'summary': asdict(aggregates.to_summary()),
+            'aggregates': asdict(aggregates),
+            # Entries beyond this offset are replayed on startup
+            'entries_offset': entries_offset
         }
         
+        summary_file = self._summary_file(day)
+        # Per-process temp name: concurrent workers each publish a consistent snapshot
+        tmp_file = summary_file.with_suffix(f'.json.{os.getpid()}.tmp')
         try:
-            with open(today_file, 'w') as f:
+            with open(tmp_file, 'w') as f:
                 json.dump(data, f, indent=2)
+            os.replace(tmp_file, summary_file)
+            if day == self.aggregates.date:
+                self._snapshot_version = summary_file.stat().st_mtime_ns
+            return True
         except Exception as e:
             print(f"Warning: Could not save usage data: {e}")
-    
-    def _generate_daily_summary(self) -> DailySummary:
-        """Generate summary for current day"""
-        
-        if not self.current_session:
-            return DailySummary(
-                date=date.today().isoformat(),
-                total_requests=0,
-                successful_requests=0,
-                failed_requests=0,
-                total_tokens=0,
-                total_cost=0.0,
-                avg_response_time=0.0,
-                projects_used=[],
-                most_used_agent="none",
-                real_ai_requests=0
-            )
-        
-        successful = [e for e in self.current_session if e.status == 'success']
-        failed = [e for e in self.current_session if e.status != 'success']
-        real_ai_entries = [e for e in self.current_session if e.real_ai]
-        
-        # Calculate metrics
-        total_tokens = sum(e.tokens_used for e in self.current_session)
-        total_cost = sum(e.cost_estimate for e in self.current_session)
-        avg_response_time = sum(e.response_time for e in self.current_session) / len(self.current_session)
-        
-        # Find most used project and agent
-        projects = list(set(e.project for e in self.current_session))
-        agent_counts = {}
-        for entry in self.current_session:
-            agent_counts[entry.agent_type] = agent_counts.get(entry.agent_type, 0) + 1
-        
-        most_used_agent = max(agent_counts.items(), key=lambda x: x[1])[0] if agent_counts else "none"
-        
-        return DailySummary(
-            date=date.today().isoformat(),
-            total_requests=len(self.current_session),
-            successful_requests=len(successful),
-            failed_requests=len(failed),
-            total_tokens=total_tokens,
-            total_cost=total_cost,
-            avg_response_time=avg_response_time,
-            projects_used=projects,
-            most_used_agent=most_used_agent,
-            real_ai_requests=len(real_ai_entries)
-        )
+            return False
     
     def get_daily_summary(self, target_date: str = None) -> Optional[DailySummary]:
         """Get summary for a specific date"""
         
-        if target_date is None:
-            return self._generate_daily_summary()
+        self.writer.flush()
+        
+        with self.lock:
+            self._refresh()
+            if target_date is None or target_date == self.aggregates.date:
+                return self.aggregates.to_summary()
         
-        daily_file = self.usage_dir / 'daily' / f'{target_date}.json'
-        if not daily_file.exists():
+        if not self._summary_file(target_date).exists() and not self._entries_file(target_date).exists():
             return None
         
         try:
-            with open(daily_file, 'r') as f:
-                data = json.load(f)
-                return DailySummary(**data['summary'])
+            # Snapshot plus any entries logged after it (normally none for past days)
+            return self._load_aggregates(target_date)[0].to_summary()
         except Exception as e:
             print(f"Error loading daily summary: {e}")
             return None
     
     def get_usage_stats(self, days: int = 7) -> Dict[str, Any]:
-        """Get usage statistics for the last N days"""
+        """Get usage statistics for the last N days, served from the rollups"""
+        
+        self.writer.flush()
+        
+        stats = self._empty_stats(days)
+        today = date.today()
+        start = (today - timedelta(days=days - 1)).isoformat()
+        with self.lock:
+            day_aggregates, totals = self.rollups.get_range(start, today.isoformat())
+        
+        day_aggregates = [agg for agg in day_aggregates if agg.total_requests]
+        if not day_aggregates:
+            return stats
+        
+        # Newest first
+        stats['daily_summaries'] = [asdict(agg.to_summary()) for agg in reversed(day_aggregates)]
+        
+        valid_days = len(day_aggregates)
+        stats['totals'] = {
+            'requests': totals.total_requests,
+            'tokens': totals.total_tokens,
+            'cost': totals.total_cost,
+            'real_ai_requests': totals.real_ai_requests
+        }
+        stats['averages'] = {
+            'requests_per_day': totals.total_requests / valid_days,
+            'tokens_per_day': totals.total_tokens / valid_days,
+            'cost_per_day': totals.total_cost / valid_days,
+            # Per-request mean, not a mean of daily means
+            'response_time': totals.response_time_sum / totals.total_requests
+        }
+        stats['latency'] = totals.latency_summary()
+        stats['trends'] = {
+            'most_active_projects': sorted(
+                totals.project_counts.items(), key=lambda x: x[1], reverse=True
+            )[:5],
+            'agent_usage': totals.agent_counts,
+            'peak_hours': [
+                {'hour': hour, 'requests': count}
+                for hour, count in sorted(
+                    enumerate(totals.hour_counts), key=lambda x: x[1], reverse=True
+                )[:3]
+                if count
+            ]
+        }
+        return stats
+    
+    def get_latency_stats(self, start_date: str, end_date: str) -> Dict[str, Any]:
+        """Latency percentiles over a date range, overall and per agent type, model and project"""
+        
+        self.writer.flush()
+        
+        with self.lock:
+            _, totals = self.rollups.get_range(start_date, end_date)
+        return totals.latency_summary()
+    
+    def get_monthly_summary(self, month: str) -> Optional[Dict[str, Any]]:
+        """Get the rolled-up summary for a month (YYYY-MM) with its per-day breakdown"""
+        
+        self.writer.flush()
+        
+        with self.lock:
+            rollup = self.rollups.get_month(month)
+            if rollup is None or not rollup.aggregates.total_requests:
+                return None
+            return {
+                'summary': asdict(rollup.aggregates.to_summary()),
+                'daily': [asdict(agg.to_summary()) for _, agg in sorted(rollup.days.items())]
+            }
+    
+    def get_hourly_usage(self, day: str) -> List[Dict[str, Any]]:
+        """Per-hour request, token, cost and latency totals for a day"""
         
-        stats = {
+        self.writer.flush()
+        
+        with self.lock:
+            hours = self.rollups.get_hours(day)
+            return [
+                {
+                    'hour': agg.date,
+                    'requests': agg.total_requests,
+                    'tokens': agg.total_tokens,
+                    'cost': agg.total_cost,
+                    'avg_response_time': agg.response_time_sum / agg.total_requests,
+                    'latency': agg.latency.summary()
+                }
+                for agg in hours
+                if agg.total_requests
+            ]
+    
+    def _empty_stats(self, days: int) -> Dict[str, Any]:
+        """Stats response skeleton"""
+        return {
             'period_days': days,
             'daily_summaries': [],
             'totals': {
@@ -262,118 +879,104 @@ class UsageTracker:
                 'most_active_projects': [],
                 'agent_usage': {},
                 'peak_hours': []
-            }
-        }
-        
-        # Collect data for the last N days
-        from datetime import timedelta
-        today = date.today()
-        
-        valid_days = 0
-        total_response_times = []
-        project_counts = {}
-        agent_counts = {}
-        hourly_usage = [0] * 24
-        
-        for i in range(days):
-            check_date = today - timedelta(days=i)
-            daily_summary = self.get_daily_summary(check_date.isoformat())
-            
-            if daily_summary and daily_summary.total_requests > 0:
-                valid_days += 1
-                stats['daily_summaries'].append(asdict(daily_summary))
-                
-                # Update totals
-                stats['totals']['requests'] += daily_summary.total_requests
-                stats['totals']['tokens'] += daily_summary.total_tokens
-                stats['totals']['cost'] += daily_summary.total_cost
-                stats['totals']['real_ai_requests'] += daily_summary.real_ai_requests
-                
-                # Collect data for trends
-                for project in daily_summary.projects_used:
-                    project_counts[project] = project_counts.get(project, 0) + 1
-                
-                agent_counts[daily_summary.most_used_agent] = agent_counts.get(
-                    daily_summary.most_used_agent, 0
-                ) + 1
-                
-                total_response_times.append(daily_summary.avg_response_time)
-        
-        # Calculate averages
-        if valid_days > 0:
-            stats['averages']['requests_per_day'] = stats['totals']['requests'] / valid_days
-            stats['averages']['tokens_per_day'] = stats['totals']['tokens'] / valid_days
-            stats['averages']['cost_per_day'] = stats['totals']['cost'] / valid_days
-            
-            if total_response_times:
-                stats['averages']['response_time'] = sum(total_response_times) / len(total_response_times)
-        
-        # Generate trends
-        stats['trends']['most_active_projects'] = sorted(
-            project_counts.items(), key=lambda x: x[1], reverse=True
-        )[:5]
-        
-        stats['trends']['agent_usage'] = agent_counts
-        
-        return stats
-    
-    def export_usage_data(self, start_date: str, end_date: str, format: str = 'json') -> str:
-        """Export usage data for a date range"""
-        
-        from datetime import datetime as dt
-        start = dt.fromisoformat(start_date).date()
-        end = dt.fromisoformat(end_date).date()
-        
-        export_data = {
-            'export_info': {
-                'start_date': start_date,
-                'end_date': end_date,
-                'export_timestamp': datetime.now().isoformat(),
-                'format': format
             },
-            'daily_data': []
+            'latency': UsageAggregates(date='').latency_summary()
         }
+    
+    def query_usage(
+        self,
+        start: str,
+        end: str,
+        group_by: List[str] = None,
+        filters: Dict[str, str] = None
+    ) -> List[Dict[str, Any]]:
+        """Group-by usage query over an arbitrary [start, end) range"""
+        if not self.store:
+            raise RuntimeError("Usage database is disabled (USAGE_SQLITE_ENABLED=false)")
+        self.writer.flush()
+        return self.store.query(start, end, group_by, filters)
+    
+    def iter_export(
+        self,
+        start_date: str,
+        end_date: str,
+        format: str = 'jsonl',
+        compress: bool = False,
+        chunk_size: int = 64 * 1024
+    ) -> Iterator[bytes]:
+        """
+        Stream usage entries for a date range as JSON Lines or CSV
+        
+        Entries are read line by line from the daily logs and emitted in chunks of
+        roughly `chunk_size` bytes, so memory stays flat however long the range is.
+        Arguments are validated up front; the returned generator does the I/O.
+        
+        Args:
+            start_date: First day (YYYY-MM-DD), inclusive
+            end_date: Last day (YYYY-MM-DD), inclusive
+            format: 'jsonl' or 'csv'
+            compress: Gzip the stream
+            chunk_size: Approximate size of each yielded chunk before compression
+        """
+        if format not in EXPORT_FORMATS:
+            raise ValueError(f"format must be one of: {', '.join(EXPORT_FORMATS)}")
+        start = date.fromisoformat(start_date)
+        end = date.fromisoformat(end_date)
+        if end < start:
+            raise ValueError("end_date must not be before start_date")
+        
+        self.writer.flush()
+        
+        chunks = self._iter_export_chunks(start, end, format, chunk_size)
+        return _gzip_chunks(chunks) if compress else chunks
+    
+    def _iter_export_chunks(self, start: date, end: date, format: str, chunk_size: int) -> Iterator[bytes]:
+        buffer = io.StringIO()
+        csv_writer = None
+        if format == 'csv':
+            csv_writer = csv.DictWriter(
+                buffer, fieldnames=[f.name for f in fields(UsageEntry)], extrasaction='ignore'
+            )
+            csv_writer.writeheader()
         
         current = start
         while current <= end:
-            daily_file = self.usage_dir / 'daily' / f'{current.isoformat()}.json'
-            if daily_file.exists():
-                try:
-                    with open(daily_file, 'r') as f:
-                        daily_data = json.load(f)
-                        export_data['daily_data'].append(daily_data)
-                except Exception as e:
-                    print(f"Warning: Could not load data for {current}: {e}")
-            
-            from datetime import timedelta
+            entries_file = self._entries_file(current.isoformat())
+            if entries_file.exists():
+                with open(entries_file, 'r', encoding='utf-8') as f:
+                    for line in f:
+                        if not line.endswith('\n'):
+                            break  # Torn final write
+                        if csv_writer:
+                            csv_writer.writerow(json.loads(line))
+                        else:
+                            buffer.write(line)
+                        
+                        if buffer.tell() >= chunk_size:
+                            yield buffer.getvalue().encode('utf-8')
+                            buffer.seek(0)
+                            buffer.truncate()
             current += timedelta(days=1)
         
-        # Save export file
-        export_filename = f"usage_export_{start_date}_to_{end_date}.{format}"
-        export_path = self.usage_dir / export_filename
-        
-        if format == 'json':
-            with open(export_path, 'w') as f:
-                json.dump(export_data, f, indent=2)
-        elif format == 'csv':
-            import csv
-            csv_path = self.usage_dir / f"usage_export_{start_date}_to_{end_date}.csv"
-            
-            with open(csv_path, 'w', newline='') as f:
-                if export_data['daily_data']:
-                    # Flatten all entries for CSV
-                    all_entries = []
-                    for daily in export_data['daily_data']:
-                        all_entries.extend(daily.get('entries', []))
-                    
-                    if all_entries:
-                        writer = csv.DictWriter(f, fieldnames=all_entries[0].keys())
-                        writer.writeheader()
-                        writer.writerows(all_entries)
-            
-            return str(csv_path)
-        
-        return str(export_path)
+        if buffer.tell():
+            yield buffer.getvalue().encode('utf-8')
+
+def _gzip_chunks(chunks: Iterator[bytes]) -> Iterator[bytes]:
+    """Gzip a byte stream incrementally"""
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)  # wbits=31 selects the gzip container
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
 
 # Global usage tracker instance
 usage_tracker = UsageTracker()
+
+if __name__ == "__main__":
+    # Usage: python -m app.usage_tracker migrate [usage_dir]
+    if sys.argv[1:2] != ["migrate"]:
+        sys.exit("Usage: python -m app.usage_tracker migrate [usage_dir]")
+    tracker = UsageTracker(sys.argv[2]) if len(sys.argv) > 2 else usage_tracker
+    print(f"Migrated {tracker.migrate_legacy_days()} legacy usage days in {tracker.usage_dir}")
+    tracker.writer.shutdown()
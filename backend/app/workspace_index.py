@@ -0,0 +1,232 @@
+"""
+COAI Workspace File Index
+Persistent per-directory listing cache, revalidated by directory mtime
+"""
+
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Directories never indexed (in addition to hidden ones)
+SKIPPED_DIRS = frozenset(['node_modules', '__pycache__', 'dist', 'build'])
+
+INDEX_VERSION = 2
+
+
+def is_skipped_dir(name: str) -> bool:
+    return name.startswith('.') or name in SKIPPED_DIRS
+
+
+class WorkspaceIndex:
+    """
+    Directory-by-directory listing of a workspace, kept on disk between runs
+
+    Each directory record holds its mtime_ns, its indexable subdirectories, the
+    names of its files with allowed extensions and their per-extension counts.
+    Adding, removing or renaming an entry bumps the parent directory's mtime,
+    so refresh() only re-scans directories whose mtime changed and reuses every
+    other record. invalidate() forces a re-scan.
+
+    refresh() itself is skipped when the index was validated less than
+    `revalidate_interval` seconds ago, which keeps warm lookups to a dict read.
+    """
+
+    def __init__(
+        self,
+        root: str,
+        extensions: Iterable[str],
+        cache_path: Optional[str] = None,
+        revalidate_interval: float = None
+    ):
+        self.root = os.path.abspath(root)
+        self.extensions = frozenset(extensions)
+        self.cache_path = cache_path
+        if revalidate_interval is None:
+            revalidate_interval = float(os.getenv('FILE_INDEX_REVALIDATE_SECONDS', '2.0'))
+        self.revalidate_interval = revalidate_interval
+        self.lock = threading.Lock()
+
+        # Relative dir path ('.' for the root) -> {"mtime_ns", "dirs", "files", "types"}
+        self.dirs: Dict[str, Dict[str, Any]] = {}
+        # Bumped whenever any record changes; lets callers cache derived views
+        self.generation = 0
+        self.validated_at = 0.0
+        self.stats = {"refreshes": 0, "dirs_scanned": 0, "dirs_reused": 0}
+
+        self._load()
+
+    # --- Persistence ---
+
+    def _load(self):
+        if not self.cache_path or not os.path.exists(self.cache_path):
+            return
+        try:
+            with open(self.cache_path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            if data.get("version") == INDEX_VERSION and data.get("root") == self.root \
+                    and sorted(data.get("extensions", [])) == sorted(self.extensions):
+                self.dirs = data["dirs"]
+        except Exception as e:
+            logger.warning(f"File index {self.cache_path} unreadable, rebuilding: {e}")
+
+    def _save(self):
+        if not self.cache_path:
+            return
+        try:
+            os.makedirs(os.path.dirname(self.cache_path), exist_ok=True)
+            tmp_path = f"{self.cache_path}.{os.getpid()}.tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump({
+                    "version": INDEX_VERSION,
+                    "root": self.root,
+                    "extensions": sorted(self.extensions),
+                    "dirs": self.dirs
+                }, f, separators=(',', ':'))
+            os.replace(tmp_path, self.cache_path)
+        except OSError as e:
+            logger.warning(f"Could not persist file index {self.cache_path}: {e}")
+
+    # --- Scanning ---
+
+    def _abs(self, rel_dir: str) -> str:
+        return self.root if rel_dir == '.' else os.path.join(self.root, rel_dir)
+
+    def _scan_dir(self, rel_dir: str, mtime_ns: int) -> Dict[str, Any]:
+        """
+        List one directory in a single os.scandir pass
+
+        The file/directory split comes from the DirEntry type (d_type on Linux),
+        so no per-entry stat is needed. Per-extension counts of visible files are
+        computed here, once per scan, so summaries never iterate file lists.
+        """
+        dirs: List[str] = []
+        files: List[str] = []
+        types: Dict[str, int] = {}
+        error = None
+        try:
+            with os.scandir(self._abs(rel_dir)) as entries:
+                for entry in entries:
+                    name = entry.name
+                    try:
+                        is_dir = entry.is_dir(follow_symlinks=False)
+                    except OSError:
+                        continue  # Entry vanished or is unreadable mid-scan
+                    if is_dir:
+                        if not is_skipped_dir(name):
+                            dirs.append(name)
+                        continue
+                    extension = os.path.splitext(name)[1].lower()
+                    if extension in self.extensions:
+                        files.append(name)
+                        if not name.startswith('.'):
+                            types[extension] = types.get(extension, 0) + 1
+        except PermissionError:
+            logger.warning(f"Permission denied accessing {self._abs(rel_dir)}")
+            error = "permission_denied"
+        dirs.sort()
+        files.sort()
+        record = {"mtime_ns": mtime_ns, "dirs": dirs, "files": files, "types": types}
+        if error:
+            record["error"] = error
+        return record
+
+    def refresh(self, force: bool = False) -> int:
+        """
+        Bring the index up to date with the filesystem
+
+        Args:
+            force: Revalidate even if the index was checked recently
+
+        Returns:
+            Number of directories re-scanned
+        """
+        with self.lock:
+            if not force and self.dirs and time.monotonic() - self.validated_at < self.revalidate_interval:
+                return 0
+
+            scanned = 0
+            seen = set()
+            pending = ['.']
+            while pending:
+                rel_dir = pending.pop()
+                try:
+                    mtime_ns = os.stat(self._abs(rel_dir)).st_mtime_ns
+                except OSError:
+                    continue
+                seen.add(rel_dir)
+
+                record = self.dirs.get(rel_dir)
+                if record is None or record["mtime_ns"] != mtime_ns:
+                    record = self.dirs[rel_dir] = self._scan_dir(rel_dir, mtime_ns)
+                    scanned += 1
+
+                for name in record["dirs"]:
+                    pending.append(name if rel_dir == '.' else os.path.join(rel_dir, name))
+
+            removed = [rel_dir for rel_dir in self.dirs if rel_dir not in seen]
+            for rel_dir in removed:
+                del self.dirs[rel_dir]
+
+            self.stats["refreshes"] += 1
+            self.stats["dirs_scanned"] += scanned
+            self.stats["dirs_reused"] += len(seen) - scanned
+            self.validated_at = time.monotonic()
+            if scanned or removed:
+                self.generation += 1
+                self._save()
+            return scanned
+
+    def invalidate(self, rel_dir: Optional[str] = None):
+        """Force the next refresh() to re-scan `rel_dir` (or everything)"""
+        with self.lock:
+            if rel_dir is None:
+                self.dirs = {}
+            else:
+                self.dirs.pop(os.path.normpath(rel_dir), None)
+            self.validated_at = 0.0
+
+    # --- Views ---
+
+    def get_dir(self, rel_dir: str = '.') -> Optional[Dict[str, Any]]:
+        return self.dirs.get(rel_dir)
+
+    def walk(self, rel_dir: str = '.', visit: Callable[[str, Dict[str, Any], int], bool] = None):
+        """
+        Depth-first, name-ordered traversal of indexed directories
+
+        `visit(rel_dir, record, depth)` is called for every directory; returning
+        False stops descent into its subdirectories.
+        """
+        stack = [(rel_dir, 0)]
+        while stack:
+            current, depth = stack.pop()
+            record = self.dirs.get(current)
+            if record is None:
+                continue
+            if visit(current, record, depth) is False:
+                continue
+            for name in reversed(record["dirs"]):
+                stack.append((name if current == '.' else os.path.join(current, name), depth + 1))
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            **self.stats,
+            "root": self.root,
+            "directories": len(self.dirs),
+            "files": sum(len(record["files"]) for record in self.dirs.values()),
+            "generation": self.generation
+        }
+
+
+def default_cache_path(root: str) -> str:
+    """Index file under backend/.coai/cache/file_index, one per indexed root"""
+    digest = hashlib.sha1(os.path.abspath(root).encode('utf-8')).hexdigest()[:16]
+    base_dir = Path(__file__).parent.parent / '.coai' / 'cache' / 'file_index'
+    return str(base_dir / f"{digest}.json")
@@ -0,0 +1,202 @@
+"""
+COAI Write-Behind Pipeline
+Bounded in-process queue that batches log and usage writes on a background thread
+"""
+
+import atexit
+import logging
+import os
+import threading
+import time
+from collections import deque
+from typing import Any, Callable, Dict, List
+
+logger = logging.getLogger(__name__)
+
+
+class WriteBehindQueue:
+    """
+    Moves blocking file writes off the request path
+
+    Producers call submit(), which only appends to an in-memory deque. A daemon
+    thread hands items to `flush_fn` in batches of up to `batch_size`, at least
+    every `flush_interval` seconds. When the queue is full the item is either
+    written on the caller's thread ("sync") or discarded ("drop"); both cases are
+    counted. Pending items are drained at interpreter exit.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        flush_fn: Callable[[List[Any]], None],
+        max_size: int = None,
+        batch_size: int = None,
+        flush_interval: float = None,
+        overflow_policy: str = None,
+        enabled: bool = None
+    ):
+        self.name = name
+        self.flush_fn = flush_fn
+        self.max_size = max_size or int(os.getenv('WRITE_BEHIND_MAX_QUEUE', '10000'))
+        self.batch_size = batch_size or int(os.getenv('WRITE_BEHIND_BATCH_SIZE', '100'))
+        self.flush_interval = flush_interval or float(os.getenv('WRITE_BEHIND_FLUSH_INTERVAL', '0.5'))
+        self.overflow_policy = overflow_policy or os.getenv('WRITE_BEHIND_OVERFLOW', 'sync')
+        if enabled is None:
+            enabled = os.getenv('WRITE_BEHIND_ENABLED', 'true').lower() == 'true'
+        self.enabled = enabled
+
+        self.stats = {
+            "submitted": 0,
+            "written": 0,
+            "batches": 0,
+            "overflows": 0,
+            "dropped": 0,
+            "errors": 0,
+            "max_queue_depth": 0
+        }
+
+        self._reset_state()
+        atexit.register(self.shutdown)
+
+    def _reset_state(self):
+        """(Re)initialise queue state; also used after a fork into a worker process"""
+        self._pid = os.getpid()
+        self._items = deque()
+        self._cond = threading.Condition()
+        self._enqueued = 0
+        self._completed = 0
+        self._flush_requested = False
+        self._stopping = False
+        self._thread = None
+
+    def _ensure_worker(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(
+                target=self._run, name=f"write-behind-{self.name}", daemon=True
+            )
+            self._thread.start()
+
+    def submit(self, item: Any) -> bool:
+        """
+        Queue an item for writing
+
+        Returns:
+            False if the item was dropped because the queue was full
+        """
+        if not self.enabled or self._stopping:
+            self._write([item])
+            return True
+
+        if self._pid != os.getpid():
+            self._reset_state()
+
+        with self._cond:
+            self._ensure_worker()
+            self.stats["submitted"] += 1
+
+            if len(self._items) >= self.max_size:
+                self.stats["overflows"] += 1
+                if self.overflow_policy == "drop":
+                    self.stats["dropped"] += 1
+                    logger.warning(f"Write-behind queue '{self.name}' full, dropping item")
+                    return False
+                overflow = True
+            else:
+                overflow = False
+                self._items.append(item)
+                self._enqueued += 1
+                self.stats["max_queue_depth"] = max(self.stats["max_queue_depth"], len(self._items))
+                if len(self._items) >= self.batch_size:
+                    self._cond.notify_all()
+
+        if overflow:
+            # Backpressure: the caller pays for its own write instead of losing it
+            self._write([item])
+        return True
+
+    def _run(self):
+        """Background flusher loop"""
+        while True:
+            with self._cond:
+                deadline = time.monotonic() + self.flush_interval
+                while (not self._stopping and not self._flush_requested
+                       and len(self._items) < self.batch_size):
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+
+                if not self._items:
+                    self._flush_requested = False
+                    if self._stopping:
+                        return
+                    continue
+
+                batch = [self._items.popleft() for _ in range(min(self.batch_size, len(self._items)))]
+
+            self._write(batch)
+
+            with self._cond:
+                self._completed += len(batch)
+                self._cond.notify_all()
+
+    def _write(self, batch: List[Any]):
+        try:
+            self.flush_fn(batch)
+            with self._cond:
+                self.stats["written"] += len(batch)
+                self.stats["batches"] += 1
+        except Exception as e:
+            with self._cond:
+                self.stats["errors"] += 1
+                self.stats["dropped"] += len(batch)
+            logger.error(f"Write-behind queue '{self.name}' failed to write {len(batch)} items: {e}")
+
+    def flush(self, timeout: float = 5.0) -> bool:
+        """
+        Block until everything queued before this call has been written
+
+        Returns:
+            True if the queue caught up within the timeout
+        """
+        if not self.enabled or self._thread is None or self._pid != os.getpid():
+            return True
+
+        with self._cond:
+            target = self._enqueued
+            if self._completed >= target:
+                return True
+            self._flush_requested = True
+            self._cond.notify_all()
+            return self._cond.wait_for(lambda: self._completed >= target, timeout)
+
+    def shutdown(self, timeout: float = 5.0):
+        """Drain pending items and stop the flusher thread"""
+        with self._cond:
+            self._stopping = True
+            self._cond.notify_all()
+            thread = self._thread
+
+        if thread is not None and thread.is_alive() and self._pid == os.getpid():
+            thread.join(timeout)
+
+        # Anything the thread could not drain in time is written inline
+        with self._cond:
+            remaining = list(self._items)
+            self._items.clear()
+        if remaining:
+            self._write(remaining)
+            with self._cond:
+                self._completed += len(remaining)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Return queue counters and configuration"""
+        return {
+            **self.stats,
+            "queue_depth": len(self._items),
+            "enabled": self.enabled,
+            "max_size": self.max_size,
+            "batch_size": self.batch_size,
+            "flush_interval": self.flush_interval,
+            "overflow_policy": self.overflow_policy
+        }
@@ -0,0 +1,9 @@
+from app.asgi_app import create_asgi_app
+
+app = create_asgi_app()
+
+if __name__ == "__main__":
+    import uvicorn
+    print("Starting async backend server...")
+    print("Open http://127.0.0.1:5000 in your browser.")
+    uvicorn.run(app, host="127.0.0.1", port=5000)
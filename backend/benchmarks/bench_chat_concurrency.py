@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+"""
+Chat Concurrency Load Test: sync (Flask on a thread pool) vs async (ASGI)
+Fires N concurrent /api/chat requests at each path, with the AI agent replaced
+by one that takes a fixed upstream latency, and reports throughput, latency
+percentiles and how many upstream calls were in flight at once.
+
+The sync path runs the Flask app on a pool of worker threads, as a threaded
+WSGI server would; the async path drives the ASGI app on one event loop. Both
+run with admission control out of the way; a last async run uses the default
+admission controller to show how much of the burst it sheds (fast 503s) and
+what the admitted requests see.
+
+Usage: python benchmarks/bench_chat_concurrency.py [concurrency] [latency_seconds] [sync_threads]
+"""
+
+import asyncio
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from main import app as flask_app
+from app import async_orchestrator as async_orchestrator_module
+from app import orchestrator as orchestrator_module
+from app.admission_control import AdmissionController, admission_controller
+from app.asgi_app import ASGIApp
+from app.security_middleware import rate_limiter
+
+
+class SlowAgents:
+    """AI agent manager with a fixed upstream latency, counting concurrent calls"""
+
+    def __init__(self, latency):
+        self.latency = latency
+        self.lock = threading.Lock()
+        self.in_flight = self.peak = 0
+
+    def _enter(self):
+        with self.lock:
+            self.in_flight += 1
+            self.peak = max(self.peak, self.in_flight)
+
+    def _exit(self):
+        with self.lock:
+            self.in_flight -= 1
+
+    def _result(self, request):
+        return {"status": "success", "agent_type": "openai", "response": f"Reply to {request['request_id']}",
+                "usage": {"prompt_tokens": 200, "completion_tokens": 50, "total_tokens": 250, "model": "gpt-4o"},
+                "real_ai": True}
+
+    def process_request(self, request):
+        self._enter()
+        time.sleep(self.latency)
+        self._exit()
+        return self._result(request)
+
+    async def aprocess_request(self, request):
+        self._enter()
+        await asyncio.sleep(self.latency)
+        self._exit()
+        return self._result(request)
+
+
+def body(n):
+    return {"message": f"Benchmark question {n}", "project": "demo-project", "file": "main.py"}
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    return ordered[min(int(len(ordered) * pct / 100), len(ordered) - 1)]
+
+
+def report(label, latencies, elapsed, agents):
+    print(f"{label:>24}: {len(latencies) / elapsed:7.1f} req/s, p50 {percentile(latencies, 50):6.2f}s, "
+          f"p99 {percentile(latencies, 99):6.2f}s, wall {elapsed:6.2f}s, peak upstream calls {agents.peak}")
+
+
+def run_sync(concurrency, threads, agents):
+    client = flask_app.test_client()
+
+    def one(n, submitted):
+        response = client.post('/api/chat', json=body(n))
+        assert response.status_code == 200, response.get_data(as_text=True)
+        # Counted from submission, so time spent queued for a free thread is included
+        return time.perf_counter() - submitted
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        futures = [pool.submit(one, n, time.perf_counter()) for n in range(concurrency)]
+        latencies = [future.result() for future in futures]
+    report(f"sync, {threads} threads", latencies, time.perf_counter() - started, agents)
+
+
+def run_async(concurrency, agents, admission, label):
+    app = ASGIApp(flask_app, admission=admission)
+    rejected = []
+
+    async def one(n):
+        payload = json.dumps(body(n)).encode()
+        scope = {"type": "http", "method": "POST", "path": "/api/chat", "query_string": b"", "root_path": "",
+                 "headers": [(b"content-type", b"application/json")], "client": ("127.0.0.1", 50000 + n)}
+        sent = []
+        delivered = False
+
+        async def receive():
+            nonlocal delivered
+            if not delivered:
+                delivered = True
+                return {"type": "http.request", "body": payload, "more_body": False}
+            await asyncio.sleep(3600)
+
+        async def send(message):
+            sent.append(message)
+
+        started = time.perf_counter()
+        await app(scope, receive, send)
+        if sent[0]["status"] == 503:
+            rejected.append(time.perf_counter() - started)
+            return None
+        assert sent[0]["status"] == 200, sent
+        return time.perf_counter() - started
+
+    async def burst():
+        return await asyncio.gather(*(one(n) for n in range(concurrency)))
+
+    started = time.perf_counter()
+    latencies = [latency for latency in asyncio.run(burst()) if latency is not None]
+    report(label, latencies, time.perf_counter() - started, agents)
+    if rejected:
+        print(f"{'':>24}  {len(rejected)} shed with 503 in p99 {percentile(rejected, 99) * 1000:.2f}ms")
+    app.executor.shutdown()
+
+
+def main(concurrency, latency, threads):
+    # Every request comes from one address here; the per-IP limit is not what is being measured
+    rate_limiter.is_allowed = lambda *args, **kwargs: True
+    logging.disable(logging.CRITICAL)  # Per-request log lines would dominate the run
+    print(f"{concurrency} concurrent chats, {latency:.2f}s simulated upstream latency")
+
+    agents = SlowAgents(latency)
+    orchestrator_module.ai_agent_manager = agents
+    admission_controller.enabled = False  # The thread pool is the only bound here
+    run_sync(concurrency, threads, agents)
+
+    unbounded = AdmissionController(initial_limit=concurrency, max_limit=concurrency, max_queue=concurrency)
+    agents = SlowAgents(latency)
+    async_orchestrator_module.ai_agent_manager = agents
+    run_async(concurrency, agents, unbounded, "async, one event loop")
+
+    agents = SlowAgents(latency)
+    async_orchestrator_module.ai_agent_manager = agents
+    run_async(concurrency, agents, AdmissionController(), "async, admission control")
+
+
+if __name__ == "__main__":
+    main(
+        int(sys.argv[1]) if len(sys.argv) > 1 else 500,
+        float(sys.argv[2]) if len(sys.argv) > 2 else 1.0,
+        int(sys.argv[3]) if len(sys.argv) > 3 else 32
+    )
@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+"""
+Code Search Benchmark
+Generates a synthetic source tree, builds the trigram index and times
+literal and regex queries against it.
+
+Usage: python benchmarks/bench_code_search.py [megabytes] [file_kb]
+"""
+
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+os.environ.setdefault('FILE_INDEX_PERSIST', 'false')
+
+from app.code_search import TrigramIndex
+
+QUERIES = [
+    ("handle_request", False),
+    ("RareSentinelValue", False),
+    (r"def\s+parse_\w+_config", True),
+    (r"class \w+Manager\(", True),
+    ("TODO(remove)", False),
+]
+
+
+def make_tree(root, megabytes, file_kb):
+    rng = random.Random(42)
+    syllables = ["ab", "cor", "de", "fin", "gra", "hul", "ix", "jo", "ker", "lum", "mo", "nat",
+                 "op", "pra", "qu", "ros", "sil", "tor", "ul", "vex", "wim", "yar", "zen"]
+    words = sorted({"".join(rng.choice(syllables) for _ in range(rng.randint(2, 4))) for _ in range(8000)})
+    words += ["handle_request", "parse_cache_config", "SessionManager", "TODO(remove)"]
+
+    files = megabytes * 1024 // file_kb
+    for n in range(files):
+        directory = os.path.join(root, f"pkg{n // 1000}", f"mod{n // 50 % 20}")
+        os.makedirs(directory, exist_ok=True)
+        lines = []
+        size = 0
+        while size < file_kb * 1024:
+            a, b, c = rng.choice(words), rng.choice(words), rng.choice(words)
+            kind = rng.random()
+            if kind < 0.2:
+                line = f"def {a}_{b}({c}, options=None):"
+            elif kind < 0.25:
+                line = f"class {a.title()}{b.title()}({c.title()}):"
+            else:
+                line = f"    {a} = {b}.{c}({rng.randint(0, 999)})  # {rng.choice(words)}"
+            lines.append(line)
+            size += len(line) + 1
+        if n % 997 == 0:
+            lines.append("SENTINEL = 'RareSentinelValue'")
+        with open(os.path.join(directory, f"file{n}.py"), "w") as f:
+            f.write("\n".join(lines))
+    return files
+
+
+def main(megabytes, file_kb):
+    with tempfile.TemporaryDirectory() as root:
+        print(f"Generating {megabytes} MB in {file_kb} KB files...")
+        files = make_tree(root, megabytes, file_kb)
+
+        index = TrigramIndex(root, revalidate_interval=3600)
+        started = time.perf_counter()
+        index.refresh(force=True)
+        build = time.perf_counter() - started
+        stats = index.get_stats()
+        print(f"Index build: {build:.1f} s for {files} files "
+              f"({stats['trigrams']} trigrams, {stats['postings']} postings)")
+
+        started = time.perf_counter()
+        index.refresh(force=True)
+        print(f"Unchanged revalidation: {(time.perf_counter() - started) * 1000:.1f} ms")
+
+        for query, regex in QUERIES:
+            timings = []
+            for _ in range(5):
+                result = index.search(query, regex=regex)
+                timings.append(result["took_ms"])
+            print(f"{query!r:28} regex={regex!s:5} median {statistics.median(timings):8.1f} ms  "
+                  f"candidates {result['candidates']:6}  matching files {result['matched_files']}{' (truncated)' if result['truncated'] else ''}")
+
+
+if __name__ == "__main__":
+    main(
+        int(sys.argv[1]) if len(sys.argv) > 1 else 100,
+        int(sys.argv[2]) if len(sys.argv) > 2 else 16
+    )
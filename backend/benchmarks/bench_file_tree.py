@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+"""
+Project File Listing Benchmark
+Builds a synthetic workspace and compares the original two-walk listing
+(listdir/isdir/getsize tree plus os.walk summary) with the single-pass
+index-backed listing, cold and warm.
+
+Usage: python benchmarks/bench_file_tree.py [files] [files_per_dir]
+"""
+
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+os.environ.setdefault('FILE_INDEX_PERSIST', 'false')
+
+from app.file_context_manager import FileContextManager
+from app.workspace_index import WorkspaceIndex
+
+EXTENSIONS = ['.py', '.js', '.ts', '.md', '.json', '.png', '.lock']
+SKIPPED = ['node_modules', '__pycache__', 'dist', 'build']
+
+
+def make_workspace(root, files, per_dir):
+    """Three-level tree of leaf directories holding `per_dir` files each"""
+    leaf_dirs = max(files // per_dir, 1)
+    fanout = max(round(leaf_dirs ** (1 / 3)), 1)
+    created = 0
+    for n in range(leaf_dirs):
+        leaf = os.path.join(root, f"pkg{n // (fanout * fanout)}", f"mod{n // fanout % fanout}", f"sub{n % fanout}")
+        os.makedirs(leaf, exist_ok=True)
+        for i in range(min(per_dir, files - created)):
+            with open(os.path.join(leaf, f"file{i}{EXTENSIONS[i % len(EXTENSIONS)]}"), 'w') as f:
+                f.write('x' * (i % 64))
+        created += per_dir
+    os.makedirs(os.path.join(root, 'node_modules', 'dep'), exist_ok=True)
+    return leaf_dirs
+
+
+def legacy_listing(manager, root_path, max_depth=3):
+    """The listing as computed before the workspace index"""
+    def build_tree(path, current_depth=0):
+        if current_depth > max_depth:
+            return {"name": "...", "type": "truncated"}
+        name = os.path.basename(path)
+        if os.path.isdir(path):
+            if name.startswith('.') or name in SKIPPED:
+                return None
+            children = []
+            for entry in sorted(os.listdir(path)):
+                child_tree = build_tree(os.path.join(path, entry), current_depth + 1)
+                if child_tree:
+                    children.append(child_tree)
+            return {"name": name, "type": "dir", "children": children[:20], "path": os.path.relpath(path, root_path)}
+        if os.path.splitext(path)[1].lower() not in manager.allowed_extensions:
+            return None
+        return {"name": name, "type": "file", "path": os.path.relpath(path, root_path),
+                "size": os.path.getsize(path), "extension": os.path.splitext(path)[1]}
+
+    total = 0
+    for root, dirs, files in os.walk(root_path):
+        dirs[:] = [d for d in dirs if not d.startswith('.') and d not in SKIPPED]
+        for file in files:
+            if not file.startswith('.') and os.path.splitext(file)[1].lower() in manager.allowed_extensions:
+                total += 1
+    return build_tree(root_path), total
+
+
+def timed(fn, repeat=1):
+    best = float('inf')
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - started)
+    return best, result
+
+
+def main(files, per_dir):
+    manager = FileContextManager()
+    with tempfile.TemporaryDirectory() as root:
+        print(f"Creating {files} files...")
+        leaf_dirs = make_workspace(root, files, per_dir)
+        print(f"  {leaf_dirs} leaf directories")
+
+        elapsed, (_, legacy_total) = timed(lambda: legacy_listing(manager, root), repeat=3)
+        print(f"legacy two-walk listing:        {elapsed * 1000:9.1f} ms  ({legacy_total} files)")
+
+        def cold():
+            index = WorkspaceIndex(root, manager.allowed_extensions, revalidate_interval=0)
+            index.refresh()
+            return index, manager._build_listing(index)
+        elapsed, (index, (_, summary)) = timed(cold, repeat=3)
+        assert summary["total_files"] == legacy_total
+        print(f"index cold scan + single pass:  {elapsed * 1000:9.1f} ms")
+
+        elapsed, _ = timed(lambda: index.refresh(force=True), repeat=5)
+        print(f"index revalidate (unchanged):   {elapsed * 1000:9.1f} ms")
+
+        elapsed, _ = timed(lambda: manager._build_listing(index), repeat=5)
+        print(f"single-pass tree + summary:     {elapsed * 1000:9.1f} ms")
+
+        manager.workspace_root = root
+        manager.get_project_file_listing()
+        elapsed, _ = timed(manager.get_project_file_listing, repeat=100)
+        print(f"warm get_project_file_listing:  {elapsed * 1000:9.3f} ms")
+
+
+if __name__ == "__main__":
+    main(
+        int(sys.argv[1]) if len(sys.argv) > 1 else 100000,
+        int(sys.argv[2]) if len(sys.argv) > 2 else 100
+    )
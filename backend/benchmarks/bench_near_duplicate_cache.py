@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+"""
+Near-Duplicate Cache Benchmark
+Fills the MinHash/LSH index with synthetic questions and measures lookup
+latency for rephrased (hit) and unrelated (miss) messages. Rephrasings swap
+two adjacent words, replace a word, or drop or add one, so hits go through
+the MinHash similarity check rather than matching an identical term set.
+
+Usage: python benchmarks/bench_near_duplicate_cache.py [entries] [lookups]
+"""
+
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from app.near_duplicate_cache import NearDuplicateCache
+
+SCOPES = 8
+# No "s" (plurals are folded) and no digits (letters mixed with digits count as code identifiers)
+LETTERS = "abcdefghijklmnopqrtuvwxyz"
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    return ordered[min(int(len(ordered) * pct / 100), len(ordered) - 1)]
+
+
+def word(n):
+    letters = []
+    for _ in range(5):
+        n, index = divmod(n, len(LETTERS))
+        letters.append(LETTERS[index])
+    return "".join(letters)
+
+
+def reorder(words, rng):
+    n = rng.randrange(len(words) - 1)
+    return words[:n] + [words[n + 1], words[n]] + words[n + 2:]
+
+
+def replace(words, rng, vocabulary):
+    n = rng.randrange(len(words))
+    return words[:n] + [rng.choice(vocabulary)] + words[n + 1:]
+
+
+def drop(words, rng):
+    n = rng.randrange(len(words))
+    return words[:n] + words[n + 1:]
+
+
+def insert(words, rng, vocabulary):
+    n = rng.randrange(len(words) + 1)
+    return words[:n] + [rng.choice(vocabulary)] + words[n:]
+
+
+def main(entries, lookups):
+    rng = random.Random(42)
+    vocabulary = [word(n) for n in range(20000)]
+    sentences = [rng.sample(vocabulary, rng.randint(10, 20)) for _ in range(entries)]
+    messages = [" ".join(words) for words in sentences]
+    scopes = [f"scope-{n % SCOPES}" for n in range(entries)]
+
+    cache = NearDuplicateCache(threshold=0.8, max_entries=entries)
+    started = time.perf_counter()
+    for n, (message, scope) in enumerate(zip(messages, scopes)):
+        cache.add(message, scope, f"key-{n}")
+    build = time.perf_counter() - started
+    print(f"Indexed {entries:,} messages in {build:.2f}s ({entries / build:,.0f}/s)")
+
+    for label, make_query in (
+        ("reordered", lambda n: (" ".join(reorder(sentences[n], rng)), scopes[n])),
+        ("word replaced", lambda n: (" ".join(replace(sentences[n], rng, vocabulary)), scopes[n])),
+        ("word dropped", lambda n: (" ".join(drop(sentences[n], rng)), scopes[n])),
+        ("word added", lambda n: (" ".join(insert(sentences[n], rng, vocabulary)), scopes[n])),
+        ("unrelated (miss)", lambda n: (" ".join(rng.sample(vocabulary, 10)), scopes[n])),
+    ):
+        samples, hits = [], 0
+        for _ in range(lookups):
+            n = rng.randrange(entries)
+            message, scope = make_query(n)
+            started = time.perf_counter()
+            match = cache.lookup(message, scope)
+            samples.append((time.perf_counter() - started) * 1000)
+            hits += match is not None and match[0] == f"key-{n}"
+        print(f"{label:>17}: mean {sum(samples) / len(samples):.3f} ms, p50 {percentile(samples, 50):.3f} ms, "
+              f"p99 {percentile(samples, 99):.3f} ms, matched {hits}/{lookups}")
+
+
+if __name__ == "__main__":
+    main(
+        int(sys.argv[1]) if len(sys.argv) > 1 else 100000,
+        int(sys.argv[2]) if len(sys.argv) > 2 else 2000
+    )
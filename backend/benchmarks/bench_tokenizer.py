@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+"""
+Tokenizer Benchmark
+Measures BPE token counting throughput on one core over the backend's own
+sources: cold (empty caches), warm (text seen before, as when prompt sections
+are re-counted per request) and full encoding.
+
+The 1M tokens/s target holds for warm caches only, the steady state of a
+running server. Cold counting also runs the BPE merges for every piece not
+seen before; together with the pure-Python regex scan it stays below the
+target (about 0.8M tokens/s on the reference machine).
+
+Usage: python benchmarks/bench_tokenizer.py [repeat]
+"""
+
+import glob
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from app.tokenizer import BPETokenizer, DEFAULT_RANKS_PATH, load_ranks
+
+BACKEND_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+# Tokens per second on one core, for warm caches
+TARGET = 1e6
+
+
+def load_corpus():
+    texts = []
+    for path in sorted(glob.glob(os.path.join(BACKEND_DIR, 'app', '*.py')) +
+                       glob.glob(os.path.join(BACKEND_DIR, '..', '*.md'))):
+        with open(path, encoding='utf-8') as f:
+            texts.append(f.read())
+    return texts
+
+
+def rate(tokens, seconds, target=False):
+    throughput = f"{tokens / seconds / 1e6:6.2f} M tokens/s"
+    if target:
+        throughput += "  (meets target)" if tokens / seconds >= TARGET else "  (BELOW TARGET)"
+    return throughput
+
+
+def main(repeat):
+    texts = load_corpus()
+    ranks = load_ranks(str(DEFAULT_RANKS_PATH))
+    characters = sum(len(text) for text in texts)
+
+    tokenizer = BPETokenizer(ranks)
+    started = time.perf_counter()
+    tokens = sum(tokenizer.count(text) for text in texts)
+    cold = time.perf_counter() - started
+    print(f"Corpus: {len(texts)} files, {characters} chars, {tokens} tokens "
+          f"({characters / tokens:.2f} chars/token, vocab {tokenizer.vocab_size})")
+    print(f"count, cold caches:        {rate(tokens, cold)}  (target applies to warm caches only)")
+
+    # New text that only shares pieces with what was counted before
+    tokenizer._count_block.cache_clear()
+    started = time.perf_counter()
+    for text in texts:
+        tokenizer.count(text)
+    print(f"count, warm piece cache:   {rate(tokens, time.perf_counter() - started, target=True)}")
+
+    started = time.perf_counter()
+    for _ in range(repeat):
+        for text in texts:
+            tokenizer.count(text)
+    print(f"count, repeated text:      {rate(tokens * repeat, time.perf_counter() - started, target=True)}")
+
+    started = time.perf_counter()
+    for text in texts:
+        tokenizer.encode(text)
+    print(f"encode, warm piece cache:  {rate(tokens, time.perf_counter() - started)}")
+
+    started = time.perf_counter()
+    words = sum(len(text.split()) for text in texts)
+    print(f"str.split word count:      {rate(tokens, time.perf_counter() - started)}  "
+          f"(counts {words} words, {100 * (words - tokens) / tokens:+.0f}% vs tokens)")
+    print(f"cache: {tokenizer.cache_info()}")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 5)
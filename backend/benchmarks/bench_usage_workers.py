@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+"""
+Usage Tracker Multi-Worker Benchmark
+Measures track_request throughput with N processes sharing one usage directory
+and checks that the merged aggregates account for every entry.
+
+Usage: python benchmarks/bench_usage_workers.py [workers] [entries_per_worker]
+"""
+
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+os.environ.setdefault('USAGE_SQLITE_ENABLED', 'false')
+
+from app.usage_tracker import UsageTracker
+
+
+def worker(usage_dir, worker_id, count, start_event):
+    tracker = UsageTracker(usage_dir)
+    start_event.wait()
+    for i in range(count):
+        tracker.track_request(
+            request_id=f"w{worker_id}_{i}",
+            agent_type="openai",
+            project=f"project-{worker_id % 3}",
+            file="main.py",
+            message="benchmark message",
+            response="benchmark response",
+            tokens_data={"total_tokens": 30, "prompt_tokens": 10, "completion_tokens": 20, "model": "mock"},
+            response_time=0.05 * (1 + i % 20),
+            status="success",
+            real_ai=False
+        )
+    tracker.writer.shutdown()
+
+
+def run(workers, per_worker):
+    with tempfile.TemporaryDirectory() as usage_dir:
+        ctx = multiprocessing.get_context('fork')
+        start_event = ctx.Event()
+        processes = [
+            ctx.Process(target=worker, args=(usage_dir, w, per_worker, start_event))
+            for w in range(workers)
+        ]
+        for process in processes:
+            process.start()
+        time.sleep(0.5)  # Let every worker finish importing and loading state
+
+        started = time.perf_counter()
+        start_event.set()
+        for process in processes:
+            process.join()
+        elapsed = time.perf_counter() - started
+
+        reader = UsageTracker(usage_dir)
+        summary = reader.get_daily_summary()
+        stats = reader.get_usage_stats(1)
+        reader.writer.shutdown()
+
+        expected = workers * per_worker
+        return {
+            'workers': workers,
+            'entries': expected,
+            'seconds': elapsed,
+            'entries_per_second': expected / elapsed,
+            'daily_total_ok': summary.total_requests == expected,
+            'rollup_total_ok': stats['totals']['requests'] == expected,
+            'tokens_ok': summary.total_tokens == expected * 30
+        }
+
+
+def main():
+    workers = int(sys.argv[1]) if len(sys.argv) > 1 else 8
+    per_worker = int(sys.argv[2]) if len(sys.argv) > 2 else 5000
+
+    for n in sorted({1, workers}):
+        result = run(n, per_worker)
+        print(
+            f"{result['workers']} worker(s): {result['entries']} entries in {result['seconds']:.2f}s "
+            f"({result['entries_per_second']:,.0f}/s) | daily total ok: {result['daily_total_ok']} | "
+            f"rollup total ok: {result['rollup_total_ok']} | tokens ok: {result['tokens_ok']}"
+        )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,11 @@
+import os
+import shutil
+import tempfile
+
+# The global usage tracker is created on import; keep test runs out of the repository's .coai/usage
+_usage_dir = tempfile.mkdtemp(prefix='coai-usage-')
+os.environ.setdefault('USAGE_DIR', _usage_dir)
+
+
+def pytest_unconfigure(config):
+    shutil.rmtree(_usage_dir, ignore_errors=True)
@@ -3,6 +3,10 @@ from app import create_app
 app = create_app()
 
 if __name__ == "__main__":
+    from app.usage_tracker import usage_tracker
+    from app.routes import warm_indexes
+    usage_tracker.migrate_legacy_days()
+    warm_indexes()
     print("Starting backend server...")
     print("Open http://127.0.0.1:5000 in your browser.")
     app.run(debug=True, port=5000)
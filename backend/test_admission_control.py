@@ -0,0 +1,194 @@
+import asyncio
+import json
+import threading
+import time
+import pytest
+from main import app
+from app import routes
+from app.admission_control import AdmissionController
+from app.error_handler import OverloadedError
+from app.stage_timer import StageTimer
+from app.asgi_app import ASGIApp
+from test_asgi_app import call
+
+
+def wait_for(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.005)
+
+
+def test_full_queue_is_rejected_and_released_slots_go_to_the_queue_in_order():
+    controller = AdmissionController(initial_limit=2, min_limit=1, max_queue=2, queue_timeout=5)
+    running = [controller.acquire(), controller.acquire()]
+    admitted = []
+
+    def queued(name):
+        timer = StageTimer()
+        slot = controller.acquire(timer)
+        admitted.append((name, timer.stages["admission_wait"]))
+        slot.release()
+
+    threads = []
+    for name in ("first", "second"):
+        threads.append(threading.Thread(target=queued, args=(name,)))
+        threads[-1].start()
+        wait_for(lambda: controller.get_stats()["queue_depth"] == len(threads))
+
+    with pytest.raises(OverloadedError) as rejected:
+        controller.acquire()
+    assert rejected.value.retry_after >= 1
+
+    time.sleep(0.05)
+    running[0].release()
+    running[0].release()  # A second release of the same slot is a no-op
+    wait_for(lambda: admitted)  # "second" is only admitted once "first" has run
+    running[1].release()
+    for thread in threads:
+        thread.join()
+
+    assert [name for name, _ in admitted] == ["first", "second"]
+    assert admitted[0][1] >= 50
+    stats = controller.get_stats()
+    assert stats["in_flight"] == 0 and stats["queue_depth"] == 0
+    assert stats["admitted"] == 4 and stats["queued"] == 2 and stats["rejected_queue_full"] == 1
+    assert stats["wait_seconds"]["count"] == 4 and stats["wait_seconds"]["p99"] >= 0.05
+
+
+def test_queued_request_times_out():
+    controller = AdmissionController(initial_limit=1, min_limit=1, max_queue=5, queue_timeout=0.05)
+    slot = controller.acquire()
+    with pytest.raises(OverloadedError):
+        controller.acquire()
+    slot.release()
+    controller.acquire().release()  # The timed-out waiter left the queue
+    stats = controller.get_stats()
+    assert stats["rejected_timeout"] == 1 and stats["queue_depth"] == 0 and stats["in_flight"] == 0
+
+
+def test_limit_grows_while_busy_and_shrinks_when_latency_rises():
+    controller = AdmissionController(initial_limit=10, min_limit=2, max_limit=100)
+
+    def finish(latency, ok=True, concurrent=10):
+        controller.in_flight = concurrent
+        controller._release(latency, ok)
+
+    for _ in range(30):
+        finish(0.1)
+    grown = controller.limit
+    assert grown > 15
+
+    for _ in range(30):
+        finish(0.1, concurrent=1)  # Far below the limit: no evidence it could go higher
+    assert controller.limit == grown
+
+    for _ in range(10):
+        finish(1.0, concurrent=int(controller.limit))
+    shed = controller.limit
+    assert shed < grown * 0.7
+
+    finish(0.1, ok=False, concurrent=int(shed))
+    assert controller.limit == pytest.approx(max(2, shed * 0.9))
+    assert controller.get_stats()["failures"] == 1
+
+
+def test_async_waiters_share_the_queue_and_cancellation_leaves_it():
+    controller = AdmissionController(initial_limit=1, min_limit=1, max_queue=5, queue_timeout=5)
+
+    async def scenario():
+        held = await controller.aacquire()
+        waiter = asyncio.ensure_future(controller.aacquire())
+        abandoned = asyncio.ensure_future(controller.aacquire())
+        await asyncio.sleep(0.01)
+        assert controller.get_stats()["queue_depth"] == 2
+        abandoned.cancel()
+        await asyncio.sleep(0.01)
+        assert controller.get_stats()["queue_depth"] == 1
+
+        await asyncio.to_thread(held.release)  # Released from a worker thread, granted on the loop
+        slot = await asyncio.wait_for(waiter, 1)
+        assert slot.waited > 0
+        slot.release()
+
+    asyncio.run(scenario())
+    stats = controller.get_stats()
+    assert stats["in_flight"] == 0 and stats["queue_depth"] == 0 and stats["admitted"] == 2
+
+
+def test_slot_granted_to_a_cancelled_waiter_is_handed_on_without_a_latency_sample():
+    controller = AdmissionController(initial_limit=1, min_limit=1, max_queue=5, queue_timeout=5)
+
+    async def scenario():
+        held = await controller.aacquire()
+        abandoned = asyncio.ensure_future(controller.aacquire())
+        next_in_line = asyncio.ensure_future(controller.aacquire())
+        await asyncio.sleep(0.01)
+        held.release()  # Grants the slot to `abandoned`...
+        baseline = (controller.limit, controller.short_latency, controller.long_latency)
+        abandoned.cancel()  # ...which goes away before it could run
+        with pytest.raises(asyncio.CancelledError):
+            await abandoned
+
+        slot = await asyncio.wait_for(next_in_line, 1)
+        assert (controller.limit, controller.short_latency, controller.long_latency) == baseline
+        slot.release()
+
+    asyncio.run(scenario())
+    assert controller.get_stats()["in_flight"] == 0
+
+
+FAILED_STREAM = [{"type": "start", "request_id": "r1"}, {"type": "error", "error": "upstream failed"}]
+
+
+class FailingOrchestrator:
+    def stream_chat_request(self, message, context, timer=None):
+        yield from FAILED_STREAM
+
+
+class AsyncFailingOrchestrator:
+    async def stream_chat_request(self, message, context, timer=None):
+        for event in FAILED_STREAM:
+            yield event
+
+
+def test_failed_streams_release_their_slot_as_failures(monkeypatch):
+    controller = AdmissionController(initial_limit=10, min_limit=1)
+    monkeypatch.setattr(routes, 'admission_controller', controller)
+    monkeypatch.setattr(routes, 'orchestrator', FailingOrchestrator())
+    body = {"message": "Hello", "project": "demo-project", "file": "main.py"}
+
+    response = app.test_client().post("/api/chat/stream", json=body, headers={"X-Forwarded-For": "10.25.1.1"})
+    assert b"event: error" in response.data
+    response.close()
+    assert controller.get_stats()["failures"] == 1 and controller.limit == pytest.approx(9.0)
+
+    asgi = ASGIApp(app, wsgi_threads=1, admission=controller, orchestrator=AsyncFailingOrchestrator())
+    status, _, payload = asyncio.run(call(asgi, "POST", "/api/chat/stream", body, client="10.25.1.2"))
+    asgi.executor.shutdown()
+    assert status == 200 and b"event: error" in payload
+    stats = controller.get_stats()
+    assert stats["failures"] == 2 and stats["in_flight"] == 0
+
+
+def test_chat_endpoints_answer_503_with_retry_after_when_saturated(monkeypatch):
+    controller = AdmissionController(initial_limit=1, min_limit=1, max_queue=0)
+    monkeypatch.setattr(routes, 'admission_controller', controller)
+    held = controller.acquire()
+    body = {"message": "Hello", "project": "demo-project", "file": "main.py"}
+
+    client = app.test_client()
+    for path in ("/api/chat", "/api/chat/stream"):
+        response = client.post(path, json=body, headers={"X-Forwarded-For": "10.25.0.1"})
+        assert response.status_code == 503
+        assert int(response.headers["Retry-After"]) >= 1
+        assert response.get_json()["error_code"] == "OVERLOADED"
+
+    asgi = ASGIApp(app, wsgi_threads=1, admission=controller)
+    status, headers, payload = asyncio.run(call(asgi, "POST", "/api/chat", body, client="10.25.0.2"))
+    asgi.executor.shutdown()
+    assert status == 503 and int(headers[b"retry-after"]) >= 1
+    assert json.loads(payload)["retry_after"] >= 1
+
+    held.release()
+    assert controller.get_stats()["rejected_queue_full"] == 3
@@ -0,0 +1,204 @@
+import asyncio
+import json
+import threading
+import time
+import pytest
+from flask import Flask, Response
+from main import app as flask_app
+from app import async_orchestrator as async_orchestrator_module
+from app.admission_control import AdmissionController
+from app.asgi_app import WSGI_BUFFERED_CHUNKS, ASGIApp
+
+
+async def call(app, method, path, body=None, client="127.0.0.1"):
+    """Run one request through the ASGI app; returns (status, headers, body bytes)"""
+    payload = json.dumps(body).encode() if body is not None else b""
+    scope = {
+        "type": "http", "method": method, "path": path, "query_string": b"", "root_path": "",
+        "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(payload)).encode())],
+        "client": (client, 50000), "server": ("testserver", 80), "scheme": "http", "http_version": "1.1",
+    }
+    requests = [{"type": "http.request", "body": payload, "more_body": False}]
+    sent = []
+
+    async def receive():
+        if requests:
+            return requests.pop(0)
+        await asyncio.sleep(3600)  # Still connected
+
+    async def send(message):
+        sent.append(message)
+
+    await app(scope, receive, send)
+    start = next(message for message in sent if message["type"] == "http.response.start")
+    return start["status"], dict(start["headers"]), b"".join(m.get("body", b"") for m in sent if m["type"] == "http.response.body")
+
+
+class SlowAgents:
+    """Stands in for the AI agent manager with a fixed upstream latency"""
+
+    def __init__(self, latency):
+        self.latency = latency
+        self.in_flight = self.peak = 0
+
+    async def aprocess_request(self, request):
+        self.in_flight += 1
+        self.peak = max(self.peak, self.in_flight)
+        await asyncio.sleep(self.latency)
+        self.in_flight -= 1
+        return {"status": "success", "agent_type": "openai", "response": "Answer to " + request["request_id"],
+                "usage": {"prompt_tokens": 10, "completion_tokens": 5, "total_tokens": 15, "model": "gpt-4o"},
+                "real_ai": True}
+
+    async def astream_request(self, request):
+        result = await self.aprocess_request(request)
+        for word in result["response"].split():
+            yield {"type": "token", "content": word + " "}
+        yield {"type": "done", **result}
+
+
+@pytest.fixture
+def asgi_app(monkeypatch):
+    agents = SlowAgents(latency=0.5)
+    monkeypatch.setattr(async_orchestrator_module, 'ai_agent_manager', agents)
+    # Room for the whole burst; shedding is covered in test_admission_control.py
+    app = ASGIApp(flask_app, wsgi_threads=4, admission=AdmissionController(initial_limit=500, max_limit=500))
+    app.agents = agents
+    yield app
+    app.executor.shutdown()
+
+
+def test_concurrent_chats_share_one_event_loop(asgi_app):
+    async def burst():
+        return await asyncio.gather(*(
+            call(asgi_app, "POST", "/api/chat", {"message": f"Question {n}", "project": "demo", "file": "main.py"},
+                 client=f"10.0.{n // 250}.{n % 250}")
+            for n in range(200)
+        ))
+
+    started = time.perf_counter()
+    responses = asyncio.run(burst())
+    elapsed = time.perf_counter() - started
+
+    assert [status for status, _, _ in responses] == [200] * 200
+    bodies = [json.loads(body) for _, _, body in responses]
+    assert len({body["request_id"] for body in bodies}) == 200
+    assert all(body["reply"] == "Answer to " + body["request_id"] for body in bodies)
+    # Upstream calls overlap far beyond the worker thread count instead of queueing behind it
+    assert asgi_app.agents.peak > 32
+    assert elapsed < 10
+
+
+def test_chat_errors_match_flask_views(asgi_app):
+    status, headers, body = asyncio.run(call(
+        asgi_app, "POST", "/api/chat", {"message": "", "project": "demo", "file": "a.py"}, client="10.2.0.1"
+    ))
+    assert status == 400
+    assert json.loads(body)["error_code"] == "VALIDATION_ERROR"
+    assert headers[b"access-control-allow-origin"] == b"*"
+
+    status, _, body = asyncio.run(call(
+        asgi_app, "POST", "/api/chat", {"message": "rm -rf /", "project": "demo", "file": "a.py"}, client="10.2.0.1"
+    ))
+    assert status == 400
+    assert json.loads(body)["error"] == "Invalid message content"
+
+
+def test_stream_sends_server_sent_events(asgi_app):
+    status, headers, body = asyncio.run(call(
+        asgi_app, "POST", "/api/chat/stream", {"message": "Explain main.py", "project": "demo", "file": "main.py"},
+        client="10.1.0.1"
+    ))
+    assert status == 200
+    assert headers[b"content-type"].startswith(b"text/event-stream")
+    events = [json.loads(block.split("data: ", 1)[1]) for block in body.decode().split("\n\n") if block]
+    assert [event["type"] for event in events][0] == "start"
+    assert events[-1]["type"] == "done"
+    assert "".join(event["content"] for event in events if event["type"] == "token") == events[-1]["reply"]
+
+
+def test_other_routes_go_through_flask(asgi_app):
+    status, headers, body = asyncio.run(call(asgi_app, "GET", "/api/health"))
+    assert status == 200
+    assert headers[b"content-type"] == b"application/json"
+    assert json.loads(body)["status"]
+
+
+def endless_stream_app():
+    """Flask app with a never-ending streamed route that counts what it produced"""
+    app = Flask(__name__)
+    app.produced = 0
+    app.closed = threading.Event()
+
+    @app.route("/endless")
+    def endless():
+        def generate():
+            try:
+                while True:
+                    app.produced += 1
+                    yield "tick\n"
+            finally:
+                app.closed.set()
+        return Response(generate())
+
+    return app
+
+
+def run_stream(app, on_body):
+    """GET /endless; on_body(chunk number) may await, and returns True once the client should disconnect"""
+    scope = {"type": "http", "method": "GET", "path": "/endless", "query_string": b"", "root_path": "",
+             "headers": [], "client": ("127.0.0.1", 50000), "server": ("testserver", 80)}
+
+    async def scenario():
+        requests = [{"type": "http.request", "body": b"", "more_body": False}]
+        gone = asyncio.Event()
+        chunks = 0
+
+        async def receive():
+            if requests:
+                return requests.pop(0)
+            await gone.wait()
+            return {"type": "http.disconnect"}
+
+        async def send(message):
+            nonlocal chunks
+            if message["type"] == "http.response.body":
+                chunks += 1
+                if await on_body(chunks):
+                    gone.set()  # Later sends are silently dropped, as uvicorn does
+
+        await asyncio.wait_for(app(scope, receive, send), 5)
+
+    asyncio.run(scenario())
+
+
+def test_wsgi_stream_releases_its_thread_when_the_client_disconnects():
+    stream_app = endless_stream_app()
+    app = ASGIApp(stream_app, wsgi_threads=1)
+
+    async def disconnect_after_three(chunk):
+        return chunk == 3
+
+    run_stream(app, disconnect_after_three)
+    assert stream_app.closed.wait(5)
+    status, _, body = asyncio.run(call(app, "GET", "/endless-is-not-a-route"))
+    assert status == 404  # The single worker thread is free again
+    app.executor.shutdown()
+
+
+def test_wsgi_stream_is_paced_by_a_slow_client():
+    stream_app = endless_stream_app()
+    app = ASGIApp(stream_app, wsgi_threads=1)
+    received = 0
+
+    async def slow_client(chunk):
+        nonlocal received
+        received = chunk
+        await asyncio.sleep(0.01)
+        return chunk == 20
+
+    run_stream(app, slow_client)
+    assert stream_app.closed.wait(5)
+    # The route only ran a bounded distance ahead of what the client had taken
+    assert stream_app.produced <= received + WSGI_BUFFERED_CHUNKS + 2
+    app.executor.shutdown()
@@ -0,0 +1,104 @@
+import json
+import multiprocessing
+import os
+import tempfile
+from app.chat_history_store import ChatHistoryStore
+from app.logger import COAILogger
+
+
+def test_append_and_tail():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        store = ChatHistoryStore(tmpdir, index_stride=4)
+        for i in range(10):
+            store.append({"n": i})
+        assert [e["n"] for e in store.tail(3)] == [7, 8, 9]
+        assert [e["n"] for e in store.tail(None)] == list(range(10))
+        store.close()
+
+
+def test_rotation_retention_and_reopen():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        store = ChatHistoryStore(tmpdir, max_segment_bytes=200, max_segments=3, index_stride=2)
+        for i in range(100):
+            store.append({"n": i, "pad": "x" * 20})
+        segments = [n for n in os.listdir(tmpdir) if n.endswith('.jsonl')]
+        assert len(segments) == 3
+
+        retained = [e["n"] for e in store.tail(None)]
+        assert retained == list(range(100 - len(retained), 100))
+        assert [e["n"] for e in store.tail(7)] == list(range(93, 100))
+        store.close()
+
+        # Reopening rebuilds the active segment and reuses the sealed index
+        reopened = ChatHistoryStore(tmpdir, max_segment_bytes=200, max_segments=3, index_stride=2)
+        reopened.append({"n": 100})
+        assert [e["n"] for e in reopened.tail(2)] == [99, 100]
+        reopened.close()
+
+
+def test_torn_write_is_discarded_on_reopen():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        store = ChatHistoryStore(tmpdir)
+        store.append({"n": 1})
+        active = os.path.join(tmpdir, store.active["name"])
+        store.close()
+        with open(active, 'ab') as f:
+            f.write(b'{"n": 2')
+
+        reopened = ChatHistoryStore(tmpdir)
+        reopened.append({"n": 3})
+        assert [e["n"] for e in reopened.tail(10)] == [1, 3]
+        reopened.close()
+
+
+def test_logger_migrates_legacy_history():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        legacy = os.path.join(tmpdir, "chat_history.json")
+        with open(legacy, 'w', encoding='utf-8') as f:
+            json.dump([{"request_id": "old_1"}, {"request_id": "old_2"}], f)
+
+        coai_logger = COAILogger(tmpdir)
+        request_id = coai_logger.log_chat_request("Hello", {"project": "demo"})
+        history = coai_logger.get_chat_history(10)
+
+        assert [e["request_id"] for e in history] == ["old_1", "old_2", request_id]
+        assert not os.path.exists(legacy)
+        assert os.path.exists(legacy + ".migrated")
+        coai_logger.chat_history.close()
+
+
+def _append_from_process(history_dir, writer, count):
+    store = ChatHistoryStore(history_dir, max_segment_bytes=600, max_segments=1000, index_stride=4)
+    for i in range(count):
+        store.append({"writer": writer, "n": i, "pad": "x" * 20})
+    store.close()
+
+
+def test_processes_share_rotation_and_index():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        context = multiprocessing.get_context("spawn")
+        writers = [context.Process(target=_append_from_process, args=(tmpdir, writer, 150)) for writer in range(3)]
+        for process in writers:
+            process.start()
+        for process in writers:
+            process.join(60)
+            assert process.exitcode == 0
+
+        with open(os.path.join(tmpdir, "index.json"), encoding='utf-8') as f:
+            sealed = json.load(f)["segments"]
+        names = sorted(n for n in os.listdir(tmpdir) if n.endswith('.jsonl'))
+        # Every segment but the newest is sealed exactly once, with counts matching its file
+        assert [s["name"] for s in sealed] == names[:-1]
+        for segment in sealed:
+            with open(os.path.join(tmpdir, segment["name"]), 'rb') as f:
+                data = f.read()
+            assert len(data) == segment["bytes"] and data.count(b"\n") == segment["entries"]
+            assert len(data) <= 600
+
+        store = ChatHistoryStore(tmpdir, max_segment_bytes=600, max_segments=1000, index_stride=4)
+        entries = store.tail(None)
+        assert len(entries) == 450
+        for writer in range(3):
+            assert [e["n"] for e in entries if e["writer"] == writer] == list(range(150))
+        assert [(e["writer"], e["n"]) for e in store.tail(5)] == [(e["writer"], e["n"]) for e in entries[-5:]]
+        store.close()
@@ -0,0 +1,78 @@
+import json
+import pytest
+from main import app
+
+@pytest.fixture
+def client():
+    app.config['TESTING'] = True
+    with app.test_client() as client:
+        yield client
+
+def parse_sse(body):
+    events = []
+    for block in body.strip().split('\n\n'):
+        lines = dict(line.split(': ', 1) for line in block.split('\n'))
+        events.append((lines['event'], json.loads(lines['data'])))
+    return events
+
+def test_chat_stream_endpoint(client):
+    response = client.post('/api/chat/stream', json={
+        "message": "Help me implement a sorting function",
+        "project": "demo-project",
+        "file": "main.py"
+    })
+    assert response.status_code == 200
+    assert response.mimetype == 'text/event-stream'
+
+    events = parse_sse(response.get_data(as_text=True))
+    names = [name for name, _ in events]
+    assert names[0] == 'start'
+    assert names[-1] == 'done'
+    assert names.count('token') > 1
+
+    streamed = ''.join(data['content'] for name, data in events if name == 'token')
+    done = events[-1][1]
+    assert done['reply'] == streamed
+    assert done['request_id'] == events[0][1]['request_id']
+    assert done['usage_tracked'] is True
+    assert done['time_to_first_token'] is not None
+
+def test_chat_stream_endpoint_validation(client):
+    response = client.post('/api/chat/stream', json={"message": "", "project": "p", "file": "f"})
+    assert response.status_code == 400
+
+def test_stream_finalised_on_client_disconnect(monkeypatch):
+    from app import orchestrator as orchestrator_module
+    tracked = []
+    monkeypatch.setattr(orchestrator_module.usage_tracker, 'track_request',
+                        lambda **kwargs: tracked.append(kwargs))
+
+    stream = orchestrator_module.orchestrator.stream_chat_request(
+        "Hello there", {"project": "demo-project", "file": "main.py"}
+    )
+    assert next(stream)['type'] == 'start'
+    assert next(stream)['type'] == 'token'
+    stream.close()
+
+    assert len(tracked) == 1
+    assert tracked[0]['status'] == 'cancelled'
+
+def test_async_stream_finalised_on_client_disconnect(monkeypatch):
+    import asyncio
+    from app import orchestrator as orchestrator_module
+    from app.async_orchestrator import async_orchestrator
+    tracked = []
+    monkeypatch.setattr(orchestrator_module.usage_tracker, 'track_request',
+                        lambda **kwargs: tracked.append(kwargs))
+
+    async def scenario():
+        stream = async_orchestrator.stream_chat_request(
+            "Hello there", {"project": "demo-project", "file": "main.py"}
+        )
+        assert (await stream.__anext__())['type'] == 'start'
+        assert (await stream.__anext__())['type'] == 'token'
+        await stream.aclose()
+
+    asyncio.run(scenario())
+    assert len(tracked) == 1
+    assert tracked[0]['status'] == 'cancelled'
@@ -0,0 +1,136 @@
+import os
+import threading
+import pytest
+from main import app
+from app import routes
+from app.code_search import CodeSearch, TrigramIndex, SearchIndexBuildingError, SearchQueryError, compile_query
+from app.file_context_manager import file_context_manager
+
+
+@pytest.fixture
+def workspace(tmp_path, monkeypatch):
+    monkeypatch.setattr(file_context_manager, 'persist_index', False)
+    monkeypatch.setenv('FILE_INDEX_REVALIDATE_SECONDS', '0')
+    root = tmp_path / 'workspace'
+    files = {
+        'src/session.py': 'class SessionManager:\n    def handle_request(self):\n        return 1\n',
+        'src/handler.py': 'from session import SessionManager\n\nhandle_request = None\n',
+        'src/handle_request.py': 'def run():\n    handle_request()\n',
+        'docs/notes.md': 'Nothing to see here\n',
+        'assets/data.bin': 'handle_request\n',
+    }
+    for rel, content in files.items():
+        path = root / rel
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(content)
+    return root
+
+
+def paths(result):
+    return [entry["path"] for entry in result["results"]]
+
+
+def test_literal_search_ranks_name_matches_first(workspace):
+    index = TrigramIndex(str(workspace), revalidate_interval=0)
+    result = index.search('handle_request')
+
+    assert paths(result) == ['src/handle_request.py', 'src/handler.py', 'src/session.py']
+    assert result["results"][1]["matches"] == [{"line": 3, "text": "handle_request = None"}]
+    assert result["candidates"] == 3  # Non-indexed extensions are never considered
+
+
+def test_regex_and_case_sensitivity(workspace):
+    index = TrigramIndex(str(workspace), revalidate_interval=0)
+
+    result = index.search(r'class \w+Manager', regex=True)
+    assert paths(result) == ['src/session.py']
+    assert result["results"][0]["matches"][0]["line"] == 1
+
+    assert paths(index.search('sessionmanager')) == ['src/handler.py', 'src/session.py']
+    assert paths(index.search('sessionmanager', case_sensitive=True)) == []
+
+
+def test_invalid_queries_raise():
+    for query, regex in (('', False), ('(unclosed', True), ('a*', True)):
+        with pytest.raises(SearchQueryError):
+            compile_query(query, regex)
+
+
+def test_query_trigrams_and_anchor():
+    query = compile_query(r'def\s+parse_\w+', regex=True)
+    assert query.anchor == b'parse_'
+    assert query.trigrams  # 'def' and 'parse_' both contribute
+    assert compile_query(r'\w+', regex=True).trigrams == set()
+
+
+def test_incremental_update_and_persistence(workspace, tmp_path):
+    cache_path = str(tmp_path / 'cache' / 'search.idx')
+    index = TrigramIndex(str(workspace), cache_path=cache_path, revalidate_interval=0)
+    assert len(index.search('handle_request')["results"]) == 3
+
+    (workspace / 'src' / 'handler.py').write_text('renamed = None\n')
+    os.remove(workspace / 'src' / 'handle_request.py')
+    (workspace / 'src' / 'extra.py').write_text('print("handle_request")\n')
+    assert paths(index.search('handle_request')) == ['src/extra.py', 'src/session.py']
+    assert index.get_stats()["tombstones"] == 2
+    index.flush()
+
+    reloaded = TrigramIndex(str(workspace), cache_path=cache_path, revalidate_interval=0)
+    assert reloaded.get_stats()["files"] == index.get_stats()["files"]
+    assert reloaded.refresh() == 0
+    assert paths(reloaded.search('handle_request')) == ['src/extra.py', 'src/session.py']
+
+
+def test_mark_dirty_between_revalidations(workspace):
+    index = TrigramIndex(str(workspace), revalidate_interval=3600)
+    assert index.search('fresh_token')["results"] == []
+
+    target = workspace / 'docs' / 'notes.md'
+    target.write_text('fresh_token lives here now\n')
+    index.mark_dirty([str(target), str(workspace / 'assets' / 'data.bin')])
+    assert paths(index.search('fresh_token')) == ['docs/notes.md']
+
+
+def test_cold_index_is_built_off_the_request_thread(workspace, monkeypatch):
+    monkeypatch.setattr(file_context_manager, 'workspace_root', str(workspace))
+    code_search = CodeSearch(persist=False)
+    index = code_search.get_index()
+
+    # Even with the index lock held (as by a running build) the request is answered at once
+    held, release, released_in_time = threading.Event(), threading.Event(), []
+
+    def hold_lock():
+        with index.lock:
+            held.set()
+            released_in_time.append(release.wait(2))
+
+    holder = threading.Thread(target=hold_lock)
+    holder.start()
+    held.wait(5)
+    with pytest.raises(SearchIndexBuildingError):
+        code_search.search('handle_request')
+    with pytest.raises(SearchQueryError):
+        code_search.search('')
+    release.set()
+    holder.join()
+    assert released_in_time == [True]
+
+    index.warmer.join(5)
+    assert index.ready.is_set()
+    assert len(code_search.search('handle_request')["results"]) == 3
+
+
+def test_search_endpoint_answers_503_while_building(workspace, monkeypatch):
+    monkeypatch.setattr(file_context_manager, 'workspace_root', str(workspace))
+    monkeypatch.setattr(routes, 'code_search', CodeSearch(persist=False))
+    client = app.test_client()
+
+    response = client.get('/api/search?q=handle_request', headers={"X-Forwarded-For": "10.14.0.1"})
+    assert response.status_code == 503
+    assert int(response.headers["Retry-After"]) >= 1
+    assert response.get_json()["building"] is True
+
+    routes.code_search.get_index().warmer.join(5)
+    response = client.get('/api/search?q=handle_request', headers={"X-Forwarded-For": "10.14.0.1"})
+    assert response.status_code == 200
+    assert len(response.get_json()["results"]) == 3
@@ -0,0 +1,91 @@
+import os
+import pytest
+from main import app
+from app.content_cache import ContentCache
+
+
+@pytest.fixture
+def cache():
+    return ContentCache(max_bytes=1024 * 1024, mmap_threshold=1024 * 1024)
+
+
+def touch(path, text):
+    path.write_text(text)
+    # Same-size rewrites within one clock tick must still be seen
+    stat = path.stat()
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000))
+
+
+def test_hit_until_file_changes(tmp_path, cache):
+    path = tmp_path / 'notes.py'
+    touch(path, 'first\nsecond\r\nthird\n')
+    content = cache.get(str(path))
+    assert content.line_count == 3
+    assert content.lines(2, 3) == 'second\nthird'
+    assert content.lines(3, 10) == 'third'
+    assert cache.get(str(path)) is content
+
+    touch(path, 'FIRST\nsecond\r\nthird\n')
+    changed = cache.get(str(path))
+    assert changed.lines(1, 1) == 'FIRST'
+    assert changed.sha256 != content.sha256
+    assert cache.get_stats()["hits"] == 1
+    assert cache.get_stats()["misses"] == 2
+
+    path.unlink()
+    assert cache.get(str(path)) is None
+    assert cache.get_stats()["entries"] == 0
+
+
+def test_lru_evicts_to_byte_budget_and_shares_duplicates(tmp_path):
+    cache = ContentCache(max_bytes=3000, max_entry_bytes=3000)
+    for name in ('a', 'b', 'c'):
+        (tmp_path / name).write_text(name * 1000)
+    (tmp_path / 'copy_of_a').write_text('a' * 1000)
+
+    cache.get(str(tmp_path / 'a'))
+    cache.get(str(tmp_path / 'copy_of_a'))
+    assert cache.get_stats()["entries"] == 2
+    assert cache.get_stats()["unique_contents"] == 1
+
+    cache.get(str(tmp_path / 'b'))
+    cache.get(str(tmp_path / 'a'))  # Most recently used
+    cache.get(str(tmp_path / 'c'))
+    stats = cache.get_stats()
+    assert stats["bytes"] <= 3000
+    assert stats["evictions"] >= 1
+    assert str(tmp_path / 'b') not in cache.entries
+    assert str(tmp_path / 'a') in cache.entries
+
+
+def test_mmap_binary_and_uncached_reads(tmp_path):
+    cache = ContentCache(mmap_threshold=16)
+    large = tmp_path / 'large.txt'
+    large.write_text('line\n' * 100)
+    content = cache.get(str(large))
+    assert content.line_count == 100
+    assert content.sha256 == ContentCache(mmap_threshold=10 ** 9).get(str(large)).sha256
+
+    binary = tmp_path / 'image.png'
+    binary.write_bytes(b'\x89PNG\0\0data')
+    assert cache.get(str(binary)).binary
+    assert cache.read_text(str(binary)) is None
+    assert cache.get(str(large), max_size=10) is None
+
+    once = tmp_path / 'once.py'
+    once.write_text('x = 1\n')
+    assert cache.get(str(once), store=False).text == 'x = 1\n'
+    assert str(once) not in cache.entries
+
+
+def test_file_endpoint_revalidates_with_etag():
+    app.config['TESTING'] = True
+    with app.test_client() as client:
+        response = client.get('/api/files/README.md')
+        assert response.status_code == 200
+        etag = response.headers['ETag']
+        assert etag.strip('"') == response.get_json()['sha256']
+
+        cached = client.get('/api/files/README.md', headers={'If-None-Match': etag})
+        assert cached.status_code == 304
+        assert client.get('/api/files/README.md', headers={'If-None-Match': '"stale"'}).status_code == 200
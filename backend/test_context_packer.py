@@ -0,0 +1,103 @@
+import pytest
+from app.context_packer import ContextPacker, Section, TRUNCATION_MARKER, prompt_token_budget
+from app.preprocessor import preprocessor
+
+
+def words(text):
+    return len(text.split())
+
+
+packer = ContextPacker(count_tokens=words)
+
+
+def test_everything_fits_and_renders_in_section_order():
+    packed = packer.pack([
+        Section("intro", priority=0, header="== Intro ==", items=["hello there"]),
+        Section("query", priority=1, header="== Query ==", items=["what is this"], required=True),
+    ], budget=100)
+
+    assert packed.text == "== Intro ==\nhello there\n\n== Query ==\nwhat is this"
+    assert packed.token_counts()["sections"] == {"intro": 5, "query": 6}
+    assert packed.truncated_sections == []
+
+
+def test_priority_decides_who_gets_the_budget():
+    sections = [
+        Section("tree", priority=3, items=["a b c", "d e f", "g h i"]),
+        Section("snippets", priority=2, budget=4, fit="greedy", items=["one two three four five six", "seven eight"]),
+        Section("query", priority=1, required=True, items=["why"]),
+    ]
+    packed = packer.pack(sections, budget=10)
+
+    # query: 1, snippets: the long one is skipped, the short one fits (2)
+    assert packed.sections["snippets"]["kept"] == [1]
+    assert packed.sections["snippets"]["dropped"] == 1
+    # tree: 7 tokens left, too few for a line plus the 7-word marker
+    assert packed.sections["tree"]["kept"] == []
+    assert set(packed.truncated_sections) == {"tree", "snippets"}
+    assert sum(stats["tokens"] for stats in packed.sections.values()) <= 10
+
+
+def test_history_keeps_most_recent_turns():
+    packed = packer.pack([
+        Section("history", priority=1, budget=12, keep="tail",
+                items=["User: a first question that was rather long", "Assistant: first answer", "User: second"]),
+    ], budget=100)
+    assert packed.text == f"{TRUNCATION_MARKER}\nAssistant: first answer\nUser: second"
+
+
+def test_required_message_is_shortened_deterministically():
+    message = " ".join(f"w{n}" for n in range(50))
+    sections = [Section("query", priority=1, budget=20, required=True, items=[message])]
+    first = packer.pack(sections, budget=100).text
+    assert first.startswith("w0 w1") and first.endswith(TRUNCATION_MARKER)
+    assert words(first) <= 20
+    assert packer.pack(sections, budget=100).text == first
+
+
+def test_required_section_keeps_its_room_when_fixed_sections_come_first():
+    message = " ".join(f"w{n}" for n in range(100))
+    sections = [
+        Section("system", priority=0, items=["a fixed rule"] * 60),
+        Section("query", priority=1, header="== Query ==", required=True, items=[message]),
+    ]
+    packed = packer.pack(sections, budget=150)
+    assert packed.sections["query"]["items"] == 1
+    assert "== Query ==\nw0 w1" in packed.text and packed.text.endswith(TRUNCATION_MARKER)
+    assert packed.total_tokens <= 150
+
+    with pytest.raises(ValueError):
+        packer.pack(sections, budget=8)  # Not even the header and the truncation marker fit
+
+
+def test_budget_from_model_window(monkeypatch):
+    monkeypatch.delenv('PROMPT_TOKEN_BUDGET', raising=False)
+    assert prompt_token_budget('gpt-4', 2000) == 8192 - 2000 - 500
+    monkeypatch.setenv('PROMPT_TOKEN_BUDGET', '3000')
+    assert prompt_token_budget('gpt-4', 2000) == 3000
+
+
+def test_preprocessor_reports_token_counts(monkeypatch):
+    monkeypatch.setenv('PROMPT_TOKEN_BUDGET', '700')
+    monkeypatch.setitem(preprocessor.section_budgets, 'snippets', 0)
+    monkeypatch.setitem(preprocessor.section_budgets, 'current_file', 0)
+    monkeypatch.setitem(preprocessor.section_budgets, 'related_files', 0)
+    monkeypatch.setitem(preprocessor.section_budgets, 'file_tree', 100)
+    monkeypatch.setitem(preprocessor.section_budgets, 'history', 40)
+    context = {
+        "project": "demo-project",
+        "file": "main.py",
+        "global_rules": ["Always answer in English"],
+        "history": [{"role": "user", "content": "earlier question " * 20}, {"role": "assistant", "content": "ok"}]
+    }
+    processed = preprocessor.process_prompt("What files are in this project?", context)
+    counts = processed["metadata"]["token_counts"]
+
+    assert counts["budget"] == 700
+    assert counts["total"] <= 700
+    assert 0 < counts["sections"]["file_tree"] <= 100
+    assert "- Always answer in English" in processed["enhanced_prompt"]
+    assert "Assistant: ok" in processed["enhanced_prompt"]
+    assert "earlier question" not in processed["enhanced_prompt"]
+    assert {"file_tree", "history"} <= set(counts["truncated_sections"])
+    assert processed["enhanced_prompt"].count("=== User Query ===") == 1
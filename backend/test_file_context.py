@@ -58,5 +58,16 @@ def test_file_context():
     print("Preprocessor integration: READY") 
     print("🎯 Next step: Test with live backend")
 
+def test_project_path_stays_inside_workspace(tmp_path, monkeypatch):
+    workspace = tmp_path / "workspace"
+    (workspace / "shop").mkdir(parents=True)
+    (tmp_path / "workspaceX").mkdir()
+    monkeypatch.setattr(file_context_manager, 'workspace_root', str(workspace))
+    
+    assert file_context_manager.resolve_project_path("shop") == str(workspace / "shop")
+    # A sibling whose name merely starts with the workspace's falls back to the root
+    assert file_context_manager.resolve_project_path("../workspaceX") == str(workspace)
+    assert file_context_manager.resolve_project_path("..") == str(workspace)
+
 if __name__ == "__main__":
     test_file_context()
@@ -0,0 +1,104 @@
+import sys
+import threading
+import time
+import pytest
+from app.file_watcher import FileWatcher, FileChange, TreeDeltaBroadcaster, is_tree_change
+from app.file_context_manager import FileContextManager
+from app.action_planner import ActionPlanner
+
+BACKENDS = ['polling'] + (['inotify'] if sys.platform.startswith('linux') else [])
+
+
+def collect(watcher):
+    batches = []
+    arrived = threading.Event()
+
+    def on_changes(changes):
+        batches.append(changes)
+        arrived.set()
+    watcher.subscribe(on_changes)
+    return batches, arrived
+
+
+@pytest.mark.parametrize('backend', BACKENDS)
+def test_watcher_publishes_debounced_changes(tmp_path, monkeypatch, backend):
+    monkeypatch.setenv('FILE_WATCHER_POLL_INTERVAL', '0.05')
+    (tmp_path / 'src').mkdir()
+    (tmp_path / 'src' / 'old.py').write_text('x = 1\n')
+    watcher = FileWatcher(debounce=0.1, max_delay=2.0, backend=backend)
+    watcher.add_root(str(tmp_path))
+    batches, arrived = collect(watcher)
+    deltas = TreeDeltaBroadcaster(watcher, str(tmp_path))
+    client = deltas.open()
+    watcher.start()
+    try:
+        (tmp_path / 'src' / 'new.py').write_text('y = 2\n')
+        (tmp_path / 'src' / 'new.py').write_text('y = 3\n')
+        (tmp_path / 'src' / 'old.py').unlink()
+        (tmp_path / 'src' / '.new.py.swp').write_text('')
+        assert arrived.wait(5)
+        time.sleep(0.3)  # Let any trailing batch land
+    finally:
+        watcher.stop()
+
+    changes = {(change.rel_path, change.kind) for batch in batches for change in batch}
+    assert changes == {('src/new.py', 'created'), ('src/old.py', 'deleted')}
+    delivered = set()
+    while not client.empty():
+        delivered |= {(delta['parent'], delta['name'], delta['change']) for delta in client.get_nowait()['changes']}
+    assert delivered == {('src', 'new.py', 'added'), ('src', 'old.py', 'removed')}
+
+
+def test_rescan_becomes_reset_delta(tmp_path):
+    delta = TreeDeltaBroadcaster.to_delta(FileChange(str(tmp_path), str(tmp_path), 'rescan', True))
+    assert delta['change'] == 'reset'
+
+
+def test_indexes_over_watched_trees_revalidate_rarely(tmp_path, monkeypatch):
+    monkeypatch.setenv('FILE_WATCHER_REVALIDATE_SECONDS', '300')
+    (tmp_path / 'project' / 'src').mkdir(parents=True)
+    watcher = FileWatcher(backend='polling')
+    watcher.add_root(str(tmp_path / 'project'))
+    assert watcher.revalidate_interval(str(tmp_path / 'project'), 10) == 10  # Not running yet
+    watcher.start()
+    try:
+        assert watcher.revalidate_interval(str(tmp_path / 'project' / 'src'), 10) == 300
+        assert watcher.revalidate_interval(str(tmp_path), 10) == 10
+    finally:
+        watcher.stop()
+
+    root = str(tmp_path / 'project')
+    assert is_tree_change(root, str(tmp_path))  # Rescan above the root
+    assert is_tree_change(root, str(tmp_path / 'project' / 'src'))
+    assert is_tree_change(root, str(tmp_path / 'project' / 'removed'))
+    assert not is_tree_change(root, str(tmp_path / 'elsewhere'))
+
+
+def test_invalidate_paths_refreshes_listing(tmp_path, monkeypatch):
+    monkeypatch.setenv('FILE_INDEX_PERSIST', 'false')
+    monkeypatch.setenv('FILE_INDEX_REVALIDATE_SECONDS', '3600')
+    (tmp_path / 'app.py').write_text('x = 1\n')
+    manager = FileContextManager()
+    manager.workspace_root = str(tmp_path)
+    assert manager.get_project_file_listing()['total_files'] == 1
+
+    (tmp_path / 'extra.py').write_text('y = 2\n')
+    # Within the revalidation interval nothing is re-checked until a change arrives
+    assert manager.get_project_file_listing()['total_files'] == 1
+    manager.invalidate_paths([str(tmp_path / 'extra.py')])
+    assert manager.get_project_file_listing()['total_files'] == 2
+
+
+def test_plan_cache_returns_copies_and_revalidates(tmp_path):
+    planner = ActionPlanner(storage_path=str(tmp_path))
+    plan = planner.generate_plan("Add a login page")
+    loaded = planner.load_plan(plan.id)
+    loaded.title = "changed in memory"
+    assert planner.load_plan(plan.id).title == plan.title
+
+    # Written by another process with no watcher event to invalidate the entry
+    path = tmp_path / f"{plan.id}.json"
+    path.write_text(path.read_text(encoding='utf-8').replace(plan.title, "Edited on disk"), encoding='utf-8')
+    assert planner.load_plan(plan.id).title == "Edited on disk"
+    path.unlink()
+    assert planner.load_plan(plan.id) is None
@@ -0,0 +1,116 @@
+import pytest
+from app.import_graph import ImportGraph, RelatedFiles, related_files
+from app.symbol_index import SymbolIndex, extract_js_symbols, extract_python_symbols, symbol_search
+from app.file_context_manager import file_context_manager
+from app.preprocessor import PromptPreprocessor
+
+
+def write(root, rel_path, text):
+    path = root / rel_path
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(text)
+
+
+@pytest.fixture
+def workspace(tmp_path, monkeypatch):
+    monkeypatch.setattr(file_context_manager, 'persist_index', False)
+    monkeypatch.setenv('FILE_INDEX_REVALIDATE_SECONDS', '0')
+    root = tmp_path / 'workspace'
+    write(root, 'backend/main.py', 'from app.routes import bp\n')
+    write(root, 'backend/app/__init__.py', '')
+    write(root, 'backend/app/routes.py', 'import os\nfrom . import store\nfrom .utils import slugify\n\nbp = slugify("x")\n')
+    write(root, 'backend/app/utils.py', 'def slugify(text):\n    return text.lower()\n')
+    write(root, 'backend/app/store.py', 'class Store:\n    def load(self, key):\n        return key\n')
+    write(root, 'frontend/jsconfig.json', '{\n  // aliases\n  "compilerOptions": {"baseUrl": ".", "paths": {"@/*": ["src/*"]},},\n}\n')
+    write(root, 'frontend/src/app/page.js', "import Button from '@/components/Button'\nimport React from 'react'\n")
+    write(root, 'frontend/src/components/Button.jsx', "const theme = require('../theme')\nexport default function Button() {}\n")
+    write(root, 'frontend/src/theme/index.js', "export const theme = {}\n")
+    return root
+
+
+def test_imports_are_extracted():
+    _, _, imports = extract_python_symbols('import os.path\nfrom ..pkg import a, b\nfrom . import c\n')
+    assert imports == [('os.path', ()), ('..pkg', ('a', 'b')), ('.', ('c',))]
+    _, _, imports = extract_js_symbols(
+        "import x from './x';\nimport './side.css';\n// import y from './commented'\n"
+        "export { z } from \"../z\";\nconst w = require('./w');\nconst v = await import('./v');\n"
+    )
+    assert [specifier for specifier, _ in imports] == ['./x', './side.css', '../z', './w', './v']
+
+
+def test_edges_resolve_python_and_js(workspace):
+    graph = ImportGraph(SymbolIndex(str(workspace), revalidate_interval=0))
+    graph.update()
+    assert graph.imports['backend/main.py'] == {'backend/app/routes.py'}
+    assert graph.imports['backend/app/routes.py'] == {'backend/app/store.py', 'backend/app/utils.py'}
+    assert graph.imports['frontend/src/app/page.js'] == {'frontend/src/components/Button.jsx'}
+    assert graph.imports['frontend/src/components/Button.jsx'] == {'frontend/src/theme/index.js'}
+    assert graph.get_stats()["edges"] == 5
+
+
+def test_neighbours_are_ordered_by_distance_then_direction(workspace):
+    graph = ImportGraph(SymbolIndex(str(workspace), revalidate_interval=0))
+    assert graph.resolve_file('app/routes.py') == 'backend/app/routes.py'
+    assert graph.resolve_file('__init__.py') == 'backend/app/__init__.py'
+    assert graph.resolve_file('missing.py') is None
+    neighbours = graph.neighbours('backend/app/routes.py', max_depth=2)
+    assert [(n["path"], n["relation"], n["distance"]) for n in neighbours] == [
+        ('backend/app/store.py', 'imports', 1),
+        ('backend/app/utils.py', 'imports', 1),
+        ('backend/main.py', 'imported_by', 1),
+    ]
+    two_hops = graph.neighbours('backend/app/utils.py', max_depth=2)
+    assert two_hops[-1] == {
+        "path": 'backend/main.py', "relation": 'imported_by', "distance": 2, "via": 'backend/app/routes.py'
+    }
+    assert graph.outline('backend/app/store.py') == 'class Store:\n  def load(self, key):'
+
+
+def test_only_indexed_non_dot_files_resolve(workspace):
+    write(workspace, 'backend/.env', 'OPENAI_API_KEY=sk-secret\n')
+    write(workspace, 'backend/.env.example', 'OPENAI_API_KEY=your_key_here\n')
+    write(workspace, 'backend/.coai/settings.json', '{}\n')
+    write(workspace, 'backend/server.pem', 'PRIVATE KEY\n')
+    write(workspace, 'docs/guide.md', '# Guide\n')
+    graph = ImportGraph(SymbolIndex(str(workspace), revalidate_interval=0))
+    assert graph.resolve_file('docs/guide.md') == 'docs/guide.md'
+    for name in ('backend/.env', 'backend/.env.example', '.env', 'backend/.coai/settings.json',
+                 'backend/server.pem', str(workspace / 'backend' / '.env')):
+        assert graph.resolve_file(name) is None, name
+
+
+def test_graph_updates_incrementally(workspace):
+    graph = ImportGraph(SymbolIndex(str(workspace), revalidate_interval=0))
+    graph.update()
+    write(workspace, 'backend/app/routes.py', 'from .utils import slugify\n')
+    graph.update()
+    assert graph.imports['backend/app/routes.py'] == {'backend/app/utils.py'}
+    assert 'backend/app/store.py' not in graph.importers
+
+    # A new module changes what an existing import resolves to
+    write(workspace, 'backend/app/slug/__init__.py', '')
+    write(workspace, 'backend/app/utils.py', 'from .slug import helpers\n')
+    write(workspace, 'backend/app/slug/helpers.py', 'def helper():\n    pass\n')
+    graph.update()
+    assert graph.imports['backend/app/utils.py'] == {'backend/app/slug/helpers.py'}
+    assert graph.importers['backend/app/slug/helpers.py'] == {'backend/app/utils.py'}
+
+
+def test_prompt_includes_current_file_and_neighbours(workspace, monkeypatch):
+    monkeypatch.setattr(file_context_manager, 'workspace_root', str(workspace))
+    monkeypatch.setattr(symbol_search, 'indexes', {})
+    monkeypatch.setattr(related_files, 'graphs', {})
+    symbol_search.warm().join(5)
+    context = RelatedFiles().context_for('backend/app/routes.py')
+    assert context["text"].startswith('import os')
+    assert [item["path"] for item in context["related"]] == [
+        'backend/app/store.py', 'backend/app/utils.py', 'backend/main.py'
+    ]
+
+    result = PromptPreprocessor().process_prompt("Explain this", {"project": "workspace", "file": "app/routes.py"})
+    prompt = result["enhanced_prompt"]
+    assert "--- backend/app/routes.py (current file) ---\nimport os" in prompt
+    assert "--- backend/app/utils.py (imported by the current file) ---\ndef slugify(text):" in prompt
+    assert "--- backend/main.py (imports the current file) ---" in prompt
+    assert result["metadata"]["current_file"] == 'backend/app/routes.py'
+    assert len(result["metadata"]["related_files"]) == 3
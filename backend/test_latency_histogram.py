@@ -0,0 +1,48 @@
+import random
+from dataclasses import asdict
+from app.latency_histogram import LatencyHistogram, RELATIVE_ACCURACY
+
+
+def exact_percentile(values, q):
+    ordered = sorted(values)
+    return ordered[int(q / 100 * (len(ordered) - 1))]
+
+
+def test_percentiles_within_relative_accuracy():
+    rng = random.Random(7)
+    values = [rng.lognormvariate(0, 1.5) for _ in range(20000)]
+    histogram = LatencyHistogram()
+    for value in values:
+        histogram.record(value)
+
+    for q in (50, 90, 99):
+        expected = exact_percentile(values, q)
+        assert abs(histogram.percentile(q) - expected) <= expected * RELATIVE_ACCURACY
+    assert histogram.max == max(values)
+    assert histogram.summary()["count"] == 20000
+
+
+def test_merge_matches_single_histogram_and_survives_json():
+    rng = random.Random(11)
+    values = [rng.uniform(0.01, 30) for _ in range(5000)] + [0.0]
+    combined = LatencyHistogram()
+    parts = [LatencyHistogram() for _ in range(4)]
+    for i, value in enumerate(values):
+        combined.record(value)
+        parts[i % 4].record(value)
+
+    # Round-trip one part through a JSON-style dict with string bucket keys
+    data = asdict(parts[0])
+    data["counts"] = {str(k): v for k, v in data["counts"].items()}
+    parts[0] = LatencyHistogram(**data)
+
+    merged = LatencyHistogram.merged(parts)
+    assert merged.counts == combined.counts
+    assert merged.zero_count == 1
+    merged_summary, combined_summary = merged.summary(), combined.summary()
+    assert abs(merged_summary.pop("mean") - combined_summary.pop("mean")) < 1e-9
+    assert merged_summary == combined_summary
+
+
+def test_empty_histogram():
+    assert LatencyHistogram().summary() == {"count": 0, "mean": 0.0, "max": 0.0, "p50": 0.0, "p90": 0.0, "p99": 0.0}
@@ -0,0 +1,98 @@
+from app import ai_agents_full
+from app import orchestrator as orchestrator_module
+from app.near_duplicate_cache import NearDuplicateCache, code_terms, message_terms
+from app.preprocessor import preprocessor
+from app.response_cache import ResponseCache
+
+
+def test_terms_fold_case_accents_plurals_and_function_words():
+    assert message_terms("How do I configure the Café logger?") == message_terms("how to configure cafe loggers")
+    assert message_terms("Why does the build fail") != message_terms("Does the build not fail")
+
+
+def test_word_order_and_identifiers_keep_questions_apart():
+    cache = NearDuplicateCache(threshold=0.8, max_entries=100)
+    cache.add("rename get_user to fetch_user in the user service", 's', 'rename')
+    assert cache.lookup("rename fetch_user to get_user in the user service", 's') is None
+    assert cache.lookup("please rename get_user to fetch_user in the user service", 's')[0] == 'rename'
+
+    cache.add("explain how the login form validates the password field before it submits the request", 's', 'password')
+    assert cache.lookup("explain how the login form validates the username field before it submits the request", 's') is None
+
+    cache.add("what does parse_config return for an empty file", 's', 'parse')
+    assert cache.lookup("what does parse_configs return for an empty file", 's') is None
+    assert code_terms("see app/routes.py and getUser or v2") == {"app/routes.py", "getUser", "v2"}
+
+
+def test_fingerprint_covers_retrieved_code():
+    context = {"project": "demo", "file": "main.py"}
+    snippet = {"path": "app/db.py", "start_line": 1, "end_line": 9, "text": "def connect(): ..."}
+    definition = {"path": "app/db.py", "line": 1, "text": "def connect(): ..."}
+    fingerprint = preprocessor._context_fingerprint(context, None, [snippet], [definition])
+    assert fingerprint == preprocessor._context_fingerprint(dict(context), None, [dict(snippet)], [dict(definition)])
+    assert fingerprint != preprocessor._context_fingerprint(context, None, [{**snippet, "text": "def connect(url): ..."}], [definition])
+    assert fingerprint != preprocessor._context_fingerprint(context, None, [snippet], [{**definition, "path": "app/orm.py"}])
+    assert fingerprint != preprocessor._context_fingerprint(context, None)
+
+
+def test_rephrased_question_hits_within_scope_only():
+    cache = NearDuplicateCache(threshold=0.6, max_entries=100)
+    assert cache.add("How do I configure the logger in the settings module?", 'scope-a', 'key-1')
+    assert not cache.add("logger", 'scope-a', 'key-short')
+
+    key, similarity = cache.lookup("how can I configure the logger in settings module", 'scope-a')
+    assert key == 'key-1' and similarity >= 0.6
+    assert cache.lookup("How do I configure the logger in the settings module?", 'scope-b') is None
+    assert cache.lookup("What does the database migration do?", 'scope-a') is None
+
+    stats = cache.get_stats()
+    assert (stats["hits"], stats["misses"], stats["entries"]) == (1, 2, 1)
+
+    cache.discard('key-1')
+    assert cache.lookup("How do I configure the logger in the settings module?", 'scope-a') is None
+    assert cache.get_stats()["entries"] == 0 and not cache.by_response
+
+
+def test_evicts_oldest_and_replaces_identical_messages():
+    cache = NearDuplicateCache(threshold=0.8, max_entries=2)
+    cache.add("explain the tokenizer merge table", 's', 'k1')
+    cache.add("explain the tokenizer merge table", 's', 'k2')
+    assert cache.get_stats()["entries"] == 1
+    assert cache.lookup("explain the tokenizer merge table", 's')[0] == 'k2'
+
+    cache.add("list the routes in the blueprint", 's', 'k3')
+    cache.add("describe the usage store schema", 's', 'k4')
+    assert cache.get_stats()["evicted"] == 1
+    assert cache.lookup("explain the tokenizer merge table", 's') is None
+    assert not cache.buckets or all(cache.buckets.values())
+    assert set(cache.by_response) == {'k3', 'k4'}
+
+
+def test_orchestrator_answers_rephrased_question_from_cache(tmp_path, monkeypatch):
+    manager = ai_agents_full.AIAgentManagerFull()
+    agent = manager.get_agent()
+    calls = []
+
+    def answer(request):
+        calls.append(request)
+        return {"status": "success", "agent_type": "openai", "response": "Set LOG_LEVEL in .env",
+                "usage": {"prompt_tokens": 300, "completion_tokens": 20, "total_tokens": 320, "model": "gpt-4o"},
+                "model": "gpt-4o", "real_ai": True}
+
+    monkeypatch.setattr(agent, 'uses_real_ai', lambda: True)
+    monkeypatch.setattr(agent, 'process_request', answer)
+    monkeypatch.setattr(ai_agents_full, 'response_cache', ResponseCache(db_path=str(tmp_path / 'responses.db'), ttl=60))
+    monkeypatch.setattr(ai_agents_full, 'near_duplicate_cache', NearDuplicateCache(threshold=0.6))
+    monkeypatch.setattr(orchestrator_module, 'ai_agent_manager', manager)
+    monkeypatch.setattr(orchestrator_module.usage_tracker, 'track_request', lambda **kwargs: None)
+
+    context = {"project": "demo-project", "file": "main.py", "global_rules": ["Be brief"]}
+    orchestrator = orchestrator_module.orchestrator
+    first = orchestrator.process_chat_request("How do I change the log level of the server?", dict(context))
+    second = orchestrator.process_chat_request("how can I change the server log level", dict(context))
+    assert len(calls) == 1
+    assert second["reply"] == first["reply"]
+    assert (second["metadata"]["cached"], second["metadata"]["cache_match"]) == (True, "near_duplicate")
+
+    orchestrator.process_chat_request("how can I change the server log level", {**context, "global_rules": ["Be thorough"]})
+    assert len(calls) == 2
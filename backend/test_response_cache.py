@@ -0,0 +1,94 @@
+import pytest
+from app import ai_agents_full
+from app import orchestrator as orchestrator_module
+from app.response_cache import ResponseCache, cache_key, normalize_prompt, rules_hash
+
+PROMPT = "=== COAI System Context ===\nProject: demo\nTimestamp: {}\n\n=== User Query ===\nWhat files are here?  \n"
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return ResponseCache(db_path=str(tmp_path / 'responses.db'), max_memory_entries=2, ttl=60)
+
+
+def test_key_ignores_timestamp_but_not_settings():
+    first = PROMPT.format('2025-01-01 10:00:00')
+    second = PROMPT.format('2025-01-02 11:30:00').replace('\n', '\r\n')
+    assert 'Timestamp' not in normalize_prompt(first)
+    assert normalize_prompt(first) == normalize_prompt(second)
+
+    rules = rules_hash({"global_rules": ["Answer in English"]})
+    key = cache_key(first, 'gpt-4o', 0.7, 2000, rules)
+    assert key == cache_key(second, 'gpt-4o', 0.7, 2000, rules)
+    assert key != cache_key(first, 'gpt-4o-mini', 0.7, 2000, rules)
+    assert key != cache_key(first, 'gpt-4o', 0.2, 2000, rules)
+    assert key != cache_key(first, 'gpt-4o', 0.7, 2000, rules_hash({"global_rules": ["Answer in Lithuanian"]}))
+
+
+def test_memory_and_disk_tiers_with_ttl(cache, tmp_path):
+    payload = {"response": "Two files", "usage": {"total_tokens": 120, "prompt_tokens": 100,
+                                                  "completion_tokens": 20, "model": "gpt-4o"}, "model": "gpt-4o"}
+    assert cache.get('k1') is None
+    cache.put('k1', payload)
+    assert cache.get('k1')["response"] == "Two files"
+
+    restarted = ResponseCache(db_path=cache.db_path, ttl=60)
+    assert restarted.get('k1')["response"] == "Two files"
+    assert restarted.get('k1') is not None
+    stats = restarted.get_stats()
+    assert (stats["disk_hits"], stats["memory_hits"], stats["tokens_saved"]) == (1, 1, 240)
+    assert stats["cost_saved"] > 0
+
+    expired = ResponseCache(db_path=str(tmp_path / 'expired.db'), ttl=0)
+    expired.put('k1', payload)
+    assert expired.get('k1') is None
+    assert expired.purge_expired() == 1
+
+    for key in ('a', 'b', 'c'):
+        cache.put(key, payload)
+    assert list(cache.memory) == ['b', 'c']
+
+
+def test_opt_out(cache, monkeypatch):
+    assert cache.key_for({"message": "hi", "context": {"cache": False}}, 'gpt-4o', 0.7, 2000) is None
+    assert cache.key_for({"message": "hi", "context": {}}, 'gpt-4o', 0.7, 2000)
+    monkeypatch.setattr(cache, 'enabled', False)
+    assert cache.key_for({"message": "hi", "context": {}}, 'gpt-4o', 0.7, 2000) is None
+    assert cache.get_stats()["bypassed"] == 2
+
+
+def test_orchestrator_serves_repeat_questions_from_cache(cache, monkeypatch):
+    manager = ai_agents_full.AIAgentManagerFull()
+    agent = manager.get_agent()
+    calls = []
+
+    def answer(request):
+        calls.append(request)
+        return {"status": "success", "agent_type": "openai", "response": "It has two files",
+                "usage": {"prompt_tokens": 300, "completion_tokens": 20, "total_tokens": 320, "model": "gpt-4o"},
+                "model": "gpt-4o", "real_ai": True}
+
+    monkeypatch.setattr(agent, 'uses_real_ai', lambda: True)
+    monkeypatch.setattr(agent, 'process_request', answer)
+    monkeypatch.setattr(ai_agents_full, 'response_cache', cache)
+    monkeypatch.setattr(orchestrator_module, 'ai_agent_manager', manager)
+    tracked = []
+    monkeypatch.setattr(orchestrator_module.usage_tracker, 'track_request', lambda **kwargs: tracked.append(kwargs))
+
+    context = {"project": "demo-project", "file": "main.py", "global_rules": ["Be brief"]}
+    first = orchestrator_module.orchestrator.process_chat_request("What files are in this project?", dict(context))
+    second = orchestrator_module.orchestrator.process_chat_request("What files are in this project?", dict(context))
+    assert len(calls) == 1
+    assert second["reply"] == first["reply"] == "It has two files"
+    assert (first["metadata"]["cached"], second["metadata"]["cached"]) == (False, True)
+    assert second["request_id"] != first["request_id"]
+    assert tracked[1]["cached"] is True
+    assert tracked[1]["tokens_data"]["total_tokens"] == 0
+
+    streamed = list(orchestrator_module.orchestrator.stream_chat_request("What files are in this project?", dict(context)))
+    assert len(calls) == 1
+    assert streamed[-1]["metadata"]["cached"] is True
+    assert "".join(event["content"] for event in streamed if event["type"] == "token") == "It has two files"
+
+    orchestrator_module.orchestrator.process_chat_request("What files are in this project?", {**context, "cache": False})
+    assert len(calls) == 2
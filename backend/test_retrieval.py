@@ -0,0 +1,82 @@
+import pytest
+from app import retrieval
+from app.retrieval import Bm25Index, SnippetRetriever, snippet_retriever, tokenize, CHUNK_LINES
+from app.file_context_manager import file_context_manager
+from app.preprocessor import preprocessor
+
+
+@pytest.fixture
+def workspace(tmp_path, monkeypatch):
+    monkeypatch.setattr(file_context_manager, 'persist_index', False)
+    monkeypatch.setenv('FILE_INDEX_REVALIDATE_SECONDS', '0')
+    root = tmp_path / 'workspace'
+    (root / 'src').mkdir(parents=True)
+    filler = '\n'.join(f'value_{n} = {n}' for n in range(CHUNK_LINES))
+    (root / 'src' / 'billing.py').write_text(
+        filler + '\n\ndef calculate_invoice_total(items):\n    return sum(item.price for item in items)\n'
+    )
+    (root / 'src' / 'auth.py').write_text('def check_password(user, password):\n    return user.password == password\n')
+    (root / 'README.md').write_text('# Demo\nA small demo project.\n')
+    return root
+
+
+def test_tokenize_splits_identifiers():
+    assert tokenize('getUserName') == ['getusername', 'get', 'user', 'name']
+    assert tokenize('the invoice_total') == ['invoice_total', 'invoice', 'total']
+
+
+def test_search_ranks_the_relevant_chunk(workspace):
+    index = Bm25Index(str(workspace), revalidate_interval=0)
+    hits = index.search('How is the invoice total calculated?')
+
+    assert hits[0]["path"] == 'src/billing.py'
+    assert (hits[0]["start_line"], hits[0]["end_line"]) == (CHUNK_LINES + 1, CHUNK_LINES + 3)
+    assert 'calculate_invoice_total' in index.read_snippet(hits[0])
+
+    (workspace / 'src' / 'auth.py').write_text('def calculate_invoice_total():\n    pass\n')
+    (workspace / 'src' / 'billing.py').unlink()
+    assert [hit["path"] for hit in index.search('invoice total')] == ['src/auth.py']
+    assert index.get_stats()["files"] == 2
+
+
+def test_retrieve_respects_token_budget(workspace, monkeypatch):
+    retriever = SnippetRetriever()
+    retriever.min_score = 0
+    monkeypatch.setattr(file_context_manager, 'workspace_root', str(workspace))
+
+    # A cold index is built in the background rather than inside the chat request
+    assert retriever.retrieve('check password for user') == []
+    retriever.get_index().warmer.join(5)
+    snippets = retriever.retrieve('check password for user', token_budget=1000)
+    assert snippets[0]["path"] == 'src/auth.py'
+    assert sum(snippet["tokens"] for snippet in snippets) <= 1000
+    assert retriever.retrieve('check password for user', token_budget=5) == []
+
+
+def test_preprocessor_injects_snippets(workspace, monkeypatch):
+    monkeypatch.setattr(file_context_manager, 'workspace_root', str(workspace))
+    snippet_retriever.warm('demo-project').join(5)
+    processed = preprocessor.process_prompt('Why does check_password compare the password?', {"project": "demo-project"})
+
+    assert "=== RELEVANT CODE SNIPPETS ===" in processed["enhanced_prompt"]
+    assert "--- src/auth.py (lines 1-2) ---" in processed["enhanced_prompt"]
+    assert processed["metadata"]["snippets"][0]["path"] == 'src/auth.py'
+
+
+def test_watched_index_relies_on_reported_changes(workspace, monkeypatch):
+    monkeypatch.setattr(retrieval.file_watcher, 'covers', lambda path: True)
+    index = Bm25Index(str(workspace), revalidate_interval=0)
+    assert index.refresh() == 3
+
+    (workspace / 'src' / 'auth.py').write_text('def verify_token(token):\n    return token\n')
+    assert index.refresh() == 0  # No full re-check while the watcher reports changes
+    index.mark_dirty([str(workspace / 'src' / 'auth.py')])
+    assert index.refresh() == 1
+
+    (workspace / 'lib').mkdir()
+    (workspace / 'lib' / 'tokens.py').write_text('def issue_token():\n    pass\n')
+    index.mark_dirty([str(workspace / 'lib')])  # A whole directory appeared
+    assert index.refresh() == 1
+    index.mark_dirty([str(workspace.parent)])  # Events were lost above the root
+    assert index.refresh() == 0 and index.validated_at > 0
+    assert index.search('issue token')[0]["path"] == 'lib/tokens.py'
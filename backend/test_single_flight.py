@@ -0,0 +1,169 @@
+import asyncio
+import threading
+import time
+import pytest
+from main import app
+from app import routes
+from app import orchestrator as orchestrator_module
+from app.admission_control import AdmissionController
+from app.single_flight import AsyncSingleFlight, SingleFlight, request_key
+
+
+def wait_for(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.005)
+
+
+def run_concurrently(count, target):
+    results = [None] * count
+    threads = [threading.Thread(target=lambda n=n: results.__setitem__(n, target())) for n in range(count)]
+    for thread in threads:
+        thread.start()
+    return threads, results
+
+
+def test_request_key_normalizes_message_but_not_context():
+    context = {"project": "demo", "file": "main.py", "history": []}
+    assert request_key("What is this?  \r\n", context) == request_key("What is this?", dict(context))
+    assert request_key("What is this?", context) != request_key("What is this?", {**context, "file": "app.py"})
+    assert request_key("What is this?", context) != request_key("What is this?", {**context, "global_rules": ["Be terse"]})
+    # Per-request fields do not split otherwise identical requests
+    stamped = {**context, "timestamp": "2024-05-01T10:00:00.123456", "request_id": "chat_1", "endpoint": "/api/chat"}
+    assert request_key("What is this?", context) == request_key("What is this?", stamped)
+
+
+def test_followers_share_the_leaders_result_and_errors():
+    flight = SingleFlight()
+    release = threading.Event()
+    calls = []
+
+    def work():
+        calls.append(1)
+        release.wait(5)
+        return "answer"
+
+    threads, results = run_concurrently(4, lambda: flight.run('k', work))
+    wait_for(lambda: flight.get_stats()["coalesced"] == 3)
+    release.set()
+    for thread in threads:
+        thread.join()
+    assert len(calls) == 1
+    assert sorted(results, key=lambda result: result[1]) == [("answer", False)] + [("answer", True)] * 3
+    assert flight.get_stats()["in_flight"] == 0
+
+    # Done calls are forgotten: the next caller runs the work again
+    assert flight.run('k', work) == ("answer", False)
+    assert flight.run(None, work) == ("answer", False)
+
+    def fail():
+        raise RuntimeError("upstream down")
+
+    with pytest.raises(RuntimeError):
+        flight.run('k', fail)
+    assert flight.get_stats()["in_flight"] == 0
+
+
+def test_async_followers_await_the_leader():
+    flight = AsyncSingleFlight()
+    calls = []
+
+    async def work():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        return "answer"
+
+    async def failing():
+        await asyncio.sleep(0.05)
+        raise RuntimeError("upstream down")
+
+    async def scenario():
+        results = await asyncio.gather(*(flight.run('k', work) for _ in range(5)))
+        failures = await asyncio.gather(*(flight.run('f', failing) for _ in range(2)), return_exceptions=True)
+        return results, failures
+
+    results, failures = asyncio.run(scenario())
+    assert len(calls) == 1
+    assert sorted(coalesced for _, coalesced in results) == [False] + [True] * 4
+    assert all(isinstance(failure, RuntimeError) for failure in failures)
+    assert flight.get_stats()["in_flight"] == 0
+
+
+def test_concurrent_identical_chat_requests_call_the_agent_once(monkeypatch):
+    flight = SingleFlight()
+    release = threading.Event()
+    calls = []
+
+    class Agents:
+        def process_request(self, request):
+            calls.append(request)
+            release.wait(5)
+            return {"status": "success", "agent_type": "openai", "response": "Two files", "real_ai": True,
+                    "usage": {"prompt_tokens": 300, "completion_tokens": 20, "total_tokens": 320, "model": "gpt-4o"}}
+
+    tracked = []
+    monkeypatch.setattr(orchestrator_module, 'single_flight', flight)
+    monkeypatch.setattr(orchestrator_module, 'ai_agent_manager', Agents())
+    monkeypatch.setattr(orchestrator_module.usage_tracker, 'track_request', lambda **kwargs: tracked.append(kwargs))
+
+    context = {"project": "demo-project", "file": "main.py"}
+    ask = lambda: orchestrator_module.orchestrator.process_chat_request("What files are here?", dict(context))
+    threads, responses = run_concurrently(3, ask)
+    wait_for(lambda: flight.get_stats()["coalesced"] == 2)
+    release.set()
+    for thread in threads:
+        thread.join()
+
+    assert len(calls) == 1
+    assert [response["reply"] for response in responses] == ["Two files"] * 3
+    assert len({response["request_id"] for response in responses}) == 3
+    assert sorted(response["metadata"]["coalesced"] for response in responses) == [False, True, True]
+    assert sorted(entry["coalesced"] for entry in tracked) == [False, True, True]
+    assert sorted(entry["tokens_data"]["total_tokens"] for entry in tracked) == [0, 0, 320]
+
+    # Requests opting out of caching are never coalesced
+    release.clear()
+    threads, _ = run_concurrently(2, lambda: orchestrator_module.orchestrator.process_chat_request(
+        "What files are here?", {**context, "cache": False}))
+    wait_for(lambda: len(calls) == 3)
+    release.set()
+    for thread in threads:
+        thread.join()
+    assert flight.get_stats()["coalesced"] == 2
+
+
+def test_concurrent_identical_chat_posts_are_coalesced(monkeypatch):
+    flight = SingleFlight()
+    release = threading.Event()
+    calls = []
+
+    class Agents:
+        def process_request(self, request):
+            calls.append(request)
+            release.wait(5)
+            return {"status": "success", "agent_type": "openai", "response": "Two files", "real_ai": True,
+                    "usage": {"prompt_tokens": 300, "completion_tokens": 20, "total_tokens": 320, "model": "gpt-4o"}}
+
+    tracked = []
+    monkeypatch.setattr(orchestrator_module, 'single_flight', flight)
+    monkeypatch.setattr(orchestrator_module, 'ai_agent_manager', Agents())
+    monkeypatch.setattr(orchestrator_module.usage_tracker, 'track_request', lambda **kwargs: tracked.append(kwargs))
+    monkeypatch.setattr(routes, 'admission_controller', AdmissionController(initial_limit=10, min_limit=1))
+
+    body = {"message": "What files are here?", "project": "demo-project", "file": "main.py"}
+    post = lambda n: app.test_client().post("/api/chat", json=body, headers={"X-Forwarded-For": f"10.23.0.{n}"})
+    results = [None] * 3
+    threads = [threading.Thread(target=lambda n=n: results.__setitem__(n, post(n))) for n in range(3)]
+    for thread in threads:
+        thread.start()
+    wait_for(lambda: flight.get_stats()["coalesced"] == 2)
+    release.set()
+    for thread in threads:
+        thread.join()
+
+    responses = [result.get_json() for result in results]
+    assert [result.status_code for result in results] == [200] * 3
+    assert len(calls) == 1
+    assert len({response["request_id"] for response in responses}) == 3
+    assert sorted(entry["coalesced"] for entry in tracked) == [False, True, True]
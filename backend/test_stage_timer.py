@@ -0,0 +1,60 @@
+import time
+import pytest
+from app.stage_timer import StageTimer, StageStats, span
+
+
+def test_spans_accumulate_and_nest():
+    timer = StageTimer()
+    with timer.span("logging"):
+        time.sleep(0.01)
+    with timer.span("preprocess"), timer.activate():
+        with span("file_context"):
+            time.sleep(0.01)
+    with timer.span("logging"):
+        time.sleep(0.01)
+
+    breakdown = timer.breakdown()
+    stages = breakdown["stages"]
+    assert stages["logging"] >= 20
+    assert stages["preprocess"] >= stages["file_context"] >= 10
+    assert breakdown["total_ms"] >= stages["logging"] + stages["preprocess"]
+
+
+def test_module_span_is_noop_without_active_timer():
+    timer = StageTimer()
+    with span("file_context"):
+        pass
+    assert timer.stages == {}
+
+
+def test_stage_stats_percentiles():
+    stats = StageStats()
+    for ms in range(1, 101):
+        timer = StageTimer()
+        timer.stages["agent"] = float(ms)
+        stats.record(timer)
+
+    summary = stats.summary()
+    assert summary["agent"]["count"] == 100
+    assert summary["agent"]["p50"] == pytest.approx(50, rel=0.05)
+    assert summary["agent"]["p99"] == pytest.approx(99, rel=0.05)
+    assert summary["total"]["count"] == 100
+
+
+def test_chat_response_includes_stage_timings():
+    from main import app
+    app.config['TESTING'] = True
+    with app.test_client() as client:
+        response = client.post('/api/chat', json={
+            "message": "Help me implement a sorting function",
+            "project": "demo-project",
+            "file": "main.py"
+        })
+        assert response.status_code == 200
+        metadata = response.get_json()["metadata"]
+        assert isinstance(metadata["processing_time"], float)
+        for stage in ("validation", "rules_injection", "preprocess", "agent", "usage_tracking", "logging"):
+            assert stage in metadata["stage_timings"]
+
+        stages = client.get('/api/usage/stages').get_json()["stages"]
+        assert stages["total"]["count"] >= 1
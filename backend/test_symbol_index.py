@@ -0,0 +1,164 @@
+import threading
+import pytest
+from main import app
+from app import symbol_index
+from app.symbol_index import (
+    SymbolIndex, SymbolSearch, extract_python_symbols, extract_js_symbols, mentioned_identifiers, symbol_search
+)
+from app.file_context_manager import file_context_manager
+
+PYTHON_SOURCE = '''\
+import os
+
+LIMIT = 10
+
+
+class SessionManager:
+    """Keeps sessions"""
+
+    @property
+    def active(self):
+        return [s for s in self.sessions if s.alive]
+
+    def close_all(self):
+        for session in self.active:
+            session.close()
+
+
+def make_manager():
+    return SessionManager()
+'''
+
+JS_SOURCE = '''\
+import React from 'react';
+const API_URL = "http://localhost/{x}"; // not a block {
+function fetchTree(path) {
+  return fetch(`${API_URL}/tree?path=${path}`);
+}
+const TreeView = ({ nodes }) => {
+  return nodes.map((node) => ({ name: node.name }));
+};
+export class Store extends Base {
+  constructor() {
+    super();
+  }
+  load(id) {
+    return fetchTree(id);
+  }
+}
+'''
+
+
+@pytest.fixture
+def workspace(tmp_path, monkeypatch):
+    monkeypatch.setattr(file_context_manager, 'persist_index', False)
+    monkeypatch.setenv('FILE_INDEX_REVALIDATE_SECONDS', '0')
+    root = tmp_path / 'workspace'
+    (root / 'src').mkdir(parents=True)
+    (root / 'src' / 'sessions.py').write_text(PYTHON_SOURCE)
+    (root / 'src' / 'store.js').write_text(JS_SOURCE)
+    (root / 'src' / 'uses.py').write_text('from sessions import make_manager\n\nmanager = make_manager()\n')
+    return root
+
+
+def test_python_definitions_and_references():
+    definitions, references, _ = extract_python_symbols(PYTHON_SOURCE)
+    by_name = {definition[1]: definition for definition in definitions}
+
+    assert by_name['LIMIT'][2:] == ('variable', 3, 3)
+    assert by_name['SessionManager'][2:] == ('class', 6, 15)
+    assert by_name['SessionManager.active'][2:] == ('method', 9, 11)  # Includes the decorator
+    assert by_name['make_manager'][2:] == ('function', 18, 19)
+    assert ('SessionManager', 19) in references
+    assert ('close', 15) in references
+    assert extract_python_symbols('def broken(:\n') == ([], [], [])
+
+
+def test_js_definitions_ignore_strings_and_comments():
+    definitions, references, _ = extract_js_symbols(JS_SOURCE)
+    found = {definition[1]: definition[2:] for definition in definitions}
+
+    assert found == {
+        'API_URL': ('variable', 2, 2),
+        'fetchTree': ('function', 3, 5),
+        'TreeView': ('function', 6, 8),
+        'Store': ('class', 9, 16),
+        'Store.constructor': ('method', 10, 12),
+        'Store.load': ('method', 13, 15),
+    }
+    assert ('fetchTree', 14) in references
+    assert not any(name == 'tree' for name, _ in references)  # Inside a template string
+
+
+def test_mentioned_identifiers_only_picks_code_like_names():
+    message = "Why does `close_all` loop? Compare make_manager() with SessionManager.active and the Store."
+    assert mentioned_identifiers(message) == ['close_all', 'make_manager', 'SessionManager.active']
+
+
+def test_index_updates_incrementally(workspace):
+    index = SymbolIndex(str(workspace), revalidate_interval=0)
+    assert index.refresh() == 3
+    assert [d["path"] for d in index.find_definitions('make_manager')] == ['src/sessions.py']
+    assert [r["path"] for r in index.find_references('make_manager')] == ['src/uses.py']
+    assert index.find_definitions('SessionManager.close_all')[0]["line"] == 13
+    assert index.refresh() == 0
+
+    (workspace / 'src' / 'sessions.py').write_text('def make_manager(kind):\n    return kind\n')
+    (workspace / 'src' / 'uses.py').unlink()
+    assert index.refresh() == 2
+    assert index.find_definitions('SessionManager') == []
+    assert [r["path"] for r in index.find_references('make_manager')] == []
+    assert index.read_definition(index.find_definitions('make_manager')[0]) == 'def make_manager(kind):\n    return kind'
+
+
+def test_pool_build_matches_in_process_build(workspace):
+    for n in range(40):
+        (workspace / 'src' / f'mod{n}.py').write_text(f'def helper_{n}():\n    return {n}\n')
+    pooled = SymbolIndex(str(workspace), revalidate_interval=0, workers=2)
+    assert pooled.refresh() == 43
+    serial = SymbolIndex(str(workspace), revalidate_interval=0, workers=1)
+    serial.refresh()
+    assert pooled.definitions == serial.definitions
+    assert pooled.find_definitions('helper_39')[0]["path"] == 'src/mod39.py'
+
+
+def test_lookups_answer_from_the_built_index_while_files_are_reparsed(workspace, monkeypatch):
+    index = SymbolIndex(str(workspace), revalidate_interval=0, workers=1)
+    index.refresh()
+    parsing, resume = threading.Event(), threading.Event()
+    real_parse = symbol_index.parse_file
+
+    def slow_parse(path):
+        parsing.set()
+        resume.wait(5)
+        return real_parse(path)
+
+    monkeypatch.setattr(symbol_index, 'parse_file', slow_parse)
+    (workspace / 'src' / 'sessions.py').write_text('def make_store():\n    return {}\n')
+    refresher = threading.Thread(target=index.refresh)
+    refresher.start()
+    assert parsing.wait(5)
+    assert index.find_definitions('make_manager')[0]["path"] == 'src/sessions.py'
+    resume.set()
+    refresher.join(5)
+    assert index.find_definitions('make_manager') == []
+    assert index.find_definitions('make_store')[0]["line"] == 1
+
+
+def test_definitions_for_message_and_endpoint(workspace, monkeypatch):
+    monkeypatch.setattr(file_context_manager, 'workspace_root', str(workspace))
+    monkeypatch.setattr(symbol_search, 'indexes', {})
+    search = SymbolSearch()
+    # A cold index is built in the background rather than inside the chat request
+    assert search.definitions_for_message('What does make_manager() return?') == []
+    search.get_index().warmer.join(5)
+    definitions = search.definitions_for_message('What does make_manager() return?')
+    assert definitions[0]["text"].startswith('def make_manager():')
+
+    app.config['TESTING'] = True
+    with app.test_client() as client:
+        data = client.get('/api/symbols?q=SessionManager.close_all').get_json()
+        assert data["definitions"][0]["kind"] == 'method'
+        assert client.get('/api/symbols?q=sessionmgr').get_json()["suggestions"] == []
+        assert client.get('/api/symbols?q=Session').get_json()["suggestions"] == ['SessionManager']
+        assert client.get('/api/symbols').status_code == 400
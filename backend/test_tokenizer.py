@@ -0,0 +1,49 @@
+import pytest
+from app.tokenizer import BPETokenizer, train, load_ranks, save_ranks, get_tokenizer, count_tokens
+from app.usage_tracker import estimate_cost
+
+SAMPLES = [
+    "def handle_request(self, data):\n    return data.get('message', '').strip()\n",
+    "Hello world!  It's   spaced\n\n\n    indented\n\tTabbed):\n\nnext",
+    "Lietuviškas tekstas su ąčęėįšųūž ir emoji 🎉 2024-08-14 12345678",
+    "",
+    "\n\n",
+]
+
+
+def test_encode_decode_round_trip_and_counts_match():
+    tokenizer = get_tokenizer()
+    for text in SAMPLES:
+        tokens = tokenizer.encode(text)
+        assert tokenizer.decode(tokens) == text
+        assert tokenizer.count(text) == len(tokens)
+        # Block-wise counting must not change the result
+        assert tokenizer.count(text * 3) == len(tokenizer.encode(text * 3))
+
+
+def test_common_code_compresses_better_than_bytes():
+    text = SAMPLES[0] * 10
+    assert count_tokens(text) < len(text.encode('utf-8')) / 3
+
+
+def test_train_learns_frequent_pairs(tmp_path):
+    ranks = train(["banana bandana " * 50], merges=100)
+    # Stops early once every piece is a single token
+    assert 256 < len(ranks) < 356
+    tokenizer = BPETokenizer(ranks)
+    assert tokenizer.encode(" bandana") == [ranks[b" bandana"]]
+    assert tokenizer.count("bandanas") > 1
+
+    path = str(tmp_path / 'ranks.tiktoken')
+    save_ranks(ranks, path)
+    assert load_ranks(path) == ranks
+
+
+def test_rank_table_must_cover_all_bytes():
+    with pytest.raises(ValueError):
+        BPETokenizer({b'a': 0})
+
+
+def test_cost_estimate_uses_model_pricing():
+    assert estimate_cost('gpt-4', 1000, 1000) == pytest.approx(0.09)
+    assert estimate_cost('gpt-3.5-turbo', 1000, 0) == pytest.approx(0.0015)
@@ -0,0 +1,145 @@
+import json
+import os
+import tempfile
+from datetime import date, timedelta
+from app.usage_store import UsageStore, import_daily_files
+from app.usage_tracker import UsageTracker
+
+
+def make_entry(timestamp, request_id, project="demo", model="mock", agent_type="openai", tokens=10, response_time=1.0):
+    return {
+        "timestamp": timestamp, "request_id": request_id, "agent_type": agent_type,
+        "project": project, "file": "main.py", "message_length": 5, "response_length": 5,
+        "tokens_used": tokens, "prompt_tokens": tokens // 2, "completion_tokens": tokens // 2,
+        "model": model, "cost_estimate": 0.001, "response_time": response_time,
+        "status": "success", "real_ai": False, "error": None
+    }
+
+
+def test_group_by_queries():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        store = UsageStore(os.path.join(tmpdir, 'usage.db'))
+        store.insert_entries([
+            make_entry("2025-08-13T09:15:00", "a", project="demo"),
+            make_entry("2025-08-13T09:45:00", "b", project="other", model="gpt-4"),
+            make_entry("2025-08-14T17:00:00", "c", project="demo", response_time=3.0),
+        ])
+
+        by_day = store.query("2025-08-13", "2025-08-15", ["day"])
+        assert [(r["day"], r["requests"]) for r in by_day] == [("2025-08-13", 2), ("2025-08-14", 1)]
+
+        by_project = store.query("2025-08-13", "2025-08-15", ["project"], order_by="requests")
+        assert by_project[0]["project"] == "demo" and by_project[0]["requests"] == 2
+
+        by_hour = store.query("2025-08-13", "2025-08-14", ["hour", "model"])
+        assert {(r["hour"], r["model"]) for r in by_hour} == {("2025-08-13T09", "mock"), ("2025-08-13T09", "gpt-4")}
+
+        filtered = store.query("2025-08-13", "2025-08-15", filters={"project": "demo"})
+        assert filtered[0]["requests"] == 2
+        assert filtered[0]["max_response_time"] == 3.0
+
+
+def test_import_daily_files_is_idempotent():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        daily = os.path.join(tmpdir, 'daily')
+        os.makedirs(daily)
+        with open(os.path.join(daily, '2025-08-13.json'), 'w') as f:
+            json.dump({"entries": [make_entry("2025-08-13T10:00:00", "legacy")]}, f)
+        with open(os.path.join(daily, '2025-08-14.jsonl'), 'w') as f:
+            f.write(json.dumps(make_entry("2025-08-14T10:00:00", "new")) + "\n")
+
+        store = UsageStore(os.path.join(tmpdir, 'usage.db'))
+        assert import_daily_files(store, daily) == 2
+        assert import_daily_files(store, daily) == 0
+        assert store.count() == 2
+
+
+def test_tracker_backfills_entries_logged_while_the_database_was_off():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        UsageTracker(tmpdir).writer.shutdown()  # The database exists from an earlier run
+        today = date.today().isoformat()
+        late = json.dumps(make_entry(f"{today}T23:59:59", "late")) + "\n"
+        # Logged by a process with USAGE_SQLITE_ENABLED=false; the last line is still being written
+        with open(os.path.join(tmpdir, 'daily', f"{today}.jsonl"), 'a') as f:
+            f.write(''.join(json.dumps(make_entry(f"{today}T08:00:0{n}", f"r{n}")) + "\n" for n in range(3)))
+            f.write(late[:20])
+
+        tracker = UsageTracker(tmpdir)
+        tomorrow = (date.today() + timedelta(days=1)).isoformat()
+        assert tracker.query_usage(today, tomorrow)[0]["requests"] == 3
+        tracker.writer.shutdown()
+
+        with open(os.path.join(tmpdir, 'daily', f"{today}.jsonl"), 'a') as f:
+            f.write(late[20:])
+        assert import_daily_files(tracker.store, os.path.join(tmpdir, 'daily')) == 1
+        assert tracker.store.count() == 4
+
+
+def test_query_usage_through_tracker():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        tracker = UsageTracker(tmpdir)
+        today = date.today()
+        yesterday = (today - timedelta(days=1)).isoformat()
+        tracker.store.insert_entries([
+            make_entry(f"{yesterday}T08:00:00", "y1", project="other", response_time=2.0),
+            make_entry(f"{today.isoformat()}T08:30:00", "t1"),
+            make_entry(f"{today.isoformat()}T14:00:00", "t2"),
+        ])
+
+        end = (today + timedelta(days=1)).isoformat()
+        rows = tracker.query_usage(yesterday, end, ["hour_of_day"])
+        assert [(r["hour_of_day"], r["requests"]) for r in rows] == [(8, 2), (14, 1)]
+
+        rows = tracker.query_usage(yesterday, end, ["project"], {"project": "demo"})
+        assert rows == [dict(rows[0], project="demo", requests=2)]
+        tracker.writer.shutdown()
+
+
+def test_cached_entries_and_column_migration():
+    import sqlite3
+    with tempfile.TemporaryDirectory() as tmpdir:
+        db_path = os.path.join(tmpdir, 'usage.db')
+        # A database from before the cached column existed
+        conn = sqlite3.connect(db_path)
+        conn.execute("CREATE TABLE usage_entries (id INTEGER PRIMARY KEY, timestamp TEXT NOT NULL, "
+                     "request_id TEXT NOT NULL, agent_type TEXT, project TEXT, file TEXT, message_length INTEGER, "
+                     "response_length INTEGER, tokens_used INTEGER, prompt_tokens INTEGER, completion_tokens INTEGER, "
+                     "model TEXT, cost_estimate REAL, response_time REAL, status TEXT, real_ai INTEGER, error TEXT, "
+                     "UNIQUE (request_id, timestamp))")
+        conn.commit()
+        conn.close()
+
+        store = UsageStore(db_path)
+        store.insert_entries([
+            make_entry("2025-08-14T08:00:00", "r1"),
+            dict(make_entry("2025-08-14T09:00:00", "r2", tokens=0), cached=True, cost_estimate=0.0),
+        ])
+        [row] = store.query("2025-08-14", "2025-08-15")
+        assert (row["requests"], row["cached_requests"]) == (2, 1)
+        assert [entry["cached"] for entry in store.iter_entries("2025-08-14", "2025-08-15")] == [False, True]
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        tracker = UsageTracker(tmpdir)
+        entry = tracker.track_request(
+            request_id="c1", agent_type="openai", project="demo", file="main.py", message="hi", response="cached",
+            tokens_data={"total_tokens": 0, "model": "gpt-4"}, response_time=0.01, status="success",
+            real_ai=True, cached=True
+        )
+        assert entry.cost_estimate == 0.0
+        tracker.writer.shutdown()
+        assert tracker.get_daily_summary().cached_requests == 1
+
+
+def test_coalesced_entries_cost_nothing():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        tracker = UsageTracker(tmpdir)
+        entry = tracker.track_request(
+            request_id="f1", agent_type="openai", project="demo", file="main.py", message="hi", response="shared",
+            tokens_data={"total_tokens": 0, "model": "gpt-4"}, response_time=0.5, status="success",
+            real_ai=True, coalesced=True
+        )
+        assert (entry.cost_estimate, entry.coalesced) == (0.0, True)
+        tracker.writer.shutdown()
+        assert tracker.get_daily_summary().coalesced_requests == 1
+        [row] = tracker.query_usage(entry.timestamp[:10], entry.timestamp[:10] + "T23:59:59")
+        assert row["coalesced_requests"] == 1
@@ -0,0 +1,202 @@
+import csv
+import gzip
+import io
+import json
+import multiprocessing
+import os
+import tempfile
+from datetime import date, timedelta
+from app.usage_tracker import UsageTracker
+
+
+def track(tracker, request_id, agent_type="openai", project="demo", status="success", tokens=10,
+          response_time=0.5):
+    return tracker.track_request(
+        request_id=request_id,
+        agent_type=agent_type,
+        project=project,
+        file="main.py",
+        message="hello",
+        response="world",
+        tokens_data={"total_tokens": tokens, "prompt_tokens": tokens // 2,
+                     "completion_tokens": tokens // 2, "model": "mock"},
+        response_time=response_time,
+        status=status,
+        real_ai=False
+    )
+
+
+def test_entries_are_appended_and_aggregated():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        tracker = UsageTracker(tmpdir)
+        tracker.snapshot_every = 2
+        track(tracker, "r1")
+        track(tracker, "r2", agent_type="copilot", project="other")
+        track(tracker, "r3", status="error", tokens=0)
+
+        summary = tracker.get_daily_summary()
+        assert summary.total_requests == 3
+        assert summary.failed_requests == 1
+        assert summary.total_tokens == 20
+        assert summary.avg_response_time == 0.5
+        assert sorted(summary.projects_used) == ["demo", "other"]
+        assert summary.most_used_agent == "openai"
+
+        today = date.today().isoformat()
+        with open(os.path.join(tmpdir, 'daily', f'{today}.jsonl')) as f:
+            assert [json.loads(line)["request_id"] for line in f] == ["r1", "r2", "r3"]
+
+        # Snapshot is taken after two entries; the third is replayed from the log
+        with open(os.path.join(tmpdir, 'daily', f'{today}.json')) as f:
+            snapshot = json.load(f)
+        assert 'entries' not in snapshot
+        tracker.writer.shutdown()
+
+        reloaded = UsageTracker(tmpdir)
+        assert reloaded.get_daily_summary(today).total_requests == 3
+        reloaded.writer.shutdown()
+
+
+def test_legacy_daily_file_is_read_in_place_and_migrated_on_request():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        os.makedirs(os.path.join(tmpdir, 'daily'))
+        legacy_entry = {
+            "timestamp": "2025-08-13T10:00:00", "request_id": "old", "agent_type": "openai",
+            "project": "demo", "file": "main.py", "message_length": 5, "response_length": 5,
+            "tokens_used": 7, "prompt_tokens": 3, "completion_tokens": 4, "model": "mock",
+            "cost_estimate": 0.0, "response_time": 1.0, "status": "success", "real_ai": False,
+            "error": None
+        }
+        with open(os.path.join(tmpdir, 'daily', '2025-08-13.json'), 'w') as f:
+            json.dump({"date": "2025-08-13", "summary": {}, "entries": [legacy_entry]}, f)
+
+        legacy_path = os.path.join(tmpdir, 'daily', '2025-08-13.json')
+        with open(legacy_path, 'rb') as f:
+            legacy_bytes = f.read()
+
+        # Opening the tracker reads the legacy day without touching any file
+        tracker = UsageTracker(tmpdir)
+        summary = tracker.get_daily_summary('2025-08-13')
+        assert (summary.total_requests, summary.total_tokens) == (1, 7)
+        assert not os.path.exists(os.path.join(tmpdir, 'daily', '2025-08-13.jsonl'))
+
+        # The explicit migration only adds the day log; the legacy file stays as it was
+        assert tracker.migrate_legacy_days() == 1
+        assert tracker.migrate_legacy_days() == 0
+        assert os.path.exists(os.path.join(tmpdir, 'daily', '2025-08-13.jsonl'))
+        summary = tracker.get_daily_summary('2025-08-13')
+        assert (summary.total_requests, summary.total_tokens) == (1, 7)
+        with open(legacy_path, 'rb') as f:
+            assert f.read() == legacy_bytes
+        tracker.writer.shutdown()
+
+
+def write_log(tmpdir, day, entries):
+    os.makedirs(os.path.join(tmpdir, 'daily'), exist_ok=True)
+    with open(os.path.join(tmpdir, 'daily', f'{day}.jsonl'), 'a') as f:
+        for hour, request_id, project in entries:
+            f.write(json.dumps({
+                "timestamp": f"{day}T{hour:02d}:00:00", "request_id": request_id,
+                "agent_type": "openai", "project": project, "file": "main.py",
+                "message_length": 5, "response_length": 5, "tokens_used": 10,
+                "prompt_tokens": 5, "completion_tokens": 5, "model": "mock",
+                "cost_estimate": 0.01, "response_time": 2.0, "status": "success",
+                "real_ai": True, "error": None
+            }) + "\n")
+
+
+def test_rollups_serve_stats_across_months():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        today = date.today()
+        old_day = (today - timedelta(days=70)).isoformat()
+        write_log(tmpdir, old_day, [(9, "o1", "legacy"), (9, "o2", "legacy")])
+
+        tracker = UsageTracker(tmpdir)
+        track(tracker, "t1", response_time=0.2)
+        track(tracker, "t2", project="other", response_time=0.2)
+
+        stats = tracker.get_usage_stats(90)
+        assert stats["totals"]["requests"] == 4
+        assert stats["totals"]["real_ai_requests"] == 2
+        assert [d["date"] for d in stats["daily_summaries"]] == [today.isoformat(), old_day]
+        assert stats["averages"]["response_time"] == 1.1
+        assert stats["trends"]["most_active_projects"][0] == ("legacy", 2)
+        assert 9 in [peak["hour"] for peak in stats["trends"]["peak_hours"]]
+        assert stats["latency"]["overall"]["count"] == 4
+        assert stats["latency"]["overall"]["max"] == 2.0
+        assert abs(stats["latency"]["project"]["legacy"]["p50"] - 2.0) <= 0.04
+        assert abs(stats["latency"]["project"]["other"]["p99"] - 0.2) <= 0.004
+        assert stats["daily_summaries"][-1]["p90_response_time"] == 2.0
+
+        assert tracker.get_usage_stats(7)["totals"]["requests"] == 2
+
+        monthly = tracker.get_monthly_summary(old_day[:7])
+        assert monthly["summary"]["total_requests"] == 2
+        hourly = tracker.get_hourly_usage(old_day)
+        assert hourly == [dict(hourly[0], hour=f"{old_day}T09", requests=2)]
+        assert hourly[0]["latency"]["count"] == 2
+
+        tracker._save_today_data()
+        tracker.writer.shutdown()
+        assert os.path.exists(os.path.join(tmpdir, 'monthly', f'{old_day[:7]}.json'))
+
+        # Entries logged after the rollup was saved are replayed, not double counted
+        write_log(tmpdir, old_day, [(10, "o3", "legacy")])
+        reloaded = UsageTracker(tmpdir)
+        assert reloaded.get_usage_stats(90)["totals"]["requests"] == 5
+        reloaded.writer.shutdown()
+
+
+def test_export_streams_jsonl_csv_and_gzip():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        write_log(tmpdir, "2025-08-13", [(9, "a", "demo"), (10, "b", "demo")])
+        write_log(tmpdir, "2025-08-15", [(11, "c", "other")])
+        tracker = UsageTracker(tmpdir)
+
+        chunks = list(tracker.iter_export("2025-08-13", "2025-08-15", "jsonl", chunk_size=1))
+        assert len(chunks) == 3
+        assert [json.loads(line)["request_id"] for line in b"".join(chunks).splitlines()] == ["a", "b", "c"]
+
+        body = b"".join(tracker.iter_export("2025-08-14", "2025-08-15", "csv")).decode()
+        rows = list(csv.DictReader(io.StringIO(body)))
+        assert [row["request_id"] for row in rows] == ["c"]
+
+        compressed = b"".join(tracker.iter_export("2025-08-13", "2025-08-13", "jsonl", compress=True))
+        assert len(gzip.decompress(compressed).splitlines()) == 2
+
+        try:
+            tracker.iter_export("2025-08-13", "2025-08-15", "xml")
+            assert False, "unsupported format accepted"
+        except ValueError:
+            pass
+        tracker.writer.shutdown()
+
+
+def track_in_worker(usage_dir, worker_id, count):
+    tracker = UsageTracker(usage_dir)
+    for i in range(count):
+        track(tracker, f"w{worker_id}_{i}", project=f"p{worker_id}")
+    tracker.writer.shutdown()
+
+
+def test_workers_share_aggregates():
+    ctx = multiprocessing.get_context('fork')
+    with tempfile.TemporaryDirectory() as tmpdir:
+        tracker = UsageTracker(tmpdir)
+        workers = [ctx.Process(target=track_in_worker, args=(tmpdir, w, 200)) for w in range(4)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+            assert worker.exitcode == 0
+
+        # A process that tracked nothing still sees every worker's entries
+        assert tracker.get_daily_summary().total_requests == 800
+        stats = tracker.get_usage_stats(1)
+        assert stats["totals"]["requests"] == 800
+        assert sorted(p for p, _ in stats["trends"]["most_active_projects"]) == ["p0", "p1", "p2", "p3"]
+        tracker.writer.shutdown()
+
+        reloaded = UsageTracker(tmpdir)
+        assert reloaded.get_daily_summary().total_requests == 800
+        reloaded.writer.shutdown()
@@ -0,0 +1,62 @@
+import os
+from app.workspace_index import WorkspaceIndex
+from app.file_context_manager import FileContextManager
+
+EXTENSIONS = {'.py', '.md'}
+
+
+def make_tree(root):
+    for rel in ('src/app.py', 'src/util/helpers.py', 'docs/README.md', 'node_modules/pkg/index.py', 'data.bin'):
+        path = root / rel
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text('x = 1\n')
+
+
+def test_refresh_rescans_only_changed_directories(tmp_path):
+    root = tmp_path / 'workspace'
+    make_tree(root)
+    cache_path = str(tmp_path / 'cache' / 'index.json')
+    index = WorkspaceIndex(str(root), EXTENSIONS, cache_path=cache_path, revalidate_interval=0)
+
+    assert index.refresh() == 4  # root, src, src/util, docs
+    assert 'node_modules' not in index.get_dir('.')['dirs']
+    assert index.get_dir('src')['files'] == ['app.py']
+    generation = index.generation
+
+    assert index.refresh() == 0
+    assert index.generation == generation
+
+    (root / 'src' / 'util' / 'new.py').write_text('y = 2\n')
+    assert index.refresh() == 1
+    assert index.get_dir('src/util')['files'] == ['helpers.py', 'new.py']
+    assert index.generation > generation
+
+    # A fresh process picks up the persisted records and re-scans nothing
+    reloaded = WorkspaceIndex(str(root), EXTENSIONS, cache_path=cache_path, revalidate_interval=0)
+    assert reloaded.refresh() == 0
+    assert reloaded.dirs == index.dirs
+
+    for name in os.listdir(root / 'docs'):
+        os.remove(root / 'docs' / name)
+    os.rmdir(root / 'docs')
+    index.refresh()
+    assert index.get_dir('docs') is None
+
+
+def test_listing_served_from_index(tmp_path, monkeypatch):
+    make_tree(tmp_path)
+    monkeypatch.setenv('FILE_INDEX_PERSIST', 'false')
+    manager = FileContextManager()
+    manager.workspace_root = str(tmp_path)
+
+    listing = manager.get_project_file_listing()
+    summary = listing['file_summary']
+    assert listing['status'] == 'success'
+    assert summary['total_files'] == 3
+    assert summary['by_type'] == {'.py': 2, '.md': 1}
+    assert summary['key_files'] == [os.path.join('docs', 'README.md'), os.path.join('src', 'app.py')]
+    assert sorted(summary['directories']) == ['docs', 'src', os.path.join('src', 'util')]
+    assert [child['name'] for child in listing['file_tree']['children']] == ['docs', 'src']
+
+    # Unchanged index generation returns the cached listing
+    assert manager.get_project_file_listing()['file_tree'] is listing['file_tree']
@@ -0,0 +1,64 @@
+import threading
+from app.write_behind import WriteBehindQueue
+
+
+def test_batches_and_flush():
+    written = []
+    queue = WriteBehindQueue("test", lambda batch: written.append(list(batch)),
+                             batch_size=10, flush_interval=5.0)
+    for i in range(25):
+        queue.submit(i)
+    assert queue.flush(timeout=2.0)
+
+    assert [item for batch in written for item in batch] == list(range(25))
+    assert max(len(batch) for batch in written) <= 10
+    stats = queue.get_stats()
+    assert stats["written"] == 25
+    assert stats["queue_depth"] == 0
+    queue.shutdown()
+
+
+def test_overflow_policies():
+    release = threading.Event()
+    written = []
+
+    def slow_write(batch):
+        release.wait(2.0)
+        written.extend(batch)
+
+    dropping = WriteBehindQueue("drop", slow_write, max_size=2, batch_size=1,
+                                flush_interval=0.01, overflow_policy="drop")
+    results = [dropping.submit(i) for i in range(10)]
+    assert results.count(False) >= 1
+    stats = dropping.get_stats()
+    assert stats["overflows"] == stats["dropped"] == results.count(False)
+    release.set()
+    dropping.shutdown()
+
+    inline = []
+    syncing = WriteBehindQueue("sync", inline.extend, max_size=1, batch_size=100,
+                               flush_interval=5.0, overflow_policy="sync")
+    for i in range(3):
+        assert syncing.submit(i)
+    assert syncing.get_stats()["overflows"] == 2
+    syncing.shutdown()
+    assert sorted(inline) == [0, 1, 2]
+
+
+def test_shutdown_drains_and_errors_are_counted():
+    written = []
+    queue = WriteBehindQueue("drain", written.extend, batch_size=1000, flush_interval=60.0)
+    for i in range(5):
+        queue.submit(i)
+    queue.shutdown()
+    assert written == [0, 1, 2, 3, 4]
+
+    def failing(batch):
+        raise IOError("disk full")
+
+    broken = WriteBehindQueue("broken", failing, batch_size=1, flush_interval=0.01)
+    broken.submit("x")
+    broken.flush(timeout=2.0)
+    assert broken.get_stats()["errors"] == 1
+    assert broken.get_stats()["dropped"] == 1
+    broken.shutdown()
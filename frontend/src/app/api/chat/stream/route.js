@@ -0,0 +1,39 @@
+const BACKEND_URL = process.env.BACKEND_URL || 'http://localhost:5000'
+
+export async function POST(request) {
+  try {
+    const body = await request.json()
+    
+    const response = await fetch(`${BACKEND_URL}/api/chat/stream`, {
+      method: 'POST',
+      headers: {
+        'Content-Type': 'application/json',
+      },
+      body: JSON.stringify(body),
+    })
+    
+    if (!response.ok) {
+      const errorData = await response.json().catch(() => ({}))
+      return Response.json(
+        { error: 'Failed to process chat message', details: errorData.message || `Backend responded with ${response.status}` },
+        { status: response.status }
+      )
+    }
+    
+    // Pass the Server-Sent Events stream straight through without buffering
+    return new Response(response.body, {
+      headers: {
+        'Content-Type': 'text/event-stream',
+        'Cache-Control': 'no-cache',
+        'Connection': 'keep-alive',
+      },
+    })
+    
+  } catch (error) {
+    console.error('Chat stream API proxy error:', error)
+    return Response.json(
+      { error: 'Failed to process chat message', details: error.message },
+      { status: 500 }
+    )
+  }
+}
@@ -0,0 +1,37 @@
+const BACKEND_URL = process.env.BACKEND_URL || 'http://localhost:5000'
+
+export async function GET(request) {
+  try {
+    // Aborted with the browser's EventSource, so the backend sees the disconnect and frees its stream
+    const response = await fetch(`${BACKEND_URL}/api/files/watch`, {
+      headers: {
+        'Accept': 'text/event-stream',
+      },
+      cache: 'no-store',
+      signal: request.signal,
+    })
+
+    if (!response.ok) {
+      return Response.json(
+        { error: 'Failed to watch files', details: `Backend responded with ${response.status}` },
+        { status: response.status }
+      )
+    }
+
+    // Pass the Server-Sent Events stream straight through without buffering
+    return new Response(response.body, {
+      headers: {
+        'Content-Type': 'text/event-stream',
+        'Cache-Control': 'no-cache',
+        'Connection': 'keep-alive',
+      },
+    })
+
+  } catch (error) {
+    console.error('File watch API proxy error:', error)
+    return Response.json(
+      { error: 'Failed to watch files', details: error.message },
+      { status: 500 }
+    )
+  }
+}
@@ -5,16 +5,13 @@ const BACKEND_URL = process.env.BACKEND_URL || 'http://localhost:5000'
 export async function GET(request) {
   try {
     const { searchParams } = new URL(request.url)
-    const format = searchParams.get('format') || 'json'
+    const format = searchParams.get('format') || 'jsonl'
     const days = searchParams.get('days') || '7'
     
     console.log(`[USAGE EXPORT] Proxying request to: ${BACKEND_URL}/api/usage/export?format=${format}&days=${days}`)
     
     const response = await fetch(`${BACKEND_URL}/api/usage/export?format=${format}&days=${days}`, {
       method: 'GET',
-      headers: {
-        'Content-Type': 'application/json',
-      },
     })
     
     if (!response.ok) {
@@ -22,18 +19,13 @@ export async function GET(request) {
       throw new Error(`Backend responded with ${response.status}`)
     }
     
-    if (format === 'csv') {
-      const csvData = await response.text()
-      return new NextResponse(csvData, {
-        headers: {
-          'Content-Type': 'text/csv',
-          'Content-Disposition': `attachment; filename="usage-export-${new Date().toISOString().split('T')[0]}.csv"`,
-        },
-      })
-    } else {
-      const data = await response.json()
-      return NextResponse.json(data)
-    }
+    // Pass the chunked body through instead of buffering the whole export
+    return new Response(response.body, {
+      headers: {
+        'Content-Type': response.headers.get('Content-Type') || 'application/octet-stream',
+        'Content-Disposition': response.headers.get('Content-Disposition') || 'attachment',
+      },
+    })
     
   } catch (error) {
     console.error('[USAGE EXPORT] Error:', error)
@@ -46,8 +46,12 @@ export async function POST(request) {
       throw new Error(`Backend responded with ${response.status}`)
     }
     
-    const data = await response.json()
-    return NextResponse.json(data)
+    return new Response(response.body, {
+      headers: {
+        'Content-Type': response.headers.get('Content-Type') || 'application/octet-stream',
+        'Content-Disposition': response.headers.get('Content-Disposition') || 'attachment',
+      },
+    })
     
   } catch (error) {
     console.error('Usage export API proxy error:', error)
@@ -19,23 +19,56 @@ export default function ChatPage() {
     setLoading(true);
     setError("");
     
+    const userText = input;
+    setMessages((msgs) => [...msgs, { role: "user", text: userText }, { role: "ai", text: "" }]);
+    setInput("");
+    
     try {
-      const res = await fetch("/api/chat", {
+      const res = await fetch("/api/chat/stream", {
         method: "POST",
         headers: { "Content-Type": "application/json" },
-        body: JSON.stringify({ message: input, project, file })
+        body: JSON.stringify({ message: userText, project, file })
       });
-      const data = await res.json();
       
       if (!res.ok) {
-        throw new Error(data.message || 'Failed to send message');
+        const data = await res.json().catch(() => ({}));
+        throw new Error(data.details || data.message || 'Failed to send message');
       }
       
-      setMessages((msgs) => [...msgs, 
-        { role: "user", text: input }, 
-        { role: "ai", text: data.reply }
-      ]);
-      setInput("");
+      // Read Server-Sent Events and append tokens to the last AI message as they arrive
+      const reader = res.body.getReader();
+      const decoder = new TextDecoder();
+      let buffer = "";
+      
+      const appendToReply = (update) => setMessages((msgs) => {
+        const next = [...msgs];
+        next[next.length - 1] = { role: "ai", text: update(next[next.length - 1].text) };
+        return next;
+      });
+      
+      while (true) {
+        const { done, value } = await reader.read();
+        if (done) break;
+        buffer += decoder.decode(value, { stream: true });
+        
+        const events = buffer.split("\n\n");
+        buffer = events.pop();
+        for (const raw of events) {
+          const eventLine = raw.split("\n").find((line) => line.startsWith("event: "));
+          const dataLine = raw.split("\n").find((line) => line.startsWith("data: "));
+          if (!eventLine || !dataLine) continue;
+          
+          const event = eventLine.slice(7);
+          const data = JSON.parse(dataLine.slice(6));
+          if (event === "token") {
+            appendToReply((text) => text + data.content);
+          } else if (event === "done") {
+            appendToReply(() => data.reply);
+          } else if (event === "error") {
+            throw new Error(data.message || "Error sending message");
+          }
+        }
+      }
     } catch (err) {
       setError(err.message || "Error sending message");
     } finally {
@@ -1,12 +1,41 @@
 "use client";
-import React, { useEffect, useState } from "react";
+import React, { useCallback, useEffect, useRef, useState } from "react";
 
+// Proxied by the Next API route, which reaches the backend at BACKEND_URL
+const WATCH_URL = "/api/files/watch";
 
+// Tree paths arrive as "./proj", "proj\sub" or "proj/sub"; deltas use "proj/sub"
+function normalizePath(path) {
+  return (path || "").replace(/\\/g, "/").replace(/^\.(\/|$)/, "");
+}
+
+// Patch a loaded children list with one "added"/"removed" delta
+function applyDelta(children, change) {
+  if (!children) return children;
+  if (change.change === "removed") {
+    return children.filter((child) => child.name !== change.name);
+  }
+  if (change.change !== "added" || children.some((child) => child.name === change.name)) {
+    return children;
+  }
+  const entry = change.type === "dir"
+    ? { name: change.name, type: "dir" }
+    : { name: change.name, type: "file", path: change.path };
+  return [...children, entry].sort((a, b) => (a.name < b.name ? -1 : a.name > b.name ? 1 : 0));
+}
 
-function TreeNode({ node, onFileClick, level = 0, selectedPath }) {
+function TreeNode({ node, onFileClick, level = 0, selectedPath, subscribe }) {
   const [open, setOpen] = useState(false);
   const [children, setChildren] = useState(null);
   const [loading, setLoading] = useState(false);
+  const loaded = children !== null;
+  const nodePath = node ? normalizePath(node.path) : null;
+
+  // Once this directory's children are loaded, keep them current from watcher deltas
+  useEffect(() => {
+    if (!loaded || !subscribe || node?.type !== "dir") return undefined;
+    return subscribe(nodePath, (change) => setChildren((current) => applyDelta(current, change)));
+  }, [loaded, subscribe, nodePath, node?.type]);
 
   if (!node) return null;
   if (node.type === "dir") {
@@ -32,7 +61,7 @@ function TreeNode({ node, onFileClick, level = 0, selectedPath }) {
           <div>
             {loading && <div>Įkeliama...</div>}
             {children && children.map((child) => (
-              <TreeNode key={child.name + (child.path || "") } node={{...child, path: (child.path || ((node.path ? node.path + "/" : "") + child.name))}} onFileClick={onFileClick} level={level + 1} selectedPath={selectedPath} />
+              <TreeNode key={child.name + (child.path || "") } node={{...child, path: (child.path || ((node.path ? node.path + "/" : "") + child.name))}} onFileClick={onFileClick} level={level + 1} selectedPath={selectedPath} subscribe={subscribe} />
             ))}
           </div>
         )}
@@ -59,16 +88,62 @@ export default function FileBrowser() {
   const [fileContent, setFileContent] = useState("");
   const [loading, setLoading] = useState(false);
   const [error, setError] = useState("");
+  const [treeVersion, setTreeVersion] = useState(0);
+  const listenersRef = useRef(new Map());
+  const selectedRef = useRef("");
+  const reloadFileRef = useRef(null);
 
   useEffect(() => {
     fetch("http://localhost:5000/api/files/list")
       .then((res) => res.json())
       .then((data) => setTree(data.tree))
       .catch(() => setError("Nepavyko gauti failų medžio"));
+  }, [treeVersion]);
+
+  // Expanded directories register here to receive deltas for their own path
+  const subscribe = useCallback((path, callback) => {
+    const listeners = listenersRef.current;
+    if (!listeners.has(path)) listeners.set(path, new Set());
+    listeners.get(path).add(callback);
+    return () => listeners.get(path)?.delete(callback);
+  }, []);
+
+  // Debounced tree changes pushed by the backend file watcher (SSE)
+  useEffect(() => {
+    if (typeof EventSource === "undefined") return undefined;
+    const source = new EventSource(WATCH_URL);
+    let connected = false;
+    const reset = () => {
+      listenersRef.current.clear();
+      setTreeVersion((version) => version + 1);
+    };
+    source.addEventListener("ready", () => {
+      // Deltas may have been missed while reconnecting
+      if (connected) reset();
+      connected = true;
+    });
+    source.addEventListener("delta", (event) => {
+      const { changes = [] } = JSON.parse(event.data);
+      for (const change of changes) {
+        if (change.change === "reset") {
+          reset();
+          return;
+        }
+        if (change.change === "modified") {
+          if (normalizePath(selectedRef.current) === change.path && reloadFileRef.current) {
+            reloadFileRef.current(selectedRef.current);
+          }
+          continue;
+        }
+        listenersRef.current.get(change.parent)?.forEach((callback) => callback(change));
+      }
+    });
+    return () => source.close();
   }, []);
 
   const MAX_SIZE = 100 * 1024; // 100 KB
   const handleFileClick = (filename) => {
+    selectedRef.current = filename;
     setSelectedFile(filename);
     setLoading(true);
     setError("");
@@ -92,6 +167,7 @@ export default function FileBrowser() {
       .catch(() => setError("Nepavyko perskaityti failo"))
       .finally(() => setLoading(false));
   };
+  reloadFileRef.current = handleFileClick;
 
   return (
     <div className="grid grid-cols-1 md:grid-cols-12 gap-6">
@@ -99,7 +175,7 @@ export default function FileBrowser() {
         <h2 className="text-sm font-semibold text-[var(--foreground)] mb-2">Failų medis</h2>
         <div className="max-h-[60vh] overflow-y-auto border border-[var(--border)] rounded-lg p-2 bg-[var(--background-secondary)]">
           {tree ? (
-            <TreeNode node={tree} onFileClick={handleFileClick} selectedPath={selectedFile} />
+            <TreeNode key={treeVersion} node={tree} onFileClick={handleFileClick} selectedPath={selectedFile} subscribe={subscribe} />
           ) : (
             <div>Įkeliama...</div>
           )}
@@ -77,13 +77,13 @@ export const AnalyticsControls = ({
         {/* Export Options */}
         <div className="flex gap-1">
           <Button 
-            onClick={() => onExport('json')} 
+            onClick={() => onExport('jsonl')} 
             variant="outline" 
             size="sm"
             className="flex items-center gap-2"
           >
             <span>📄</span>
-            JSON
+            JSONL
           </Button>
           <Button 
             onClick={() => onExport('csv')} 